@@ -0,0 +1,12 @@
+from django.contrib import admin
+from .models import RideHourlyStat
+
+
+@admin.register(RideHourlyStat)
+class RideHourlyStatAdmin(admin.ModelAdmin):
+    list_display = ('hour', 'category', 'zone', 'requests', 'completions', 'cancellations', 'revenue')
+    list_filter = ('category',)
+    list_select_related = ('category',)
+    search_fields = ('=zone',)
+    date_hierarchy = 'hour'
+    readonly_fields = ('updated_at',)
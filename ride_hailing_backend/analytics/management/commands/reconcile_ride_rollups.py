@@ -0,0 +1,33 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from analytics.rollups import get_analytics_setting, reconcile
+
+
+class Command(BaseCommand):
+    help = 'Recompute recent hourly ride rollups from the raw rides to correct drift.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=None,
+                            help='Hours back from now to reconcile (defaults to ANALYTICS["RECONCILE_HOURS"]).')
+        parser.add_argument('--since', default=None,
+                            help='ISO 8601 start instead of --hours, e.g. to backfill.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report drift without fixing it.')
+
+    def handle(self, *args, **options):
+        end = timezone.now()
+        if options['since']:
+            start = parse_datetime(options['since'])
+            if start is None:
+                raise CommandError('--since must be an ISO 8601 date/time')
+            if timezone.is_naive(start):
+                start = timezone.make_aware(start)
+        else:
+            start = end - timedelta(hours=options['hours'] or get_analytics_setting('RECONCILE_HOURS'))
+
+        created, updated, deleted = reconcile(start, end, dry_run=options['dry_run'])
+        self.stdout.write(f"hourly stats: created {created}, updated {updated}, deleted {deleted}")
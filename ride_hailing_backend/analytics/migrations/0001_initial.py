@@ -0,0 +1,38 @@
+# Generated by Django 5.2.1 on 2026-10-19 12:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('rides', '0005_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RideHourlyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('zone', models.CharField(max_length=32)),
+                ('requests', models.PositiveIntegerField(default=0)),
+                ('completions', models.PositiveIntegerField(default=0)),
+                ('cancellations', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('accepted', models.PositiveIntegerField(default=0)),
+                ('wait_seconds', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hourly_stats', to='rides.ridecategory')),
+            ],
+            options={
+                'verbose_name': 'ride hourly stat',
+                'verbose_name_plural': 'ride hourly stats',
+                'ordering': ['-hour'],
+                'constraints': [models.UniqueConstraint(fields=('hour', 'category', 'zone'), name='ride_hourly_stat_unique')],
+            },
+        ),
+    ]
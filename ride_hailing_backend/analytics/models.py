@@ -0,0 +1,44 @@
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+from rides.models import RideCategory
+
+
+class RideHourlyStat(models.Model):
+    """
+    Ride counts and revenue for one hour, category and pickup zone.
+
+    Rides are bucketed by the hour they were requested in, so a ride stays in
+    the same row as it moves through its states.
+    """
+    hour = models.DateTimeField()
+    category = models.ForeignKey(RideCategory, on_delete=models.CASCADE, related_name='hourly_stats')
+    # South-west corner of the pickup grid cell, as "lat,lng"
+    zone = models.CharField(max_length=32)
+    requests = models.PositiveIntegerField(default=0)
+    completions = models.PositiveIntegerField(default=0)
+    cancellations = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    # Rides accepted by a driver and their summed request-to-accept time
+    accepted = models.PositiveIntegerField(default=0)
+    wait_seconds = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = _('ride hourly stat')
+        verbose_name_plural = _('ride hourly stats')
+        ordering = ['-hour']
+        constraints = [
+            models.UniqueConstraint(fields=['hour', 'category', 'zone'], name='ride_hourly_stat_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.hour:%Y-%m-%d %H:00} {self.category_id} {self.zone}"
+
+    @property
+    def cancellation_rate(self):
+        return self.cancellations / self.requests if self.requests else 0.0
+
+    @property
+    def average_wait_seconds(self):
+        return self.wait_seconds / self.accepted if self.accepted else None
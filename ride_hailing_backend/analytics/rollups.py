@@ -0,0 +1,143 @@
+from datetime import timedelta
+from decimal import Decimal, ROUND_FLOOR
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from rides.models import Ride
+from .models import RideHourlyStat
+
+
+DEFAULTS = {
+    # Pickup zones are square grid cells of this many degrees (0.05 is about 5.5 km)
+    'ZONE_SIZE_DEG': '0.05',
+    # How far back the periodic reconcile re-aggregates raw rides
+    'RECONCILE_HOURS': 48,
+}
+
+COUNTERS = ('requests', 'completions', 'cancellations', 'revenue', 'accepted', 'wait_seconds')
+RIDE_FIELDS = ('requested_at', 'category_id', 'pickup_latitude', 'pickup_longitude', 'status', 'total_fare', 'accepted_at')
+
+
+def get_analytics_setting(name):
+    return getattr(settings, 'ANALYTICS', {}).get(name, DEFAULTS[name])
+
+
+def zone_for(latitude, longitude):
+    # Decimal arithmetic so every code path puts a coordinate on a cell edge
+    # into the same zone
+    size = Decimal(str(get_analytics_setting('ZONE_SIZE_DEG')))
+    row = (Decimal(str(latitude)) / size).to_integral_value(ROUND_FLOOR)
+    col = (Decimal(str(longitude)) / size).to_integral_value(ROUND_FLOOR)
+    return f"{row * size:.4f},{col * size:.4f}"
+
+
+def bucket_for(requested_at, category_id, latitude, longitude):
+    return requested_at.replace(minute=0, second=0, microsecond=0), category_id, zone_for(latitude, longitude)
+
+
+def _wait_seconds(requested_at, accepted_at):
+    return max(int((accepted_at - requested_at).total_seconds()), 0)
+
+
+def contribution(requested_at, category_id, pickup_latitude, pickup_longitude, status, total_fare, accepted_at):
+    """
+    What one ride in its current state adds to its bucket.
+    """
+    completed = status == 'completed'
+    return {
+        'requests': 1,
+        'completions': int(completed),
+        'cancellations': int(status == 'cancelled'),
+        'revenue': Decimal(total_fare) if completed else Decimal('0'),
+        'accepted': int(accepted_at is not None),
+        'wait_seconds': _wait_seconds(requested_at, accepted_at) if accepted_at else 0,
+    }
+
+
+def event_delta(ride, event):
+    """
+    Change to a ride's bucket caused by one state change.
+    """
+    if event == 'created':
+        return contribution(*(getattr(ride, field) for field in RIDE_FIELDS))
+    if event == 'accepted':
+        return {'accepted': 1, 'wait_seconds': _wait_seconds(ride.requested_at, ride.accepted_at)}
+    if event == 'completed':
+        return {'completions': 1, 'revenue': Decimal(ride.total_fare)}
+    if event == 'cancelled':
+        return {'cancellations': 1}
+    return {}
+
+
+def apply_delta(hour, category_id, zone, delta):
+    """
+    Add to a bucket's counters, creating the row on first use.
+    """
+    delta = {name: value for name, value in delta.items() if value}
+    if not delta:
+        return
+    bucket = RideHourlyStat.objects.filter(hour=hour, category_id=category_id, zone=zone)
+    increments = {name: F(name) + value for name, value in delta.items()}
+    if bucket.update(**increments):
+        return
+    try:
+        with transaction.atomic():
+            RideHourlyStat.objects.create(hour=hour, category_id=category_id, zone=zone, **delta)
+    except IntegrityError:
+        # Created concurrently by another request
+        bucket.update(**increments)
+
+
+def aggregate_rides(start, end):
+    """
+    Compute the buckets of rides requested in [start, end) from the raw rides.
+    """
+    buckets = {}
+    rows = Ride.objects.filter(requested_at__gte=start, requested_at__lt=end).order_by().values_list(*RIDE_FIELDS)
+    for row in rows.iterator(chunk_size=5000):
+        key = bucket_for(row[0], row[1], row[2], row[3])
+        totals = buckets.setdefault(key, dict.fromkeys(COUNTERS, 0))
+        for name, value in contribution(*row).items():
+            totals[name] += value
+    return buckets
+
+
+def reconcile(start, end, dry_run=False, chunk_hours=6):
+    """
+    Make the rollups of each hour in [start, end) match the raw rides.
+
+    Every chunk_hours hours are fixed in their own short transaction.
+    Returns the number of rows created, updated and deleted.
+    """
+    created = updated = deleted = 0
+    chunk_start = start.replace(minute=0, second=0, microsecond=0)
+    while chunk_start < end:
+        chunk_end = chunk_start + timedelta(hours=chunk_hours)
+        with transaction.atomic():
+            # Lock the rows before reading rides: a ride committed after the
+            # read then applies its increment on top of the fixed row
+            existing = {
+                (row.hour, row.category_id, row.zone): row
+                for row in RideHourlyStat.objects.select_for_update().filter(hour__gte=chunk_start, hour__lt=chunk_end)
+            }
+            expected = aggregate_rides(chunk_start, chunk_end)
+            to_create, to_update = [], []
+            for key, totals in expected.items():
+                row = existing.pop(key, None)
+                if row is None:
+                    to_create.append(RideHourlyStat(hour=key[0], category_id=key[1], zone=key[2], **totals))
+                elif any(getattr(row, name) != totals[name] for name in COUNTERS):
+                    for name in COUNTERS:
+                        setattr(row, name, totals[name])
+                    to_update.append(row)
+            if not dry_run:
+                RideHourlyStat.objects.bulk_create(to_create)
+                RideHourlyStat.objects.bulk_update(to_update, COUNTERS)
+                RideHourlyStat.objects.filter(pk__in=[row.pk for row in existing.values()]).delete()
+        created += len(to_create)
+        updated += len(to_update)
+        deleted += len(existing)
+        chunk_start = chunk_end
+    return created, updated, deleted
@@ -0,0 +1,15 @@
+from rest_framework import serializers
+from .models import RideHourlyStat
+
+
+class RideHourlyStatSerializer(serializers.ModelSerializer):
+    category = serializers.CharField(source='category.name', read_only=True)
+    cancellation_rate = serializers.FloatField(read_only=True)
+    average_wait_seconds = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = RideHourlyStat
+        fields = [
+            'hour', 'category', 'zone', 'requests', 'completions', 'cancellations',
+            'cancellation_rate', 'revenue', 'average_wait_seconds',
+        ]
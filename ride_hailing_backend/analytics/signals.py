@@ -0,0 +1,12 @@
+from django.dispatch import receiver
+from rides.models import Ride, ride_status_changed
+from .rollups import apply_delta, bucket_for, event_delta
+
+
+@receiver(ride_status_changed, sender=Ride)
+def update_ride_rollups(sender, ride, event, **kwargs):
+    """
+    Keep the hourly rollups in step with ride state changes.
+    """
+    hour, category_id, zone = bucket_for(ride.requested_at, ride.category_id, ride.pickup_latitude, ride.pickup_longitude)
+    apply_delta(hour, category_id, zone, event_delta(ride, event))
@@ -0,0 +1,98 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from rides.models import Driver, RideCategory, Ride
+from users.models import User
+from .models import RideHourlyStat
+from .rollups import reconcile, zone_for
+
+
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class RideRollupTests(TestCase):
+    def setUp(self):
+        call_command('seed_data', users=10, drivers=2, rides=60, locations_per_ride=0, days=3, stdout=StringIO())
+        self.user = User.objects.filter(driver_profile__isnull=True).first()
+        self.driver = Driver.objects.first()
+        self.category = RideCategory.objects.filter(is_pooled=False).first()
+
+    def new_ride(self, latitude=9.0821):
+        return Ride.objects.create(
+            user=self.user, category=self.category, pickup_latitude=latitude, pickup_longitude=8.6753,
+            pickup_address='A', destination_latitude=9.1, destination_longitude=8.7, destination_address='B',
+            estimated_distance_km=5, estimated_duration_minutes=10, base_fare=1, distance_fare=1,
+            time_fare=1, total_fare=Decimal('12.50'),
+        )
+
+    def drift(self):
+        window = (timezone.now() - timedelta(days=4), timezone.now() + timedelta(hours=1))
+        return reconcile(*window, dry_run=True)
+
+    def test_seeded_rollups_match_rides(self):
+        self.assertEqual(self.drift(), (0, 0, 0))
+        self.assertEqual(sum(RideHourlyStat.objects.values_list('requests', flat=True)), Ride.objects.count())
+
+    def test_state_changes_update_rollups_incrementally(self):
+        completed, cancelled = self.new_ride(), self.new_ride(latitude=9.2)
+        self.assertTrue(completed.assign_driver(self.driver))
+        self.assertTrue(completed.complete())
+        self.assertTrue(cancelled.cancel('user'))
+        self.assertFalse(cancelled.cancel('user'))
+
+        row = RideHourlyStat.objects.get(
+            hour=completed.requested_at.replace(minute=0, second=0, microsecond=0),
+            category=self.category, zone=zone_for(9.0821, 8.6753),
+        )
+        self.assertGreaterEqual(row.completions, 1)
+        self.assertEqual(self.drift(), (0, 0, 0))
+
+    def test_reconcile_fixes_late_updates(self):
+        ride = self.new_ride()
+        # Written behind the model's back, e.g. by a data fix
+        Ride.objects.filter(pk=ride.pk).update(status='completed')
+        out = StringIO()
+        call_command('reconcile_ride_rollups', hours=2, stdout=out)
+        self.assertIn('updated 1', out.getvalue())
+        self.assertEqual(self.drift(), (0, 0, 0))
+
+    def test_endpoints_read_only_rollups(self):
+        admin = User.objects.create_superuser(
+            email='admin@example.com', password='pass', phone_number='+2348111111111', full_name='Admin'
+        )
+        admin_auth = {'HTTP_AUTHORIZATION': f"Bearer {RefreshToken.for_user(admin).access_token}"}
+        rider_auth = {'HTTP_AUTHORIZATION': f"Bearer {RefreshToken.for_user(self.user).access_token}"}
+        start = (timezone.now() - timedelta(days=4)).isoformat()
+        url = reverse('ride-stats-summary')
+
+        self.assertEqual(self.client.get(url, **rider_auth).status_code, 403)
+        self.assertEqual(self.client.get(url, {'group_by': 'week'}, **admin_auth).status_code, 400)
+        for view in ('ride-stats-summary', 'ride-stats-hourly'):
+            response = self.client.get(reverse(view), {'start': '2024-02-30T00:00:00'}, **admin_auth)
+            self.assertEqual(response.status_code, 400, view)
+            self.assertIn('start', response.json()['errors'])
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, {'start': start}, **admin_auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(any('rides_ride' in query['sql'] for query in ctx.captured_queries))
+        [summary] = response.json()['data']['results']
+        self.assertEqual(summary['requests'], Ride.objects.count())
+        self.assertEqual(summary['cancellations'], Ride.objects.filter(status='cancelled').count())
+
+        response = self.client.get(url, {'start': start, 'group_by': 'category'}, **admin_auth)
+        by_category = {row['category']: row['requests'] for row in response.json()['data']['results']}
+        self.assertEqual(by_category[self.category.name], self.category.rides.count())
+
+        response = self.client.get(reverse('ride-stats-hourly'), {'start': start}, **admin_auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], RideHourlyStat.objects.count())
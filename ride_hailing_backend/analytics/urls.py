@@ -0,0 +1,7 @@
+from django.urls import path
+from .views import HourlyRideStatsView, RideStatsSummaryView
+
+urlpatterns = [
+    path('rides/hourly/', HourlyRideStatsView.as_view(), name='ride-stats-hourly'),
+    path('rides/summary/', RideStatsSummaryView.as_view(), name='ride-stats-summary'),
+]
@@ -0,0 +1,156 @@
+from datetime import timedelta
+
+from django.db.models import Sum
+from django.db.models.functions import TruncDay
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import generics, permissions, status
+from rest_framework.response import Response
+
+from ride_hailing_backend.db_routing import replica_reads
+
+from .models import RideHourlyStat
+from .serializers import RideHourlyStatSerializer
+
+
+GROUPINGS = {
+    'hour': ('hour',),
+    'day': ('day',),
+    'category': ('category__name',),
+    'zone': ('zone',),
+    'category_zone': ('category__name', 'zone'),
+}
+
+
+class RideStatsMixin:
+    """
+    Window and filter handling shared by the rollup endpoints.
+
+    Only the rollup table is read, never the rides themselves.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def parse_window(self, request):
+        """
+        Return (start, end, errors) from the start/end query parameters.
+        Defaults to the last 24 hours.
+        """
+        errors = {}
+        bounds = {}
+        for name in ('start', 'end'):
+            value = request.query_params.get(name)
+            if value:
+                try:
+                    # None when malformed; ValueError for dates that do not exist, like February 30
+                    parsed = parse_datetime(value)
+                except ValueError:
+                    parsed = None
+                if parsed is None:
+                    errors[name] = 'Enter a valid ISO 8601 date/time'
+                elif timezone.is_naive(parsed):
+                    parsed = timezone.make_aware(parsed)
+                bounds[name] = parsed
+        end = bounds.get('end') or timezone.now()
+        start = bounds.get('start') or end - timedelta(hours=24)
+        return start, end, errors
+
+    def filter_stats(self, request, start, end):
+        queryset = RideHourlyStat.objects.filter(hour__gte=start, hour__lt=end)
+        category = request.query_params.get('category')
+        zone = request.query_params.get('zone')
+        if category:
+            queryset = queryset.filter(category__name=category)
+        if zone:
+            queryset = queryset.filter(zone=zone)
+        return queryset
+
+    def invalid(self, errors):
+        return Response({
+            'status': 'error',
+            'message': 'Invalid query parameters',
+            'errors': errors
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+
+@replica_reads
+class HourlyRideStatsView(RideStatsMixin, generics.ListAPIView):
+    """
+    Admin endpoint listing hourly ride rollups per category and pickup zone.
+    """
+    serializer_class = RideHourlyStatSerializer
+
+    def list(self, request, *args, **kwargs):
+        start, end, errors = self.parse_window(request)
+        if errors:
+            return self.invalid(errors)
+        queryset = self.filter_stats(request, start, end).select_related('category').order_by('-hour', 'zone')
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
+        serializer = self.get_serializer(queryset, many=True)
+        return Response({
+            'status': 'success',
+            'message': 'Hourly ride stats retrieved successfully',
+            'data': serializer.data
+        })
+
+
+@replica_reads
+class RideStatsSummaryView(RideStatsMixin, generics.GenericAPIView):
+    """
+    Admin endpoint totalling ride rollups over a window, optionally grouped.
+    """
+
+    def get(self, request, *args, **kwargs):
+        start, end, errors = self.parse_window(request)
+        group_by = request.query_params.get('group_by')
+        if group_by and group_by not in GROUPINGS:
+            errors['group_by'] = f"Must be one of: {', '.join(GROUPINGS)}"
+        if errors:
+            return self.invalid(errors)
+
+        queryset = self.filter_stats(request, start, end).order_by()
+        totals = {
+            'requests': Sum('requests'),
+            'completions': Sum('completions'),
+            'cancellations': Sum('cancellations'),
+            'revenue': Sum('revenue'),
+            'accepted': Sum('accepted'),
+            'wait_seconds': Sum('wait_seconds'),
+        }
+        if group_by:
+            fields = GROUPINGS[group_by]
+            if group_by == 'day':
+                queryset = queryset.annotate(day=TruncDay('hour'))
+            rows = list(queryset.values(*fields).annotate(**totals).order_by(*fields))
+        else:
+            rows = [queryset.aggregate(**totals)]
+
+        return Response({
+            'status': 'success',
+            'message': 'Ride stats summary retrieved successfully',
+            'data': {
+                'start': start,
+                'end': end,
+                'results': [self._summarize(row) for row in rows],
+            }
+        })
+
+    def _summarize(self, row):
+        requests = row.pop('requests') or 0
+        accepted = row.pop('accepted') or 0
+        wait_seconds = row.pop('wait_seconds') or 0
+        if 'category__name' in row:
+            row['category'] = row.pop('category__name')
+        row.update(
+            requests=requests,
+            completions=row['completions'] or 0,
+            cancellations=row['cancellations'] or 0,
+            revenue=str(row['revenue'] or 0),
+            cancellation_rate=(row['cancellations'] or 0) / requests if requests else 0.0,
+            average_wait_seconds=wait_seconds / accepted if accepted else None,
+        )
+        return row
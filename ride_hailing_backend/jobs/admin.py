@@ -0,0 +1,18 @@
+from django.contrib import admin
+from ride_hailing_backend.paginators import EstimatedCountPaginator
+from .models import Job
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'task', 'queue', 'status', 'attempts', 'run_at', 'updated_at')
+    list_filter = ('queue', 'status', 'task')
+    search_fields = ('=id', 'task')
+    readonly_fields = ('created_at', 'updated_at', 'locked_by', 'locked_at')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ['retry_jobs']
+
+    @admin.action(description='Retry selected jobs')
+    def retry_jobs(self, request, queryset):
+        queryset.exclude(status='running').update(status='pending', attempts=0, last_error=None)
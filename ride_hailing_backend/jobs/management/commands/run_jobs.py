@@ -0,0 +1,42 @@
+import signal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from jobs.registry import get_jobs_setting
+from jobs.worker import Worker
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs from the database queue.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queue', action='append', dest='queues',
+                            help='Only process the given queue(s). Defaults to all configured queues.')
+        parser.add_argument('--once', action='store_true',
+                            help='Process the jobs that are due now and exit.')
+
+    def handle(self, *args, **options):
+        configured = get_jobs_setting('QUEUES')
+        unknown = set(options['queues'] or []) - set(configured)
+        if unknown:
+            raise CommandError(f"Unknown queue(s): {', '.join(sorted(unknown))}")
+
+        worker = Worker(options['queues'])
+        if options['once']:
+            total = 0
+            while True:
+                claimed = worker.run_once(wait_for_completion=True)
+                if not claimed:
+                    break
+                total += claimed
+            worker.shutdown()
+            self.stdout.write(f"Processed {total} job(s)")
+            return
+
+        def stop(signum, frame):
+            worker.stopping = True
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        self.stdout.write(f"Worker {worker.worker_id} processing {', '.join(worker.pools)}")
+        worker.run_forever()
@@ -0,0 +1,95 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+
+DEFAULTS = {
+    'QUEUES': {'default': {'CONCURRENCY': 1}},
+    'POLL_INTERVAL': 1.0,
+    # Running jobs whose worker died are handed out again after this many seconds
+    'VISIBILITY_TIMEOUT': 300,
+    # Retry delay in seconds, doubled after every failed attempt
+    'RETRY_BACKOFF': 5,
+    'MAX_BACKOFF': 3600,
+    # Run tasks immediately on enqueue instead of storing them
+    'EAGER': False,
+}
+
+_tasks = {}
+
+
+def get_jobs_setting(name):
+    return getattr(settings, 'JOBS', {}).get(name, DEFAULTS[name])
+
+
+class Task:
+    """
+    A function that can be run later by a worker.
+
+    Tasks with batch_size > 1 receive a list of payloads, so a worker can
+    process many pending jobs of the same task with a single call.
+    """
+
+    def __init__(self, func, name, queue, batch_size, max_attempts):
+        self.func = func
+        self.name = name
+        self.queue = queue
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+
+    def __repr__(self):
+        return f"<Task {self.name}>"
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def run(self, payloads):
+        if self.batch_size > 1:
+            return self.func(payloads)
+        for payload in payloads:
+            self.func(payload)
+
+    def enqueue(self, payload=None, delay=None):
+        """
+        Store a job for this task and return it without running it.
+        """
+        from .models import Job
+
+        payload = payload or {}
+        if get_jobs_setting('EAGER'):
+            self.run([payload])
+            return None
+
+        run_at = timezone.now()
+        if delay:
+            run_at += delay if isinstance(delay, timedelta) else timedelta(seconds=delay)
+        return Job.objects.create(
+            queue=self.queue,
+            task=self.name,
+            payload=payload,
+            max_attempts=self.max_attempts,
+            run_at=run_at,
+        )
+
+
+def task(name=None, queue='default', batch_size=1, max_attempts=5):
+    """
+    Register a function as a background task.
+
+        @task(queue='ratings', batch_size=100)
+        def update_driver_ratings(payloads):
+            ...
+
+        update_driver_ratings.enqueue({'driver_id': str(driver.id)})
+    """
+    def decorator(func):
+        task_name = name or f"{func.__module__}.{func.__name__}"
+        registered = Task(func, task_name, queue, batch_size, max_attempts)
+        _tasks[task_name] = registered
+        return registered
+    return decorator
+
+
+def get_task(name):
+    return _tasks.get(name)
@@ -0,0 +1,93 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+
+from .models import Job
+from .registry import task
+from .worker import Worker
+
+
+calls = []
+
+
+@task(name='tests.record', queue='default')
+def record(payload):
+    calls.append(payload)
+
+
+@task(name='tests.record_batch', queue='default', batch_size=10)
+def record_batch(payloads):
+    calls.append(list(payloads))
+
+
+@task(name='tests.explode', queue='default', max_attempts=2)
+def explode(payload):
+    raise RuntimeError('boom')
+
+
+TEST_JOBS = {'QUEUES': {'default': {'CONCURRENCY': 2}}, 'RETRY_BACKOFF': 10}
+
+
+# Worker threads use their own database connections, so jobs must be committed
+@override_settings(JOBS=TEST_JOBS)
+class WorkerTests(TransactionTestCase):
+    def setUp(self):
+        calls.clear()
+        self.worker = Worker()
+        self.addCleanup(self.worker.shutdown)
+
+    def test_runs_and_deletes_jobs(self):
+        record.enqueue({'n': 1})
+        self.assertEqual(self.worker.run_once(wait_for_completion=True), 1)
+        self.assertEqual(calls, [{'n': 1}])
+        self.assertFalse(Job.objects.exists())
+
+    def test_batches_jobs_of_the_same_task(self):
+        for n in range(5):
+            record_batch.enqueue({'n': n})
+        self.worker.run_once(wait_for_completion=True)
+        self.assertEqual(calls, [[{'n': n} for n in range(5)]])
+
+    def test_delayed_jobs_wait(self):
+        record.enqueue({'n': 1}, delay=60)
+        self.assertEqual(self.worker.run_once(wait_for_completion=True), 0)
+        self.assertEqual(calls, [])
+
+    def test_retries_with_backoff_then_fails(self):
+        job = explode.enqueue({})
+        with self.assertLogs('jobs.worker', 'ERROR'):
+            self.worker.run_once(wait_for_completion=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('pending', 1))
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=5))
+        self.assertIn('boom', job.last_error)
+
+        Job.objects.filter(id=job.id).update(run_at=timezone.now())
+        with self.assertLogs('jobs.worker', 'ERROR'):
+            self.worker.run_once(wait_for_completion=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+
+    def test_requeues_jobs_of_dead_workers(self):
+        job = record.enqueue({'n': 1})
+        Job.objects.filter(id=job.id).update(
+            status='running', locked_by='dead', locked_at=timezone.now() - timedelta(hours=1)
+        )
+        self.worker.run_once(wait_for_completion=True)
+        self.assertEqual(calls, [{'n': 1}])
+
+    def test_claims_are_limited_by_queue_concurrency(self):
+        for n in range(5):
+            record.enqueue({'n': n})
+        claimed = self.worker.claim('default', 2)
+        self.assertEqual(len(claimed), 2)
+        self.assertEqual(Job.objects.filter(status='pending').count(), 3)
+
+    def test_run_jobs_command(self):
+        record.enqueue({'n': 1})
+        out = StringIO()
+        call_command('run_jobs', once=True, stdout=out)
+        self.assertIn('Processed 1 job(s)', out.getvalue())
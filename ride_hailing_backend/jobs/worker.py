@@ -0,0 +1,134 @@
+import logging
+import os
+import socket
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import timedelta
+from itertools import groupby
+
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import Job
+from .registry import get_jobs_setting, get_task, _tasks
+
+
+logger = logging.getLogger(__name__)
+
+
+class Worker:
+    """
+    Claims pending jobs from the database and runs them in per-queue thread pools.
+
+    Delivery is at-least-once: a job is only deleted after its task returns,
+    and jobs left running by a dead worker are handed out again once
+    VISIBILITY_TIMEOUT has passed, so tasks must be idempotent.
+    """
+
+    def __init__(self, queues=None):
+        configured = get_jobs_setting('QUEUES')
+        names = queues or list(configured)
+        self.concurrency = {name: configured.get(name, {}).get('CONCURRENCY', 1) for name in names}
+        self.pools = {
+            name: ThreadPoolExecutor(max_workers=limit, thread_name_prefix=f"jobs-{name}")
+            for name, limit in self.concurrency.items()
+        }
+        self.inflight = {name: set() for name in names}
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.stopping = False
+
+    def requeue_stale(self):
+        """
+        Hand out again the jobs of workers that died while running them.
+        """
+        cutoff = timezone.now() - timedelta(seconds=get_jobs_setting('VISIBILITY_TIMEOUT'))
+        return Job.objects.filter(
+            queue__in=list(self.pools), status='running', locked_at__lt=cutoff
+        ).update(status='pending', locked_by=None, locked_at=None)
+
+    def claim(self, queue, limit):
+        """
+        Atomically mark up to `limit` due jobs of a queue as running by this worker.
+        """
+        now = timezone.now()
+        token = f"{self.worker_id}:{uuid.uuid4().hex[:8]}"
+        due = Job.objects.filter(queue=queue, status='pending', run_at__lte=now).order_by('run_at').values('id')[:limit]
+        # Re-checking the status in the UPDATE makes concurrent claims safe
+        Job.objects.filter(id__in=due, status='pending').update(status='running', locked_by=token, locked_at=now)
+        return list(Job.objects.filter(locked_by=token, status='running').order_by('task', 'run_at'))
+
+    def run_once(self, wait_for_completion=False):
+        """
+        Claim and dispatch due jobs for every queue with free slots.
+
+        Returns the number of jobs claimed.
+        """
+        self.requeue_stale()
+        claimed = 0
+        for queue, pool in self.pools.items():
+            inflight = self.inflight[queue]
+            inflight.difference_update([future for future in inflight if future.done()])
+            free = self.concurrency[queue] - len(inflight)
+            if free <= 0:
+                continue
+
+            batch_size = max([t.batch_size for t in _tasks.values() if t.queue == queue] or [1])
+            jobs = self.claim(queue, free * batch_size)
+            claimed += len(jobs)
+            for task_name, grouped in groupby(jobs, key=lambda job: job.task):
+                grouped = list(grouped)
+                task = get_task(task_name)
+                size = task.batch_size if task else 1
+                for start in range(0, len(grouped), size):
+                    inflight.add(pool.submit(self._execute, task_name, grouped[start:start + size]))
+
+        if wait_for_completion:
+            wait([future for futures in self.inflight.values() for future in futures])
+        return claimed
+
+    def run_forever(self):
+        poll_interval = get_jobs_setting('POLL_INTERVAL')
+        try:
+            while not self.stopping:
+                if not self.run_once():
+                    time.sleep(poll_interval)
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        self.stopping = True
+        for pool in self.pools.values():
+            pool.shutdown(wait=True)
+
+    def _execute(self, task_name, jobs):
+        close_old_connections()
+        try:
+            task = get_task(task_name)
+            if task is None:
+                raise LookupError(f"No task registered as {task_name}")
+            task.run([job.payload for job in jobs])
+        except Exception:
+            logger.exception('Job batch %s failed', task_name)
+            self._retry_or_fail(jobs, traceback.format_exc())
+        else:
+            Job.objects.filter(id__in=[job.id for job in jobs]).delete()
+        finally:
+            close_old_connections()
+
+    def _retry_or_fail(self, jobs, error):
+        now = timezone.now()
+        backoff = get_jobs_setting('RETRY_BACKOFF')
+        max_backoff = get_jobs_setting('MAX_BACKOFF')
+        for job in jobs:
+            job.attempts += 1
+            job.last_error = error
+            job.locked_by = None
+            job.locked_at = None
+            if job.attempts >= job.max_attempts:
+                job.status = 'failed'
+            else:
+                job.status = 'pending'
+                job.run_at = now + timedelta(seconds=min(backoff * 2 ** (job.attempts - 1), max_backoff))
+        Job.objects.bulk_update(jobs, ['attempts', 'last_error', 'locked_by', 'locked_at', 'status', 'run_at'])
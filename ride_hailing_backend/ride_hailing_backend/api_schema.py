@@ -0,0 +1,164 @@
+"""
+Pre-generated OpenAPI schema.
+
+Building the schema introspects every view and serializer, so it is done
+once by the generate_api_schema command (at build time) and the files are
+served from memory with an ETag. The Swagger and ReDoc pages load the schema
+from these endpoints instead of having drf_yasg rebuild it on every hit.
+
+With API_SCHEMA['AUTO_REGENERATE'] (on with DEBUG) the schema is rebuilt
+when a Python file in the project is newer than the stored one.
+"""
+import hashlib
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.views.decorators.http import condition, require_safe
+from drf_yasg import openapi
+from drf_yasg.codecs import OpenAPICodecJson, OpenAPICodecYaml
+from drf_yasg.generators import OpenAPISchemaGenerator
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Where generate_api_schema writes openapi.json and openapi.yaml
+    'DIR': None,
+    'AUTO_REGENERATE': False,
+}
+
+API_INFO = openapi.Info(
+    title="Ride Hailing API",
+    default_version="v1",
+    description="API documentation for Ride Hailing application",
+    terms_of_service="https://www.example.com/terms/",
+    contact=openapi.Contact(email="contact@example.com"),
+    license=openapi.License(name="BSD License"),
+)
+
+# Format: (file name, content type, codec)
+FORMATS = {
+    'json': ('openapi.json', 'application/json', OpenAPICodecJson),
+    'yaml': ('openapi.yaml', 'application/yaml', OpenAPICodecYaml),
+}
+
+# Directories under BASE_DIR that hold no schema sources
+SKIP_DIRS = {'media', 'staticfiles', 'migrations', 'management', 'benchmarks', 'profiles', 'metrics', '__pycache__'}
+
+
+def get_schema_setting(name):
+    return getattr(settings, 'API_SCHEMA', {}).get(name, DEFAULTS[name])
+
+
+class StoredSchema:
+    def __init__(self, body, content_type):
+        self.body = body
+        self.content_type = content_type
+        self.etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+def generate_schema():
+    """
+    Build the schema and return it encoded in every format, as bytes by format.
+    """
+    schema = OpenAPISchemaGenerator(API_INFO).get_schema(request=None, public=True)
+    return {fmt: codec(validators=[]).encode(schema) for fmt, (_, _, codec) in FORMATS.items()}
+
+
+def write_schema(encoded, schema_dir):
+    os.makedirs(schema_dir, exist_ok=True)
+    for fmt, body in encoded.items():
+        path = os.path.join(schema_dir, FORMATS[fmt][0])
+        # Written under a temporary name and renamed, so readers never see a partial file
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, 'wb') as fh:
+            fh.write(body)
+        os.replace(temporary, path)
+
+
+def newest_source_mtime():
+    newest = 0.0
+    for root, dirs, files in os.walk(settings.BASE_DIR):
+        dirs[:] = [name for name in dirs if name not in SKIP_DIRS and not name.startswith('.')]
+        for name in files:
+            if name.endswith('.py'):
+                newest = max(newest, os.path.getmtime(os.path.join(root, name)))
+    return newest
+
+
+_schemas = {}
+_sources_mtime = None
+_lock = threading.Lock()
+
+
+def _stored_mtime(schema_dir):
+    try:
+        return min(os.path.getmtime(os.path.join(schema_dir, name)) for name, _, _ in FORMATS.values())
+    except OSError:
+        return None
+
+
+def _load(sources_mtime):
+    """
+    Read the stored schema, or build and store it when missing or older than sources_mtime.
+    """
+    schema_dir = get_schema_setting('DIR')
+    stored_mtime = _stored_mtime(schema_dir) if schema_dir else None
+    if stored_mtime is not None and (sources_mtime is None or stored_mtime >= sources_mtime):
+        encoded = {}
+        for fmt, (name, _, _) in FORMATS.items():
+            with open(os.path.join(schema_dir, name), 'rb') as fh:
+                encoded[fmt] = fh.read()
+    else:
+        if sources_mtime is None:
+            logger.warning('No pre-generated API schema found; run generate_api_schema at build time')
+        encoded = generate_schema()
+        if schema_dir:
+            try:
+                write_schema(encoded, schema_dir)
+            except OSError as exc:
+                logger.warning('Could not store the API schema in %s: %s', schema_dir, exc)
+    return {fmt: StoredSchema(body, FORMATS[fmt][1]) for fmt, body in encoded.items()}
+
+
+def get_stored_schema(fmt):
+    """
+    Return the StoredSchema for a format, loading or building it on first use.
+    """
+    global _schemas, _sources_mtime
+    if fmt not in FORMATS:
+        raise Http404
+    auto_regenerate = get_schema_setting('AUTO_REGENERATE')
+    schemas = _schemas
+    if schemas and not auto_regenerate:
+        return schemas[fmt]
+    with _lock:
+        sources_mtime = newest_source_mtime() if auto_regenerate else None
+        if not _schemas or sources_mtime != _sources_mtime:
+            _schemas = _load(sources_mtime)
+            _sources_mtime = sources_mtime
+        return _schemas[fmt]
+
+
+def reset_schema():
+    global _schemas, _sources_mtime
+    with _lock:
+        _schemas = {}
+        _sources_mtime = None
+
+
+def _etag(request, fmt):
+    return get_stored_schema(fmt).etag
+
+
+@require_safe
+@condition(etag_func=_etag)
+def schema_file_view(request, fmt):
+    stored = get_stored_schema(fmt)
+    response = HttpResponse(stored.body, content_type=stored.content_type)
+    # Clients may keep a copy but must check the ETag before using it
+    response['Cache-Control'] = 'no-cache'
+    return response
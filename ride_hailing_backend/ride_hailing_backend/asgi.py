@@ -14,3 +14,7 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ride_hailing_backend.settings')
 
 application = get_asgi_application()
+
+# Expire drivers whose heartbeats stop (see rides/heartbeats.py)
+from rides.heartbeats import monitor  # noqa: E402
+monitor.enable_sweeper()
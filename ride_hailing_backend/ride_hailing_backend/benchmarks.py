@@ -0,0 +1,79 @@
+import json
+import os
+import platform
+import subprocess
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+
+
+def percentile(samples, pct):
+    """
+    Return the pct-th percentile of samples using linear interpolation.
+    """
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = (len(ordered) - 1) * (pct / 100.0)
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(latencies_ms, query_counts=None, elapsed_s=None):
+    """
+    Summarize a list of latencies (in milliseconds) into the figures we track.
+    """
+    summary = {
+        'requests': len(latencies_ms),
+        'p50_ms': round(percentile(latencies_ms, 50), 3),
+        'p95_ms': round(percentile(latencies_ms, 95), 3),
+        'p99_ms': round(percentile(latencies_ms, 99), 3),
+        'mean_ms': round(sum(latencies_ms) / len(latencies_ms), 3) if latencies_ms else 0.0,
+    }
+    if query_counts is not None:
+        summary['queries_per_request'] = round(sum(query_counts) / len(query_counts), 2) if query_counts else 0.0
+        summary['max_queries'] = max(query_counts) if query_counts else 0
+    if elapsed_s:
+        summary['throughput_rps'] = round(len(latencies_ms) / elapsed_s, 2)
+    return summary
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=settings.BASE_DIR,
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(name, results, output_dir=None):
+    """
+    Store benchmark results as JSON so runs can be compared over time.
+
+    Returns the path of the written file.
+    """
+    output_dir = output_dir or settings.BENCHMARK_RESULTS_DIR
+    os.makedirs(output_dir, exist_ok=True)
+
+    now = datetime.now(dt_timezone.utc)
+    payload = {
+        'benchmark': name,
+        'created_at': now.isoformat(),
+        'git_revision': _git_revision(),
+        'python': platform.python_version(),
+        'database': settings.DATABASES['default']['ENGINE'],
+        'results': results,
+    }
+    path = os.path.join(output_dir, f"{name}-{now.strftime('%Y%m%dT%H%M%S')}.json")
+    with open(path, 'w') as fh:
+        json.dump(payload, fh, indent=2, default=str)
+    return path
+
+
+def load_results(path):
+    with open(path) as fh:
+        return json.load(fh)
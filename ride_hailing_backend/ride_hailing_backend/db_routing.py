@@ -0,0 +1,173 @@
+"""
+Read-replica routing.
+
+Views opt in with the ``replica_reads`` decorator, on the class or on single
+handlers and actions. For GET, HEAD and OPTIONS requests to those views,
+ReplicaRoutingMiddleware picks one of DATABASE_ROUTING['REPLICAS'] and
+ReplicaRouter sends the request's reads there. Writes, reads inside
+``transaction.atomic`` and everything outside annotated views stay on the
+primary.
+
+A user reads from the primary for PIN_SECONDS after their own writes and
+after a token was issued to them (login, registration, refresh), so they
+always see their own changes despite replication lag.
+"""
+import contextvars
+import random
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from .metrics import Counter
+
+
+DEFAULTS = {
+    # Aliases in DATABASES that replicate the primary
+    'REPLICAS': [],
+    # Seconds a user reads from the primary after their own write; should
+    # exceed the usual replication lag
+    'PIN_SECONDS': 5,
+    # Django cache alias holding the pins. Use a shared backend (Redis,
+    # memcached) when running several worker processes.
+    'CACHE': 'default',
+}
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+DATABASE_READ_ROUTES = Counter(
+    'database_read_routes_total', 'Requests to replica-enabled views by where their reads went.', ('route',),
+)
+
+_read_alias = contextvars.ContextVar('read_alias', default=None)
+
+
+def get_routing_setting(name):
+    return getattr(settings, 'DATABASE_ROUTING', {}).get(name, DEFAULTS[name])
+
+
+def replica_reads(view):
+    """
+    Mark a view class, handler or viewset action as safe to serve from a replica.
+    """
+    view.replica_reads = True
+    return view
+
+
+@contextmanager
+def read_from(alias):
+    """
+    Send reads made outside transactions in this block to a database alias.
+    """
+    token = _read_alias.set(alias)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        alias = _read_alias.get()
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        aliases = {DEFAULT_DB_ALIAS, *get_routing_setting('REPLICAS')}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema through replication
+        if db in get_routing_setting('REPLICAS'):
+            return False
+        return None
+
+
+def _wants_replica(view_func, method):
+    if getattr(view_func, 'replica_reads', False):
+        return True
+    cls = getattr(view_func, 'cls', None)
+    if cls is None:
+        return False
+    if getattr(cls, 'replica_reads', False):
+        return True
+    handler_name = method.lower()
+    actions = getattr(view_func, 'actions', None)
+    if actions:
+        handler_name = actions.get(handler_name) or actions.get('get')
+    return getattr(getattr(cls, handler_name or '', None), 'replica_reads', False)
+
+
+def _pin_key(user_id):
+    return f"db:pin:{user_id}"
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Route reads of annotated views to a replica unless the user is pinned.
+    """
+
+    def __init__(self, get_response):
+        self.replicas = list(get_routing_setting('REPLICAS'))
+        if not self.replicas:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.pin_seconds = get_routing_setting('PIN_SECONDS')
+        self.cache = caches[get_routing_setting('CACHE')]
+
+    def __call__(self, request):
+        try:
+            response = self.get_response(request)
+        finally:
+            token = getattr(request, '_read_alias_token', None)
+            if token is not None:
+                _read_alias.reset(token)
+
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            # DRF sets request.user on the underlying request once it authenticates
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_authenticated:
+                self.cache.set(_pin_key(user.pk), True, self.pin_seconds)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method not in SAFE_METHODS or not _wants_replica(view_func, request.method):
+            return None
+        if self._is_pinned(request):
+            DATABASE_READ_ROUTES.inc('pinned')
+            return None
+        DATABASE_READ_ROUTES.inc('replica')
+        request._read_alias_token = _read_alias.set(random.choice(self.replicas))
+        return None
+
+    def _is_pinned(self, request):
+        from rest_framework_simplejwt.authentication import JWTAuthentication
+        from rest_framework_simplejwt.exceptions import InvalidToken
+        from rest_framework_simplejwt.settings import api_settings
+
+        # Authentication has not run yet, so read the user from the access
+        # token. This only checks the signature and does not touch the database.
+        authentication = JWTAuthentication()
+        header = authentication.get_header(request)
+        raw_token = authentication.get_raw_token(header) if header else None
+        if raw_token is None:
+            return False
+        try:
+            token = authentication.get_validated_token(raw_token)
+        except InvalidToken:
+            # The view will reject the request; nothing to read-your-writes
+            return False
+        if time.time() - token.get('iat', 0) < self.pin_seconds:
+            return True
+        user_id = token.get(api_settings.USER_ID_CLAIM)
+        return user_id is not None and bool(self.cache.get(_pin_key(user_id)))
@@ -0,0 +1,243 @@
+import csv
+import functools
+import json
+import logging
+import math
+import os
+import threading
+
+import numpy as np
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    # CSV with name, region, latitude and longitude columns
+    'PLACES_FILE': os.path.join(os.path.dirname(__file__), 'data', 'places.csv'),
+    # Where the memory-mapped index built from PLACES_FILE is kept
+    'INDEX_DIR': None,
+    'CELL_SIZE_DEG': 0.1,
+    # Coordinates further than this from every place get no place name
+    'MAX_DISTANCE_KM': 30,
+    'CACHE_SIZE': 10000,
+    # Decimals kept when caching lookups; 4 is about 11 m
+    'CACHE_PRECISION': 4,
+    # Client-supplied addresses that carry no information and are replaced
+    'PLACEHOLDERS': ('', 'current location', 'my location', 'pinned location', 'dropped pin'),
+}
+
+EARTH_RADIUS_M = 6371000.0
+INDEX_FILES = ('keys.npy', 'coords.npy', 'label_offsets.npy', 'labels.bin')
+
+
+def get_geocoder_setting(name):
+    return getattr(settings, 'GEOCODER', {}).get(name, DEFAULTS[name])
+
+
+class Place:
+    def __init__(self, label, latitude, longitude, distance_m):
+        self.label = label
+        self.latitude = latitude
+        self.longitude = longitude
+        self.distance_m = distance_m
+
+    def __repr__(self):
+        return f"<Place {self.label} ({self.distance_m:.0f} m)>"
+
+
+def _cell_keys(latitudes, longitudes, cell_size):
+    columns = math.ceil(360 / cell_size)
+    rows = np.floor((np.asarray(latitudes) + 90) / cell_size).astype(np.int64)
+    cols = np.floor((np.asarray(longitudes) + 180) / cell_size).astype(np.int64) % columns
+    return rows * columns + cols
+
+
+def build_index(places_file, index_dir, cell_size):
+    """
+    Write the grid index for a places CSV to index_dir.
+
+    Places are sorted by grid cell, so the places of a cell are one
+    contiguous slice found by binary search on keys.npy.
+    """
+    labels, coords = [], []
+    with open(places_file, newline='', encoding='utf-8') as fh:
+        for row in csv.DictReader(fh):
+            name, region = row['name'].strip(), (row.get('region') or '').strip()
+            labels.append(f"{name}, {region}" if region else name)
+            coords.append((float(row['latitude']), float(row['longitude'])))
+
+    coords = np.array(coords, dtype=np.float64).reshape(-1, 2)
+    keys = _cell_keys(coords[:, 0], coords[:, 1], cell_size)
+    order = np.argsort(keys, kind='stable')
+    encoded = [labels[i].encode('utf-8') for i in order]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(label) for label in encoded])
+
+    os.makedirs(index_dir, exist_ok=True)
+    # Written under temporary names and renamed, so readers never see a
+    # partial index even if several processes build it at once
+    suffix = f".{os.getpid()}.tmp"
+    arrays = {'keys.npy': keys[order], 'coords.npy': coords[order], 'label_offsets.npy': offsets}
+    for name, array in arrays.items():
+        with open(os.path.join(index_dir, name + suffix), 'wb') as fh:
+            np.save(fh, array)
+    with open(os.path.join(index_dir, 'labels.bin' + suffix), 'wb') as fh:
+        fh.write(b''.join(encoded))
+    for name in INDEX_FILES:
+        os.replace(os.path.join(index_dir, name + suffix), os.path.join(index_dir, name))
+
+    meta = {'source_mtime': os.path.getmtime(places_file), 'cell_size': cell_size, 'count': len(labels)}
+    with open(os.path.join(index_dir, 'meta.json'), 'w') as fh:
+        json.dump(meta, fh)
+    return len(labels)
+
+
+def index_is_current(places_file, index_dir, cell_size):
+    try:
+        with open(os.path.join(index_dir, 'meta.json')) as fh:
+            meta = json.load(fh)
+    except (OSError, ValueError):
+        return False
+    return (
+        meta['source_mtime'] == os.path.getmtime(places_file)
+        and meta['cell_size'] == cell_size
+        and all(os.path.exists(os.path.join(index_dir, name)) for name in INDEX_FILES)
+    )
+
+
+class ReverseGeocoder:
+    """
+    Nearest-place lookups over a memory-mapped grid index.
+
+    Arrays are opened with mmap, so worker processes share the page cache
+    instead of each holding a copy. Lookups are cached by rounded coordinates.
+    """
+
+    def __init__(self, index_dir, cell_size, max_distance_km, cache_size, cache_precision):
+        self.keys = np.load(os.path.join(index_dir, 'keys.npy'), mmap_mode='r')
+        self.coords = np.load(os.path.join(index_dir, 'coords.npy'), mmap_mode='r')
+        self.label_offsets = np.load(os.path.join(index_dir, 'label_offsets.npy'), mmap_mode='r')
+        labels_path = os.path.join(index_dir, 'labels.bin')
+        self.labels = np.memmap(labels_path, dtype=np.uint8, mode='r') if os.path.getsize(labels_path) else b''
+        self.cell_size = cell_size
+        self.columns = math.ceil(360 / cell_size)
+        self.max_distance_m = max_distance_km * 1000
+        self.cache_precision = cache_precision
+        self._cached_nearest = functools.lru_cache(maxsize=cache_size)(self.nearest_uncached)
+
+    def nearest(self, latitude, longitude):
+        """
+        Return the nearest Place within MAX_DISTANCE_KM, or None.
+        """
+        precision = self.cache_precision
+        return self._cached_nearest(round(float(latitude), precision), round(float(longitude), precision))
+
+    def nearest_uncached(self, latitude, longitude):
+        if not len(self.keys):
+            return None
+        cell_m = self.cell_size * math.pi / 180 * EARTH_RADIUS_M
+        cos_lat = max(math.cos(math.radians(latitude)), 0.01)
+        row = math.floor((latitude + 90) / self.cell_size)
+        col = math.floor((longitude + 180) / self.cell_size)
+        # Search growing squares of cells around the query. Anything outside a
+        # square of radius r is at least r cells away, so a match closer than
+        # that is final; the last square covers MAX_DISTANCE_KM.
+        reach = math.ceil(self.max_distance_m / (cell_m * cos_lat))
+        for radius in range(1, reach + 1):
+            best = self._nearest_in_square(latitude, longitude, row, col, radius, cos_lat)
+            if best is not None and best[1] <= radius * cell_m * cos_lat:
+                break
+        if best is None or best[1] > self.max_distance_m:
+            return None
+
+        index, distance, point = best
+        label = bytes(self.labels[self.label_offsets[index]:self.label_offsets[index + 1]]).decode('utf-8')
+        return Place(label, float(point[0]), float(point[1]), float(distance))
+
+    def _nearest_in_square(self, latitude, longitude, row, col, radius, cos_lat):
+        offsets = np.arange(-radius, radius + 1)
+        cells = ((row + offsets)[:, None] * self.columns + (col + offsets)[None, :] % self.columns).ravel()
+        starts = np.searchsorted(self.keys, cells, side='left')
+        ends = np.searchsorted(self.keys, cells, side='right')
+        found = ends > starts
+        if not found.any():
+            return None
+        candidates = np.concatenate([np.arange(s, e) for s, e in zip(starts[found], ends[found])])
+
+        # Equirectangular distance is accurate to well under 1% at these ranges
+        points = self.coords[candidates]
+        d_lat = np.radians(points[:, 0] - latitude)
+        d_lon = np.radians(points[:, 1] - longitude) * cos_lat
+        distances = np.hypot(d_lat, d_lon) * EARTH_RADIUS_M
+        best = int(np.argmin(distances))
+        return int(candidates[best]), distances[best], points[best]
+
+
+_geocoder = None
+_geocoder_lock = threading.Lock()
+
+
+def get_geocoder():
+    """
+    Return the shared geocoder, building its index first if the places file changed.
+
+    Returns None when geocoding is disabled or the places file is missing.
+    """
+    global _geocoder
+    if not get_geocoder_setting('ENABLED'):
+        return None
+    if _geocoder is not None:
+        return _geocoder or None
+    with _geocoder_lock:
+        if _geocoder is None:
+            places_file = get_geocoder_setting('PLACES_FILE')
+            index_dir = get_geocoder_setting('INDEX_DIR')
+            cell_size = get_geocoder_setting('CELL_SIZE_DEG')
+            if not index_dir or not os.path.exists(places_file):
+                logger.warning('Reverse geocoding disabled: no places file or index directory configured')
+                # False marks the lookup as done, so the warning is logged once
+                _geocoder = False
+                return None
+            if not index_is_current(places_file, index_dir, cell_size):
+                build_index(places_file, index_dir, cell_size)
+            _geocoder = ReverseGeocoder(
+                index_dir, cell_size,
+                get_geocoder_setting('MAX_DISTANCE_KM'),
+                get_geocoder_setting('CACHE_SIZE'),
+                get_geocoder_setting('CACHE_PRECISION'),
+            )
+    return _geocoder or None
+
+
+def reset_geocoder():
+    global _geocoder
+    with _geocoder_lock:
+        _geocoder = None
+
+
+def is_placeholder(address):
+    return (address or '').strip().lower() in get_geocoder_setting('PLACEHOLDERS')
+
+
+def describe(latitude, longitude):
+    """
+    Human-readable address for a coordinate: the nearest place, or the coordinates.
+    """
+    geocoder = get_geocoder()
+    place = geocoder.nearest(latitude, longitude) if geocoder else None
+    if place is None:
+        return f"{float(latitude):.6f}, {float(longitude):.6f}"
+    if place.distance_m < 1000:
+        return place.label
+    return f"Near {place.label}"
+
+
+def fill_address(address, latitude, longitude):
+    """
+    Keep a meaningful client-supplied address, otherwise describe the coordinate.
+    """
+    if latitude is None or longitude is None or not is_placeholder(address):
+        return address
+    return describe(latitude, longitude)
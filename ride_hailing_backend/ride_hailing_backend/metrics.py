@@ -0,0 +1,336 @@
+"""
+Low-overhead process metrics exposed in Prometheus text format.
+
+Every thread records into its own shard (a plain dict), so recording never
+takes a lock. Shards are merged when metrics are collected. Each worker
+process periodically writes its merged snapshot to METRICS['DIR'] and the
+metrics view sums the snapshots of all workers, which gives per-deployment
+totals without an external agent. Snapshots of workers that have exited are
+folded into retired.json, so their counts are kept and a new worker reusing
+the PID does not overwrite them. Worker liveness is checked by PID, so DIR
+must not be shared between hosts.
+"""
+import atexit
+import fcntl
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db.backends.signals import connection_created
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+
+DEFAULTS = {
+    'ENABLED': False,
+    'DIR': None,
+    'FLUSH_INTERVAL': 5.0,
+    'ALLOWED_IPS': ('127.0.0.1', '::1'),
+}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+_metrics = {}
+_shards = []
+_shards_lock = threading.Lock()
+_local = threading.local()
+# PID of the process that last flushed, to notice the first flush after a fork
+_flushed_pid = None
+
+RETIRED_FILE = 'retired.json'
+
+
+def get_metrics_setting(name):
+    return getattr(settings, 'METRICS', {}).get(name, DEFAULTS[name])
+
+
+def _new_shard():
+    shard = {}
+    # Only taken once per thread, never on the recording path
+    with _shards_lock:
+        _shards.append(shard)
+    _local.shard = shard
+    return shard
+
+
+class Counter:
+    """Monotonically increasing value, optionally split by labels."""
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        _metrics[name] = self
+
+    def inc(self, *labelvalues, amount=1):
+        try:
+            shard = _local.shard
+        except AttributeError:
+            shard = _new_shard()
+        key = (self.name, labelvalues)
+        shard[key] = shard.get(key, 0) + amount
+
+    def merge(self, current, value):
+        return (current or 0) + value
+
+
+class Histogram:
+    """Bucketed observations with their sum and count, optionally split by labels."""
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        _metrics[name] = self
+
+    def observe(self, value, *labelvalues):
+        try:
+            shard = _local.shard
+        except AttributeError:
+            shard = _new_shard()
+        key = (self.name, labelvalues)
+        cell = shard.get(key)
+        if cell is None:
+            # One slot per bucket, one for +Inf, then sum and count
+            cell = shard[key] = [0] * (len(self.buckets) + 3)
+        cell[bisect_left(self.buckets, value)] += 1
+        cell[-2] += value
+        cell[-1] += 1
+
+    def merge(self, current, value):
+        if current is None:
+            return list(value)
+        return [a + b for a, b in zip(current, value)]
+
+
+def snapshot():
+    """
+    Merge the shards of every thread in this process.
+    """
+    merged = {}
+    with _shards_lock:
+        shards = list(_shards)
+    for shard in shards:
+        for key, value in list(shard.items()):
+            metric = _metrics.get(key[0])
+            if metric is not None:
+                merged[key] = metric.merge(merged.get(key), value)
+    return merged
+
+
+def _read_rows(path):
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_rows(path, rows):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as fh:
+        json.dump(rows, fh)
+    os.replace(tmp_path, path)
+
+
+def _merge_rows(merged, rows):
+    for name, labels, value in rows:
+        metric = _metrics.get(name)
+        if metric is not None:
+            key = (name, tuple(labels))
+            merged[key] = metric.merge(merged.get(key), value)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _retire(directory, filenames):
+    """
+    Fold the snapshots of exited workers into retired.json and delete them.
+    """
+    # Under the lock a snapshot is folded once, whichever worker gets to it
+    with open(os.path.join(directory, 'retired.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        retired_path = os.path.join(directory, RETIRED_FILE)
+        merged = {}
+        _merge_rows(merged, _read_rows(retired_path) or [])
+        retiring = []
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            rows = _read_rows(path)
+            if rows is not None:
+                _merge_rows(merged, rows)
+                retiring.append(path)
+        if retiring:
+            _write_rows(retired_path, [[name, list(labels), value] for (name, labels), value in merged.items()])
+            for path in retiring:
+                os.remove(path)
+
+
+def _retire_dead_workers(directory):
+    dead = [
+        filename for filename in os.listdir(directory)
+        if filename.endswith('.json') and filename[:-5].isdigit() and not _pid_alive(int(filename[:-5]))
+    ]
+    if dead:
+        _retire(directory, dead)
+
+
+def flush():
+    """
+    Write this process's snapshot where the metrics view of any worker can read it.
+    """
+    global _flushed_pid
+    directory = get_metrics_setting('DIR')
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    pid = os.getpid()
+    filename = f"{pid}.json"
+    if _flushed_pid != pid:
+        # A snapshot under our PID was left by an earlier process that had it
+        if os.path.exists(os.path.join(directory, filename)):
+            _retire(directory, [filename])
+        _flushed_pid = pid
+    rows = [[name, list(labels), value] for (name, labels), value in snapshot().items()]
+    _write_rows(os.path.join(directory, filename), rows)
+
+
+def collect():
+    """
+    Combine the live snapshot of this process with the last flush of every other worker.
+    """
+    merged = snapshot()
+    directory = get_metrics_setting('DIR')
+    if directory and os.path.isdir(directory):
+        _retire_dead_workers(directory)
+        own_file = f"{os.getpid()}.json"
+        for filename in os.listdir(directory):
+            if not filename.endswith('.json') or filename == own_file:
+                continue
+            _merge_rows(merged, _read_rows(os.path.join(directory, filename)) or [])
+    return merged
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def render_prometheus(values=None):
+    """
+    Render collected values in the Prometheus text exposition format.
+    """
+    values = collect() if values is None else values
+    lines = []
+    for name, metric in sorted(_metrics.items()):
+        lines.append(f"# HELP {name} {metric.documentation}")
+        lines.append(f"# TYPE {name} {metric.type}")
+        for (key_name, labelvalues), value in sorted(values.items(), key=lambda item: item[0]):
+            if key_name != name:
+                continue
+            pairs = list(zip(metric.labelnames, labelvalues))
+            if metric.type == 'counter':
+                lines.append(f"{name}{_format_labels(pairs)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets + ('+Inf',), value[:-2]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(pairs + [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(pairs)} {value[-2]}")
+            lines.append(f"{name}_count{_format_labels(pairs)} {value[-1]}")
+    return '\n'.join(lines) + '\n'
+
+
+def _count_query(execute, sql, params, many, context):
+    _local.queries = getattr(_local, 'queries', 0) + 1
+    return execute(sql, params, many, context)
+
+
+def _install_query_counter(sender=None, connection=None, **kwargs):
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+def query_count():
+    """
+    Number of SQL queries executed by the current thread so far.
+    """
+    return getattr(_local, 'queries', 0)
+
+
+REQUESTS = Counter(
+    'http_requests_total', 'HTTP requests by URL name, method and status code.',
+    ('view', 'method', 'status'),
+)
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Request latency by URL name.', ('view',),
+)
+REQUEST_QUERIES = Histogram(
+    'http_request_db_queries', 'SQL queries per request by URL name.', ('view',), buckets=QUERY_BUCKETS,
+)
+
+
+class MetricsMiddleware:
+    """
+    Record latency, status code and query count for every request.
+    """
+
+    def __init__(self, get_response):
+        if not get_metrics_setting('ENABLED'):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.flush_interval = get_metrics_setting('FLUSH_INTERVAL')
+        self.next_flush = time.perf_counter() + self.flush_interval
+
+        connection_created.connect(_install_query_counter, weak=False, dispatch_uid='metrics_query_counter')
+        for connection in connections.all(initialized_only=True):
+            _install_query_counter(connection=connection)
+        atexit.register(flush)
+
+    def __call__(self, request):
+        queries = query_count()
+        started = time.perf_counter()
+        response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = match.url_name if match is not None and match.url_name else 'unmatched'
+        REQUESTS.inc(view, request.method, str(response.status_code))
+        REQUEST_LATENCY.observe(elapsed, view)
+        REQUEST_QUERIES.observe(query_count() - queries, view)
+
+        if started > self.next_flush:
+            self.next_flush = started + self.flush_interval
+            flush()
+        return response
+
+
+def metrics_view(request):
+    """
+    Internal endpoint returning all metrics in Prometheus text format.
+    """
+    if request.META.get('REMOTE_ADDR') not in get_metrics_setting('ALLOWED_IPS'):
+        return HttpResponseForbidden()
+    flush()
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
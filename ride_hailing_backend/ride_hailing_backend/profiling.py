@@ -0,0 +1,170 @@
+"""
+Sampled per-request profiling.
+
+ProfilingMiddleware times SQL (through ``connection.execute_wrapper``),
+serializer ``.data`` evaluation and DRF rendering for a sample of requests and
+reports them in a ``Server-Timing`` header. A single request can also be run
+under cProfile by sending the configured token in the ``X-Profile`` header.
+
+Unsampled requests only pay for a ``random.random()`` call and a context
+variable lookup in the DRF hooks, so the middleware can stay enabled in
+production at a low sample rate.
+"""
+import contextvars
+import cProfile
+import os
+import random
+import time
+import uuid
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+
+DEFAULTS = {
+    'ENABLED': False,
+    'SAMPLE_RATE': 0.01,
+    # Value the X-Profile header must carry to trigger a cProfile dump.
+    # Empty means cProfile dumps are only allowed when DEBUG is on.
+    'CPROFILE_TOKEN': '',
+    'CPROFILE_DIR': None,
+}
+
+_current_profile = contextvars.ContextVar('request_profile', default=None)
+
+
+def get_profiling_setting(name):
+    return getattr(settings, 'PROFILING', {}).get(name, DEFAULTS[name])
+
+
+def get_current_profile():
+    """
+    Return the RequestProfile of the request being sampled, if any.
+    """
+    return _current_profile.get()
+
+
+class RequestProfile:
+    """Timings collected for one sampled request (durations in seconds)."""
+    __slots__ = ('sql_count', 'sql_time', 'serializer_time', 'render_time', 'started')
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.serializer_time = 0.0
+        self.render_time = 0.0
+        self.started = time.perf_counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        # Used as a connection.execute_wrapper
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - started
+            self.sql_count += 1
+
+    def server_timing(self):
+        total = time.perf_counter() - self.started
+        return ', '.join([
+            f'sql;dur={self.sql_time * 1000:.2f};desc="{self.sql_count} queries"',
+            f'serializer;dur={self.serializer_time * 1000:.2f}',
+            f'render;dur={self.render_time * 1000:.2f}',
+            f'total;dur={total * 1000:.2f}',
+        ])
+
+
+def _timed_property(prop, attribute):
+    fget = prop.fget
+
+    def timed(self):
+        profile = _current_profile.get()
+        if profile is None:
+            return fget(self)
+        started = time.perf_counter()
+        try:
+            return fget(self)
+        finally:
+            setattr(profile, attribute, getattr(profile, attribute) + time.perf_counter() - started)
+
+    timed._profiled = True
+    return property(timed, prop.fset, prop.fdel, prop.__doc__)
+
+
+def install_drf_hooks():
+    """
+    Wrap serializer ``.data`` and ``Response.rendered_content`` with timers.
+
+    Only top-level serializers evaluate ``.data`` (nested ones go through
+    ``to_representation``), so nothing is counted twice. Safe to call repeatedly.
+    """
+    from rest_framework import serializers
+    from rest_framework.response import Response
+
+    targets = (
+        (serializers.Serializer, 'data', 'serializer_time'),
+        (serializers.ListSerializer, 'data', 'serializer_time'),
+        (Response, 'rendered_content', 'render_time'),
+    )
+    for cls, name, attribute in targets:
+        prop = cls.__dict__[name]
+        if not getattr(prop.fget, '_profiled', False):
+            setattr(cls, name, _timed_property(prop, attribute))
+
+
+class ProfilingMiddleware:
+    """
+    Emit a Server-Timing header for a random sample of requests.
+    """
+
+    def __init__(self, get_response):
+        if not get_profiling_setting('ENABLED'):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = get_profiling_setting('SAMPLE_RATE')
+        self.cprofile_token = get_profiling_setting('CPROFILE_TOKEN')
+        self.cprofile_dir = get_profiling_setting('CPROFILE_DIR') or os.path.join(settings.BASE_DIR, 'profiles')
+        install_drf_hooks()
+
+    def __call__(self, request):
+        run_cprofile = self._wants_cprofile(request)
+        if not run_cprofile and random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        profiler = cProfile.Profile() if run_cprofile else None
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(profile))
+                if profiler:
+                    profiler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    if profiler:
+                        profiler.disable()
+        finally:
+            _current_profile.reset(token)
+
+        response['Server-Timing'] = profile.server_timing()
+        if profiler:
+            response['X-Profile-Dump'] = self._dump(profiler)
+        return response
+
+    def _wants_cprofile(self, request):
+        value = request.headers.get('X-Profile')
+        if not value:
+            return False
+        if self.cprofile_token:
+            return value == self.cprofile_token
+        return settings.DEBUG
+
+    def _dump(self, profiler):
+        os.makedirs(self.cprofile_dir, exist_ok=True)
+        filename = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}.prof"
+        profiler.dump_stats(os.path.join(self.cprofile_dir, filename))
+        return filename
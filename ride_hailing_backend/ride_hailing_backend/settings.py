@@ -1,8 +1,9 @@
 import os
+from decimal import Decimal
 from datetime import timedelta
 from pathlib import Path
 # from decouple import config, Csv
-from  decouple import config
+from  decouple import config, Csv
 
 
 
@@ -40,6 +41,7 @@ INSTALLED_APPS = [
     # Third-party apps
     'rest_framework',
     'rest_framework_simplejwt',
+    'rest_framework_simplejwt.token_blacklist',
     'corsheaders',
     'drf_yasg',
     'django_filters',
@@ -47,9 +49,13 @@ INSTALLED_APPS = [
     # Local apps
     'users',
     'rides',
+    'jobs',
+    'analytics',
 ]
 
 MIDDLEWARE = [
+    'ride_hailing_backend.metrics.MetricsMiddleware',  # Prometheus request metrics
+    'ride_hailing_backend.profiling.ProfilingMiddleware',  # Sampled Server-Timing output
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # Static files in production
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -59,6 +65,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'ride_hailing_backend.db_routing.ReplicaRoutingMiddleware',  # Read replicas for annotated views
 ]
 
 ROOT_URLCONF = 'ride_hailing_backend.urls'
@@ -92,6 +99,14 @@ DATABASES = {
     }
 }
 
+# Read replicas, one alias per entry in DATABASE_REPLICAS. To try them locally
+# with SQLite, copy the primary (sqlite3 db.sqlite3 ".backup replica.sqlite3")
+# and set DATABASE_REPLICAS=replica.sqlite3. Tests mirror them to the primary.
+for index, name in enumerate(config('DATABASE_REPLICAS', default='', cast=Csv())):
+    DATABASES[f'replica{index + 1}'] = {**DATABASES['default'], 'NAME': name, 'TEST': {'MIRROR': 'default'}}
+
+DATABASE_ROUTERS = ['ride_hailing_backend.db_routing.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -146,6 +161,174 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Request profiling (see ride_hailing_backend/profiling.py)
+PROFILING = {
+    'ENABLED': config('PROFILING_ENABLED', default=True, cast=bool),
+    'SAMPLE_RATE': config('PROFILING_SAMPLE_RATE', default=0.01, cast=float),
+    'CPROFILE_TOKEN': config('PROFILING_CPROFILE_TOKEN', default=''),
+    'CPROFILE_DIR': os.path.join(BASE_DIR, 'profiles'),
+}
+
+# Operational metrics (see ride_hailing_backend/metrics.py)
+METRICS = {
+    'ENABLED': config('METRICS_ENABLED', default=True, cast=bool),
+    # Worker processes share their counters through this directory
+    'DIR': config('METRICS_DIR', default=os.path.join(BASE_DIR, 'metrics')),
+    'FLUSH_INTERVAL': 5.0,
+    'ALLOWED_IPS': ('127.0.0.1', '::1'),
+}
+
+# Points METRICS['DIR'] at a temporary directory while tests run
+TEST_RUNNER = 'ride_hailing_backend.test_runner.TestRunner'
+
+# Bulk user imports (see users/importers.py)
+USER_IMPORT = {
+    'API_WORKERS': config('USER_IMPORT_API_WORKERS', default=2, cast=int),
+}
+
+# Background jobs (see jobs/worker.py, run with `manage.py run_jobs`)
+JOBS = {
+    'QUEUES': {
+        'default': {'CONCURRENCY': 2},
+        'ratings': {'CONCURRENCY': 1},
+        'payments': {'CONCURRENCY': 2},
+        'map_matching': {'CONCURRENCY': 1},
+    },
+    'POLL_INTERVAL': 1.0,
+    'VISIBILITY_TIMEOUT': 300,
+    'RETRY_BACKOFF': 5,
+    'MAX_BACKOFF': 3600,
+    'EAGER': config('JOBS_EAGER', default=False, cast=bool),
+}
+
+# Ride payment settlement (see rides/payments.py)
+PAYMENTS = {
+    # Without a gateway card and wallet rides stay pending; the stub charges nothing real
+    'GATEWAY': config('PAYMENT_GATEWAY', default='rides.payments.StubGateway' if DEBUG else None),
+    'GATEWAY_OPTIONS': {},
+    'CURRENCY': 'NGN',
+    'CONCURRENCY': config('PAYMENT_CONCURRENCY', default=8, cast=int),
+    'BATCH_SIZE': 200,
+    'MAX_ATTEMPTS': 5,
+    'RETRY_BACKOFF': 30,
+    'MAX_BACKOFF': 3600,
+}
+
+# Driver availability heartbeats (see rides/heartbeats.py)
+HEARTBEATS = {
+    'ENABLED': True,
+    'TIMEOUT': config('HEARTBEAT_TIMEOUT', default=60, cast=int),
+    'TICK': 1.0,
+    'BATCH_SIZE': 500,
+    'RESYNC_INTERVAL': 300,
+}
+
+# Pooled ride matching and fare splitting (see rides/pooling.py)
+POOLING = {
+    'ENABLED': True,
+    'SEARCH_RADIUS_KM': 3,
+    'MAX_CANDIDATES': 50,
+    'SPEED_KMH': 25,
+    'ROAD_FACTOR': 1.3,
+    'MAX_PICKUP_MINUTES': 10,
+    'MAX_DELAY_MINUTES': 8,
+    'MAX_DETOUR_FACTOR': 1.5,
+    'MAX_FARE_SHARE': Decimal('0.75'),
+    'MAX_ATTEMPTS': 3,
+}
+
+# Map matching of completed rides' GPS traces (see rides/map_matching.py)
+MAP_MATCHING = {
+    'ENABLED': config('MAP_MATCHING_ENABLED', default=True, cast=bool),
+    'ROADS_FILE': config('ROADS_FILE', default=os.path.join(BASE_DIR, 'ride_hailing_backend', 'data', 'roads.csv')),
+    'GRAPH_PATH': config('ROAD_GRAPH_PATH', default=os.path.join(BASE_DIR, 'roads', 'graph.npz')),
+    'CELL_SIZE_DEG': 0.005,
+    'GPS_SIGMA_M': 10.0,
+    'TRANSITION_BETA_M': 20.0,
+    'SEARCH_RADIUS_M': 50.0,
+    'MAX_CANDIDATES': 8,
+    'MAX_ROUTE_FACTOR': 4.0,
+    'MIN_SPACING_M': 20.0,
+    'WORKERS': config('MAP_MATCHING_WORKERS', default=2, cast=int),
+}
+
+# Idempotency-Key handling for retried POSTs (see rides/idempotency.py)
+IDEMPOTENCY = {
+    # Seconds a stored response is replayed for
+    'TTL': 24 * 60 * 60,
+    # Completed responses kept in each process's memory
+    'CACHE_SIZE': 10000,
+    # Seconds after which an unfinished first request is assumed dead
+    'LOCK_TIMEOUT': 30,
+}
+
+# GPS ping throttling and downsampling per ride status (see rides/gps.py)
+GPS_THROTTLE = {
+    'CACHE': 'default',
+    'POLICIES': {
+        'accepted': {'RATE': 0.5, 'BURST': 5, 'MIN_DISTANCE_M': 50, 'MIN_INTERVAL_S': 10, 'MAX_INTERVAL_S': 60},
+        'arrived': {'RATE': 0.2, 'BURST': 3, 'MIN_DISTANCE_M': 25, 'MIN_INTERVAL_S': 30, 'MAX_INTERVAL_S': 120},
+        'in_progress': {'RATE': 2.0, 'BURST': 10, 'MIN_DISTANCE_M': 15, 'MIN_INTERVAL_S': 3, 'MAX_INTERVAL_S': 30},
+    },
+}
+
+# Simplified ride traces in API responses (see rides/traces.py)
+TRACES = {
+    'CACHE': 'default',
+    'CACHE_TIMEOUT': 86400,
+    'PIXEL_TOLERANCE': 1.0,
+    'DEFAULT_ZOOM': 16,
+    'MIN_TOLERANCE_M': 5.0,
+    'MAX_TOLERANCE_M': 1000.0,
+    'POLYLINE_PRECISION': 5,
+}
+
+# Offline reverse geocoding of ride and saved-location addresses (see ride_hailing_backend/geocoder.py)
+GEOCODER = {
+    'ENABLED': config('GEOCODER_ENABLED', default=True, cast=bool),
+    'PLACES_FILE': config('GEOCODER_PLACES_FILE', default=os.path.join(BASE_DIR, 'ride_hailing_backend', 'data', 'places.csv')),
+    'INDEX_DIR': config('GEOCODER_INDEX_DIR', default=os.path.join(BASE_DIR, 'geocoder_index')),
+    'MAX_DISTANCE_KM': 30,
+    'CACHE_SIZE': 10000,
+}
+
+# Hourly ride rollups (see analytics/rollups.py, fixed up by `manage.py reconcile_ride_rollups`)
+ANALYTICS = {
+    'ZONE_SIZE_DEG': '0.05',
+    'RECONCILE_HOURS': 48,
+}
+
+# Pickup ETAs from learned speeds (see rides/eta.py); rebuild nightly with build_speed_table
+ETA = {
+    'ENABLED': config('ETA_ENABLED', default=True, cast=bool),
+    'TABLE_PATH': config('ETA_TABLE_PATH', default=os.path.join(BASE_DIR, 'eta', 'speeds.npz')),
+    'HISTORY_DAYS': 28,
+}
+
+# Read-replica routing (see ride_hailing_backend/db_routing.py)
+DATABASE_ROUTING = {
+    'REPLICAS': [alias for alias in DATABASES if alias != 'default'],
+    'PIN_SECONDS': config('DATABASE_PIN_SECONDS', default=5, cast=int),
+}
+
+# Pre-generated OpenAPI schema (see ride_hailing_backend/api_schema.py).
+# Generate it at build time with `manage.py generate_api_schema`.
+API_SCHEMA = {
+    'DIR': config('API_SCHEMA_DIR', default=os.path.join(BASE_DIR, 'schema')),
+    # Rebuild when the code changes; development only, it scans the source tree
+    'AUTO_REGENERATE': DEBUG,
+}
+
+SWAGGER_SETTINGS = {
+    'SPEC_URL': 'schema-json',
+}
+REDOC_SETTINGS = {
+    'SPEC_URL': 'schema-json',
+}
+
+# Benchmark results (written by the benchmark management commands)
+BENCHMARK_RESULTS_DIR = os.path.join(BASE_DIR, 'benchmarks', 'results')
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -176,6 +359,15 @@ SIMPLE_JWT = {
     'AUTH_HEADER_NAME': 'HTTP_AUTHORIZATION',
     'USER_ID_FIELD': 'id',
     'USER_ID_CLAIM': 'user_id',
+    'TOKEN_REFRESH_SERIALIZER': 'users.serializers.TokenRefreshSerializer',
+}
+
+# In-memory filter of blacklisted refresh tokens (see users/tokens.py)
+TOKEN_BLACKLIST_FILTER = {
+    'CAPACITY': 100000,
+    'ERROR_RATE': 0.001,
+    'SYNC_INTERVAL': 2.0,
+    'REBUILD_INTERVAL': 3600.0,
 }
 
 # CORS Settings
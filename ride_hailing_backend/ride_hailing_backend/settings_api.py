@@ -0,0 +1,36 @@
+"""
+Settings for API-only worker pods.
+
+The same as settings.py without the admin, the API docs, static file
+handling and the browsable API, none of which JSON clients use. Workers
+start faster and use less memory.
+
+Start API workers with DJANGO_SETTINGS_MODULE=ride_hailing_backend.settings_api
+and keep a small pool on the default settings for the admin and docs.
+Compare both with the benchmark_startup command.
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import INSTALLED_APPS, MIDDLEWARE, REST_FRAMEWORK
+
+
+EXCLUDED_APPS = (
+    'jazzmin',
+    'django.contrib.admin',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+    'drf_yasg',
+)
+EXCLUDED_MIDDLEWARE = (
+    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+)
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in EXCLUDED_APPS]
+MIDDLEWARE = [middleware for middleware in MIDDLEWARE if middleware not in EXCLUDED_MIDDLEWARE]
+
+ROOT_URLCONF = 'ride_hailing_backend.urls_api'
+
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,
+    'DEFAULT_RENDERER_CLASSES': ['rest_framework.renderers.JSONRenderer'],
+}
@@ -0,0 +1,33 @@
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Keeps the metrics snapshots of test processes out of the real METRICS['DIR']
+    and charges rides through the stub gateway when no other is configured.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.metrics_dir = tempfile.mkdtemp(prefix='metrics-')
+        settings.METRICS = {**settings.METRICS, 'DIR': self.metrics_dir}
+        # Read by the settings of Django processes that tests start
+        self.saved_metrics_dir = os.environ.get('METRICS_DIR')
+        os.environ['METRICS_DIR'] = self.metrics_dir
+        if not settings.PAYMENTS.get('GATEWAY'):
+            settings.PAYMENTS = {**settings.PAYMENTS, 'GATEWAY': 'rides.payments.StubGateway'}
+
+    def teardown_test_environment(self, **kwargs):
+        # Without a DIR the flush registered with atexit writes nothing
+        settings.METRICS = {**settings.METRICS, 'DIR': None}
+        if self.saved_metrics_dir is None:
+            del os.environ['METRICS_DIR']
+        else:
+            os.environ['METRICS_DIR'] = self.saved_metrics_dir
+        shutil.rmtree(self.metrics_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
@@ -1,31 +1,27 @@
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path
 from django.conf import settings
 from django.conf.urls.static import static
 from rest_framework import permissions
 from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
+from .api_schema import API_INFO, schema_file_view
+from .urls_api import urlpatterns as api_urlpatterns
 
-# API Documentation
+# API Documentation. The UI pages load the pre-generated schema from
+# openapi.json (see SWAGGER_SETTINGS and api_schema.py).
 schema_view = get_schema_view(
-    openapi.Info(
-        title="Ride Hailing API",
-        default_version="v1",
-        description="API documentation for Ride Hailing application",
-        terms_of_service="https://www.example.com/terms/",
-        contact=openapi.Contact(email="contact@example.com"),
-        license=openapi.License(name="BSD License"),
-    ),
+    API_INFO,
     public=True,
     permission_classes=(permissions.AllowAny,),
 )
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('api/v1/', include('users.urls')),
-    path('api/v1/', include('rides.urls')),
+    *api_urlpatterns,
     
     # Documentation
+    path('openapi.json', schema_file_view, {'fmt': 'json'}, name='schema-json'),
+    path('openapi.yaml', schema_file_view, {'fmt': 'yaml'}, name='schema-yaml'),
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
 ]
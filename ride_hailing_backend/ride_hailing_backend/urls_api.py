@@ -0,0 +1,12 @@
+from django.urls import path, include
+from .metrics import metrics_view
+
+# Routes served by API workers (settings_api); urls.py adds the admin and docs
+urlpatterns = [
+    path('api/v1/', include('users.urls')),
+    path('api/v1/', include('rides.urls')),
+    path('api/v1/analytics/', include('analytics.urls')),
+    
+    # Internal monitoring
+    path('internal/metrics/', metrics_view, name='metrics'),
+]
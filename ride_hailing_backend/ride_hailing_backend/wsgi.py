@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ride_hailing_backend.settings')
 
 application = get_wsgi_application()
+
+# Expire drivers whose heartbeats stop (see rides/heartbeats.py)
+from rides.heartbeats import monitor  # noqa: E402
+monitor.enable_sweeper()
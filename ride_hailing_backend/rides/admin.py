@@ -1,40 +1,60 @@
+import uuid
 from django.contrib import admin
-from .models import Driver, RideCategory, Ride, RideLocation
+from django.db.models import Q, Count, Min, Max
+from django.urls import reverse
+from django.utils.html import format_html, format_html_join
+from ride_hailing_backend.paginators import EstimatedCountPaginator
+from users.models import User
+from .models import Driver, RideCategory, Ride, RideLocation, PoolTrip, RideStop
+from .tasks import refund_ride_payments
+
+
+# Number of GPS points shown on the ride change page
+TRACE_PREVIEW_POINTS = 20
+
+
+def parse_uuid(value):
+    try:
+        return uuid.UUID(value.strip())
+    except ValueError:
+        return None
 
 
 @admin.register(Driver)
 class DriverAdmin(admin.ModelAdmin):
     list_display = ('user', 'vehicle_make', 'vehicle_model', 'is_active', 'is_available', 'rating')
+    list_select_related = ('user',)
     list_filter = ('is_active', 'is_available')
+    raw_id_fields = ('user',)
     search_fields = ('user__email', 'user__full_name', 'vehicle_license_plate')
 
 
 @admin.register(RideCategory)
 class RideCategoryAdmin(admin.ModelAdmin):
-    list_display = ('name', 'base_fare', 'per_km_rate', 'capacity', 'is_active')
-    list_filter = ('is_active',)
+    list_display = ('name', 'base_fare', 'per_km_rate', 'capacity', 'is_pooled', 'is_active')
+    list_filter = ('is_active', 'is_pooled')
     search_fields = ('name', 'description')
 
 
-class RideLocationInline(admin.TabularInline):
-    model = RideLocation
-    extra = 0
-    readonly_fields = ('timestamp',)
-
-
 @admin.register(Ride)
 class RideAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'driver', 'status', 'total_fare', 'requested_at')
+    list_select_related = ('user', 'driver__user')
     list_filter = ('status', 'payment_status', 'requested_at')
-    search_fields = ('user__email', 'driver__user__email', 'pickup_address', 'destination_address')
+    # Matched exactly in get_search_results so every search hits an index
+    search_fields = ('=id', '=user__email', '=driver__user__email')
+    search_help_text = 'Search by ride ID, rider email or driver email.'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    raw_id_fields = ('category', 'payment_method')
+    actions = ['refund_payments']
     readonly_fields = (
         'id', 'user', 'driver', 'requested_at', 'accepted_at', 'driver_arrived_at',
-        'started_at', 'completed_at', 'cancelled_at'
+        'started_at', 'completed_at', 'cancelled_at', 'location_trace', 'payment_reference', 'pool_trip'
     )
-    inlines = [RideLocationInline]
     fieldsets = (
         ('Basic Info', {
-            'fields': ('id', 'user', 'driver', 'category', 'status')
+            'fields': ('id', 'user', 'driver', 'category', 'status', 'seats', 'pool_trip')
         }),
         ('Locations', {
             'fields': (
@@ -50,7 +70,7 @@ class RideAdmin(admin.ModelAdmin):
         }),
         ('Payment', {
             'fields': (
-                'payment_method', 'payment_status', 'base_fare',
+                'payment_method', 'payment_status', 'payment_reference', 'base_fare',
                 'distance_fare', 'time_fare', 'surge_multiplier', 'total_fare'
             )
         }),
@@ -60,6 +80,9 @@ class RideAdmin(admin.ModelAdmin):
                 'started_at', 'completed_at', 'cancelled_at'
             )
         }),
+        ('Location Trace', {
+            'fields': ('location_trace',)
+        }),
         ('Cancellation', {
             'fields': ('cancelled_by', 'cancellation_reason'),
             'classes': ('collapse',)
@@ -70,9 +93,84 @@ class RideAdmin(admin.ModelAdmin):
         }),
     )
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user', 'driver__user', 'category', 'payment_method')
+
+    @admin.action(description='Refund selected paid rides')
+    def refund_payments(self, request, queryset):
+        ride_ids = list(queryset.filter(payment_status='paid').values_list('id', flat=True))
+        for ride_id in ride_ids:
+            refund_ride_payments.enqueue({'ride_id': str(ride_id)})
+        self.message_user(request, f"Queued refunds for {len(ride_ids)} ride(s).")
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        ride_id = parse_uuid(search_term)
+        if ride_id:
+            return queryset.filter(id=ride_id), False
+        users = User.objects.filter(email=search_term).values('id')
+        return queryset.filter(Q(user__in=users) | Q(driver__user__in=users)), False
+
+    @admin.display(description='GPS trace')
+    def location_trace(self, obj):
+        """
+        Summarize the ride's GPS points instead of rendering all of them inline.
+        """
+        if obj.pk is None:
+            return '-'
+        summary = obj.location_updates.aggregate(
+            points=Count('id'), first=Min('timestamp'), last=Max('timestamp')
+        )
+        if not summary['points']:
+            return 'No location updates'
+
+        latest = obj.location_updates.order_by('-timestamp').values_list(
+            'timestamp', 'latitude', 'longitude'
+        )[:TRACE_PREVIEW_POINTS]
+        url = f"{reverse('admin:rides_ridelocation_changelist')}?ride__id__exact={obj.pk}"
+        return format_html(
+            '{} points from {} to {} (<a href="{}">view all</a>)'
+            '<table><tr><th>Timestamp</th><th>Latitude</th><th>Longitude</th></tr>{}</table>',
+            summary['points'], summary['first'], summary['last'], url,
+            format_html_join('', '<tr><td>{}</td><td>{}</td><td>{}</td></tr>', latest),
+        )
+
+
+class RideStopInline(admin.TabularInline):
+    model = RideStop
+    fields = ('sequence', 'kind', 'ride', 'latitude', 'longitude')
+    readonly_fields = fields
+    ordering = ('sequence',)
+    extra = 0
+    can_delete = False
+
+
+@admin.register(PoolTrip)
+class PoolTripAdmin(admin.ModelAdmin):
+    list_display = ('id', 'driver', 'category', 'is_open', 'created_at')
+    list_select_related = ('driver__user', 'category')
+    list_filter = ('is_open', 'category')
+    raw_id_fields = ('driver', 'category')
+    readonly_fields = ('version', 'created_at', 'updated_at')
+    inlines = [RideStopInline]
+
 
 @admin.register(RideLocation)
 class RideLocationAdmin(admin.ModelAdmin):
-    list_display = ('ride', 'latitude', 'longitude', 'timestamp')
+    list_display = ('ride_id', 'latitude', 'longitude', 'timestamp')
     list_filter = ('timestamp',)
-    search_fields = ('ride__id',)
+    search_fields = ('=ride__id',)
+    search_help_text = 'Search by ride ID.'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    raw_id_fields = ('ride',)
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        ride_id = parse_uuid(search_term)
+        if ride_id is None:
+            return queryset.none(), False
+        return queryset.filter(ride_id=ride_id), False
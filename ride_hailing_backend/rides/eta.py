@@ -0,0 +1,328 @@
+import math
+import os
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Driver, RideLocation
+from ride_hailing_backend.fields import bounding_box
+
+
+DEFAULTS = {
+    'ENABLED': True,
+    # File holding the speed table built by build_speed_table
+    'TABLE_PATH': None,
+    'CELL_SIZE_DEG': 0.01,
+    # Hours added to UTC to get the local hour of week; the service area has no DST
+    'UTC_OFFSET_HOURS': 1,
+    # Days of location history the table is learned from
+    'HISTORY_DAYS': 28,
+    # Seconds of driving a cell and hour needs before its own speed is trusted
+    'MIN_SAMPLE_SECONDS': 300,
+    # Speed used where the table knows nothing, in km/h
+    'DEFAULT_SPEED_KMH': 25,
+    # Road distance per straight-line distance
+    'ROAD_FACTOR': 1.3,
+    # Only available drivers within this radius are considered; drivers that
+    # stop sending heartbeats are made unavailable (see rides/heartbeats.py)
+    'SEARCH_RADIUS_KM': 5,
+    'MAX_DRIVERS': 10,
+    # Seconds between checks whether the table file was rebuilt
+    'RELOAD_INTERVAL': 60,
+}
+
+EARTH_RADIUS_M = 6371000.0
+HOURS_PER_WEEK = 7 * 24
+# Consecutive pings further apart than this are not one drive
+MAX_GAP_SECONDS = 600
+# Faster segments are GPS glitches (180 km/h)
+MAX_SPEED_MS = 50.0
+# Slower segments are a driver waiting, at a pickup or in a queue, not driving (3.6 km/h)
+MIN_SPEED_MS = 1.0
+CHUNK_SIZE = 20000
+
+
+def get_eta_setting(name):
+    return getattr(settings, 'ETA', {}).get(name, DEFAULTS[name])
+
+
+def cell_keys(latitudes, longitudes, cell_size):
+    columns = math.ceil(360 / cell_size)
+    rows = np.floor((np.asarray(latitudes, dtype=np.float64) + 90) / cell_size).astype(np.int64)
+    cols = np.floor((np.asarray(longitudes, dtype=np.float64) + 180) / cell_size).astype(np.int64) % columns
+    return rows * columns + cols
+
+
+def hours_of_week(epoch_seconds, utc_offset_hours):
+    # Hour 0 is Monday 00:00; the epoch fell on a Thursday, hour 72
+    hours = np.floor((np.asarray(epoch_seconds, dtype=np.float64) / 3600) + utc_offset_hours + 72)
+    return (hours % HOURS_PER_WEEK).astype(np.int64)
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(value, dtype=np.float64)) for value in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+class SpeedTable:
+    """
+    Learned driving speeds in m/s by grid cell and local hour of week.
+
+    Only cells with enough history are stored, sorted by cell key so a batch
+    of cells is looked up with one searchsorted call. Hours a cell has too
+    little data for follow the city-wide profile for that hour.
+    """
+
+    def __init__(self, keys, speeds, hourly, cell_size, utc_offset_hours, default_speed):
+        self.keys = keys
+        self.speeds = speeds
+        self.hourly = hourly
+        self.cell_size = cell_size
+        self.utc_offset_hours = utc_offset_hours
+        self.default_speed = default_speed
+
+    @classmethod
+    def load(cls, path, default_speed):
+        with np.load(path) as data:
+            return cls(
+                data['keys'], data['speeds'], data['hourly'],
+                float(data['cell_size']), float(data['utc_offset_hours']), default_speed,
+            )
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # Written under a temporary name and renamed, so readers never see a partial table
+        temporary = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            temporary, keys=self.keys, speeds=self.speeds, hourly=self.hourly,
+            cell_size=self.cell_size, utc_offset_hours=self.utc_offset_hours,
+        )
+        os.replace(temporary, path)
+
+    def lookup(self, latitudes, longitudes, hour):
+        """
+        Speeds in m/s at the given points for one hour of week.
+        """
+        cells = cell_keys(latitudes, longitudes, self.cell_size)
+        fallback = self.hourly[hour] if np.isfinite(self.hourly[hour]) else self.default_speed
+        if not len(self.keys):
+            return np.full(cells.shape, fallback, dtype=np.float64)
+        index = np.minimum(np.searchsorted(self.keys, cells), len(self.keys) - 1)
+        found = self.keys[index] == cells
+        speeds = np.where(found, self.speeds[index, hour].astype(np.float64), np.nan)
+        # Tables learned before waiting was left out can hold speeds of 0
+        return np.maximum(np.where(np.isfinite(speeds), speeds, fallback), MIN_SPEED_MS)
+
+
+def _segments(rows):
+    """
+    Turn (ride_id, latitude, longitude, epoch) rows ordered by ride and time
+    into arrays of segment midpoints, start times, lengths and durations.
+    """
+    rides = np.array([row[0] for row in rows], dtype=object)
+    points = np.array([row[1:] for row in rows], dtype=np.float64)
+    same_ride = rides[1:] == rides[:-1]
+    durations = np.diff(points[:, 2])
+    lengths = haversine_m(points[:-1, 0], points[:-1, 1], points[1:, 0], points[1:, 1])
+    keep = (
+        same_ride & (durations > 0) & (durations <= MAX_GAP_SECONDS)
+        & (lengths >= durations * MIN_SPEED_MS) & (lengths <= durations * MAX_SPEED_MS)
+    )
+    middle = (points[:-1, :2] + points[1:, :2]) / 2
+    return middle[keep], points[:-1, 2][keep], lengths[keep], durations[keep]
+
+
+def build_speed_table(since=None, cell_size=None, utc_offset_hours=None, min_sample_seconds=None):
+    """
+    Learn a SpeedTable from the stored ride location updates since a date.
+
+    Pings are streamed in chunks and folded into per (cell, hour of week)
+    sums of distance and time, so memory use is bounded by the number of
+    distinct cells rather than the number of pings.
+    """
+    cell_size = cell_size or get_eta_setting('CELL_SIZE_DEG')
+    utc_offset_hours = get_eta_setting('UTC_OFFSET_HOURS') if utc_offset_hours is None else utc_offset_hours
+    min_sample_seconds = get_eta_setting('MIN_SAMPLE_SECONDS') if min_sample_seconds is None else min_sample_seconds
+    default_speed = get_eta_setting('DEFAULT_SPEED_KMH') / 3.6
+
+    updates = RideLocation.objects.all()
+    if since is not None:
+        updates = updates.filter(timestamp__gte=since)
+    rows = updates.order_by('ride_id', 'timestamp').values_list(
+        'ride_id', 'latitude', 'longitude', 'timestamp'
+    ).iterator(chunk_size=CHUNK_SIZE)
+
+    totals = {}
+    chunk = []
+    for ride_id, latitude, longitude, timestamp in rows:
+        chunk.append((ride_id, latitude, longitude, timestamp.timestamp()))
+        if len(chunk) >= CHUNK_SIZE:
+            _accumulate(totals, chunk, cell_size, utc_offset_hours)
+            # The last ping starts the first segment of the next chunk
+            chunk = chunk[-1:]
+    if len(chunk) > 1:
+        _accumulate(totals, chunk, cell_size, utc_offset_hours)
+
+    keys = np.fromiter(totals.keys(), dtype=np.int64, count=len(totals))
+    sums = np.array(list(totals.values()), dtype=np.float64).reshape(-1, 2)
+    cells, hours = keys // HOURS_PER_WEEK, keys % HOURS_PER_WEEK
+
+    hourly_distance = np.bincount(hours, weights=sums[:, 0], minlength=HOURS_PER_WEEK)
+    hourly_time = np.bincount(hours, weights=sums[:, 1], minlength=HOURS_PER_WEEK)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        hourly = np.where(hourly_time >= min_sample_seconds, hourly_distance / hourly_time, np.nan)
+    overall = sums[:, 0].sum() / sums[:, 1].sum() if len(sums) else default_speed
+    # How much faster or slower than average the city drives at each hour
+    hour_factor = np.where(np.isfinite(hourly), hourly / overall, 1.0)
+
+    unique_cells, cell_index = np.unique(cells, return_inverse=True)
+    cell_distance = np.bincount(cell_index, weights=sums[:, 0], minlength=len(unique_cells))
+    cell_time = np.bincount(cell_index, weights=sums[:, 1], minlength=len(unique_cells))
+    known = cell_time >= min_sample_seconds
+
+    speeds = (cell_distance / np.maximum(cell_time, 1e-9))[:, None] * hour_factor[None, :]
+    trusted = sums[:, 1] >= min_sample_seconds
+    speeds[cell_index[trusted], hours[trusted]] = sums[trusted, 0] / sums[trusted, 1]
+
+    return SpeedTable(
+        unique_cells[known], speeds[known].astype(np.float16), hourly.astype(np.float32),
+        cell_size, utc_offset_hours, default_speed,
+    )
+
+
+def _accumulate(totals, chunk, cell_size, utc_offset_hours):
+    middle, started, lengths, durations = _segments(chunk)
+    if not len(lengths):
+        return
+    keys = cell_keys(middle[:, 0], middle[:, 1], cell_size) * HOURS_PER_WEEK + hours_of_week(started, utc_offset_hours)
+    unique, index = np.unique(keys, return_inverse=True)
+    distance = np.bincount(index, weights=lengths)
+    seconds = np.bincount(index, weights=durations)
+    for key, d, s in zip(unique.tolist(), distance.tolist(), seconds.tolist()):
+        current = totals.get(key)
+        totals[key] = (current[0] + d, current[1] + s) if current else (d, s)
+
+
+def rebuild_speed_table(days=None):
+    """
+    Rebuild the table file from recent history and make this process use it.
+    """
+    days = days or get_eta_setting('HISTORY_DAYS')
+    table = build_speed_table(since=timezone.now() - timedelta(days=days))
+    table.save(get_eta_setting('TABLE_PATH'))
+    reset_speed_table()
+    return table
+
+
+_table = None
+_table_checked = 0.0
+_table_mtime = None
+_table_lock = threading.Lock()
+
+
+def get_speed_table():
+    """
+    Return the shared speed table, reloading it when the file was rebuilt.
+
+    Without a table file every lookup uses DEFAULT_SPEED_KMH.
+    """
+    global _table, _table_checked, _table_mtime
+    now = time.monotonic()
+    if _table is not None and now - _table_checked < get_eta_setting('RELOAD_INTERVAL'):
+        return _table
+    with _table_lock:
+        if _table is not None and now - _table_checked < get_eta_setting('RELOAD_INTERVAL'):
+            return _table
+        default_speed = get_eta_setting('DEFAULT_SPEED_KMH') / 3.6
+        path = get_eta_setting('TABLE_PATH')
+        try:
+            mtime = os.path.getmtime(path) if path else None
+        except OSError:
+            mtime = None
+        if _table is None or mtime != _table_mtime:
+            if mtime is None:
+                _table = SpeedTable(
+                    np.zeros(0, dtype=np.int64), np.zeros((0, HOURS_PER_WEEK), dtype=np.float16),
+                    np.full(HOURS_PER_WEEK, np.nan, dtype=np.float32),
+                    get_eta_setting('CELL_SIZE_DEG'), get_eta_setting('UTC_OFFSET_HOURS'), default_speed,
+                )
+            else:
+                _table = SpeedTable.load(path, default_speed)
+            _table_mtime = mtime
+        _table_checked = now
+    return _table
+
+
+def reset_speed_table():
+    global _table
+    with _table_lock:
+        _table = None
+
+
+def pickup_etas(latitude, longitude, driver_points, at=None, table=None):
+    """
+    Seconds for drivers at driver_points, an (n, 2) array of coordinates, to reach a pickup.
+
+    Road distance is the straight-line distance times ROAD_FACTOR, driven
+    half at the speed of the driver's cell and half at the pickup's.
+    """
+    table = table or get_speed_table()
+    points = np.asarray(driver_points, dtype=np.float64).reshape(-1, 2)
+    at = timezone.now() if at is None else at
+    hour = int(hours_of_week(at.timestamp(), table.utc_offset_hours))
+    distances = haversine_m(points[:, 0], points[:, 1], latitude, longitude) * get_eta_setting('ROAD_FACTOR')
+    driver_speeds = table.lookup(points[:, 0], points[:, 1], hour)
+    pickup_speed = table.lookup([latitude], [longitude], hour)[0]
+    return distances / 2 / driver_speeds + distances / 2 / pickup_speed
+
+
+def nearby_drivers(latitude, longitude):
+    """
+    Available drivers within SEARCH_RADIUS_KM, as (ids, (n, 2) coordinates).
+    """
+    radius_km = get_eta_setting('SEARCH_RADIUS_KM')
+    rows = list(Driver.objects.filter(
+        is_active=True,
+        is_available=True,
+        **bounding_box(latitude, longitude, radius_km, prefix='current_'),
+    ).values_list('id', 'current_latitude', 'current_longitude'))
+    ids = [row[0] for row in rows]
+    points = np.array([row[1:] for row in rows], dtype=np.float64).reshape(-1, 2)
+    # The bounding box is a square; drop its corners
+    inside = haversine_m(points[:, 0], points[:, 1], latitude, longitude) <= radius_km * 1000
+    return [driver_id for driver_id, keep in zip(ids, inside) if keep], points[inside]
+
+
+def estimate_pickup(latitude, longitude, at=None):
+    """
+    Pickup estimate for a point: the number of nearby drivers and the ETA in
+    seconds of the quickest of the nearest MAX_DRIVERS, or None without drivers.
+    """
+    if not get_eta_setting('ENABLED'):
+        return {'nearby_drivers': 0, 'eta_seconds': None, 'driver_id': None}
+    latitude, longitude = float(latitude), float(longitude)
+    ids, points = nearby_drivers(latitude, longitude)
+    if not ids:
+        return {'nearby_drivers': 0, 'eta_seconds': None, 'driver_id': None}
+    limit = get_eta_setting('MAX_DRIVERS')
+    if len(ids) > limit:
+        distances = haversine_m(points[:, 0], points[:, 1], latitude, longitude)
+        nearest = np.argpartition(distances, limit - 1)[:limit]
+    else:
+        nearest = np.arange(len(ids))
+    etas = pickup_etas(latitude, longitude, points[nearest], at=at)
+    best = int(np.argmin(etas))
+    if not np.isfinite(etas[best]):
+        return {'nearby_drivers': len(ids), 'eta_seconds': None, 'driver_id': None}
+    return {'nearby_drivers': len(ids), 'eta_seconds': float(etas[best]), 'driver_id': ids[int(nearest[best])]}
+
+
+def eta_minutes(seconds):
+    if seconds is None or not math.isfinite(seconds):
+        return None
+    return max(1, math.ceil(seconds / 60))
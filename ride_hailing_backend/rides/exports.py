@@ -0,0 +1,239 @@
+import csv
+import json
+import zlib
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from itertools import groupby
+
+from django.db.models import F
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.renderers import BaseRenderer
+
+from .models import Ride
+
+
+CHUNK_SIZE = 2000
+# Rows are joined into pieces of about this many characters before being sent
+BUFFER_SIZE = 64 * 1024
+
+TRIP_COLUMNS = (
+    'ride_id', 'driver_id', 'driver_name', 'driver_email', 'vehicle_license_plate', 'category',
+    'requested_at', 'completed_at', 'distance_km', 'duration_minutes', 'total_fare', 'payment_status',
+)
+SUMMARY_COLUMNS = (
+    'driver_id', 'driver_name', 'driver_email', 'vehicle_license_plate', 'trips',
+    'distance_km', 'duration_minutes', 'total_fare', 'first_trip_at', 'last_trip_at',
+)
+KINDS = ('summary', 'trips')
+
+
+class Echo:
+    """File-like object whose write() returns the value, for csv.writer in generators"""
+
+    def write(self, value):
+        return value
+
+
+def parse_bound(value, is_end=False):
+    """
+    Parse an ISO date or date/time. A plain date as an end bound includes the whole day.
+    """
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Invalid date: {value}")
+        parsed = datetime.combine(day + timedelta(days=1) if is_end else day, time.min)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def completed_rides(start=None, end=None, driver_id=None):
+    """
+    Completed rides in [start, end) as tuples in TRIP_COLUMNS order, per driver.
+
+    Only the needed columns are fetched and rows are streamed from the
+    database in chunks, so memory use does not grow with the date range.
+    """
+    rides = Ride.objects.filter(status='completed', driver__isnull=False)
+    if start:
+        rides = rides.filter(completed_at__gte=start)
+    if end:
+        rides = rides.filter(completed_at__lt=end)
+    if driver_id:
+        rides = rides.filter(driver_id=driver_id)
+    return rides.order_by('driver_id', 'completed_at').values_list(
+        'id', 'driver_id', F('driver__user__full_name'), F('driver__user__email'),
+        F('driver__vehicle_license_plate'), F('category__name'), 'requested_at', 'completed_at',
+        Coalesce('actual_distance_km', 'estimated_distance_km'),
+        Coalesce('actual_duration_minutes', 'estimated_duration_minutes'),
+        'total_fare', 'payment_status',
+    ).iterator(chunk_size=CHUNK_SIZE)
+
+
+def summary_rows(rides):
+    """
+    Fold rides ordered by driver into one earnings row per driver.
+
+    Only the current driver's running totals are held in memory.
+    """
+    for driver_id, trips in groupby(rides, key=lambda ride: ride[1]):
+        count = duration = 0
+        distance = fare = Decimal('0')
+        first = last = None
+        for ride in trips:
+            details = ride[2:5]
+            first = first or ride[7]
+            last = ride[7]
+            count += 1
+            distance += ride[8] or 0
+            duration += ride[9] or 0
+            fare += ride[10]
+        yield (driver_id, *details, count, distance, duration, fare, first, last)
+
+
+def export_rows(kind, start=None, end=None, driver_id=None):
+    """
+    Return (header, rows) for a driver earnings export.
+    """
+    if kind not in KINDS:
+        raise ValueError(f"Unknown export kind: {kind}")
+    rides = completed_rides(start, end, driver_id)
+    if kind == 'trips':
+        return TRIP_COLUMNS, rides
+    return SUMMARY_COLUMNS, summary_rows(rides)
+
+
+def buffered(pieces, buffer_size=BUFFER_SIZE):
+    """
+    Join small strings into pieces of about buffer_size characters.
+    """
+    buffer, size = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= buffer_size:
+            yield ''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def iter_csv(header, rows, buffer_size=BUFFER_SIZE):
+    """
+    Yield CSV text for the header and rows in pieces of about buffer_size characters.
+    """
+    writer = csv.writer(Echo())
+    lines = (writer.writerow(row) for row in rows)
+    yield from buffered(_prepend(writer.writerow(header), lines), buffer_size)
+
+
+def _prepend(first, rest):
+    yield first
+    yield from rest
+
+
+def _iso(value):
+    return value.isoformat()
+
+
+def _coordinate(value):
+    # Same text as the decimal columns these used to be
+    return f"{value:.6f}"
+
+
+# Output key, values() lookup and converter of each field in a ride history row
+HISTORY_FIELDS = (
+    ('id', 'id', str),
+    ('status', 'status', None),
+    ('category', 'category__name', None),
+    ('pickup_latitude', 'pickup_latitude', _coordinate),
+    ('pickup_longitude', 'pickup_longitude', _coordinate),
+    ('pickup_address', 'pickup_address', None),
+    ('destination_latitude', 'destination_latitude', _coordinate),
+    ('destination_longitude', 'destination_longitude', _coordinate),
+    ('destination_address', 'destination_address', None),
+    ('estimated_distance_km', 'estimated_distance_km', str),
+    ('estimated_duration_minutes', 'estimated_duration_minutes', None),
+    ('actual_distance_km', 'actual_distance_km', str),
+    ('actual_duration_minutes', 'actual_duration_minutes', None),
+    ('total_fare', 'total_fare', str),
+    ('surge_multiplier', 'surge_multiplier', str),
+    ('payment_status', 'payment_status', None),
+    ('payment_type', 'payment_method__type', None),
+    ('driver_name', 'driver__user__full_name', None),
+    ('vehicle', 'driver__vehicle_license_plate', None),
+    ('requested_at', 'requested_at', _iso),
+    ('accepted_at', 'accepted_at', _iso),
+    ('started_at', 'started_at', _iso),
+    ('completed_at', 'completed_at', _iso),
+    ('cancelled_at', 'cancelled_at', _iso),
+    ('cancelled_by', 'cancelled_by', None),
+    ('cancellation_reason', 'cancellation_reason', None),
+    ('user_rating', 'user_rating', None),
+    ('user_feedback', 'user_feedback', None),
+)
+
+
+class NDJSONRenderer(BaseRenderer):
+    """Lets clients ask for application/x-ndjson; also renders error bodies as one line"""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+def compile_row_serializer(fields):
+    """
+    Build a function turning a values_list() tuple into one JSON line.
+
+    The field layout is resolved once here instead of per row, which is
+    what makes this much cheaper than a nested ModelSerializer.
+    """
+    keys = [key for key, _, _ in fields]
+    converters = [(index, convert) for index, (_, _, convert) in enumerate(fields) if convert]
+    encode = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+
+    def serialize(row):
+        row = list(row)
+        for index, convert in converters:
+            value = row[index]
+            if value is not None:
+                row[index] = convert(value)
+        return encode(dict(zip(keys, row))) + '\n'
+
+    return serialize
+
+
+serialize_history_row = compile_row_serializer(HISTORY_FIELDS)
+
+
+def ride_history_lines(user):
+    """
+    Yield every ride of a user, newest first, as NDJSON lines.
+
+    On PostgreSQL .iterator() reads through a server-side cursor, so only
+    one chunk of rows is in memory at a time.
+    """
+    rows = Ride.objects.filter(user=user).order_by('-requested_at').values_list(
+        *(lookup for _, lookup, _ in HISTORY_FIELDS)
+    ).iterator(chunk_size=CHUNK_SIZE)
+    for row in rows:
+        yield serialize_history_row(row)
+
+
+def gzip_stream(chunks, level=6):
+    """
+    Compress a stream of text chunks into a gzip byte stream on the fly.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,98 @@
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+DEFAULTS = {
+    # Django cache alias holding the buckets and last persisted points. Use a
+    # shared backend (Redis, memcached) when running several worker processes.
+    'CACHE': 'default',
+    # Per ride status:
+    #   RATE, BURST: token bucket of accepted pings per driver (per second, max)
+    #   MIN_DISTANCE_M, MIN_INTERVAL_S: a ping is only stored once the driver
+    #     has moved this far and this long since the last stored point
+    #   MAX_INTERVAL_S: a ping is always stored after this long, so stops
+    #     still show up in the trace
+    'POLICIES': {
+        'accepted': {'RATE': 0.5, 'BURST': 5, 'MIN_DISTANCE_M': 50, 'MIN_INTERVAL_S': 10, 'MAX_INTERVAL_S': 60},
+        'arrived': {'RATE': 0.2, 'BURST': 3, 'MIN_DISTANCE_M': 25, 'MIN_INTERVAL_S': 30, 'MAX_INTERVAL_S': 120},
+        'in_progress': {'RATE': 2.0, 'BURST': 10, 'MIN_DISTANCE_M': 15, 'MIN_INTERVAL_S': 3, 'MAX_INTERVAL_S': 30},
+    },
+    # Seconds cache entries outlive their last use
+    'STATE_TIMEOUT': 3600,
+}
+
+EARTH_RADIUS_M = 6371000.0
+
+
+def get_gps_setting(name):
+    return getattr(settings, 'GPS_THROTTLE', {}).get(name, DEFAULTS[name])
+
+
+def get_policy(ride_status):
+    return get_gps_setting('POLICIES').get(ride_status)
+
+
+def distance_m(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance in meters (haversine).
+    """
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def _cache():
+    return caches[get_gps_setting('CACHE')]
+
+
+def take_token(driver_id, policy, now=None):
+    """
+    Take one token from a driver's bucket.
+
+    Returns 0 if the ping is allowed, otherwise the seconds until the next
+    token. Read-modify-write is not atomic across processes; a race lets
+    through at most one extra ping, which is fine for a rate limiter.
+    """
+    now = time.time() if now is None else now
+    cache = _cache()
+    key = f"gps:bucket:{driver_id}"
+    tokens, updated = cache.get(key) or (policy['BURST'], now)
+    tokens = min(policy['BURST'], tokens + (now - updated) * policy['RATE'])
+    if tokens < 1:
+        cache.set(key, (tokens, now), get_gps_setting('STATE_TIMEOUT'))
+        return (1 - tokens) / policy['RATE']
+    cache.set(key, (tokens - 1, now), get_gps_setting('STATE_TIMEOUT'))
+    return 0
+
+
+def should_persist(ride, latitude, longitude, policy, now=None):
+    """
+    Decide whether a ping adds enough to the ride's trace to be stored.
+    """
+    now = time.time() if now is None else now
+    last = _cache().get(f"gps:last:{ride.id}")
+    if last is None:
+        # Cold cache, e.g. after a restart: fall back to the stored trace
+        latest = ride.location_updates.order_by('-timestamp').values_list(
+            'latitude', 'longitude', 'timestamp'
+        ).first()
+        if latest is None:
+            return True
+        last = (float(latest[0]), float(latest[1]), latest[2].timestamp())
+
+    elapsed = now - last[2]
+    if elapsed >= policy['MAX_INTERVAL_S']:
+        return True
+    if elapsed < policy['MIN_INTERVAL_S']:
+        return False
+    return distance_m(last[0], last[1], latitude, longitude) >= policy['MIN_DISTANCE_M']
+
+
+def remember_persisted(ride, latitude, longitude, now=None):
+    now = time.time() if now is None else now
+    _cache().set(f"gps:last:{ride.id}", (latitude, longitude, now), get_gps_setting('STATE_TIMEOUT'))
@@ -0,0 +1,237 @@
+"""
+Driver availability heartbeats.
+
+The driver app sends a heartbeat (or a ride location update) every few
+seconds while it is online. Each one moves the driver to a new slot of a
+per-process hashed timing wheel, and a sweeper thread turns the wheel once
+per TICK: the drivers in the slot it reaches have not been heard of for
+TIMEOUT seconds and are made unavailable with one batched UPDATE.
+Rescheduling and expiring a driver are O(1); nothing scans the drivers table
+on every tick.
+
+Each process only sees the heartbeats it served, so the database stays the
+judge: the UPDATE only flips drivers whose last_location_update is older than
+the timeout, and drivers that another process heard from are put back on the
+wheel at their real deadline. The wheel is filled with every available driver
+when it is first used and topped up every RESYNC_INTERVAL with those it does
+not hold, so drivers last heard by a process that has since exited, as after
+a scale-down, are still expired.
+
+wsgi.py and asgi.py enable the sweeper, so only server processes run it. The
+thread itself starts with the first heartbeat a process serves rather than at
+import, as a server that preloads the application and forks its workers
+(gunicorn --preload) would leave it behind in the parent.
+"""
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Q
+
+from .metrics import DRIVERS_EXPIRED
+from .models import Driver
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    # Seconds without a heartbeat before a driver is made unavailable
+    'TIMEOUT': 60,
+    # Seconds per wheel slot; expiry happens up to one tick late
+    'TICK': 1.0,
+    # Drivers flipped per UPDATE
+    'BATCH_SIZE': 500,
+    # Seconds between reloads of available drivers that are on no wheel of this process
+    'RESYNC_INTERVAL': 300,
+}
+
+
+def get_heartbeat_setting(name):
+    return getattr(settings, 'HEARTBEATS', {}).get(name, DEFAULTS[name])
+
+
+class TimingWheel:
+    """
+    Hashed timing wheel: keys hashed by deadline tick into a ring of slots.
+
+    The ring covers the longest deadline, so every key in the slot the wheel
+    reaches is due and no per-key round counters are needed.
+    """
+
+    def __init__(self, horizon, tick, now):
+        self.tick = tick
+        self.size = math.ceil(horizon / tick) + 1
+        self.slots = [set() for _ in range(self.size)]
+        self.slot_of = {}
+        self.current = math.floor(now / tick)
+
+    def __len__(self):
+        return len(self.slot_of)
+
+    def schedule(self, key, deadline):
+        # Past deadlines fire on the next turn; ones beyond the ring are
+        # clamped and fire early, which the caller has to tolerate
+        tick = min(max(math.ceil(deadline / self.tick), self.current + 1), self.current + self.size - 1)
+        slot = tick % self.size
+        previous = self.slot_of.get(key)
+        if previous is not None:
+            self.slots[previous].discard(key)
+        self.slots[slot].add(key)
+        self.slot_of[key] = slot
+
+    def cancel(self, key):
+        slot = self.slot_of.pop(key, None)
+        if slot is not None:
+            self.slots[slot].discard(key)
+
+    def advance(self, now):
+        """
+        Turn the wheel to `now` and return the keys whose deadline has passed.
+        """
+        target = math.floor(now / self.tick)
+        expired = []
+        for tick in range(self.current + 1, min(target, self.current + self.size) + 1):
+            slot = tick % self.size
+            if self.slots[slot]:
+                expired.extend(self.slots[slot])
+                for key in self.slots[slot]:
+                    del self.slot_of[key]
+                self.slots[slot] = set()
+        self.current = target
+        return expired
+
+
+class HeartbeatMonitor:
+    """
+    The process's timing wheel of available drivers and its sweeper.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wheel = None
+        self.synced = 0.0
+        self.thread = None
+        self.thread_pid = None
+        self.autostart = False
+
+    def beat(self, driver_id, at=None):
+        if not get_heartbeat_setting('ENABLED'):
+            return
+        at = time.time() if at is None else at
+        self._ensure_loaded()
+        with self.lock:
+            self.wheel.schedule(driver_id, at + get_heartbeat_setting('TIMEOUT'))
+        if self.autostart:
+            self.start()
+
+    def forget(self, driver_id):
+        if self.wheel is not None:
+            with self.lock:
+                self.wheel.cancel(driver_id)
+
+    def reset(self):
+        with self.lock:
+            self.wheel = None
+            self.synced = 0.0
+
+    def sweep(self, now=None):
+        """
+        Make the drivers whose heartbeats stopped unavailable. Returns how many were.
+        """
+        if not get_heartbeat_setting('ENABLED'):
+            return 0
+        now = time.time() if now is None else now
+        self._ensure_loaded()
+        if now - self.synced >= get_heartbeat_setting('RESYNC_INTERVAL'):
+            self._resync(now)
+        with self.lock:
+            expired = self.wheel.advance(now)
+        if not expired:
+            return 0
+
+        timeout = get_heartbeat_setting('TIMEOUT')
+        cutoff = datetime.fromtimestamp(now - timeout, dt_timezone.utc)
+        batch_size = get_heartbeat_setting('BATCH_SIZE')
+        flipped = 0
+        for start in range(0, len(expired), batch_size):
+            batch = expired[start:start + batch_size]
+            flipped += Driver.objects.filter(
+                Q(last_location_update__lt=cutoff) | Q(last_location_update__isnull=True),
+                id__in=batch, is_available=True,
+            ).update(is_available=False)
+            # The rest were heard by another process; wait for their real deadline
+            alive = Driver.objects.filter(id__in=batch, is_available=True).values_list('id', 'last_location_update')
+            with self.lock:
+                for driver_id, seen in alive:
+                    self.wheel.schedule(driver_id, seen.timestamp() + timeout)
+        DRIVERS_EXPIRED.inc(amount=flipped)
+        return flipped
+
+    def enable_sweeper(self):
+        """
+        Let this process run the sweeper; it starts with the first heartbeat.
+        """
+        self.autostart = True
+
+    def start(self):
+        """
+        Start the sweeper thread of this process.
+        """
+        if not get_heartbeat_setting('ENABLED'):
+            return
+        with self.lock:
+            # A thread started before a fork does not exist in the child
+            if self.thread is None or self.thread_pid != os.getpid():
+                self.thread = threading.Thread(target=self._run, name='heartbeat-sweeper', daemon=True)
+                self.thread_pid = os.getpid()
+                self.thread.start()
+
+    def _ensure_loaded(self):
+        if self.wheel is None:
+            with self.lock:
+                if self.wheel is None:
+                    self.wheel = self._load()
+
+    def _load(self):
+        now = time.time()
+        wheel = TimingWheel(get_heartbeat_setting('TIMEOUT'), get_heartbeat_setting('TICK'), now)
+        for driver_id, deadline in self._available():
+            wheel.schedule(driver_id, deadline)
+        self.synced = now
+        return wheel
+
+    def _resync(self, now):
+        # Drivers heard by other processes, including ones that have exited
+        rows = list(self._available())
+        with self.lock:
+            for driver_id, deadline in rows:
+                if driver_id not in self.wheel.slot_of:
+                    self.wheel.schedule(driver_id, deadline)
+            self.synced = now
+
+    def _available(self):
+        timeout = get_heartbeat_setting('TIMEOUT')
+        # Drivers that never reported a position expire on the first sweep
+        rows = Driver.objects.filter(is_available=True).values_list('id', 'last_location_update')
+        for driver_id, seen in rows.iterator(chunk_size=5000):
+            yield driver_id, seen.timestamp() + timeout if seen else 0
+
+    def _run(self):
+        tick = get_heartbeat_setting('TICK')
+        while True:
+            time.sleep(tick)
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception('Driver heartbeat sweep failed')
+            finally:
+                close_old_connections()
+
+
+monitor = HeartbeatMonitor()
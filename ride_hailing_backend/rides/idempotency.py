@@ -0,0 +1,225 @@
+import functools
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+
+DEFAULTS = {
+    'TTL': 24 * 60 * 60,
+    'CACHE_SIZE': 10000,
+    'LOCK_TIMEOUT': 30,
+}
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+def get_idempotency_setting(name):
+    return getattr(settings, 'IDEMPOTENCY', {}).get(name, DEFAULTS[name])
+
+
+class ResponseCache:
+    """
+    Bounded LRU of completed responses with a per-entry expiry time.
+
+    Entries are immutable once stored, so every process can keep its own copy.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, scope):
+        with self.lock:
+            entry = self.entries.get(scope)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self.entries[scope]
+                return None
+            self.entries.move_to_end(scope)
+            return entry[1]
+
+    def set(self, scope, stored, expires_at):
+        with self.lock:
+            self.entries[scope] = (expires_at, stored)
+            self.entries.move_to_end(scope)
+            while len(self.entries) > get_idempotency_setting('CACHE_SIZE'):
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class StoredResponse:
+    def __init__(self, request_hash, status_code, content_type, body):
+        self.request_hash = request_hash
+        self.status_code = status_code
+        self.content_type = content_type
+        self.body = bytes(body)
+
+    def replay(self):
+        response = HttpResponse(self.body, status=self.status_code, content_type=self.content_type)
+        response['Idempotent-Replayed'] = 'true'
+        return response
+
+
+response_cache = ResponseCache()
+
+# Requests currently being handled in this process, by scope. Duplicates
+# arriving meanwhile wait on the event instead of running the view again.
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def _error(message, code):
+    return Response({
+        'status': 'error',
+        'message': message,
+        'errors': {'idempotency_key': message},
+    }, status=code)
+
+
+def _load(scope, user, path, key):
+    """
+    Return the stored response for a key, or None if there is none yet.
+    """
+    record = IdempotencyKey.objects.filter(user=user, path=path, key=key).first()
+    if record is None:
+        return None
+    if record.expires_at <= timezone.now():
+        IdempotencyKey.objects.filter(pk=record.pk, expires_at=record.expires_at).delete()
+        return None
+    if record.status_code is None:
+        return None
+    stored = StoredResponse(record.request_hash, record.status_code, record.content_type, record.response_body)
+    response_cache.set(scope, stored, record.expires_at.timestamp())
+    return stored
+
+
+def _reserve(user, path, key, request_hash):
+    """
+    Insert the in-progress row for a key. Returns the row, or None when the
+    key is already taken.
+    """
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(
+                user=user, path=path, key=key, request_hash=request_hash,
+                created_at=now, expires_at=now + timedelta(seconds=get_idempotency_setting('TTL')),
+            )
+    except IntegrityError:
+        pass
+    # Take over rows left unfinished by a process that died mid-request
+    stale = now - timedelta(seconds=get_idempotency_setting('LOCK_TIMEOUT'))
+    taken = IdempotencyKey.objects.filter(
+        user=user, path=path, key=key, status_code__isnull=True, created_at__lt=stale
+    ).update(created_at=now, request_hash=request_hash)
+    if taken:
+        return IdempotencyKey.objects.get(user=user, path=path, key=key)
+    return None
+
+
+def _replay_or_reject(stored, request_hash):
+    if stored.request_hash != request_hash:
+        return _error('Idempotency key was already used with a different request', status.HTTP_422_UNPROCESSABLE_ENTITY)
+    return stored.replay()
+
+
+def idempotent(handler):
+    """
+    Make a view handler safe to retry with an Idempotency-Key header.
+
+    The first request with a key runs the handler; its rendered response is
+    kept in the database and an in-process LRU for IDEMPOTENCY['TTL']
+    seconds. Retries with the same key and body get the stored bytes back
+    without running the handler. Requests without the header are unaffected.
+    Responses with a 5xx status and raised exceptions are not stored, so
+    those requests can be retried for real.
+    """
+    @functools.wraps(handler)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return handler(self, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return _error(f"Idempotency key must be at most {MAX_KEY_LENGTH} characters", status.HTTP_400_BAD_REQUEST)
+
+        user = request.user
+        path = request.path
+        scope = f"{user.pk}:{path}:{key}"
+        request_hash = hashlib.sha256(request.body).hexdigest()
+
+        stored = response_cache.get(scope)
+        if stored is not None:
+            return _replay_or_reject(stored, request_hash)
+
+        with _inflight_lock:
+            done = _inflight.get(scope)
+            leader = done is None
+            if leader:
+                done = _inflight[scope] = threading.Event()
+        if not leader:
+            done.wait(get_idempotency_setting('LOCK_TIMEOUT'))
+            stored = response_cache.get(scope)
+            if stored is not None:
+                return _replay_or_reject(stored, request_hash)
+            return _error('A request with this idempotency key is in progress', status.HTTP_409_CONFLICT)
+
+        try:
+            stored = _load(scope, user, path, key)
+            if stored:
+                return _replay_or_reject(stored, request_hash)
+            record = _reserve(user, path, key, request_hash)
+            if record is None:
+                return _error('A request with this idempotency key is in progress', status.HTTP_409_CONFLICT)
+            return _run(self, handler, request, args, kwargs, scope, record)
+        finally:
+            with _inflight_lock:
+                _inflight.pop(scope, None)
+            done.set()
+
+    return wrapper
+
+
+def _run(view, handler, request, args, kwargs, scope, record):
+    try:
+        # The handler's writes and the stored response commit together, so a
+        # crash in between cannot leave a ride without its replayable response
+        with transaction.atomic():
+            response = handler(view, request, *args, **kwargs)
+            if response.status_code < 500:
+                if isinstance(response, Response):
+                    # What finalize_response would do, so the bytes exist to be stored
+                    response.accepted_renderer = request.accepted_renderer
+                    response.accepted_media_type = request.accepted_media_type
+                    response.renderer_context = view.get_renderer_context()
+                    response.render()
+                record.status_code = response.status_code
+                record.content_type = response.get('Content-Type', '')
+                record.response_body = response.content
+                record.save(update_fields=['status_code', 'content_type', 'response_body'])
+    except BaseException:
+        record.delete()
+        raise
+    if record.status_code is None:
+        record.delete()
+        return response
+
+    response_cache.set(scope, StoredResponse(
+        record.request_hash, record.status_code, record.content_type, record.response_body
+    ), record.expires_at.timestamp())
+    return response
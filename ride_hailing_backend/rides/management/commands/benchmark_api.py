@@ -0,0 +1,185 @@
+import json
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ride_hailing_backend.benchmarks import summarize, write_results, load_results
+from users.models import User
+from rides.models import Driver, RideCategory, Ride
+from .seed_data import SEED_PASSWORD, SEED_EMAIL_DOMAIN
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Drive the main API endpoints in-process and report latency, queries and throughput.'
+
+    ENDPOINTS = ('login', 'home', 'ride-history', 'ride-active', 'ride-create', 'location-update')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Requests per endpoint.')
+        parser.add_argument('--login-requests', type=int, default=20,
+                            help='Requests for the login endpoint (password hashing is slow by design).')
+        parser.add_argument('--users', type=int, default=20,
+                            help='Number of seeded users to spread requests over.')
+        parser.add_argument('--endpoint', action='append', choices=self.ENDPOINTS,
+                            help='Only run the given endpoint(s).')
+        parser.add_argument('--keep-data', action='store_true',
+                            help='Commit rows written by the benchmark instead of rolling them back.')
+        parser.add_argument('--output-dir', default=None)
+        parser.add_argument('--baseline', default=None,
+                            help='Previous results file to compare against.')
+
+    def handle(self, *args, **options):
+        users = list(
+            User.objects.filter(email__endswith=f"@{SEED_EMAIL_DOMAIN}", driver_profile__isnull=True)
+            .order_by('?')[:options['users']]
+        )
+        driver = Driver.objects.select_related('user').filter(user__email__endswith=f"@{SEED_EMAIL_DOMAIN}").first()
+        category = RideCategory.objects.filter(is_active=True).first()
+        if not users or driver is None or category is None:
+            raise CommandError('No seeded data found, run `manage.py seed_data` first.')
+
+        # Count server errors instead of aborting the whole run
+        self.client = Client(raise_request_exception=False)
+        self.category = category
+        endpoints = options['endpoint'] or self.ENDPOINTS
+
+        results = {}
+        try:
+            with transaction.atomic():
+                tokens = [self._login(user.email) for user in users]
+                driver_token = self._login(driver.user.email)
+                ride = self._active_ride_for(driver, users[0])
+
+                for name in endpoints:
+                    count = options['login_requests'] if name == 'login' else options['requests']
+                    make_request = getattr(self, f"_request_{name.replace('-', '_')}")
+                    results[name] = self._measure(make_request, count, users, tokens, driver_token, ride)
+                    self._report(name, results[name])
+
+                if not options['keep_data']:
+                    raise _Rollback
+        except _Rollback:
+            pass
+
+        path = write_results('api', results, options['output_dir'])
+        self.stdout.write(self.style.SUCCESS(f"Results written to {path}"))
+
+        if options['baseline']:
+            self._compare(load_results(options['baseline'])['results'], results)
+
+    def _login(self, email):
+        response = self.client.post(
+            reverse('login'), {'email': email, 'password': SEED_PASSWORD}, content_type='application/json'
+        )
+        if response.status_code != 200:
+            raise CommandError(f"Login failed for {email}: {response.content[:200]}")
+        return response.json()['data']['tokens']['access']
+
+    def _active_ride_for(self, driver, user):
+        ride = Ride.objects.filter(user=user).first()
+        return Ride.objects.create(
+            user=user,
+            driver=driver,
+            category=self.category,
+            status='in_progress',
+            pickup_latitude=ride.pickup_latitude if ride else 9.082,
+            pickup_longitude=ride.pickup_longitude if ride else 8.6753,
+            pickup_address='Benchmark pickup',
+            destination_latitude=9.092,
+            destination_longitude=8.6853,
+            destination_address='Benchmark destination',
+            estimated_distance_km=Decimal('5.00'),
+            estimated_duration_minutes=15,
+            base_fare=self.category.base_fare,
+            distance_fare=Decimal('0.00'),
+            time_fare=Decimal('0.00'),
+            total_fare=self.category.base_fare,
+        )
+
+    def _measure(self, make_request, count, users, tokens, driver_token, ride):
+        latencies = []
+        queries = []
+        statuses = {}
+        started = time.perf_counter()
+        for i in range(count):
+            index = i % len(users)
+            with CaptureQueriesContext(connection) as ctx:
+                request_started = time.perf_counter()
+                response = make_request(users[index], tokens[index], driver_token, ride)
+                latencies.append((time.perf_counter() - request_started) * 1000)
+            queries.append(len(ctx.captured_queries))
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        summary = summarize(latencies, queries, time.perf_counter() - started)
+        summary['status_codes'] = statuses
+        return summary
+
+    def _auth(self, token):
+        return {'HTTP_AUTHORIZATION': f"Bearer {token}"}
+
+    def _request_login(self, user, token, driver_token, ride):
+        return self.client.post(
+            reverse('login'), {'email': user.email, 'password': SEED_PASSWORD}, content_type='application/json'
+        )
+
+    def _request_home(self, user, token, driver_token, ride):
+        return self.client.get(reverse('home-data'), **self._auth(token))
+
+    def _request_ride_history(self, user, token, driver_token, ride):
+        return self.client.get(reverse('ride-history'), **self._auth(token))
+
+    def _request_ride_active(self, user, token, driver_token, ride):
+        return self.client.get(reverse('ride-active'), **self._auth(token))
+
+    def _request_ride_create(self, user, token, driver_token, ride):
+        payload = {
+            'category_id': str(self.category.id),
+            'pickup_latitude': '9.082000',
+            'pickup_longitude': '8.675300',
+            'pickup_address': 'Benchmark pickup',
+            'destination_latitude': '9.092000',
+            'destination_longitude': '8.685300',
+            'destination_address': 'Benchmark destination',
+            'estimated_distance_km': '5.00',
+            'estimated_duration_minutes': 15,
+        }
+        return self.client.post(reverse('ride-list'), payload, content_type='application/json', **self._auth(token))
+
+    def _request_location_update(self, user, token, driver_token, ride):
+        payload = {
+            'ride_id': str(ride.id),
+            'latitude': f"{9.082 + random.uniform(-0.01, 0.01):.6f}",
+            'longitude': f"{8.6753 + random.uniform(-0.01, 0.01):.6f}",
+        }
+        return self.client.post(
+            reverse('location-update'), payload, content_type='application/json', **self._auth(driver_token)
+        )
+
+    def _report(self, name, summary):
+        self.stdout.write(
+            f"{name:16} p50={summary['p50_ms']:8.2f}ms p95={summary['p95_ms']:8.2f}ms "
+            f"p99={summary['p99_ms']:8.2f}ms queries={summary['queries_per_request']:6.1f} "
+            f"rps={summary['throughput_rps']:8.1f} status={json.dumps(summary['status_codes'])}"
+        )
+
+    def _compare(self, baseline, results):
+        self.stdout.write('Change against baseline (p95 / queries per request):')
+        for name, summary in results.items():
+            previous = baseline.get(name)
+            if not previous:
+                continue
+            p95_change = (summary['p95_ms'] - previous['p95_ms']) / previous['p95_ms'] * 100 if previous['p95_ms'] else 0
+            self.stdout.write(
+                f"  {name:16} p95 {p95_change:+6.1f}%  "
+                f"queries {previous['queries_per_request']} -> {summary['queries_per_request']}"
+            )
@@ -0,0 +1,130 @@
+import random
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection, models
+
+from ride_hailing_backend.benchmarks import percentile, write_results
+from ride_hailing_backend.fields import CoordinateField, bounding_box
+from rides.eta import haversine_m
+
+
+# Scratch tables holding the same points in both representations. They are
+# created and dropped by the command and never migrated.
+class DecimalPoint(models.Model):
+    latitude = models.DecimalField(max_digits=9, decimal_places=6)
+    longitude = models.DecimalField(max_digits=9, decimal_places=6)
+
+    class Meta:
+        app_label = 'rides'
+        managed = False
+        db_table = 'benchmark_decimal_point'
+        indexes = [models.Index(fields=['latitude', 'longitude'], name='bench_decimal_point_idx')]
+
+
+class MicroDegreePoint(models.Model):
+    latitude = CoordinateField(max_degrees=90)
+    longitude = CoordinateField()
+
+    class Meta:
+        app_label = 'rides'
+        managed = False
+        db_table = 'benchmark_micro_degree_point'
+        indexes = [models.Index(fields=['latitude', 'longitude'], name='bench_micro_point_idx')]
+
+
+class Command(BaseCommand):
+    help = 'Compare decimal and integer micro-degree coordinate columns: decoding, distances, bounding boxes and size.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=200000)
+        parser.add_argument('--queries', type=int, default=200, help='Bounding-box queries to time.')
+        parser.add_argument('--radius-km', type=float, default=2.0)
+        parser.add_argument('--output-dir', default=None)
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        # Spread over a metro area the size of Lagos
+        points = [(round(rng.uniform(6.4, 6.7), 6), round(rng.uniform(3.2, 3.6), 6)) for _ in range(options['rows'])]
+        centres = [(rng.uniform(6.4, 6.7), rng.uniform(3.2, 3.6)) for _ in range(options['queries'])]
+
+        results = {}
+        with connection.schema_editor() as editor:
+            for model in (DecimalPoint, MicroDegreePoint):
+                editor.create_model(model)
+        try:
+            for model in (DecimalPoint, MicroDegreePoint):
+                model.objects.bulk_create(
+                    (model(latitude=lat, longitude=lon) for lat, lon in points), batch_size=5000
+                )
+                results[model._meta.db_table] = self._measure(model, centres, options['radius_km'])
+        finally:
+            with connection.schema_editor() as editor:
+                for model in (DecimalPoint, MicroDegreePoint):
+                    editor.delete_model(model)
+
+        before, after = results['benchmark_decimal_point'], results['benchmark_micro_degree_point']
+        results = {'rows': options['rows'], 'decimal': before, 'micro_degrees': after}
+        for name, value in before.items():
+            if value is None:
+                continue
+            self.stdout.write(
+                f"{name:20} decimal {value:>12.3f}   micro-degrees {after[name]:>12.3f}   x{value / after[name]:.1f}"
+            )
+
+        path = write_results('coordinates', results, options['output_dir'])
+        self.stdout.write(self.style.SUCCESS(f"Results written to {path}"))
+
+    def _measure(self, model, centres, radius_km):
+        rows, decode_s = self._best_of(3, lambda: list(model.objects.values_list('latitude', 'longitude')))
+        _, distance_s = self._best_of(3, lambda: self._distances(rows))
+
+        latencies = []
+        for latitude, longitude in centres:
+            started = time.perf_counter()
+            model.objects.filter(**bounding_box(latitude, longitude, radius_km)).count()
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        return {
+            'decode_us_per_row': decode_s / len(rows) * 1e6,
+            'distances_ms': distance_s * 1000,
+            'bbox_p50_ms': percentile(latencies, 50),
+            'bbox_p95_ms': percentile(latencies, 95),
+            'table_bytes': self._table_bytes(model._meta.db_table),
+        }
+
+    def _distances(self, rows):
+        # Decimals have to be converted before any maths; floats go straight in
+        points = np.array(rows, dtype=np.float64)
+        return haversine_m(points[:, 0], points[:, 1], 6.5244, 3.3792)
+
+    def _best_of(self, runs, func):
+        best = None
+        for _ in range(runs):
+            started = time.perf_counter()
+            value = func()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return value, best
+
+    def _table_bytes(self, table):
+        """
+        Bytes used by a table and its indexes, where the backend can tell.
+        """
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT pg_total_relation_size(%s)', [table])
+                return cursor.fetchone()[0]
+            if connection.vendor == 'sqlite':
+                try:
+                    cursor.execute(
+                        'SELECT SUM(pgsize) FROM dbstat WHERE name = %s OR name IN '
+                        '(SELECT name FROM sqlite_master WHERE type = %s AND tbl_name = %s)',
+                        [table, 'index', table],
+                    )
+                except DatabaseError:
+                    # SQLite built without the dbstat table
+                    return None
+                return cursor.fetchone()[0]
+        return None
@@ -0,0 +1,58 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from django.urls import resolve
+
+from ride_hailing_backend.benchmarks import write_results
+from ride_hailing_backend.metrics import MetricsMiddleware, REQUESTS, REQUEST_LATENCY, REQUEST_QUERIES
+
+
+class Command(BaseCommand):
+    help = 'Measure the per-request cost of recording metrics.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200000)
+        parser.add_argument('--output-dir', default=None)
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        results = {
+            'record_us': self._time_recording(iterations),
+            'middleware_us': self._time_middleware(iterations),
+        }
+        for name, value in results.items():
+            self.stdout.write(f"{name:16} {value:.3f} us/request")
+
+        path = write_results('metrics', results, options['output_dir'])
+        self.stdout.write(self.style.SUCCESS(f"Results written to {path}"))
+
+    def _time_recording(self, iterations):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            REQUESTS.inc('benchmark', 'GET', '200')
+            REQUEST_LATENCY.observe(0.012, 'benchmark')
+            REQUEST_QUERIES.observe(4, 'benchmark')
+        return (time.perf_counter() - started) / iterations * 1e6
+
+    def _time_middleware(self, iterations):
+        request = RequestFactory().get('/api/v1/home/')
+        request.resolver_match = resolve('/api/v1/home/')
+        response = HttpResponse()
+
+        def noop_view(request):
+            return response
+
+        with override_settings(METRICS={'ENABLED': True, 'DIR': None}):
+            middleware = MetricsMiddleware(noop_view)
+
+        started = time.perf_counter()
+        for _ in range(iterations):
+            middleware(request)
+        baseline_started = time.perf_counter()
+        for _ in range(iterations):
+            noop_view(request)
+        finished = time.perf_counter()
+
+        return ((baseline_started - started) - (finished - baseline_started)) / iterations * 1e6
@@ -0,0 +1,123 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ride_hailing_backend.benchmarks import percentile, write_results
+from rides.models import Driver, PoolTrip, Ride, RideCategory, RideStop
+from rides.pooling import Planner, find_insertion
+from users.models import User
+
+
+# Metro area the size of Lagos
+BOUNDS = ((6.4, 6.7), (3.2, 3.6))
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Measure pooled ride insertion decisions against many concurrent pooled trips.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trips', type=int, default=3000, help='Open pooled trips.')
+        parser.add_argument('--riders-per-trip', type=int, default=2)
+        parser.add_argument('--requests', type=int, default=300, help='Insertion decisions to time.')
+        parser.add_argument('--output-dir', default=None)
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        try:
+            with transaction.atomic():
+                category = self._create_trips(rng, options['trips'], options['riders_per_trip'])
+                results = self._measure(rng, category, options['requests'])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+        results.update(trips=options['trips'], riders_per_trip=options['riders_per_trip'])
+        self.stdout.write(
+            f"{options['trips']} trips: insertion p50 {results['p50_ms']:.2f} ms, p95 {results['p95_ms']:.2f} ms, "
+            f"max {results['max_ms']:.2f} ms; {results['matched']}/{options['requests']} requests matched"
+        )
+        path = write_results('pooling', results, options['output_dir'])
+        self.stdout.write(self.style.SUCCESS(f"Results written to {path}"))
+
+    def _measure(self, rng, category, requests):
+        planner = Planner()
+        latencies, matched = [], 0
+        for _ in range(requests):
+            pickup = self._point(rng)
+            destination = self._point(rng, near=pickup)
+            ride = Ride(
+                category=category, seats=1,
+                pickup_latitude=pickup[0], pickup_longitude=pickup[1],
+                destination_latitude=destination[0], destination_longitude=destination[1],
+            )
+            started = time.perf_counter()
+            insertion = find_insertion(ride, planner)
+            latencies.append((time.perf_counter() - started) * 1000)
+            matched += insertion is not None
+        return {
+            'requests': requests,
+            'matched': matched,
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'max_ms': max(latencies),
+        }
+
+    def _point(self, rng, near=None):
+        if near is None:
+            return rng.uniform(*BOUNDS[0]), rng.uniform(*BOUNDS[1])
+        return near[0] + rng.uniform(-0.04, 0.04), near[1] + rng.uniform(-0.04, 0.04)
+
+    def _create_trips(self, rng, count, riders_per_trip):
+        category = RideCategory.objects.create(
+            name='Pooling Benchmark', description='', base_fare=Decimal('400.00'),
+            per_km_rate=Decimal('120.00'), per_minute_rate=Decimal('15.00'), capacity=4, is_pooled=True
+        )
+        users = User.objects.bulk_create([
+            User(email=f"pooling-benchmark-{index}@example.com", phone_number=f"+2349{index:09d}",
+                 full_name='Pooling Benchmark', password='!')
+            for index in range(count + 1)
+        ], batch_size=1000)
+        rider = users[-1]
+        drivers = Driver.objects.bulk_create([
+            Driver(
+                user=user, vehicle_make='Toyota', vehicle_model='Corolla', vehicle_year=2020,
+                vehicle_color='Blue', vehicle_license_plate='BENCH', driving_license_number='BENCH',
+                is_available=False, current_latitude=position[0], current_longitude=position[1],
+            )
+            for user, position in ((user, self._point(rng)) for user in users[:count])
+        ], batch_size=1000)
+        trips = PoolTrip.objects.bulk_create(
+            [PoolTrip(driver=driver, category=category) for driver in drivers], batch_size=1000
+        )
+
+        rides, stops = [], []
+        for trip, driver in zip(trips, drivers):
+            here = (driver.current_latitude, driver.current_longitude)
+            sequence = 0
+            for index in range(riders_per_trip):
+                # The first rider is on board, the others are still waiting
+                pickup, destination = self._point(rng, near=here), self._point(rng, near=here)
+                ride = Ride(
+                    user=rider, driver=driver, category=category, pool_trip=trip,
+                    status='in_progress' if index == 0 else 'accepted',
+                    pickup_latitude=pickup[0], pickup_longitude=pickup[1], pickup_address='A',
+                    destination_latitude=destination[0], destination_longitude=destination[1], destination_address='B',
+                    estimated_distance_km=Decimal('8.00'), estimated_duration_minutes=20,
+                    base_fare=Decimal('400.00'), distance_fare=Decimal('720.00'), time_fare=Decimal('225.00'),
+                    total_fare=Decimal('1345.00'),
+                )
+                rides.append(ride)
+                for kind, point in (('pickup', pickup), ('dropoff', destination)):
+                    stops.append(RideStop(trip=trip, ride=ride, kind=kind, sequence=sequence,
+                                          latitude=point[0], longitude=point[1]))
+                    sequence += 1
+        Ride.objects.bulk_create(rides, batch_size=1000)
+        RideStop.objects.bulk_create(stops, batch_size=1000)
+        return category
@@ -0,0 +1,91 @@
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+from django.utils import timezone
+
+from ride_hailing_backend.benchmarks import write_results
+from rides.models import Ride, RideCategory
+from rides.payments import StubGateway, reset_gateway, settle_rides
+from users.models import PaymentMethod, User
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Measure payment settlement throughput (rides settled per second) against a stub gateway.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rides', type=int, default=1000)
+        parser.add_argument('--latency-ms', type=float, default=20.0,
+                            help='Simulated gateway round-trip per charge.')
+        parser.add_argument('--concurrency', default='1,8,32',
+                            help='Comma-separated numbers of gateway calls in flight to compare.')
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--output-dir', default=None)
+
+    def handle(self, *args, **options):
+        results = {}
+        try:
+            with transaction.atomic():
+                ride_ids = self._create_rides(options['rides'])
+                for concurrency in [int(value) for value in options['concurrency'].split(',')]:
+                    Ride.objects.filter(id__in=ride_ids).update(payment_status='pending', payment_reference=None)
+                    results[f"concurrency_{concurrency}"] = self._measure(
+                        ride_ids, concurrency, options['latency_ms'] / 1000, options['batch_size']
+                    )
+                raise _Rollback
+        except _Rollback:
+            pass
+        finally:
+            reset_gateway()
+
+        for name, summary in results.items():
+            self.stdout.write(f"{name:16} {summary['rides_per_second']:>10.1f} rides/s  ({summary['elapsed_s']:.2f}s)")
+        path = write_results('settlement', results, options['output_dir'])
+        self.stdout.write(self.style.SUCCESS(f"Results written to {path}"))
+
+    def _measure(self, ride_ids, concurrency, latency, batch_size):
+        gateway = StubGateway(latency=latency)
+        settled = 0
+        with override_settings(PAYMENTS={'CONCURRENCY': concurrency}):
+            reset_gateway()
+            started = time.perf_counter()
+            for start in range(0, len(ride_ids), batch_size):
+                settled += settle_rides(ride_ids[start:start + batch_size], gateway=gateway)['paid']
+            elapsed = time.perf_counter() - started
+        reset_gateway()
+        return {
+            'rides': settled,
+            'elapsed_s': round(elapsed, 3),
+            'rides_per_second': round(settled / elapsed, 1),
+            'latency_ms': latency * 1000,
+        }
+
+    def _create_rides(self, count):
+        user = User.objects.create_user(
+            email='settlement-benchmark@example.com', password=None,
+            phone_number='+2340000000000', full_name='Settlement Benchmark'
+        )
+        card = PaymentMethod.objects.create(user=user, type='card', card_last_four='4242')
+        category = RideCategory.objects.create(
+            name='Settlement Benchmark', description='', base_fare=Decimal('500.00'),
+            per_km_rate=Decimal('100.00'), per_minute_rate=Decimal('10.00'), capacity=4
+        )
+        now = timezone.now()
+        rides = Ride.objects.bulk_create([
+            Ride(
+                user=user, category=category, payment_method=card, status='completed', completed_at=now,
+                pickup_latitude=6.5244, pickup_longitude=3.3792, pickup_address='A',
+                destination_latitude=6.4541, destination_longitude=3.3947, destination_address='B',
+                estimated_distance_km=Decimal('8.00'), estimated_duration_minutes=20,
+                base_fare=Decimal('500.00'), distance_fare=Decimal('800.00'), time_fare=Decimal('200.00'),
+                total_fare=Decimal('1500.00'),
+            )
+            for _ in range(count)
+        ], batch_size=1000)
+        return [ride.id for ride in rides]
@@ -0,0 +1,66 @@
+import json
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ride_hailing_backend.benchmarks import percentile, write_results
+
+
+# Run in a fresh interpreter: load the WSGI application and URLconf the way a
+# worker does before its first request, then report what that cost
+WORKER = """
+import json, os, resource, sys, time
+started = time.perf_counter()
+os.environ['DJANGO_SETTINGS_MODULE'] = sys.argv[1]
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+from django.urls import get_resolver
+get_resolver().url_patterns
+ready = time.perf_counter()
+print(json.dumps({
+    'ready_ms': (ready - started) * 1000,
+    'modules': len(sys.modules),
+    'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+}))
+"""
+
+
+class Command(BaseCommand):
+    help = 'Measure worker start-up time, imported modules and memory for each settings profile.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=10)
+        parser.add_argument('--profiles', nargs='+',
+                            default=['ride_hailing_backend.settings', 'ride_hailing_backend.settings_api'])
+        parser.add_argument('--output-dir', default=None)
+
+    def handle(self, *args, **options):
+        results = {}
+        for profile in options['profiles']:
+            runs = [self._run_worker(profile) for _ in range(options['runs'])]
+            results[profile] = {
+                'runs': len(runs),
+                'process_p50_ms': round(percentile([run['process_ms'] for run in runs], 50), 1),
+                'ready_p50_ms': round(percentile([run['ready_ms'] for run in runs], 50), 1),
+                'modules': runs[-1]['modules'],
+                'max_rss_mb': round(percentile([run['max_rss_kb'] for run in runs], 50) / 1024, 1),
+            }
+            self.stdout.write(f"{profile}: " + ', '.join(f"{k} {v}" for k, v in results[profile].items()))
+
+        path = write_results('startup', results, options['output_dir'])
+        self.stdout.write(self.style.SUCCESS(f"Results written to {path}"))
+
+    def _run_worker(self, profile):
+        started = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, '-c', WORKER, profile], cwd=settings.BASE_DIR, capture_output=True, text=True,
+        )
+        elapsed = (time.perf_counter() - started) * 1000
+        if completed.returncode:
+            raise CommandError(f"{profile} failed to start:\n{completed.stderr}")
+        run = json.loads(completed.stdout.strip().splitlines()[-1])
+        run['process_ms'] = elapsed
+        return run
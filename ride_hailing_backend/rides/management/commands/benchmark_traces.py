@@ -0,0 +1,120 @@
+import json
+import math
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from ride_hailing_backend.benchmarks import percentile, write_results
+from rides.models import Ride, RideCategory, RideLocation
+from rides.serializers import RideSerializer
+from rides.traces import get_trace_setting
+from users.models import User
+
+
+# Ride detail as clients request it: the raw trace, then simplified at two zoom levels
+VARIANTS = (
+    ('full_trace', {}, True),
+    ('zoom_16', {'zoom': 16}, False),
+    ('zoom_13', {'zoom': 13}, False),
+    ('zoom_16_polyline', {'zoom': 16, 'encoding': 'polyline'}, False),
+)
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Measure ride detail payload size and serialization time with and without trace simplification.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--minutes', type=int, default=90, help='Length of the ride.')
+        parser.add_argument('--interval', type=float, default=3.0, help='Seconds between stored GPS points.')
+        parser.add_argument('--repeat', type=int, default=50, help='Serializations timed per variant.')
+        parser.add_argument('--output-dir', default=None)
+
+    def handle(self, *args, **options):
+        results = {}
+        try:
+            with transaction.atomic():
+                ride = self._create_ride(options['minutes'], options['interval'])
+                for name, route_options, full_trace in VARIANTS:
+                    results[name] = self._measure(ride, route_options, full_trace, options['repeat'])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+        for name, summary in results.items():
+            self.stdout.write(
+                f"{name:18} {summary['bytes']:>9} bytes  {summary['points']:>5} points  "
+                f"cold {summary['cold_ms']:.2f} ms  cached p50 {summary['p50_ms']:.2f} ms"
+            )
+        path = write_results('traces', results, options['output_dir'])
+        self.stdout.write(self.style.SUCCESS(f"Results written to {path}"))
+
+    def _measure(self, ride, route_options, full_trace, repeat):
+        context = {'route_options': route_options, 'full_trace': full_trace}
+        caches[get_trace_setting('CACHE')].clear()
+        latencies = []
+        for _ in range(repeat + 1):
+            started = time.perf_counter()
+            body = JSONRenderer().render(RideSerializer(ride, context=context).data)
+            latencies.append((time.perf_counter() - started) * 1000)
+        data = json.loads(body)
+        route = data['route']
+        return {
+            'bytes': len(body),
+            'points': len(data['location_updates']) if full_trace else route['points_kept'],
+            'tolerance_m': route['tolerance_m'],
+            # The first serialization simplifies the trace; later ones hit the cache
+            'cold_ms': latencies[0],
+            'p50_ms': percentile(latencies[1:], 50),
+            'p95_ms': percentile(latencies[1:], 95),
+        }
+
+    def _create_ride(self, minutes, interval):
+        user = User.objects.create_user(
+            email='traces-benchmark@example.com', password=None,
+            phone_number='+2340000000001', full_name='Traces Benchmark'
+        )
+        category = RideCategory.objects.create(
+            name='Traces Benchmark', description='', base_fare=Decimal('500.00'),
+            per_km_rate=Decimal('100.00'), per_minute_rate=Decimal('10.00'), capacity=4
+        )
+        now = timezone.now()
+        ride = Ride.objects.create(
+            user=user, category=category, status='completed', completed_at=now,
+            pickup_latitude=6.45, pickup_longitude=3.39, pickup_address='A',
+            destination_latitude=6.6, destination_longitude=3.35, destination_address='B',
+            estimated_distance_km=Decimal('30.00'), estimated_duration_minutes=minutes,
+            base_fare=Decimal('500.00'), distance_fare=Decimal('3000.00'), time_fare=Decimal('900.00'),
+            total_fare=Decimal('4400.00'),
+        )
+
+        # City driving: straight stretches at 30 km/h, a turn every few hundred metres, 5 m GPS error
+        rng = random.Random(42)
+        lat, lon, heading = 6.45, 3.39, 0.0
+        step = 30 / 3.6 * interval / 111000
+        count = int(minutes * 60 / interval)
+        points = []
+        for index in range(count):
+            if rng.random() < 0.05:
+                heading += rng.choice((-1, 1)) * math.pi / 2
+            lat += step * math.cos(heading)
+            lon += step * math.sin(heading)
+            points.append(RideLocation(
+                ride=ride, latitude=lat + rng.gauss(0, 5) / 111000, longitude=lon + rng.gauss(0, 5) / 111000,
+            ))
+        points = RideLocation.objects.bulk_create(points, batch_size=1000)
+        # auto_now_add stamped them all at once
+        for index, point in enumerate(points):
+            point.timestamp = now - timedelta(seconds=interval * (count - index))
+        RideLocation.objects.bulk_update(points, ['timestamp'], batch_size=1000)
+        return ride
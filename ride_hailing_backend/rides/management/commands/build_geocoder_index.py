@@ -0,0 +1,45 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ride_hailing_backend.geocoder import ReverseGeocoder, build_index, get_geocoder_setting, reset_geocoder
+
+
+class Command(BaseCommand):
+    help = 'Build the reverse-geocoding index from the places file and time lookups against it.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--places-file', default=None)
+        parser.add_argument('--index-dir', default=None)
+        parser.add_argument('--lookups', type=int, default=10000,
+                            help='Random uncached lookups to time after building (0 to skip).')
+
+    def handle(self, *args, **options):
+        places_file = options['places_file'] or get_geocoder_setting('PLACES_FILE')
+        index_dir = options['index_dir'] or get_geocoder_setting('INDEX_DIR')
+        cell_size = get_geocoder_setting('CELL_SIZE_DEG')
+        if not index_dir:
+            raise CommandError('No index directory: set GEOCODER["INDEX_DIR"] or pass --index-dir.')
+
+        started = time.perf_counter()
+        try:
+            count = build_index(places_file, index_dir, cell_size)
+        except (OSError, KeyError, ValueError) as exc:
+            raise CommandError(f"Could not build index from {places_file}: {exc}")
+        reset_geocoder()
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {count} places in {time.perf_counter() - started:.2f}s into {index_dir}"
+        ))
+
+        if options['lookups']:
+            geocoder = ReverseGeocoder(
+                index_dir, cell_size, get_geocoder_setting('MAX_DISTANCE_KM'), 1, get_geocoder_setting('CACHE_PRECISION')
+            )
+            points = [(random.uniform(4.3, 13.9), random.uniform(2.7, 14.6)) for _ in range(options['lookups'])]
+            started = time.perf_counter()
+            hits = sum(geocoder.nearest_uncached(lat, lon) is not None for lat, lon in points)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"{len(points)} uncached lookups: {elapsed / len(points) * 1e6:.1f} us each, {hits} within range"
+            )
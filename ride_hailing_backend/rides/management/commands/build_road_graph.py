@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rides.map_matching import build_road_graph, get_matching_setting
+
+
+class Command(BaseCommand):
+    help = 'Compile the roads file into the road graph used to map-match ride traces.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--roads-file', default=None)
+        parser.add_argument('--output', default=None, help='Graph file (defaults to MAP_MATCHING["GRAPH_PATH"]).')
+
+    def handle(self, *args, **options):
+        roads_file = options['roads_file'] or get_matching_setting('ROADS_FILE')
+        path = options['output'] or get_matching_setting('GRAPH_PATH')
+        if not roads_file or not path:
+            raise CommandError('Set MAP_MATCHING["ROADS_FILE"] and ["GRAPH_PATH"] or pass --roads-file and --output.')
+
+        started = time.perf_counter()
+        try:
+            graph = build_road_graph(roads_file, path)
+        except (OSError, KeyError, ValueError) as exc:
+            raise CommandError(f"Could not build road graph from {roads_file}: {exc}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Compiled {len(graph.node_coords)} nodes and {len(graph)} directed segments "
+            f"in {time.perf_counter() - started:.2f}s into {path}"
+        ))
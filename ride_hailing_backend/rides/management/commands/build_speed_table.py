@@ -0,0 +1,37 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from rides.eta import get_eta_setting, pickup_etas, rebuild_speed_table
+
+
+class Command(BaseCommand):
+    help = 'Learn per-cell, per-hour-of-week driving speeds from ride location history. Run nightly.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Days of history to learn from (defaults to ETA["HISTORY_DAYS"]).')
+        parser.add_argument('--lookups', type=int, default=1000,
+                            help='ETA computations for 10 drivers to time after building (0 to skip).')
+
+    def handle(self, *args, **options):
+        if not get_eta_setting('TABLE_PATH'):
+            raise CommandError('No table path: set ETA["TABLE_PATH"].')
+
+        started = time.perf_counter()
+        table = rebuild_speed_table(options['days'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Learned speeds for {len(table.keys)} cells in {time.perf_counter() - started:.2f}s "
+            f"into {get_eta_setting('TABLE_PATH')} ({table.speeds.nbytes // 1024} KiB)"
+        ))
+
+        if options['lookups']:
+            rng = np.random.default_rng()
+            pickups = rng.uniform((6.4, 3.3), (6.7, 3.5), size=(options['lookups'], 2))
+            drivers = pickups[:, None, :] + rng.normal(scale=0.02, size=(options['lookups'], 10, 2))
+            started = time.perf_counter()
+            for pickup, points in zip(pickups, drivers):
+                pickup_etas(pickup[0], pickup[1], points, table=table)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f"{options['lookups']} ETA computations: {elapsed / options['lookups'] * 1e6:.1f} us each")
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from rides.exports import KINDS, export_rows, iter_csv, parse_bound
+
+
+class Command(BaseCommand):
+    help = 'Write completed-ride earnings per driver (or every trip) as CSV, streaming from the database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=KINDS, default='summary')
+        parser.add_argument('--start', default=None, help='ISO date or date/time, inclusive.')
+        parser.add_argument('--end', default=None, help='ISO date (inclusive) or date/time (exclusive).')
+        parser.add_argument('--driver', default=None, help='Only this driver id.')
+        parser.add_argument('--output', default='-', help="File to write, or '-' for stdout.")
+
+    def handle(self, *args, **options):
+        try:
+            start = parse_bound(options['start']) if options['start'] else None
+            end = parse_bound(options['end'], is_end=True) if options['end'] else None
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        header, rows = export_rows(options['kind'], start, end, options['driver'])
+        if options['output'] == '-':
+            for chunk in iter_csv(header, rows):
+                self.stdout.write(chunk, ending='')
+            return
+        try:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as fh:
+                for chunk in iter_csv(header, rows):
+                    fh.write(chunk)
+        except OSError as exc:
+            raise CommandError(str(exc))
+        self.stderr.write(f"Export written to {options['output']}")
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ride_hailing_backend.api_schema import FORMATS, generate_schema, get_schema_setting, reset_schema, write_schema
+
+
+class Command(BaseCommand):
+    help = 'Generate the OpenAPI schema served by the docs endpoints. Run at build time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=None, help='Output directory (defaults to API_SCHEMA["DIR"]).')
+
+    def handle(self, *args, **options):
+        schema_dir = options['dir'] or get_schema_setting('DIR')
+        if not schema_dir:
+            raise CommandError('No output directory: set API_SCHEMA["DIR"] or pass --dir.')
+
+        started = time.perf_counter()
+        encoded = generate_schema()
+        write_schema(encoded, schema_dir)
+        reset_schema()
+        sizes = ', '.join(f"{FORMATS[fmt][0]} {len(body) // 1024} KiB" for fmt, body in encoded.items())
+        self.stdout.write(self.style.SUCCESS(
+            f"Schema generated in {time.perf_counter() - started:.2f}s into {schema_dir}: {sizes}"
+        ))
@@ -0,0 +1,49 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils import timezone
+
+from rides.map_matching import get_matching_setting, graph_path, match_rides
+from rides.models import Ride
+
+
+class Command(BaseCommand):
+    help = 'Map-match the GPS traces of completed rides, e.g. rides completed before the road graph was built.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help='Match rides completed in the last this many days.')
+        parser.add_argument('--batch-size', type=int, default=200, help='Rides read and matched per batch.')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Matching processes (defaults to MAP_MATCHING["WORKERS"]).')
+        parser.add_argument('--rematch', action='store_true', help='Also match rides that already have a route.')
+
+    def handle(self, *args, **options):
+        if graph_path() is None:
+            raise CommandError('No road graph; enable MAP_MATCHING and run build_road_graph first.')
+        workers = options['workers'] or get_matching_setting('WORKERS')
+        due = Ride.objects.filter(
+            status='completed', completed_at__gte=timezone.now() - timedelta(days=options['days'])
+        )
+        if not options['rematch']:
+            due = due.filter(matched_route__isnull=True)
+
+        matched, started = 0, time.perf_counter()
+        last = None
+        while True:
+            # Keyset pagination, so rides without a trace are not read again
+            batch = due.order_by('completed_at', 'id')
+            if last is not None:
+                batch = batch.filter(Q(completed_at__gt=last[0]) | Q(completed_at=last[0], id__gt=last[1]))
+            batch = list(batch.values_list('completed_at', 'id')[:options['batch_size']])
+            if not batch:
+                break
+            last = batch[-1]
+            matched += match_rides([ride_id for _, ride_id in batch], workers=workers)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"Matched {matched} rides in {elapsed:.2f}s ({matched / elapsed if elapsed else 0:.1f} rides/s, "
+            f"{workers} worker(s))"
+        )
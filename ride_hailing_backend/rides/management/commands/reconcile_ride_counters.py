@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q
+
+from users.models import User
+from rides.models import Driver, Ride
+
+
+class Command(BaseCommand):
+    help = 'Recompute the denormalized ride counters on users and drivers in chunks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report drift without fixing it.')
+
+    def handle(self, *args, **options):
+        for model, ride_field in ((User, 'user_id'), (Driver, 'driver_id')):
+            checked, fixed = self._reconcile(model, ride_field, options['chunk_size'], options['dry_run'])
+            self.stdout.write(f"{model._meta.verbose_name_plural}: checked {checked}, fixed {fixed}")
+
+    def _reconcile(self, model, ride_field, chunk_size, dry_run):
+        checked = fixed = 0
+        last_pk = None
+        while True:
+            # Short transaction per chunk: rows are locked (on databases that
+            # support it) only while their counts are recomputed
+            with transaction.atomic():
+                rows = model.objects.select_for_update().order_by('pk')
+                if last_pk is not None:
+                    rows = rows.filter(pk__gt=last_pk)
+                rows = list(rows.only('pk', 'total_rides', 'completed_rides')[:chunk_size])
+                if not rows:
+                    break
+                last_pk = rows[-1].pk
+
+                counts = {
+                    row[ride_field]: row
+                    for row in Ride.objects.filter(**{f"{ride_field}__in": [obj.pk for obj in rows]})
+                    .order_by()
+                    .values(ride_field)
+                    .annotate(total=Count('id'), completed=Count('id', filter=Q(status='completed')))
+                }
+                drifted = []
+                for obj in rows:
+                    actual = counts.get(obj.pk, {'total': 0, 'completed': 0})
+                    if (obj.total_rides, obj.completed_rides) != (actual['total'], actual['completed']):
+                        obj.total_rides = actual['total']
+                        obj.completed_rides = actual['completed']
+                        drifted.append(obj)
+
+                if drifted and not dry_run:
+                    model.objects.bulk_update(drifted, ['total_rides', 'completed_rides'])
+            checked += len(rows)
+            fixed += len(drifted)
+        return checked, fixed
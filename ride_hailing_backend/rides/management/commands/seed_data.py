@@ -0,0 +1,343 @@
+import math
+import os
+import random
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+import django
+from django.apps import apps
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from django.utils import timezone
+
+from users.models import User, PaymentMethod
+from rides.models import Driver, RideCategory, Ride, RideLocation
+
+
+# Every seeded user can log in with this password (used by benchmark_api)
+SEED_PASSWORD = 'SeedPass123!'
+SEED_EMAIL_DOMAIN = 'seed.example.com'
+
+# Default city centre (matches the map centre used by the mobile app)
+DEFAULT_CENTER = (9.0820, 8.6753)
+
+KIND_USER = 1
+KIND_PAYMENT_METHOD = 2
+KIND_DRIVER = 3
+KIND_RIDE = 4
+
+DEFAULT_CATEGORIES = [
+    {'name': 'Standard', 'description': 'Affordable everyday rides', 'base_fare': Decimal('500.00'),
+     'per_km_rate': Decimal('120.00'), 'per_minute_rate': Decimal('15.00'), 'capacity': 4},
+    {'name': 'Comfort', 'description': 'Newer cars with extra legroom', 'base_fare': Decimal('800.00'),
+     'per_km_rate': Decimal('160.00'), 'per_minute_rate': Decimal('20.00'), 'capacity': 4},
+    {'name': 'XL', 'description': 'Rides for groups of up to 6', 'base_fare': Decimal('1000.00'),
+     'per_km_rate': Decimal('200.00'), 'per_minute_rate': Decimal('25.00'), 'capacity': 6},
+    {'name': 'Pool', 'description': 'Share the ride and the fare', 'base_fare': Decimal('400.00'),
+     'per_km_rate': Decimal('120.00'), 'per_minute_rate': Decimal('15.00'), 'capacity': 4, 'is_pooled': True},
+]
+
+# (status, weight) used when generating historical rides
+STATUS_WEIGHTS = (
+    ('completed', 80),
+    ('cancelled', 12),
+    ('requested', 2),
+    ('accepted', 2),
+    ('arrived', 1),
+    ('in_progress', 3),
+)
+
+VEHICLES = (
+    ('Toyota', 'Corolla'), ('Toyota', 'Camry'), ('Honda', 'Accord'),
+    ('Hyundai', 'Elantra'), ('Kia', 'Rio'), ('Lexus', 'RX 350'),
+)
+COLORS = ('Black', 'White', 'Silver', 'Blue', 'Red', 'Grey')
+
+
+def seed_uuid(run, kind, index):
+    """
+    Build a deterministic UUID for the index-th row of a kind in a seed run.
+
+    Rows can then reference each other (ride -> user, driver, payment method)
+    without any lookup queries, even when generated in separate processes.
+    """
+    return uuid.UUID(int=(run << 64) | (kind << 48) | index)
+
+
+def seed_email(run, index):
+    return f"seed-{run:016x}-{index}@{SEED_EMAIL_DOMAIN}"
+
+
+def seed_phone(run, index):
+    return f"+{run % 1000000:06d}{index:010d}"
+
+
+@contextmanager
+def historical_timestamps(*fields):
+    """
+    Temporarily disable auto_now_add so generated rows keep their own timestamps.
+    """
+    previous = [(field, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, value in previous:
+            field.auto_now_add = value
+
+
+def _init_worker():
+    # Spawned workers need Django configured; forked ones must not reuse the
+    # parent's database connection.
+    if not apps.ready:
+        django.setup()
+    connections.close_all()
+
+
+def _jitter(rng, center, radius_km):
+    # Roughly 111km per degree, good enough for synthetic data
+    lat = center[0] + rng.uniform(-radius_km, radius_km) / 111.0
+    lng = center[1] + rng.uniform(-radius_km, radius_km) / (111.0 * math.cos(math.radians(center[0])))
+    return lat, lng
+
+
+def _coord(value):
+    return round(value, 6)
+
+
+def seed_users(task):
+    run, start, stop, options = task
+    password = options['password_hash']
+    now = timezone.now()
+
+    users = []
+    payment_methods = []
+    for index in range(start, stop):
+        user_id = seed_uuid(run, KIND_USER, index)
+        users.append(User(
+            id=user_id,
+            email=seed_email(run, index),
+            phone_number=seed_phone(run, index),
+            full_name=f"Seed User {index}",
+            password=password,
+            is_verified=True,
+            date_joined=now,
+        ))
+        # bulk_create skips post_save, so create the default cash method here
+        payment_methods.append(PaymentMethod(
+            id=seed_uuid(run, KIND_PAYMENT_METHOD, index),
+            user_id=user_id,
+            type='cash',
+            is_default=True,
+        ))
+
+    with transaction.atomic():
+        User.objects.bulk_create(users, batch_size=options['batch_size'])
+        PaymentMethod.objects.bulk_create(payment_methods, batch_size=options['batch_size'])
+    return stop - start
+
+
+def seed_drivers(task):
+    run, start, stop, options = task
+    rng = random.Random(f"{run}:drivers:{start}")
+    now = timezone.now()
+
+    drivers = []
+    for index in range(start, stop):
+        make, model = rng.choice(VEHICLES)
+        available = rng.random() < 0.4
+        lat, lng = _jitter(rng, options['center'], options['radius_km'])
+        drivers.append(Driver(
+            id=seed_uuid(run, KIND_DRIVER, index),
+            # Drivers are the first `drivers` seeded users
+            user_id=seed_uuid(run, KIND_USER, index),
+            vehicle_make=make,
+            vehicle_model=model,
+            vehicle_year=rng.randint(2010, 2024),
+            vehicle_color=rng.choice(COLORS),
+            vehicle_license_plate=f"SD-{index:07d}",
+            driving_license_number=f"DL{run % 10000:04d}{index:09d}",
+            is_available=available,
+            rating=Decimal(f"{rng.uniform(3.5, 5.0):.2f}"),
+            current_latitude=_coord(lat),
+            current_longitude=_coord(lng),
+            last_location_update=now - timedelta(minutes=rng.randint(0, 30)) if available else None,
+        ))
+
+    with transaction.atomic():
+        Driver.objects.bulk_create(drivers, batch_size=options['batch_size'])
+    return stop - start
+
+
+def seed_rides(task):
+    run, start, stop, options = task
+    rng = random.Random(f"{run}:rides:{start}")
+    now = timezone.now()
+    categories = options['categories']
+    statuses = [status for status, _ in STATUS_WEIGHTS]
+    weights = [weight for _, weight in STATUS_WEIGHTS]
+    center, radius_km = options['center'], options['radius_km']
+
+    rides = []
+    locations = []
+    for index in range(start, stop):
+        category = rng.choice(categories)
+        status = rng.choices(statuses, weights)[0]
+        user_index = rng.randrange(options['users'])
+        pickup = _jitter(rng, center, radius_km)
+        destination = _jitter(rng, center, radius_km)
+        distance_km = Decimal(f"{rng.uniform(1, 25):.2f}")
+        duration_minutes = rng.randint(5, 90)
+        requested_at = now - timedelta(seconds=rng.randint(0, options['days'] * 86400))
+
+        distance_fare = category['per_km_rate'] * distance_km
+        time_fare = category['per_minute_rate'] * duration_minutes
+        ride = Ride(
+            id=seed_uuid(run, KIND_RIDE, index),
+            user_id=seed_uuid(run, KIND_USER, user_index),
+            category_id=category['id'],
+            pickup_latitude=_coord(pickup[0]),
+            pickup_longitude=_coord(pickup[1]),
+            pickup_address=f"{rng.randint(1, 200)} Seed Street",
+            destination_latitude=_coord(destination[0]),
+            destination_longitude=_coord(destination[1]),
+            destination_address=f"{rng.randint(1, 200)} Sample Avenue",
+            estimated_distance_km=distance_km,
+            estimated_duration_minutes=duration_minutes,
+            status=status,
+            payment_method_id=seed_uuid(run, KIND_PAYMENT_METHOD, user_index),
+            base_fare=category['base_fare'],
+            distance_fare=distance_fare,
+            time_fare=time_fare,
+            total_fare=category['base_fare'] + distance_fare + time_fare,
+            requested_at=requested_at,
+        )
+
+        if status != 'requested' and options['drivers']:
+            ride.driver_id = seed_uuid(run, KIND_DRIVER, rng.randrange(options['drivers']))
+            ride.accepted_at = requested_at + timedelta(minutes=rng.randint(1, 5))
+        if status in ('arrived', 'in_progress', 'completed') and ride.accepted_at:
+            ride.driver_arrived_at = ride.accepted_at + timedelta(minutes=rng.randint(2, 10))
+        if status in ('in_progress', 'completed') and ride.driver_arrived_at:
+            ride.started_at = ride.driver_arrived_at + timedelta(minutes=rng.randint(0, 3))
+        if status == 'completed' and ride.started_at:
+            ride.completed_at = ride.started_at + timedelta(minutes=duration_minutes)
+            ride.actual_distance_km = distance_km
+            ride.actual_duration_minutes = duration_minutes
+            ride.payment_status = 'paid'
+            if rng.random() < 0.7:
+                ride.user_rating = rng.randint(3, 5)
+        if status == 'cancelled':
+            ride.cancelled_at = requested_at + timedelta(minutes=rng.randint(1, 10))
+            ride.cancelled_by = rng.choice(('user', 'driver'))
+            ride.cancellation_reason = 'Changed plans'
+        rides.append(ride)
+
+        # GPS trace from pickup towards destination for rides that were driven
+        if ride.started_at and options['locations_per_ride']:
+            points = options['locations_per_ride']
+            step = timedelta(seconds=(duration_minutes * 60) / points)
+            for point in range(points):
+                fraction = point / max(points - 1, 1)
+                locations.append(RideLocation(
+                    ride_id=ride.id,
+                    latitude=_coord(pickup[0] + (destination[0] - pickup[0]) * fraction + rng.gauss(0, 0.00005)),
+                    longitude=_coord(pickup[1] + (destination[1] - pickup[1]) * fraction + rng.gauss(0, 0.00005)),
+                    timestamp=ride.started_at + step * point,
+                ))
+
+    with historical_timestamps(Ride._meta.get_field('requested_at'), RideLocation._meta.get_field('timestamp')):
+        with transaction.atomic():
+            Ride.objects.bulk_create(rides, batch_size=options['batch_size'])
+            RideLocation.objects.bulk_create(locations, batch_size=options['batch_size'])
+    return stop - start
+
+
+class Command(BaseCommand):
+    help = 'Bulk-seed synthetic users, drivers, rides and ride locations for load testing.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--drivers', type=int, default=1000,
+                            help='Number of drivers (taken from the seeded users).')
+        parser.add_argument('--rides', type=int, default=50000)
+        parser.add_argument('--locations-per-ride', type=int, default=10)
+        parser.add_argument('--days', type=int, default=90,
+                            help='Spread ride request times over this many past days.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Parallel worker processes (defaults to 1 on SQLite, CPU count otherwise).')
+        parser.add_argument('--radius-km', type=float, default=15.0)
+
+    def handle(self, *args, **options):
+        if options['drivers'] > options['users']:
+            raise CommandError('--drivers cannot be larger than --users')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+
+        workers = options['workers']
+        if workers is None:
+            # SQLite serializes writers, so extra processes only add lock contention
+            workers = 1 if connection.vendor == 'sqlite' else (os.cpu_count() or 1)
+
+        run = random.getrandbits(64)
+        task_options = {
+            'batch_size': options['batch_size'],
+            'users': options['users'],
+            'drivers': options['drivers'],
+            'days': options['days'],
+            'locations_per_ride': options['locations_per_ride'],
+            'center': DEFAULT_CENTER,
+            'radius_km': options['radius_km'],
+            # Hash once: PBKDF2 per seeded user would dominate the run time
+            'password_hash': make_password(SEED_PASSWORD),
+            'categories': self._ensure_categories(),
+        }
+
+        self.stdout.write(f"Seeding run {run:016x} with {workers} worker(s)")
+        self._run_phase('users', seed_users, run, options['users'], task_options, workers)
+        self._run_phase('drivers', seed_drivers, run, options['drivers'], task_options, workers)
+        self._run_phase('rides', seed_rides, run, options['rides'], task_options, workers)
+        # bulk_create bypasses Ride.save, so fill in the ride counters and rollups afterwards
+        call_command('reconcile_ride_counters', stdout=self.stdout)
+        call_command('reconcile_ride_rollups', hours=options['days'] * 24 + 1, stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f"Seed users log in with password '{SEED_PASSWORD}'"))
+
+    def _ensure_categories(self):
+        if not RideCategory.objects.filter(is_active=True).exists():
+            RideCategory.objects.bulk_create([RideCategory(**data) for data in DEFAULT_CATEGORIES])
+        # Pooled rides need trips and split fares, so history is only seeded for single-party categories
+        return list(RideCategory.objects.filter(is_active=True, is_pooled=False).values(
+            'id', 'base_fare', 'per_km_rate', 'per_minute_rate'
+        ))
+
+    def _run_phase(self, name, func, run, total, task_options, workers):
+        if not total:
+            return
+        batch_size = task_options['batch_size']
+        tasks = [
+            (run, start, min(start + batch_size, total), task_options)
+            for start in range(0, total, batch_size)
+        ]
+
+        started = time.perf_counter()
+        done = 0
+        if workers == 1:
+            for task in tasks:
+                done += func(task)
+        else:
+            # Close the parent's connection so forked workers open their own
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+                for count in pool.map(func, tasks):
+                    done += count
+        elapsed = time.perf_counter() - started
+        rate = done / elapsed if elapsed else done
+        self.stdout.write(f"  {name}: {done} rows in {elapsed:.1f}s ({rate:,.0f}/s)")
@@ -0,0 +1,45 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from rides.models import Ride
+from rides.payments import get_payments_setting, settle_rides
+
+
+class Command(BaseCommand):
+    help = 'Settle completed rides still waiting for payment, e.g. rides completed before settlement existed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=int, default=600,
+                            help='Skip rides completed less than this many seconds ago; their jobs are still queued.')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Rides charged per batch (defaults to PAYMENTS["BATCH_SIZE"]).')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size'] or get_payments_setting('BATCH_SIZE')
+        cutoff = timezone.now() - timedelta(seconds=options['min_age'])
+        due = Ride.objects.filter(status='completed', payment_status='pending', completed_at__lte=cutoff)
+
+        totals = {'paid': 0, 'failed': 0, 'retry': 0}
+        last = None
+        while True:
+            # Keyset pagination, so rides left pending by gateway errors are not read again
+            batch = due.order_by('completed_at', 'id')
+            if last is not None:
+                batch = batch.filter(Q(completed_at__gt=last[0]) | Q(completed_at=last[0], id__gt=last[1]))
+            batch = list(batch.values_list('completed_at', 'id')[:batch_size])
+            if not batch:
+                break
+            last = batch[-1]
+
+            result = settle_rides([ride_id for _, ride_id in batch])
+            totals['paid'] += result['paid']
+            totals['failed'] += result['failed']
+            totals['retry'] += len(result['retry'])
+
+        self.stdout.write(
+            f"Paid {totals['paid']}, failed {totals['failed']}, "
+            f"left pending after gateway errors {totals['retry']}"
+        )
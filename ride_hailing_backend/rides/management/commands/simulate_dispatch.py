@@ -0,0 +1,63 @@
+import json
+import math
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+from rides.exports import parse_bound
+from rides.models import Ride
+from rides.simulator import Demand, Fleet, Simulation
+
+
+class Command(BaseCommand):
+    help = 'Replay historical ride requests against a synthetic fleet to measure a dispatch and pricing policy.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', default=None,
+                            help='ISO date or date/time, inclusive (defaults to a day before --end).')
+        parser.add_argument('--end', default=None,
+                            help='ISO date (inclusive) or date/time (exclusive); defaults to just after the latest ride.')
+        parser.add_argument('--drivers', type=int, default=200)
+        parser.add_argument('--shift-hours', type=float, default=8)
+        parser.add_argument('--patience', type=float, default=600,
+                            help='Seconds a rider waits for an assignment before giving up.')
+        parser.add_argument('--policy', default='rides.simulator.nearest_driver_policy',
+                            help='Dotted path of a policy(request, simulation) -> (driver_index, fare) callable.')
+        parser.add_argument('--price-elasticity', type=float, default=0.0)
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON.')
+
+    def handle(self, *args, **options):
+        try:
+            policy = import_string(options['policy'])
+        except ImportError as exc:
+            raise CommandError(str(exc))
+        try:
+            end = parse_bound(options['end'], is_end=True) if options['end'] else None
+            start = parse_bound(options['start']) if options['start'] else None
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        if end is None:
+            latest = Ride.objects.order_by('-requested_at').values_list('requested_at', flat=True).first()
+            if latest is None:
+                raise CommandError('There are no rides to replay.')
+            end = latest + timedelta(seconds=1)
+        start = start or end - timedelta(days=1)
+
+        demand = Demand.from_rides(start, end)
+        if not len(demand):
+            raise CommandError(f"No rides were requested between {start} and {end}.")
+        fleet = Fleet.synthetic(demand, options['drivers'], options['shift_hours'], seed=options['seed'])
+        report = Simulation(
+            demand, fleet, policy, patience=options['patience'],
+            price_elasticity=options['price_elasticity'], seed=options['seed'],
+        ).run()
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for name, value in report.items():
+            if isinstance(value, float):
+                value = 'n/a' if math.isnan(value) else f"{value:.3f}"
+            self.stdout.write(f"{name}: {value}")
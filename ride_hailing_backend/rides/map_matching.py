@@ -0,0 +1,549 @@
+"""
+Map matching of ride GPS traces.
+
+A completed ride's RideLocation points are snapped onto the road graph with
+a hidden Markov model (Newson & Krumm, 2009). The candidate states of a fix
+are its projections onto the road segments within SEARCH_RADIUS_M, scored
+for GPS error with a Gaussian; transitions prefer candidate pairs whose
+distance along the roads matches the straight-line distance between the
+fixes. Viterbi picks the most likely sequence, and the path along the roads
+and its length are stored in MatchedRoute.
+
+The graph is compiled by build_road_graph from ROADS_FILE, a CSV of road
+segments exported from OpenStreetMap, into an .npz file holding the nodes,
+the directed segments, their adjacency and a grid index over the segments.
+Candidates for a whole trace are found and scored in a few NumPy operations;
+routes between candidates come from a Dijkstra search bounded by how far the
+vehicle can have driven.
+
+Matching is CPU-bound, so match_rides hands traces to a pool of WORKERS
+processes that each load the graph once. Only the calling thread touches the
+database.
+"""
+import csv
+import heapq
+import logging
+import math
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+import django
+import numpy as np
+from django.apps import apps
+from django.conf import settings
+
+from .eta import haversine_m
+from .models import MatchedRoute, Ride, RideLocation
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    # CSV of road segments: from_node, to_node, from_latitude, from_longitude,
+    # to_latitude, to_longitude and oneway ('yes', 'no' or '-1' as in OSM)
+    'ROADS_FILE': None,
+    # Compiled graph written by build_road_graph
+    'GRAPH_PATH': None,
+    # Grid cells of the segment index; must be wider than SEARCH_RADIUS_M
+    'CELL_SIZE_DEG': 0.005,
+    # Standard deviation of GPS error
+    'GPS_SIGMA_M': 10.0,
+    # Scale of the allowed difference between road and straight-line distance
+    'TRANSITION_BETA_M': 20.0,
+    'SEARCH_RADIUS_M': 50.0,
+    'MAX_CANDIDATES': 8,
+    # Routes longer than this times the straight-line distance are not followed
+    'MAX_ROUTE_FACTOR': 4.0,
+    # Fixes closer than this to the previous one add nothing but noise
+    'MIN_SPACING_M': 20.0,
+    # Processes matching traces; 1 matches in the calling process
+    'WORKERS': 2,
+}
+
+METRES_PER_DEGREE = 6371000.0 * math.pi / 180
+GRAPH_ARRAYS = (
+    'node_coords', 'segment_from', 'segment_to', 'segment_length',
+    'cell_keys', 'cell_segments', 'out_offsets', 'out_segments',
+)
+
+
+def get_matching_setting(name):
+    return getattr(settings, 'MAP_MATCHING', {}).get(name, DEFAULTS[name])
+
+
+def matcher_options():
+    return {
+        name.lower(): get_matching_setting(name)
+        for name in ('GPS_SIGMA_M', 'TRANSITION_BETA_M', 'SEARCH_RADIUS_M', 'MAX_CANDIDATES',
+                     'MAX_ROUTE_FACTOR', 'MIN_SPACING_M')
+    }
+
+
+class RoadGraph:
+    """
+    Directed road segments between nodes, with a grid index over the segments.
+
+    Two-way roads are stored as one segment per direction. Segments are
+    listed in every grid cell their bounding box touches, sorted by cell
+    key, and out_offsets/out_segments list the segments leaving each node.
+    """
+
+    def __init__(self, node_coords, segment_from, segment_to, segment_length, cell_keys, cell_segments,
+                 out_offsets, out_segments, cell_size):
+        self.node_coords = node_coords
+        self.segment_from = segment_from
+        self.segment_to = segment_to
+        self.segment_length = segment_length
+        self.cell_keys = cell_keys
+        self.cell_segments = cell_segments
+        self.out_offsets = out_offsets
+        self.out_segments = out_segments
+        self.cell_size = cell_size
+        self.columns = math.ceil(360 / cell_size)
+        # Dijkstra walks these one at a time, which is faster on lists
+        self._out_offsets = out_offsets.tolist()
+        self._out_segments = out_segments.tolist()
+        self._segment_to = segment_to.tolist()
+        self._segment_length = segment_length.tolist()
+
+    def __len__(self):
+        return len(self.segment_from)
+
+    @classmethod
+    def from_csv(cls, path, cell_size):
+        nodes, coords, pairs = {}, [], []
+
+        def node(osm_id, latitude, longitude):
+            index = nodes.get(osm_id)
+            if index is None:
+                index = nodes[osm_id] = len(coords)
+                coords.append((float(latitude), float(longitude)))
+            return index
+
+        with open(path, newline='', encoding='utf-8') as fh:
+            for row in csv.DictReader(fh):
+                start = node(row['from_node'], row['from_latitude'], row['from_longitude'])
+                end = node(row['to_node'], row['to_latitude'], row['to_longitude'])
+                oneway = (row.get('oneway') or 'no').strip().lower()
+                if oneway != '-1':
+                    pairs.append((start, end))
+                if oneway not in ('yes', 'true', '1'):
+                    pairs.append((end, start))
+
+        node_coords = np.array(coords, dtype=np.float64).reshape(-1, 2)
+        pairs = np.array(pairs, dtype=np.int32).reshape(-1, 2)
+        # Grouped by start node, so the segments leaving a node are one slice
+        pairs = pairs[np.argsort(pairs[:, 0], kind='stable')]
+        segment_from, segment_to = pairs[:, 0], pairs[:, 1]
+        start, end = node_coords[segment_from], node_coords[segment_to]
+        segment_length = haversine_m(start[:, 0], start[:, 1], end[:, 0], end[:, 1])
+        out_offsets = np.searchsorted(segment_from, np.arange(len(node_coords) + 1)).astype(np.int64)
+        out_segments = np.arange(len(pairs), dtype=np.int32)
+
+        columns = math.ceil(360 / cell_size)
+        low = np.floor((np.minimum(start, end) + (90, 180)) / cell_size).astype(np.int64)
+        high = np.floor((np.maximum(start, end) + (90, 180)) / cell_size).astype(np.int64)
+        keys, members = [], []
+        for segment in range(len(pairs)):
+            for row in range(low[segment, 0], high[segment, 0] + 1):
+                for col in range(low[segment, 1], high[segment, 1] + 1):
+                    keys.append(row * columns + col % columns)
+                    members.append(segment)
+        keys = np.array(keys, dtype=np.int64)
+        order = np.argsort(keys, kind='stable')
+        return cls(
+            node_coords, segment_from, segment_to, segment_length, keys[order],
+            np.array(members, dtype=np.int32)[order], out_offsets, out_segments, cell_size,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(*(data[name] for name in GRAPH_ARRAYS), float(data['cell_size']))
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # Written under a temporary name and renamed, so readers never see a partial graph
+        temporary = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(temporary, cell_size=self.cell_size, **{name: getattr(self, name) for name in GRAPH_ARRAYS})
+        os.replace(temporary, path)
+
+    def candidates(self, latitudes, longitudes, radius_m, limit):
+        """
+        Projections of every point onto the segments within radius_m, at most limit per point.
+
+        Returns arrays of point indexes, segments, offsets along the segment
+        (0 to 1) and distances in metres, ordered by point then distance.
+        """
+        n = len(latitudes)
+        rows = np.floor((latitudes + 90) / self.cell_size).astype(np.int64)
+        cols = np.floor((longitudes + 180) / self.cell_size).astype(np.int64)
+        around = np.arange(-1, 2)
+        cells = (
+            (rows[:, None, None] + around[None, :, None]) * self.columns
+            + (cols[:, None, None] + around[None, None, :]) % self.columns
+        ).reshape(n, 9)
+        starts = np.searchsorted(self.cell_keys, cells, side='left').ravel()
+        counts = np.searchsorted(self.cell_keys, cells, side='right').ravel() - starts
+        total = int(counts.sum())
+        # Every (point, segment) pair of the 3x3 cells around each point, without duplicates
+        positions = np.repeat(starts - np.concatenate(([0], np.cumsum(counts)[:-1])), counts) + np.arange(total)
+        points = np.repeat(np.repeat(np.arange(n), 9), counts)
+        pairs = np.unique(points.astype(np.int64) * len(self) + self.cell_segments[positions])
+        points, segments = pairs // len(self), pairs % len(self)
+
+        # Flat projection around the trace; exact enough at these distances
+        x_scale = METRES_PER_DEGREE * math.cos(math.radians(float(np.mean(latitudes)) if n else 0.0))
+        px, py = longitudes[points] * x_scale, latitudes[points] * METRES_PER_DEGREE
+        a = self.node_coords[self.segment_from[segments]]
+        b = self.node_coords[self.segment_to[segments]]
+        ax, ay = a[:, 1] * x_scale, a[:, 0] * METRES_PER_DEGREE
+        dx, dy = b[:, 1] * x_scale - ax, b[:, 0] * METRES_PER_DEGREE - ay
+        squared = dx * dx + dy * dy
+        offsets = np.clip(((px - ax) * dx + (py - ay) * dy) / np.where(squared > 0, squared, 1), 0, 1)
+        distances = np.hypot(px - ax - offsets * dx, py - ay - offsets * dy)
+
+        near = distances <= radius_m
+        points, segments, offsets, distances = points[near], segments[near], offsets[near], distances[near]
+        order = np.lexsort((distances, points))
+        points, segments, offsets, distances = points[order], segments[order], offsets[order], distances[order]
+        first = np.searchsorted(points, points, side='left')
+        keep = np.arange(len(points)) - first < limit
+        return points[keep], segments[keep], offsets[keep], distances[keep]
+
+    def shortest_paths(self, source, cutoff):
+        """
+        Road distances from a node to every node within cutoff metres, and
+        the segment each was reached by.
+        """
+        offsets, out, to, length = self._out_offsets, self._out_segments, self._segment_to, self._segment_length
+        distances, via = {source: 0.0}, {}
+        heap = [(0.0, source)]
+        while heap:
+            distance, node = heapq.heappop(heap)
+            if distance > distances[node]:
+                continue
+            for segment in out[offsets[node]:offsets[node + 1]]:
+                reached = distance + length[segment]
+                target = to[segment]
+                if reached <= cutoff and reached < distances.get(target, math.inf):
+                    distances[target] = reached
+                    via[target] = segment
+                    heapq.heappush(heap, (reached, target))
+        return distances, via
+
+    def point_on(self, segment, offset):
+        start = self.node_coords[self.segment_from[segment]]
+        end = self.node_coords[self.segment_to[segment]]
+        return start + (end - start) * offset
+
+
+class MatchResult:
+    __slots__ = ('distance_m', 'path', 'points_matched', 'points_total')
+
+    def __init__(self, distance_m, path, points_matched, points_total):
+        self.distance_m = distance_m
+        self.path = path
+        self.points_matched = points_matched
+        self.points_total = points_total
+
+
+class MapMatcher:
+    """
+    HMM map matcher over a RoadGraph; see the module docstring.
+    """
+
+    def __init__(self, graph, gps_sigma_m, transition_beta_m, search_radius_m, max_candidates,
+                 max_route_factor, min_spacing_m):
+        self.graph = graph
+        self.sigma = gps_sigma_m
+        self.beta = transition_beta_m
+        self.radius = search_radius_m
+        self.limit = max_candidates
+        self.route_factor = max_route_factor
+        self.min_spacing = min_spacing_m
+        # Fixes that fall back along a segment by less than this are GPS error, not U-turns
+        self.jitter = 2 * gps_sigma_m
+
+    def match(self, points):
+        """
+        Match a trace, an (n, 2) array of coordinates in time order.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        total = len(points)
+        points = self._thin(points)
+        owners, segments, offsets, distances = self.graph.candidates(
+            points[:, 0], points[:, 1], self.radius, self.limit
+        )
+        # Emission scores of every candidate at once
+        emissions = -0.5 * (distances / self.sigma) ** 2
+        bounds = np.searchsorted(owners, np.arange(len(points) + 1))
+        steps = [
+            (index, segments[start:end], offsets[start:end] * self.graph.segment_length[segments[start:end]],
+             emissions[start:end])
+            for index, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])) if end > start
+        ]
+
+        paths = {}
+        distance, path, matched = 0.0, [], 0
+        previous_fix = None
+        for chain in self._viterbi(points, steps, paths):
+            chain_distance, chain_path = self._follow(chain, paths)
+            if previous_fix is not None:
+                # No route joins this chain to the last one; count the gap as the crow flies
+                distance += float(haversine_m(*previous_fix, *points[chain[0][0]]))
+            distance += chain_distance
+            path.extend(chain_path)
+            matched += len(chain)
+            previous_fix = points[chain[-1][0]]
+        return MatchResult(distance, path, matched, total)
+
+    def _thin(self, points):
+        if len(points) < 3:
+            return points
+        keep, last = [0], points[0]
+        for index in range(1, len(points) - 1):
+            if haversine_m(last[0], last[1], points[index, 0], points[index, 1]) >= self.min_spacing:
+                keep.append(index)
+                last = points[index]
+        keep.append(len(points) - 1)
+        return points[keep]
+
+    def _routes(self, points, before, after, paths):
+        """
+        Road distances between the candidates of two consecutive fixes, inf where there is no route.
+        """
+        graph = self.graph
+        _, from_segments, from_offsets, _ = before
+        _, to_segments, to_offsets, _ = after
+        straight = float(haversine_m(*points[before[0]], *points[after[0]]))
+        cutoff = straight * self.route_factor + 2 * self.radius
+        routes = np.full((len(from_segments), len(to_segments)), np.inf)
+        for a, (segment, offset) in enumerate(zip(from_segments.tolist(), from_offsets.tolist())):
+            remaining = graph._segment_length[segment] - offset
+            node = graph._segment_to[segment]
+            cached = paths.get(node)
+            if cached is None or cached[0] < cutoff:
+                cached = paths[node] = (cutoff, *graph.shortest_paths(node, cutoff))
+            reachable = cached[1]
+            for b, (to_segment, to_offset) in enumerate(zip(to_segments.tolist(), to_offsets.tolist())):
+                if to_segment == segment and to_offset >= offset - self.jitter:
+                    routes[a, b] = max(to_offset - offset, 0.0)
+                    continue
+                between = reachable.get(int(graph.segment_from[to_segment]))
+                if between is not None:
+                    routes[a, b] = remaining + between + to_offset
+        routes[routes > cutoff] = np.inf
+        return routes, straight
+
+    def _viterbi(self, points, steps, paths):
+        """
+        Yield the most likely state sequences, one per run of fixes joined by roads.
+
+        A state is (fix index, segment, offset in metres, road distance from the previous state).
+        """
+        if not steps:
+            return
+        scores = steps[0][3]
+        history = [(steps[0], None, None)]
+        for before, after in zip(steps, steps[1:]):
+            routes, straight = self._routes(points, before, after, paths)
+            totals = scores[:, None] - np.abs(routes - straight) / self.beta
+            best = np.argmax(totals, axis=0)
+            reached = totals[best, np.arange(len(best))]
+            if not np.isfinite(reached).any():
+                yield self._backtrack(history, scores)
+                scores = after[3]
+                history = [(after, None, None)]
+                continue
+            scores = reached + after[3]
+            history.append((after, best, routes[best, np.arange(len(best))]))
+        yield self._backtrack(history, scores)
+
+    def _backtrack(self, history, scores):
+        state = int(np.argmax(scores))
+        chain = []
+        for step, best, routes in reversed(history):
+            index, segments, offsets, _ = step
+            chain.append((index, int(segments[state]), float(offsets[state]),
+                          0.0 if routes is None else float(routes[state])))
+            if best is not None:
+                state = int(best[state])
+        chain.reverse()
+        return chain
+
+    def _follow(self, chain, paths):
+        """
+        Length of a chain of states and its path along the roads as [latitude, longitude] pairs.
+        """
+        graph = self.graph
+        distance = 0.0
+        path = [self._coordinate(chain[0][1], chain[0][2])]
+        for (_, segment, offset, _), (_, to_segment, to_offset, route) in zip(chain, chain[1:]):
+            distance += route
+            if to_segment == segment and to_offset >= offset - self.jitter:
+                if to_offset < offset:
+                    # Stood still; the fix only jittered back
+                    continue
+            else:
+                # Walk back from the next segment's start node to this segment's end node
+                node, target = int(graph.segment_from[to_segment]), graph._segment_to[segment]
+                via = paths[target][2]
+                nodes = [node]
+                while node != target:
+                    node = int(graph.segment_from[via[node]])
+                    nodes.append(node)
+                path.extend(
+                    [round(float(value), 6) for value in graph.node_coords[node]] for node in reversed(nodes)
+                )
+            path.append(self._coordinate(to_segment, to_offset))
+        # Consecutive duplicates appear where a fix sits on a node
+        return distance, [point for index, point in enumerate(path) if index == 0 or point != path[index - 1]]
+
+    def _coordinate(self, segment, offset_m):
+        length = self.graph.segment_length[segment]
+        point = self.graph.point_on(segment, offset_m / length if length else 0.0)
+        return [round(float(point[0]), 6), round(float(point[1]), 6)]
+
+
+# One matcher per process: the jobs worker's, or each pool process's
+_matcher = None
+_matcher_mtime = None
+_pool = None
+_pool_key = None
+_warned = False
+_lock = threading.Lock()
+
+
+def _load_matcher(graph_path, options):
+    global _matcher, _matcher_mtime
+    mtime = os.path.getmtime(graph_path)
+    if _matcher is None or mtime != _matcher_mtime:
+        _matcher = MapMatcher(RoadGraph.load(graph_path), **options)
+        _matcher_mtime = mtime
+    return _matcher
+
+
+def _init_worker(graph_path, options):
+    # Spawned processes import the rides models when unpickling the task
+    if not apps.ready:
+        django.setup()
+    _load_matcher(graph_path, options)
+
+
+def _match_trace(points):
+    result = _matcher.match(points)
+    return result.distance_m, result.path, result.points_matched, result.points_total
+
+
+def _get_pool(graph_path, options, workers):
+    """
+    The process pool matching traces, rebuilt when the graph file or the worker count changes.
+    """
+    global _pool, _pool_key
+    key = (os.path.getmtime(graph_path), workers)
+    if _pool is None or key != _pool_key:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+        _pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(graph_path, options))
+        _pool_key = key
+    return _pool
+
+
+def reset_map_matcher():
+    """
+    Forget the loaded graph and the process pool so they are rebuilt from the settings.
+    """
+    global _matcher, _pool, _warned
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+        _matcher = None
+        _pool = None
+        _warned = False
+
+
+def graph_path():
+    """
+    The compiled road graph, or None when map matching is off or no graph was built.
+    """
+    path = get_matching_setting('GRAPH_PATH')
+    if not get_matching_setting('ENABLED') or not path or not os.path.exists(path):
+        return None
+    return path
+
+
+def build_road_graph(roads_file=None, path=None):
+    """
+    Compile the roads file into the graph file and make this process use it.
+    """
+    roads_file = roads_file or get_matching_setting('ROADS_FILE')
+    path = path or get_matching_setting('GRAPH_PATH')
+    graph = RoadGraph.from_csv(roads_file, get_matching_setting('CELL_SIZE_DEG'))
+    graph.save(path)
+    reset_map_matcher()
+    return graph
+
+
+def match_rides(ride_ids, workers=None):
+    """
+    Match the GPS traces of completed rides and store their MatchedRoutes.
+
+    Also fills in actual_distance_km where the driver app did not report it.
+    Traces with no fix near a road store nothing. Returns the number of
+    rides matched.
+    """
+    global _warned
+    path = graph_path()
+    if path is None:
+        if not _warned:
+            logger.warning('Map matching skipped: no road graph; run build_road_graph')
+            _warned = True
+        return 0
+    ride_ids = list(Ride.objects.filter(id__in=ride_ids, status='completed').values_list('id', flat=True))
+    traces = {}
+    rows = RideLocation.objects.filter(ride_id__in=ride_ids).order_by('ride_id', 'timestamp').values_list(
+        'ride_id', 'latitude', 'longitude'
+    )
+    for ride_id, latitude, longitude in rows.iterator(chunk_size=5000):
+        traces.setdefault(ride_id, []).append((latitude, longitude))
+    traces = {ride_id: points for ride_id, points in traces.items() if len(points) >= 2}
+    if not traces:
+        return 0
+
+    options = matcher_options()
+    workers = workers or get_matching_setting('WORKERS')
+    with _lock:
+        if workers > 1 and len(traces) > 1:
+            chunksize = max(1, len(traces) // (workers * 4))
+            results = list(_get_pool(path, options, workers).map(_match_trace, traces.values(), chunksize=chunksize))
+        else:
+            _load_matcher(path, options)
+            results = [_match_trace(points) for points in traces.values()]
+
+    routes = [
+        MatchedRoute(
+            ride_id=ride_id, distance_km=Decimal(f"{distance / 1000:.3f}"), path=matched_path,
+            points_matched=matched, points_total=total,
+        )
+        for ride_id, (distance, matched_path, matched, total) in zip(traces, results)
+        if matched
+    ]
+    if len(routes) < len(traces):
+        logger.info('Map matching left %d of %d rides unmatched', len(traces) - len(routes), len(traces))
+    if not routes:
+        return 0
+    MatchedRoute.objects.bulk_create(
+        routes, update_conflicts=True, unique_fields=['ride'],
+        update_fields=['distance_km', 'path', 'points_matched', 'points_total', 'matched_at'],
+    )
+    distances = {route.ride_id: route.distance_km for route in routes}
+    missing = Ride.objects.filter(id__in=list(distances), actual_distance_km__isnull=True).values_list('id', flat=True)
+    Ride.objects.bulk_update(
+        [Ride(id=ride_id, actual_distance_km=distances[ride_id].quantize(Decimal('0.01'))) for ride_id in missing],
+        ['actual_distance_km'],
+    )
+    return len(routes)
@@ -0,0 +1,13 @@
+from ride_hailing_backend.metrics import Counter
+
+
+LOCATION_UPDATES = Counter('location_updates_ingested_total', 'Ride location updates stored.')
+LOCATION_UPDATES_SKIPPED = Counter(
+    'location_updates_skipped_total', 'Ride location updates not stored, by reason.', ('reason',)
+)
+RIDES_CREATED = Counter('rides_created_total', 'Rides requested.', ('category',))
+RIDES_CANCELLED = Counter('rides_cancelled_total', 'Rides cancelled, by who cancelled them.', ('cancelled_by',))
+PAYMENTS_SETTLED = Counter('ride_payments_settled_total', 'Ride payments settled, by outcome.', ('outcome',))
+PAYMENTS_REFUNDED = Counter('ride_payments_refunded_total', 'Ride refunds processed, by outcome.', ('outcome',))
+POOL_INSERTIONS = Counter('pool_insertions_total', 'Pooled ride requests, by insertion outcome.', ('outcome',))
+DRIVERS_EXPIRED = Counter('drivers_expired_total', 'Drivers made unavailable after their heartbeats stopped.')
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.1 on 2026-10-19 12:33
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0002_initial'),
+        ('users', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(fields=['-requested_at'], name='ride_requested_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ridelocation',
+            index=models.Index(fields=['ride', 'timestamp'], name='ridelocation_ride_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ridelocation',
+            index=models.Index(fields=['timestamp'], name='ridelocation_timestamp_idx'),
+        ),
+    ]
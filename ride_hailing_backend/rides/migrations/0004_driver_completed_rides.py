@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-19 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0003_ride_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='driver',
+            name='completed_rides',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
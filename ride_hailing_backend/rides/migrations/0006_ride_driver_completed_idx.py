@@ -0,0 +1,20 @@
+# Generated by Django 5.2.1 on 2026-10-19 13:01
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0005_idempotency_key'),
+        ('users', '0002_user_ride_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(fields=['driver', 'completed_at'], name='ride_driver_completed_idx'),
+        ),
+    ]
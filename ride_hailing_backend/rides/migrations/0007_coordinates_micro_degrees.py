@@ -0,0 +1,222 @@
+# Store coordinates as integer micro-degrees (see ride_hailing_backend/fields.py).
+#
+# Each column is copied into a new integer column with a single UPDATE per
+# table, then the decimal column is dropped and the new one takes its name.
+# The old columns are made nullable first so the migration can be reversed.
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import F, Value
+from django.db.models.functions import Cast, Round
+
+import ride_hailing_backend.fields
+
+FIELDS = {
+    'Driver': ('current_latitude', 'current_longitude'),
+    'Ride': ('pickup_latitude', 'pickup_longitude', 'destination_latitude', 'destination_longitude'),
+    'RideLocation': ('latitude', 'longitude'),
+}
+
+
+def to_micro_degrees(apps, schema_editor):
+    for model_name, names in FIELDS.items():
+        model = apps.get_model('rides', model_name)
+        model.objects.using(schema_editor.connection.alias).update(**{
+            f"{name}_e6": Cast(Round(F(name) * Value(Decimal(1000000))), models.IntegerField()) for name in names
+        })
+
+
+def to_degrees(apps, schema_editor):
+    for model_name, names in FIELDS.items():
+        model = apps.get_model('rides', model_name)
+        model.objects.using(schema_editor.connection.alias).update(**{
+            name: F(f"{name}_e6") / Value(1000000.0) for name in names
+        })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0006_ride_driver_completed_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='driver',
+            name='current_latitude_e6',
+            field=ride_hailing_backend.fields.CoordinateField(max_degrees=90, null=True, blank=True),
+        ),
+        migrations.AddField(
+            model_name='driver',
+            name='current_longitude_e6',
+            field=ride_hailing_backend.fields.CoordinateField(null=True, blank=True),
+        ),
+        migrations.AlterField(
+            model_name='ride',
+            name='pickup_latitude',
+            field=models.DecimalField(decimal_places=6, max_digits=9, null=True),
+        ),
+        migrations.AlterField(
+            model_name='ride',
+            name='pickup_longitude',
+            field=models.DecimalField(decimal_places=6, max_digits=9, null=True),
+        ),
+        migrations.AlterField(
+            model_name='ride',
+            name='destination_latitude',
+            field=models.DecimalField(decimal_places=6, max_digits=9, null=True),
+        ),
+        migrations.AlterField(
+            model_name='ride',
+            name='destination_longitude',
+            field=models.DecimalField(decimal_places=6, max_digits=9, null=True),
+        ),
+        migrations.AddField(
+            model_name='ride',
+            name='pickup_latitude_e6',
+            field=ride_hailing_backend.fields.CoordinateField(max_degrees=90, null=True),
+        ),
+        migrations.AddField(
+            model_name='ride',
+            name='pickup_longitude_e6',
+            field=ride_hailing_backend.fields.CoordinateField(null=True),
+        ),
+        migrations.AddField(
+            model_name='ride',
+            name='destination_latitude_e6',
+            field=ride_hailing_backend.fields.CoordinateField(max_degrees=90, null=True),
+        ),
+        migrations.AddField(
+            model_name='ride',
+            name='destination_longitude_e6',
+            field=ride_hailing_backend.fields.CoordinateField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='ridelocation',
+            name='latitude',
+            field=models.DecimalField(decimal_places=6, max_digits=9, null=True),
+        ),
+        migrations.AlterField(
+            model_name='ridelocation',
+            name='longitude',
+            field=models.DecimalField(decimal_places=6, max_digits=9, null=True),
+        ),
+        migrations.AddField(
+            model_name='ridelocation',
+            name='latitude_e6',
+            field=ride_hailing_backend.fields.CoordinateField(max_degrees=90, null=True),
+        ),
+        migrations.AddField(
+            model_name='ridelocation',
+            name='longitude_e6',
+            field=ride_hailing_backend.fields.CoordinateField(null=True),
+        ),
+        migrations.RunPython(to_micro_degrees, to_degrees),
+        migrations.RemoveField(
+            model_name='driver',
+            name='current_latitude',
+        ),
+        migrations.RemoveField(
+            model_name='driver',
+            name='current_longitude',
+        ),
+        migrations.RenameField(
+            model_name='driver',
+            old_name='current_latitude_e6',
+            new_name='current_latitude',
+        ),
+        migrations.RenameField(
+            model_name='driver',
+            old_name='current_longitude_e6',
+            new_name='current_longitude',
+        ),
+        migrations.RemoveField(
+            model_name='ride',
+            name='pickup_latitude',
+        ),
+        migrations.RemoveField(
+            model_name='ride',
+            name='pickup_longitude',
+        ),
+        migrations.RemoveField(
+            model_name='ride',
+            name='destination_latitude',
+        ),
+        migrations.RemoveField(
+            model_name='ride',
+            name='destination_longitude',
+        ),
+        migrations.RenameField(
+            model_name='ride',
+            old_name='pickup_latitude_e6',
+            new_name='pickup_latitude',
+        ),
+        migrations.RenameField(
+            model_name='ride',
+            old_name='pickup_longitude_e6',
+            new_name='pickup_longitude',
+        ),
+        migrations.RenameField(
+            model_name='ride',
+            old_name='destination_latitude_e6',
+            new_name='destination_latitude',
+        ),
+        migrations.RenameField(
+            model_name='ride',
+            old_name='destination_longitude_e6',
+            new_name='destination_longitude',
+        ),
+        migrations.AlterField(
+            model_name='ride',
+            name='pickup_latitude',
+            field=ride_hailing_backend.fields.CoordinateField(max_degrees=90),
+        ),
+        migrations.AlterField(
+            model_name='ride',
+            name='pickup_longitude',
+            field=ride_hailing_backend.fields.CoordinateField(),
+        ),
+        migrations.AlterField(
+            model_name='ride',
+            name='destination_latitude',
+            field=ride_hailing_backend.fields.CoordinateField(max_degrees=90),
+        ),
+        migrations.AlterField(
+            model_name='ride',
+            name='destination_longitude',
+            field=ride_hailing_backend.fields.CoordinateField(),
+        ),
+        migrations.RemoveField(
+            model_name='ridelocation',
+            name='latitude',
+        ),
+        migrations.RemoveField(
+            model_name='ridelocation',
+            name='longitude',
+        ),
+        migrations.RenameField(
+            model_name='ridelocation',
+            old_name='latitude_e6',
+            new_name='latitude',
+        ),
+        migrations.RenameField(
+            model_name='ridelocation',
+            old_name='longitude_e6',
+            new_name='longitude',
+        ),
+        migrations.AlterField(
+            model_name='ridelocation',
+            name='latitude',
+            field=ride_hailing_backend.fields.CoordinateField(max_degrees=90),
+        ),
+        migrations.AlterField(
+            model_name='ridelocation',
+            name='longitude',
+            field=ride_hailing_backend.fields.CoordinateField(),
+        ),
+        migrations.AddIndex(
+            model_name='driver',
+            index=models.Index(fields=['current_latitude', 'current_longitude'], name='driver_position_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.1 on 2026-10-19 13:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0007_coordinates_micro_degrees'),
+        ('users', '0003_coordinates_micro_degrees'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ride',
+            name='payment_reference',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(fields=['payment_status', 'completed_at'], name='ride_payment_due_idx'),
+        ),
+    ]
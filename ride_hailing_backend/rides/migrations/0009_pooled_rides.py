@@ -0,0 +1,66 @@
+# Generated by Django 5.2.1 on 2026-10-19 13:44
+
+import django.db.models.deletion
+import ride_hailing_backend.fields
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0008_ride_payment_reference'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ride',
+            name='seats',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='ridecategory',
+            name='is_pooled',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='PoolTrip',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('is_open', models.BooleanField(default=True)),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pool_trips', to='rides.ridecategory')),
+                ('driver', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pool_trips', to='rides.driver')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='ride',
+            name='pool_trip',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='rides', to='rides.pooltrip'),
+        ),
+        migrations.CreateModel(
+            name='RideStop',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('pickup', 'Pickup'), ('dropoff', 'Drop-off')], max_length=10)),
+                ('sequence', models.PositiveSmallIntegerField()),
+                ('latitude', ride_hailing_backend.fields.CoordinateField(max_degrees=90)),
+                ('longitude', ride_hailing_backend.fields.CoordinateField()),
+                ('ride', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stops', to='rides.ride')),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stops', to='rides.pooltrip')),
+            ],
+            options={
+                'ordering': ['trip', 'sequence'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='pooltrip',
+            index=models.Index(fields=['driver', 'is_open'], name='pooltrip_driver_open_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ridestop',
+            index=models.Index(fields=['trip', 'sequence'], name='ridestop_trip_sequence_idx'),
+        ),
+    ]
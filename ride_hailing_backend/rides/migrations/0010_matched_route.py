@@ -0,0 +1,25 @@
+# Generated by Django 5.2.1 on 2026-10-19 13:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0009_pooled_rides'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MatchedRoute',
+            fields=[
+                ('ride', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='matched_route', serialize=False, to='rides.ride')),
+                ('distance_km', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('path', models.JSONField(default=list)),
+                ('points_matched', models.PositiveIntegerField(default=0)),
+                ('points_total', models.PositiveIntegerField(default=0)),
+                ('matched_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
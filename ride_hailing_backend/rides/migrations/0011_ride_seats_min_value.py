@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-19 14:16
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0010_matched_route'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ride',
+            name='seats',
+            field=models.PositiveSmallIntegerField(default=1, validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+    ]
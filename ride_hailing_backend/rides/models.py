@@ -1,6 +1,11 @@
-from django.db import models
+from django.core.validators import MinValueValidator
+from django.db import models, transaction
+from django.db.models import F
+from django.dispatch import Signal
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 import uuid
+from ride_hailing_backend.fields import CoordinateField
 from users.models import User, UserLocation, PaymentMethod
 
 
@@ -17,13 +22,21 @@ class Driver(models.Model):
     is_active = models.BooleanField(default=True)
     is_available = models.BooleanField(default=False)
     rating = models.DecimalField(max_digits=3, decimal_places=2, default=0.0)
+    # Denormalized ride counters, maintained by Ride
     total_rides = models.IntegerField(default=0)
-    current_latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
-    current_longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    completed_rides = models.PositiveIntegerField(default=0)
+    current_latitude = CoordinateField(max_degrees=90, null=True, blank=True)
+    current_longitude = CoordinateField(null=True, blank=True)
     last_location_update = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        indexes = [
+            # Bounding-box searches for nearby drivers (see fields.bounding_box)
+            models.Index(fields=['current_latitude', 'current_longitude'], name='driver_position_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.user.full_name} - {self.vehicle_make} {self.vehicle_model}"
 
@@ -37,6 +50,8 @@ class RideCategory(models.Model):
     per_km_rate = models.DecimalField(max_digits=10, decimal_places=2)
     per_minute_rate = models.DecimalField(max_digits=10, decimal_places=2)
     capacity = models.IntegerField(default=4)
+    # Riders of pooled categories share the vehicle (see rides/pooling.py)
+    is_pooled = models.BooleanField(default=False)
     image = models.ImageField(upload_to='ride_categories/', null=True, blank=True)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -50,6 +65,11 @@ class RideCategory(models.Model):
         verbose_name_plural = _('ride categories')
 
 
+# Sent inside the transaction that creates a ride or moves it to accepted,
+# completed or cancelled, with the ride and the event name
+ride_status_changed = Signal()
+
+
 class Ride(models.Model):
     """Model representing a ride in the system"""
     STATUS_CHOICES = (
@@ -72,13 +92,18 @@ class Ride(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='rides')
     driver = models.ForeignKey(Driver, on_delete=models.SET_NULL, null=True, blank=True, related_name='rides')
     category = models.ForeignKey(RideCategory, on_delete=models.CASCADE, related_name='rides')
+    # Pooled rides: the shared trip carrying this rider and the seats they take
+    pool_trip = models.ForeignKey(
+        'PoolTrip', on_delete=models.SET_NULL, null=True, blank=True, related_name='rides'
+    )
+    seats = models.PositiveSmallIntegerField(default=1, validators=[MinValueValidator(1)])
     
     # Pickup and destination details
-    pickup_latitude = models.DecimalField(max_digits=9, decimal_places=6)
-    pickup_longitude = models.DecimalField(max_digits=9, decimal_places=6)
+    pickup_latitude = CoordinateField(max_degrees=90)
+    pickup_longitude = CoordinateField()
     pickup_address = models.CharField(max_length=255)
-    destination_latitude = models.DecimalField(max_digits=9, decimal_places=6)
-    destination_longitude = models.DecimalField(max_digits=9, decimal_places=6)
+    destination_latitude = CoordinateField(max_degrees=90)
+    destination_longitude = CoordinateField()
     destination_address = models.CharField(max_length=255)
     
     # Distance and duration estimates
@@ -93,6 +118,8 @@ class Ride(models.Model):
     # Payment details
     payment_method = models.ForeignKey(PaymentMethod, on_delete=models.SET_NULL, null=True, blank=True)
     payment_status = models.CharField(max_length=20, choices=PAYMENT_STATUS_CHOICES, default='pending')
+    # The gateway's charge id, set when the ride is settled (see rides/payments.py)
+    payment_reference = models.CharField(max_length=100, null=True, blank=True)
     base_fare = models.DecimalField(max_digits=10, decimal_places=2)
     distance_fare = models.DecimalField(max_digits=10, decimal_places=2)
     time_fare = models.DecimalField(max_digits=10, decimal_places=2)
@@ -119,21 +146,201 @@ class Ride(models.Model):
     
     class Meta:
         ordering = ['-requested_at']
+        indexes = [
+            models.Index(fields=['-requested_at'], name='ride_requested_at_idx'),
+            models.Index(fields=['driver', 'completed_at'], name='ride_driver_completed_idx'),
+            models.Index(fields=['payment_status', 'completed_at'], name='ride_payment_due_idx'),
+        ]
     
     def __str__(self):
         return f"Ride {self.id} - {self.status}"
+    
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+            if adding:
+                # Keep the rider's and driver's counters in step with new rides
+                completed = 1 if self.status == 'completed' else 0
+                User.objects.filter(pk=self.user_id).update(
+                    total_rides=F('total_rides') + 1,
+                    completed_rides=F('completed_rides') + completed
+                )
+                if self.driver_id:
+                    Driver.objects.filter(pk=self.driver_id).update(
+                        total_rides=F('total_rides') + 1,
+                        completed_rides=F('completed_rides') + completed
+                    )
+                ride_status_changed.send(sender=Ride, ride=self, event='created')
+    
+    def assign_driver(self, driver):
+        """
+        Accept a requested ride for a driver and count it towards the driver's rides.
+        Returns False if the ride is no longer waiting for a driver.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            updated = Ride.objects.filter(pk=self.pk, status='requested').update(
+                driver=driver, status='accepted', accepted_at=now
+            )
+            if not updated:
+                return False
+            Driver.objects.filter(pk=driver.pk).update(total_rides=F('total_rides') + 1)
+            self.driver = driver
+            self.status = 'accepted'
+            self.accepted_at = now
+            ride_status_changed.send(sender=Ride, ride=self, event='accepted')
+        return True
+    
+    def complete(self, actual_distance_km=None, actual_duration_minutes=None):
+        """
+        Mark the ride completed and update the rider's and driver's completed counters.
+        Returns False if the ride was already completed or cancelled.
+        """
+        now = timezone.now()
+        fields = {
+            'status': 'completed',
+            'completed_at': now,
+            'actual_distance_km': actual_distance_km,
+            'actual_duration_minutes': actual_duration_minutes,
+        }
+        with transaction.atomic():
+            # The conditional UPDATE makes concurrent completions count once
+            updated = Ride.objects.filter(pk=self.pk).exclude(
+                status__in=['completed', 'cancelled']
+            ).update(**fields)
+            if not updated:
+                return False
+            User.objects.filter(pk=self.user_id).update(completed_rides=F('completed_rides') + 1)
+            if self.driver_id:
+                Driver.objects.filter(pk=self.driver_id).update(completed_rides=F('completed_rides') + 1)
+            for name, value in fields.items():
+                setattr(self, name, value)
+            ride_status_changed.send(sender=Ride, ride=self, event='completed')
+        return True
+    
+    def cancel(self, cancelled_by, reason=None):
+        """
+        Cancel a ride that has not started yet.
+        Returns False if the ride is already under way, finished or cancelled.
+        """
+        fields = {
+            'status': 'cancelled',
+            'cancelled_at': timezone.now(),
+            'cancelled_by': cancelled_by,
+            'cancellation_reason': reason,
+        }
+        with transaction.atomic():
+            updated = Ride.objects.filter(pk=self.pk, status__in=['requested', 'accepted']).update(**fields)
+            if not updated:
+                return False
+            for name, value in fields.items():
+                setattr(self, name, value)
+            ride_status_changed.send(sender=Ride, ride=self, event='cancelled')
+        return True
+
+
+class PoolTrip(models.Model):
+    """A driver's route shared by the pooled rides inserted into it, as ordered stops"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    driver = models.ForeignKey(Driver, on_delete=models.CASCADE, related_name='pool_trips')
+    category = models.ForeignKey(RideCategory, on_delete=models.CASCADE, related_name='pool_trips')
+    # Open while the trip has riders to pick up or drop off
+    is_open = models.BooleanField(default=True)
+    # Bumped by every insertion, so a route is only changed by whoever planned on its latest version
+    version = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            # Open trips near a pickup are found through their drivers (see rides/pooling.py)
+            models.Index(fields=['driver', 'is_open'], name='pooltrip_driver_open_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Pool trip {self.id}"
+
+
+class RideStop(models.Model):
+    """A pickup or drop-off of a pooled ride on its trip's route"""
+    KIND_CHOICES = (
+        ('pickup', 'Pickup'),
+        ('dropoff', 'Drop-off'),
+    )
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    trip = models.ForeignKey(PoolTrip, on_delete=models.CASCADE, related_name='stops')
+    ride = models.ForeignKey(Ride, on_delete=models.CASCADE, related_name='stops')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    # Position on the route; stops are renumbered when rides are inserted
+    sequence = models.PositiveSmallIntegerField()
+    latitude = CoordinateField(max_degrees=90)
+    longitude = CoordinateField()
+    
+    class Meta:
+        ordering = ['trip', 'sequence']
+        indexes = [
+            models.Index(fields=['trip', 'sequence'], name='ridestop_trip_sequence_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_kind_display()} of ride {self.ride_id} (stop {self.sequence})"
 
 
 class RideLocation(models.Model):
     """Model to store ride location updates during the journey"""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     ride = models.ForeignKey(Ride, on_delete=models.CASCADE, related_name='location_updates')
-    latitude = models.DecimalField(max_digits=9, decimal_places=6)
-    longitude = models.DecimalField(max_digits=9, decimal_places=6)
+    latitude = CoordinateField(max_degrees=90)
+    longitude = CoordinateField()
     timestamp = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['ride', 'timestamp'], name='ridelocation_ride_ts_idx'),
+            models.Index(fields=['timestamp'], name='ridelocation_timestamp_idx'),
+        ]
     
     def __str__(self):
-        return f"Location update for ride {self.ride.id} at {self.timestamp}"
+        # ride_id avoids loading the ride just to print its id
+        return f"Location update for ride {self.ride_id} at {self.timestamp}"
+
+
+class MatchedRoute(models.Model):
+    """A completed ride's GPS trace snapped onto the road graph (see rides/map_matching.py)"""
+    ride = models.OneToOneField(Ride, on_delete=models.CASCADE, primary_key=True, related_name='matched_route')
+    distance_km = models.DecimalField(max_digits=10, decimal_places=3)
+    # [latitude, longitude] pairs along the roads driven
+    path = models.JSONField(default=list)
+    points_matched = models.PositiveIntegerField(default=0)
+    points_total = models.PositiveIntegerField(default=0)
+    matched_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Matched route of ride {self.ride_id}"
+
+
+class IdempotencyKey(models.Model):
+    """Stored response of a POST made with an Idempotency-Key header"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    path = models.CharField(max_length=255)
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    # Null while the first request with this key is still being handled
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    response_body = models.BinaryField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        verbose_name = _('idempotency key')
+        verbose_name_plural = _('idempotency keys')
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'path', 'key'], name='idempotency_key_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.key} ({self.path})"
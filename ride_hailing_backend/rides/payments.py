@@ -0,0 +1,302 @@
+"""
+Ride payment settlement.
+
+Completing a ride only queues a settle_ride_payments job (see rides/tasks.py);
+the jobs worker later charges the queued rides in batches, so no gateway
+round-trip sits on the driver's request. Charges of a batch run concurrently
+on a process-wide pool of PAYMENTS['CONCURRENCY'] threads, which bounds the
+calls in flight against the gateway however many batches run at once. Only
+the pool threads talk to the gateway; all database reads and writes stay on
+the calling thread, which records the outcomes with a few bulk UPDATEs.
+
+Every charge and refund carries an idempotency key derived from the ride, so
+retried batches (delivery is at-least-once) never charge a rider twice.
+
+There is no default gateway outside DEBUG and tests: until PAYMENTS['GATEWAY']
+is set, card and wallet rides stay pending with a warning, and
+settle_payments charges them once it is.
+"""
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .metrics import PAYMENTS_SETTLED, PAYMENTS_REFUNDED
+from .models import Ride
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Dotted path of the PaymentGateway class and its keyword arguments
+    'GATEWAY': None,
+    'GATEWAY_OPTIONS': {},
+    'CURRENCY': 'NGN',
+    # Gateway calls in flight per process
+    'CONCURRENCY': 8,
+    # Rides charged per settlement job
+    'BATCH_SIZE': 200,
+    # Attempts before a ride whose charge keeps erroring is marked failed
+    'MAX_ATTEMPTS': 5,
+    # Retry delay in seconds, doubled after every attempt
+    'RETRY_BACKOFF': 30,
+    'MAX_BACKOFF': 3600,
+}
+
+# Gateway outcomes
+SUCCEEDED = 'succeeded'
+DECLINED = 'declined'
+RETRY = 'retry'
+
+# Rides paid this way were collected by the driver and never reach the gateway
+OFFLINE_PAYMENT_TYPES = (None, 'cash')
+
+
+def get_payments_setting(name):
+    return getattr(settings, 'PAYMENTS', {}).get(name, DEFAULTS[name])
+
+
+def retry_delay(attempt):
+    return min(get_payments_setting('RETRY_BACKOFF') * 2 ** (attempt - 1), get_payments_setting('MAX_BACKOFF'))
+
+
+class GatewayError(Exception):
+    """
+    A gateway call that may succeed when retried: timeouts, 5xx responses, rate limits.
+    """
+
+
+class Charge:
+    __slots__ = ('ride_id', 'amount', 'currency', 'payment_method_id', 'payment_type', 'idempotency_key')
+
+    def __init__(self, ride_id, amount, currency, payment_method_id, payment_type):
+        self.ride_id = ride_id
+        self.amount = amount
+        self.currency = currency
+        self.payment_method_id = payment_method_id
+        self.payment_type = payment_type
+        self.idempotency_key = f"charge:{ride_id}"
+
+
+class Refund:
+    __slots__ = ('ride_id', 'reference', 'amount', 'currency', 'idempotency_key')
+
+    def __init__(self, ride_id, reference, amount, currency):
+        self.ride_id = ride_id
+        self.reference = reference
+        self.amount = amount
+        self.currency = currency
+        self.idempotency_key = f"refund:{ride_id}"
+
+
+class GatewayResult:
+    __slots__ = ('outcome', 'reference', 'error')
+
+    def __init__(self, outcome, reference=None, error=None):
+        self.outcome = outcome
+        self.reference = reference
+        self.error = error
+
+
+class PaymentGateway:
+    """
+    Interface of payment providers.
+
+    Both methods are called from several threads at once and must return a
+    GatewayResult (SUCCEEDED with the provider's reference, or DECLINED with
+    the reason) or raise GatewayError when the call should be retried. A
+    repeated idempotency_key must return the outcome of the first call.
+    """
+
+    def charge(self, charge):
+        raise NotImplementedError
+
+    def refund(self, refund):
+        raise NotImplementedError
+
+
+class StubGateway(PaymentGateway):
+    """
+    In-process gateway for development, tests and benchmarks.
+
+    Each call sleeps for `latency` seconds like a network round-trip. Charges
+    for payment types in decline_types are declined, and every fail_every-th
+    call raises GatewayError.
+    """
+
+    def __init__(self, latency=0.0, decline_types=(), fail_every=0):
+        self.latency = latency
+        self.decline_types = set(decline_types)
+        self.fail_every = fail_every
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.charges = {}
+        self.refunds = {}
+
+    def charge(self, charge):
+        self._round_trip()
+        if charge.payment_type in self.decline_types:
+            return GatewayResult(DECLINED, error='declined by issuer')
+        with self.lock:
+            reference = self.charges.setdefault(charge.idempotency_key, f"ch_{uuid.uuid4().hex[:24]}")
+        return GatewayResult(SUCCEEDED, reference)
+
+    def refund(self, refund):
+        self._round_trip()
+        with self.lock:
+            reference = self.refunds.setdefault(refund.idempotency_key, f"re_{uuid.uuid4().hex[:24]}")
+        return GatewayResult(SUCCEEDED, reference)
+
+    def _round_trip(self):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.calls += 1
+            calls = self.calls
+        if self.fail_every and calls % self.fail_every == 0:
+            raise GatewayError('stub gateway unavailable')
+
+
+_gateway = None
+_pool = None
+_lock = threading.Lock()
+
+
+def get_gateway():
+    """
+    The configured gateway, or None when PAYMENTS['GATEWAY'] is not set.
+    """
+    global _gateway
+    if _gateway is None and get_payments_setting('GATEWAY'):
+        with _lock:
+            if _gateway is None:
+                gateway_class = import_string(get_payments_setting('GATEWAY'))
+                _gateway = gateway_class(**get_payments_setting('GATEWAY_OPTIONS'))
+    return _gateway
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(
+                    max_workers=get_payments_setting('CONCURRENCY'), thread_name_prefix='payments'
+                )
+    return _pool
+
+
+def reset_gateway():
+    """
+    Forget the gateway and the call pool so they are rebuilt from the settings.
+    """
+    global _gateway, _pool
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+        _gateway = None
+        _pool = None
+
+
+def _call(method, request):
+    try:
+        return method(request)
+    except GatewayError as exc:
+        return GatewayResult(RETRY, error=str(exc))
+    except Exception as exc:
+        logger.exception('Payment gateway call for ride %s failed', request.ride_id)
+        return GatewayResult(RETRY, error=repr(exc))
+
+
+def _call_all(method, requests):
+    return list(_get_pool().map(lambda request: _call(method, request), requests))
+
+
+def settle_rides(ride_ids, attempt=1, gateway=None):
+    """
+    Charge the completed, still pending rides among ride_ids and record the outcomes.
+
+    Returns {'paid': n, 'failed': n, 'retry': [ride ids to try again]}.
+    Rides whose charge errored on the last allowed attempt are marked failed.
+    """
+    gateway = gateway or get_gateway()
+    currency = get_payments_setting('CURRENCY')
+    rows = Ride.objects.filter(id__in=ride_ids, status='completed', payment_status='pending').values_list(
+        'id', 'total_fare', 'payment_method_id', 'payment_method__type'
+    )
+    offline, charges = [], []
+    for ride_id, fare, method_id, method_type in rows:
+        if method_type in OFFLINE_PAYMENT_TYPES:
+            offline.append(ride_id)
+        else:
+            charges.append(Charge(ride_id, fare, currency, method_id, method_type))
+    if charges and gateway is None:
+        logger.warning('No payment gateway configured; leaving %d ride(s) pending', len(charges))
+        charges = []
+
+    paid, failed, retry = [], [], []
+    results = _call_all(gateway.charge, charges) if charges else []
+    for charge, result in zip(charges, results):
+        if result.outcome == SUCCEEDED:
+            paid.append(Ride(id=charge.ride_id, payment_status='paid', payment_reference=result.reference))
+        elif result.outcome == DECLINED or attempt >= get_payments_setting('MAX_ATTEMPTS'):
+            logger.warning('Charge for ride %s failed: %s', charge.ride_id, result.error)
+            failed.append(charge.ride_id)
+        else:
+            retry.append(charge.ride_id)
+
+    pending = Ride.objects.filter(payment_status='pending')
+    if offline:
+        pending.filter(id__in=offline).update(payment_status='paid')
+    if paid:
+        # One UPDATE with a CASE per batch; the references differ per ride
+        Ride.objects.bulk_update(paid, ['payment_status', 'payment_reference'], batch_size=500)
+    if failed:
+        pending.filter(id__in=failed).update(payment_status='failed')
+
+    PAYMENTS_SETTLED.inc('paid', amount=len(offline) + len(paid))
+    PAYMENTS_SETTLED.inc('failed', amount=len(failed))
+    PAYMENTS_SETTLED.inc('retry', amount=len(retry))
+    return {'paid': len(offline) + len(paid), 'failed': len(failed), 'retry': [str(ride_id) for ride_id in retry]}
+
+
+def refund_rides(ride_ids, attempt=1, gateway=None):
+    """
+    Refund the paid rides among ride_ids in full.
+
+    Cash rides have nothing to refund through the gateway and are skipped, as
+    are declined refunds, which need a person to look at them. Returns
+    {'refunded': n, 'skipped': n, 'retry': [ride ids to try again]}.
+    """
+    gateway = gateway or get_gateway()
+    currency = get_payments_setting('CURRENCY')
+    rows = list(Ride.objects.filter(id__in=ride_ids, payment_status='paid').values_list(
+        'id', 'total_fare', 'payment_reference'
+    ))
+    refunds = [Refund(ride_id, reference, fare, currency) for ride_id, fare, reference in rows if reference]
+    skipped = len(rows) - len(refunds)
+    if refunds and gateway is None:
+        logger.error('No payment gateway configured; %d refund(s) not sent', len(refunds))
+        skipped += len(refunds)
+        refunds = []
+
+    refunded, retry = [], []
+    results = _call_all(gateway.refund, refunds) if refunds else []
+    for refund, result in zip(refunds, results):
+        if result.outcome == SUCCEEDED:
+            refunded.append(refund.ride_id)
+        elif result.outcome == RETRY and attempt < get_payments_setting('MAX_ATTEMPTS'):
+            retry.append(refund.ride_id)
+        else:
+            logger.error('Refund for ride %s failed: %s', refund.ride_id, result.error)
+            skipped += 1
+
+    if refunded:
+        Ride.objects.filter(id__in=refunded, payment_status='paid').update(payment_status='refunded')
+    PAYMENTS_REFUNDED.inc('refunded', amount=len(refunded))
+    PAYMENTS_REFUNDED.inc('skipped', amount=skipped)
+    return {'refunded': len(refunded), 'skipped': skipped, 'retry': [str(ride_id) for ride_id in retry]}
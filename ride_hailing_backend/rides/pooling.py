@@ -0,0 +1,415 @@
+"""
+Pooled rides.
+
+A ride in a pooled category (RideCategory.is_pooled) can be inserted into
+the route of a trip that is already under way instead of waiting for a
+driver of its own. The first pooled ride a driver accepts opens a PoolTrip
+whose route is the ride's pickup and drop-off (see rides/signals.py); later
+requests are matched by insert_ride():
+
+1. Spatial filter: only open trips of the category whose driver is within
+   SEARCH_RADIUS_KM of the pickup are considered, found with a bounding box
+   on driver_position_idx and cut to the MAX_CANDIDATES nearest.
+2. Insertion heuristic: for each candidate the pickup and drop-off are tried
+   at every pair of positions in the remaining route (O(n^2) for n stops,
+   and n is at most twice the seats), keeping the cheapest pair that fits
+   the seats, the delay it adds to the riders already on the trip and the
+   new rider's own pickup wait and detour. Travel times are straight-line
+   distances * ROAD_FACTOR at SPEED_KMH, measured on a flat projection
+   around the pickup, so no routing service or trigonometry per pair is
+   needed.
+3. The cheapest insertion over all candidates is written, guarded by the
+   trip's version so concurrent matches never interleave their stops.
+
+Fares are split per leg of the route: the seats on board share each leg,
+and a rider pays their share relative to riding alone, never more than
+MAX_FARE_SHARE of the solo fare and never more than they were quoted.
+"""
+import math
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max, Q
+from django.utils import timezone
+
+from ride_hailing_backend.fields import bounding_box
+from .gps import distance_m
+from .metrics import POOL_INSERTIONS
+from .models import Driver, PoolTrip, Ride, RideStop
+
+
+DEFAULTS = {
+    'ENABLED': True,
+    # Only trips whose driver is this close to the pickup are considered
+    'SEARCH_RADIUS_KM': 3,
+    'MAX_CANDIDATES': 50,
+    # Travel time estimates: straight-line distance * ROAD_FACTOR at SPEED_KMH
+    'SPEED_KMH': 25,
+    'ROAD_FACTOR': 1.3,
+    # Longest a new rider may wait for the pickup
+    'MAX_PICKUP_MINUTES': 10,
+    # Most an insertion may delay any stop already on the route
+    'MAX_DELAY_MINUTES': 8,
+    # A new rider's time in the vehicle is at most this times the direct ride
+    'MAX_DETOUR_FACTOR': 1.5,
+    # Pooled riders pay at most this share of the solo distance and time fare
+    'MAX_FARE_SHARE': Decimal('0.75'),
+    # Matches retried when another request changed the chosen trip first
+    'MAX_ATTEMPTS': 3,
+}
+
+WAITING = ('accepted', 'arrived')
+ACTIVE = ('accepted', 'arrived', 'in_progress')
+
+# Outcomes of insert_ride, as counted by POOL_INSERTIONS
+INSERTED = 'inserted'
+UNMATCHED = 'unmatched'
+CONFLICT = 'conflict'
+
+CENTS = Decimal('0.01')
+
+METRES_PER_DEGREE = 6371000.0 * math.pi / 180
+
+
+def get_pooling_setting(name):
+    return getattr(settings, 'POOLING', {}).get(name, DEFAULTS[name])
+
+
+class Insertion:
+    """
+    Where a new rider fits on a trip: the pickup goes right after route[after_pickup]
+    and the drop-off right after route[after_dropoff] of the route before the insertion.
+    """
+    __slots__ = ('trip_id', 'version', 'driver_id', 'after_pickup', 'after_dropoff', 'sequences',
+                 'added_seconds', 'pickup_seconds')
+
+    def __init__(self, trip_id, version, driver_id, after_pickup, after_dropoff, sequences,
+                 added_seconds, pickup_seconds):
+        self.trip_id = trip_id
+        self.version = version
+        self.driver_id = driver_id
+        self.after_pickup = after_pickup
+        self.after_dropoff = after_dropoff
+        self.sequences = sequences
+        self.added_seconds = added_seconds
+        self.pickup_seconds = pickup_seconds
+
+
+class Planner:
+    """
+    Travel time estimates and insertion limits, read from the settings once per match.
+    """
+
+    def __init__(self):
+        self.metres_per_second = get_pooling_setting('SPEED_KMH') / 3.6 / get_pooling_setting('ROAD_FACTOR')
+        self.max_pickup = get_pooling_setting('MAX_PICKUP_MINUTES') * 60
+        self.max_delay = get_pooling_setting('MAX_DELAY_MINUTES') * 60
+        self.detour_factor = get_pooling_setting('MAX_DETOUR_FACTOR')
+
+    def seconds(self, a, b):
+        return distance_m(a[0], a[1], b[0], b[1]) / self.metres_per_second
+
+    def project(self, points, latitude):
+        """
+        Points as (x, y) in seconds of travel on a flat projection around latitude.
+
+        Within the search radius the error against great-circle distances
+        is well under 0.1%.
+        """
+        y_scale = METRES_PER_DEGREE / self.metres_per_second
+        x_scale = y_scale * math.cos(math.radians(latitude))
+        return [(point[1] * x_scale, point[0] * y_scale) for point in points]
+
+    def best_insertion(self, route, onboard, capacity, pickup, dropoff, seats):
+        """
+        Cheapest positions for a new rider on a route, or None when nothing fits.
+
+        route is the vehicle's position followed by the remaining stops, as
+        (latitude, longitude, seats boarding there, negative when alighting),
+        and onboard the seats taken at the vehicle's position. Returns
+        (seconds added to the route, i, j, seconds until the pickup) for the
+        pickup right after route[i] and the drop-off right after route[j].
+        """
+        hypot = math.hypot
+        n = len(route) - 1
+        points = self.project(route, pickup[0])
+        (px, py), (dx, dy) = self.project((pickup, dropoff), pickup[0])
+        legs = [hypot(points[k + 1][0] - points[k][0], points[k + 1][1] - points[k][1]) for k in range(n)]
+        # Travel times are symmetric, so these also serve as times from the pickup and drop-off
+        to_pickup = [hypot(x - px, y - py) for x, y in points]
+        to_dropoff = [hypot(x - dx, y - dy) for x, y in points]
+        from_pickup, from_dropoff = to_pickup, to_dropoff
+        direct = hypot(dx - px, dy - py)
+        max_ride = self.detour_factor * direct
+        # arrival[k]: seconds until the vehicle reaches route[k]; load[k]: seats taken leaving it
+        arrival, load = [0.0], [onboard]
+        for k in range(n):
+            arrival.append(arrival[k] + legs[k])
+            load.append(load[k] + route[k + 1][2])
+        free = capacity - seats
+
+        best = None
+        for i in range(n + 1):
+            if arrival[i] > self.max_pickup:
+                break
+            wait = arrival[i] + to_pickup[i]
+            if load[i] > free or wait > self.max_pickup:
+                continue
+
+            # Pickup and drop-off back to back; every later stop is delayed by the whole detour
+            added = to_pickup[i] + direct + (from_dropoff[i + 1] - legs[i] if i < n else 0)
+            if (i == n or added <= self.max_delay) and (best is None or added < best[0]):
+                best = (added, i, i, wait)
+            if i == n:
+                continue
+
+            # Drop-off after a later stop: stops up to it are delayed by the pickup detour only
+            pickup_detour = to_pickup[i] + from_pickup[i + 1] - legs[i]
+            if pickup_detour > self.max_delay:
+                continue
+            riding = from_pickup[i + 1]
+            for j in range(i + 1, n + 1):
+                if j > i + 1:
+                    riding += legs[j - 1]
+                if load[j] > free or riding > max_ride:
+                    break
+                if riding + to_dropoff[j] > max_ride:
+                    continue
+                added = pickup_detour + to_dropoff[j] + (from_dropoff[j + 1] - legs[j] if j < n else 0)
+                if j < n and added > self.max_delay:
+                    continue
+                if best is None or added < best[0]:
+                    best = (added, i, j, wait)
+        return best
+
+
+def _candidate_routes(ride):
+    """
+    Open trips near the ride's pickup, nearest first, with their remaining routes.
+
+    Yields (trip id, version, driver id, capacity, route, sequences, onboard)
+    where sequences[k] is the RideStop.sequence of route[k]; the vehicle's
+    position counts as the stop just before the first remaining one.
+    """
+    latitude, longitude = ride.pickup_latitude, ride.pickup_longitude
+    radius_km = get_pooling_setting('SEARCH_RADIUS_KM')
+    # Rooted at the drivers so the box is searched on driver_position_idx; the
+    # category is checked here, or the database may scan every trip of it instead
+    trips = Driver.objects.filter(
+        pool_trips__is_open=True, **bounding_box(latitude, longitude, radius_km, prefix='current_'),
+    ).values_list('pool_trips__id', 'pool_trips__version', 'id', 'pool_trips__category_id',
+                  'current_latitude', 'current_longitude')
+    nearby = []
+    for row in trips:
+        if row[3] != ride.category_id:
+            continue
+        distance = distance_m(latitude, longitude, row[4], row[5])
+        # The bounding box is a square; drop its corners
+        if distance <= radius_km * 1000:
+            nearby.append((distance, row))
+    nearby.sort(key=lambda item: item[0])
+    nearby = [row for _, row in nearby[:get_pooling_setting('MAX_CANDIDATES')]]
+    if not nearby:
+        return
+
+    # Stops still ahead: pickups of riders not yet on board and drop-offs of every active rider
+    stops = defaultdict(list)
+    rows = RideStop.objects.filter(trip_id__in=[row[0] for row in nearby]).filter(
+        Q(kind='pickup', ride__status__in=WAITING) | Q(kind='dropoff', ride__status__in=ACTIVE)
+    ).order_by('trip_id', 'sequence').values_list('trip_id', 'ride__status', 'kind', 'sequence', 'latitude',
+                                                  'longitude', 'ride__seats')
+    for row in rows:
+        stops[row[0]].append(row[1:])
+
+    capacity = ride.category.capacity
+    for trip_id, version, driver_id, _, driver_latitude, driver_longitude in nearby:
+        remaining = stops.get(trip_id)
+        if not remaining:
+            continue
+        onboard = 0
+        route = [(driver_latitude, driver_longitude, 0)]
+        sequences = [remaining[0][2] - 1]
+        for status, kind, sequence, stop_latitude, stop_longitude, seats in remaining:
+            if status == 'in_progress':
+                onboard += seats
+            route.append((stop_latitude, stop_longitude, seats if kind == 'pickup' else -seats))
+            sequences.append(sequence)
+        yield trip_id, version, driver_id, capacity, route, sequences, onboard
+
+
+def find_insertion(ride, planner=None):
+    """
+    The cheapest Insertion of a requested pooled ride into a nearby open trip, or None.
+    """
+    planner = planner or Planner()
+    pickup = (ride.pickup_latitude, ride.pickup_longitude)
+    dropoff = (ride.destination_latitude, ride.destination_longitude)
+    best = None
+    for trip_id, version, driver_id, capacity, route, sequences, onboard in _candidate_routes(ride):
+        found = planner.best_insertion(route, onboard, capacity, pickup, dropoff, ride.seats)
+        if found is not None and (best is None or found[0] < best.added_seconds):
+            added, i, j, wait = found
+            best = Insertion(trip_id, version, driver_id, i, j, sequences, added, wait)
+    return best
+
+
+def _apply(ride, insertion):
+    """
+    Write an insertion and assign the trip's driver to the ride. Returns an outcome.
+    """
+    with transaction.atomic():
+        if not Ride.objects.filter(pk=ride.pk, status='requested').update(pool_trip_id=insertion.trip_id):
+            # Cancelled in the meantime
+            return UNMATCHED
+        if not PoolTrip.objects.filter(pk=insertion.trip_id, version=insertion.version, is_open=True).update(
+            version=F('version') + 1, updated_at=timezone.now()
+        ):
+            transaction.set_rollback(True)
+            return CONFLICT
+
+        # Make room in the sequence numbers: one after the pickup's place, two after the drop-off's
+        after_pickup = insertion.sequences[insertion.after_pickup]
+        after_dropoff = insertion.sequences[insertion.after_dropoff]
+        stops = RideStop.objects.filter(trip_id=insertion.trip_id)
+        stops.filter(sequence__gt=after_dropoff).update(sequence=F('sequence') + 2)
+        if after_dropoff > after_pickup:
+            stops.filter(sequence__gt=after_pickup, sequence__lte=after_dropoff).update(sequence=F('sequence') + 1)
+        RideStop.objects.bulk_create([
+            RideStop(trip_id=insertion.trip_id, ride=ride, kind='pickup', sequence=after_pickup + 1,
+                     latitude=ride.pickup_latitude, longitude=ride.pickup_longitude),
+            RideStop(trip_id=insertion.trip_id, ride=ride, kind='dropoff', sequence=after_dropoff + 2,
+                     latitude=ride.destination_latitude, longitude=ride.destination_longitude),
+        ])
+
+        ride.pool_trip_id = insertion.trip_id
+        ride.assign_driver(Driver.objects.select_related('user').get(pk=insertion.driver_id))
+        split_fares(insertion.trip_id)
+    return INSERTED
+
+
+def insert_ride(ride):
+    """
+    Insert a requested pooled ride into the open trip where it adds the least time.
+
+    Returns the Insertion, or None when no trip fits and the ride waits for
+    a driver of its own.
+    """
+    if not get_pooling_setting('ENABLED') or not ride.category.is_pooled:
+        return None
+    planner = Planner()
+    for _ in range(get_pooling_setting('MAX_ATTEMPTS')):
+        insertion = find_insertion(ride, planner)
+        outcome = UNMATCHED if insertion is None else _apply(ride, insertion)
+        POOL_INSERTIONS.inc(outcome)
+        if outcome != CONFLICT:
+            return insertion if outcome == INSERTED else None
+    return None
+
+
+def open_trip(ride):
+    """
+    Start a trip for a pooled ride its driver accepted, or append the ride to
+    the driver's open trip of the category.
+    """
+    with transaction.atomic():
+        trip = PoolTrip.objects.select_for_update().filter(
+            driver_id=ride.driver_id, category_id=ride.category_id, is_open=True
+        ).first()
+        if trip is None:
+            trip = PoolTrip.objects.create(driver_id=ride.driver_id, category_id=ride.category_id)
+            last = -1
+        else:
+            PoolTrip.objects.filter(pk=trip.pk).update(version=F('version') + 1, updated_at=timezone.now())
+            last = trip.stops.aggregate(last=Max('sequence'))['last']
+            last = -1 if last is None else last
+        RideStop.objects.bulk_create([
+            RideStop(trip=trip, ride=ride, kind='pickup', sequence=last + 1,
+                     latitude=ride.pickup_latitude, longitude=ride.pickup_longitude),
+            RideStop(trip=trip, ride=ride, kind='dropoff', sequence=last + 2,
+                     latitude=ride.destination_latitude, longitude=ride.destination_longitude),
+        ])
+        Ride.objects.filter(pk=ride.pk).update(pool_trip=trip)
+        ride.pool_trip = trip
+    return trip
+
+
+def close_trip_if_done(trip_id):
+    """
+    Stop inserting into a trip once none of its rides is active.
+    """
+    version = PoolTrip.objects.filter(pk=trip_id, is_open=True).values_list('version', flat=True).first()
+    if version is None or Ride.objects.filter(pool_trip_id=trip_id, status__in=ACTIVE).exists():
+        return False
+    # A ride inserted since the check bumped the version and keeps the trip open
+    return bool(PoolTrip.objects.filter(pk=trip_id, version=version).update(is_open=False))
+
+
+def fare_shares(stops, seconds):
+    """
+    Each ride's share of the route relative to riding alone, by ride id.
+
+    stops are the trip's (ride id, kind, latitude, longitude, seats) in
+    route order. Every leg is shared by the seats on board, so a rider
+    alone for the whole ride has a share of 1 and sharing lowers it.
+    """
+    shared = defaultdict(float)
+    boarded = {}
+    on_board = {}
+    for stop, next_stop in zip(stops, stops[1:] + [None]):
+        ride_id, kind, latitude, longitude, seats = stop
+        if kind == 'pickup':
+            on_board[ride_id] = seats
+            boarded[ride_id] = (latitude, longitude)
+        else:
+            on_board.pop(ride_id, None)
+        if next_stop is None or not on_board:
+            continue
+        taken = sum(on_board.values())
+        if not taken:
+            continue
+        leg = seconds((latitude, longitude), next_stop[2:4])
+        for rider, rider_seats in on_board.items():
+            shared[rider] += leg * rider_seats / taken
+
+    shares = {}
+    for ride_id, kind, latitude, longitude, _ in stops:
+        # A ride that took no seats shared no leg and keeps its quoted fare
+        if kind == 'dropoff' and ride_id in boarded and ride_id in shared:
+            direct = seconds(boarded[ride_id], (latitude, longitude))
+            shares[ride_id] = shared[ride_id] / direct if direct else 1.0
+    return shares
+
+
+def split_fares(trip_id):
+    """
+    Lower the fares of a trip's active rides to their share of the route.
+    """
+    stops = list(RideStop.objects.filter(trip_id=trip_id).exclude(ride__status='cancelled').order_by(
+        'sequence'
+    ).values_list('ride_id', 'kind', 'latitude', 'longitude', 'ride__seats'))
+    shares = fare_shares(stops, Planner().seconds)
+    max_share = Decimal(get_pooling_setting('MAX_FARE_SHARE'))
+
+    rides = Ride.objects.filter(pool_trip_id=trip_id, status__in=ACTIVE).select_related('category')
+    changed = []
+    for ride in rides:
+        if ride.id not in shares:
+            continue
+        share = min(Decimal(f"{shares[ride.id]:.4f}"), max_share)
+        category = ride.category
+        distance_fare = min(
+            ride.distance_fare, (category.per_km_rate * ride.estimated_distance_km * share).quantize(CENTS)
+        )
+        time_fare = min(
+            ride.time_fare, (category.per_minute_rate * ride.estimated_duration_minutes * share).quantize(CENTS)
+        )
+        if (distance_fare, time_fare) == (ride.distance_fare, ride.time_fare):
+            continue
+        ride.distance_fare = distance_fare
+        ride.time_fare = time_fare
+        ride.total_fare = ((ride.base_fare + distance_fare + time_fare) * ride.surge_multiplier).quantize(CENTS)
+        changed.append(ride)
+    Ride.objects.bulk_update(changed, ['distance_fare', 'time_fare', 'total_fare'])
+    return changed
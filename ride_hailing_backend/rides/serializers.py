@@ -1,9 +1,23 @@
+import math
+from decimal import Decimal
 from rest_framework import serializers
 from django.db.models import Avg
 from .models import Driver, RideCategory, Ride, RideLocation
+from .pooling import get_pooling_setting
 from users.serializers import UserProfileSerializer, PaymentMethodSerializer, UserLocationSerializer
 
 
+class FiniteFloatField(serializers.FloatField):
+    """FloatField that rejects nan and inf, which slip past min_value and max_value"""
+    default_error_messages = {'not_finite': 'A finite number is required.'}
+    
+    def to_internal_value(self, data):
+        value = super().to_internal_value(data)
+        if not math.isfinite(value):
+            self.fail('not_finite')
+        return value
+
+
 class DriverSerializer(serializers.ModelSerializer):
     user = UserProfileSerializer(read_only=True)
     rating = serializers.DecimalField(max_digits=3, decimal_places=2, read_only=True)
@@ -13,9 +27,9 @@ class DriverSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'user', 'vehicle_make', 'vehicle_model', 'vehicle_year',
             'vehicle_color', 'vehicle_license_plate', 'is_available',
-            'rating', 'total_rides', 'current_latitude', 'current_longitude'
+            'rating', 'total_rides', 'completed_rides', 'current_latitude', 'current_longitude'
         ]
-        read_only_fields = ['id', 'rating', 'total_rides']
+        read_only_fields = ['id', 'rating', 'total_rides', 'completed_rides']
 
 
 class RideCategorySerializer(serializers.ModelSerializer):
@@ -37,6 +51,7 @@ class RideSerializer(serializers.ModelSerializer):
     category = RideCategorySerializer(read_only=True)
     payment_method = PaymentMethodSerializer(read_only=True)
     location_updates = RideLocationSerializer(many=True, read_only=True)
+    route = serializers.SerializerMethodField()
     
     class Meta:
         model = Ride
@@ -44,8 +59,26 @@ class RideSerializer(serializers.ModelSerializer):
         read_only_fields = [
             'id', 'user', 'driver', 'status', 'accepted_at', 'driver_arrived_at',
             'started_at', 'completed_at', 'cancelled_at', 'cancelled_by',
-            'actual_distance_km', 'actual_duration_minutes', 'payment_status'
+            'actual_distance_km', 'actual_duration_minutes', 'payment_status', 'pool_trip'
         ]
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Every stored GPS point is only sent when asked for with ?trace=full
+        if not self.context.get('full_trace'):
+            self.fields.pop('location_updates')
+        # The simplified route only where the view asked for one (see RideViewSet.get_serializer_context)
+        if 'route_options' not in self.context:
+            self.fields.pop('route')
+    
+    def get_route(self, obj):
+        """
+        The GPS trace simplified for the client's map (see rides/traces.py).
+        """
+        # Imported here so NumPy is only loaded once a ride is serialized
+        from .traces import ride_route
+        
+        return ride_route(obj, **self.context['route_options'])
 
 
 class RideRequestSerializer(serializers.ModelSerializer):
@@ -58,8 +91,13 @@ class RideRequestSerializer(serializers.ModelSerializer):
             'category_id', 'payment_method_id',
             'pickup_latitude', 'pickup_longitude', 'pickup_address',
             'destination_latitude', 'destination_longitude', 'destination_address',
-            'estimated_distance_km', 'estimated_duration_minutes'
+            'estimated_distance_km', 'estimated_duration_minutes', 'seats'
         ]
+        # Filled in from the coordinates when left out (see rides/signals.py)
+        extra_kwargs = {
+            'pickup_address': {'required': False, 'allow_blank': True},
+            'destination_address': {'required': False, 'allow_blank': True},
+        }
     
     def create(self, validated_data):
         user = self.context['request'].user
@@ -71,14 +109,21 @@ class RideRequestSerializer(serializers.ModelSerializer):
             category = RideCategory.objects.get(id=category_id)
         except RideCategory.DoesNotExist:
             raise serializers.ValidationError({"category_id": "Invalid ride category"})
+        if validated_data.get('seats', 1) > category.capacity:
+            raise serializers.ValidationError({"seats": f"This category seats at most {category.capacity}"})
         
         # Calculate fare
         base_fare = category.base_fare
         distance_fare = category.per_km_rate * validated_data['estimated_distance_km']
         time_fare = category.per_minute_rate * validated_data['estimated_duration_minutes']
+        if category.is_pooled:
+            # The most a pooled rider pays; sharing the ride lowers it (see rides/pooling.py)
+            share = Decimal(get_pooling_setting('MAX_FARE_SHARE'))
+            distance_fare = (distance_fare * share).quantize(Decimal('0.01'))
+            time_fare = (time_fare * share).quantize(Decimal('0.01'))
         
         # TODO: Implement surge pricing logic if needed
-        surge_multiplier = 1.0
+        surge_multiplier = Decimal('1.0')
         
         total_fare = (base_fare + distance_fare + time_fare) * surge_multiplier
         
@@ -119,11 +164,30 @@ class RideFeedbackSerializer(serializers.ModelSerializer):
         return value
 
 
+class DriverHeartbeatSerializer(serializers.Serializer):
+    """Serializer for driver app heartbeats"""
+    latitude = FiniteFloatField(min_value=-90, max_value=90, required=False)
+    longitude = FiniteFloatField(min_value=-180, max_value=180, required=False)
+    is_available = serializers.BooleanField(default=True)
+    
+    def validate(self, data):
+        if ('latitude' in data) != ('longitude' in data):
+            raise serializers.ValidationError("Latitude and longitude must be sent together")
+        return data
+
+
+class PickupPointSerializer(serializers.Serializer):
+    """Serializer for the position a client sends with home page requests"""
+    latitude = FiniteFloatField(min_value=-90, max_value=90)
+    longitude = FiniteFloatField(min_value=-180, max_value=180)
+
+
 class HomePageDataSerializer(serializers.Serializer):
     """Serializer for home page data"""
     user = UserProfileSerializer()
     saved_locations = UserLocationSerializer(many=True)
     nearby_drivers_count = serializers.IntegerField()
+    pickup_eta_minutes = serializers.IntegerField(allow_null=True)
     categories = RideCategorySerializer(many=True)
     recent_rides = RideSerializer(many=True)
     promotions = serializers.ListField(child=serializers.DictField())
@@ -0,0 +1,51 @@
+from django.db.models.signals import pre_save
+from django.dispatch import receiver
+from .models import Ride, ride_status_changed
+from .tasks import match_ride_routes, settle_ride_payments
+
+
+@receiver(pre_save, sender=Ride)
+def fill_ride_addresses(sender, instance, **kwargs):
+    """
+    Describe pickup and destination from their coordinates when the client sent no address.
+    """
+    # Imported here so workers only load the geocoder and NumPy once rides are saved
+    from ride_hailing_backend.geocoder import fill_address
+
+    instance.pickup_address = fill_address(instance.pickup_address, instance.pickup_latitude, instance.pickup_longitude)
+    instance.destination_address = fill_address(
+        instance.destination_address, instance.destination_latitude, instance.destination_longitude
+    )
+
+
+@receiver(ride_status_changed, sender=Ride)
+def queue_payment_settlement(sender, ride, event, **kwargs):
+    """
+    Queue the charge for a completed ride; the jobs worker settles it in a later batch.
+    """
+    if event == 'completed':
+        settle_ride_payments.enqueue({'ride_id': str(ride.id)})
+
+
+@receiver(ride_status_changed, sender=Ride)
+def update_pool_trip(sender, ride, event, **kwargs):
+    """
+    Open a trip when a driver accepts a pooled ride and close it once its last ride is over.
+    """
+    from .pooling import close_trip_if_done, open_trip
+
+    if event == 'accepted' and ride.pool_trip_id is None and ride.category.is_pooled:
+        open_trip(ride)
+    elif event in ('completed', 'cancelled') and ride.pool_trip_id:
+        close_trip_if_done(ride.pool_trip_id)
+
+
+@receiver(ride_status_changed, sender=Ride)
+def queue_route_matching(sender, ride, event, **kwargs):
+    """
+    Queue map matching of a completed ride's GPS trace.
+    """
+    from .map_matching import get_matching_setting
+
+    if event == 'completed' and get_matching_setting('ENABLED'):
+        match_ride_routes.enqueue({'ride_id': str(ride.id)})
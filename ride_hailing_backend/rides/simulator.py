@@ -0,0 +1,314 @@
+"""
+Offline dispatch simulation.
+
+Historical ride requests are replayed against a synthetic driver fleet on a
+priority-queue event loop. The assignment and pricing policy is a callable
+``policy(request, simulation)`` returning ``(driver_index, fare)``; a
+``driver_index`` of None leaves the request waiting until a driver frees up
+or the rider gives up. Driver state lives in NumPy arrays so policies can
+scan the whole fleet in one vectorized pass.
+"""
+import heapq
+import math
+import time
+
+import numpy as np
+from django.db.models import F
+
+from .eta import EARTH_RADIUS_M, get_eta_setting, get_speed_table, hours_of_week
+from .models import Ride
+
+
+# Event kinds, in the order simultaneous events are handled: freed drivers
+# are available to requests arriving at the same moment
+DROPOFF, SHIFT_START, SHIFT_END, REQUEST, ABANDON = range(5)
+
+# Request outcomes
+PENDING, COMPLETED, ABANDONED, DECLINED = range(4)
+
+# Waiting requests, nearest first, offered to each driver who frees up
+MAX_RETRIES = 5
+
+
+class Demand:
+    """
+    Ride requests as column arrays, ordered by request time (epoch seconds).
+    """
+
+    def __init__(self, requested_at, pickup, destination, category, duration_s, standard_fare):
+        order = np.argsort(requested_at, kind='stable')
+        self.requested_at = np.asarray(requested_at, dtype=np.float64)[order]
+        self.pickup = np.asarray(pickup, dtype=np.float64).reshape(-1, 2)[order]
+        self.destination = np.asarray(destination, dtype=np.float64).reshape(-1, 2)[order]
+        self.category = np.asarray(category, dtype=object)[order]
+        self.duration_s = np.asarray(duration_s, dtype=np.float64)[order]
+        self.standard_fare = np.asarray(standard_fare, dtype=np.float64)[order]
+
+    def __len__(self):
+        return len(self.requested_at)
+
+    @classmethod
+    def from_rides(cls, start, end):
+        """
+        Load the rides requested in [start, end), whatever became of them.
+        """
+        rows = list(Ride.objects.filter(requested_at__gte=start, requested_at__lt=end).values_list(
+            'requested_at', 'pickup_latitude', 'pickup_longitude', 'destination_latitude',
+            'destination_longitude', F('category__name'), 'estimated_duration_minutes',
+            F('category__base_fare'), F('category__per_km_rate'), F('category__per_minute_rate'),
+            'estimated_distance_km',
+        ).iterator(chunk_size=5000))
+        return cls(
+            [row[0].timestamp() for row in rows],
+            [(float(row[1]), float(row[2])) for row in rows],
+            [(float(row[3]), float(row[4])) for row in rows],
+            [row[5] for row in rows],
+            [row[6] * 60 for row in rows],
+            # The fare the ride would have had without surge
+            [float(row[7] + row[8] * row[10] + row[9] * row[6]) for row in rows],
+        )
+
+
+class Fleet:
+    """
+    Driver state as parallel arrays indexed by driver.
+    """
+
+    def __init__(self, positions, shift_start, shift_end):
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        self.latitude = positions[:, 0].copy()
+        self.longitude = positions[:, 1].copy()
+        self.shift_start = np.asarray(shift_start, dtype=np.float64)
+        self.shift_end = np.asarray(shift_end, dtype=np.float64)
+        self.online = np.zeros(len(positions), dtype=bool)
+        self.busy = np.zeros(len(positions), dtype=bool)
+        self.available = np.zeros(len(positions), dtype=bool)
+        self.busy_seconds = np.zeros(len(positions), dtype=np.float64)
+        self.trips = np.zeros(len(positions), dtype=np.int64)
+
+    def __len__(self):
+        return len(self.latitude)
+
+    @classmethod
+    def synthetic(cls, demand, size, shift_hours=8, jitter_deg=0.01, seed=None):
+        """
+        A fleet placed where riders ask for rides, on shifts spread over the demand window.
+        """
+        rng = np.random.default_rng(seed)
+        start, end = demand.requested_at[0], demand.requested_at[-1]
+        homes = demand.pickup[rng.integers(0, len(demand), size)]
+        positions = homes + rng.normal(scale=jitter_deg, size=(size, 2))
+        shift = shift_hours * 3600
+        shift_start = rng.uniform(start - shift / 2, max(end - shift / 2, start), size)
+        return cls(positions, shift_start, shift_start + shift)
+
+    def nearest_available(self, latitude, longitude, max_km=None):
+        """
+        Index and straight-line distance in meters of the closest free driver, or (None, None).
+        """
+        # Squared equirectangular distances in degrees over the whole fleet;
+        # cheaper than gathering the free drivers first
+        d_lat = self.latitude - latitude
+        d_lon = (self.longitude - longitude) * math.cos(math.radians(latitude))
+        squared = np.where(self.available, d_lat * d_lat + d_lon * d_lon, np.inf)
+        best = int(squared.argmin())
+        distance = math.sqrt(squared[best]) * math.pi / 180 * EARTH_RADIUS_M
+        if math.isinf(distance) or (max_km is not None and distance > max_km * 1000):
+            return None, None
+        return best, distance
+
+
+class RideRequest:
+    __slots__ = ('index', 'requested_at', 'latitude', 'longitude', 'category', 'duration_s', 'standard_fare')
+
+    def __init__(self, demand, index):
+        self.index = index
+        self.requested_at = demand.requested_at[index]
+        self.latitude, self.longitude = demand.pickup[index]
+        self.category = demand.category[index]
+        self.duration_s = demand.duration_s[index]
+        self.standard_fare = demand.standard_fare[index]
+
+
+def nearest_driver_policy(request, simulation):
+    """
+    Closest free driver within 5 km at the standard fare.
+    """
+    driver, _ = simulation.fleet.nearest_available(request.latitude, request.longitude, max_km=5)
+    return driver, request.standard_fare
+
+
+def surge_policy(request, simulation):
+    """
+    Closest free driver, with the fare raised by up to 2x when waiting riders outnumber free drivers.
+    """
+    driver, _ = simulation.fleet.nearest_available(request.latitude, request.longitude, max_km=5)
+    free = int(simulation.fleet.available.sum())
+    multiplier = min(2.0, max(1.0, (simulation.waiting + 1) / max(free, 1)))
+    return driver, request.standard_fare * multiplier
+
+
+class Simulation:
+    """
+    Replay a Demand against a Fleet under a policy.
+
+    Riders leave after waiting ``patience`` seconds for an assignment. With
+    ``price_elasticity`` above 0, a rider quoted m times the standard fare
+    books with probability exp(-price_elasticity * (m - 1)).
+    """
+
+    def __init__(self, demand, fleet, policy, patience=600, price_elasticity=0.0, speed_table=None, seed=None):
+        self.demand = demand
+        self.fleet = fleet
+        self.policy = policy
+        self.patience = patience
+        self.price_elasticity = price_elasticity
+        self.speed_table = speed_table or get_speed_table()
+        self.road_factor = get_eta_setting('ROAD_FACTOR')
+        self.rng = np.random.default_rng(seed)
+
+        self.now = 0.0
+        self.status = np.full(len(demand), PENDING, dtype=np.int8)
+        self.wait_s = np.full(len(demand), np.nan)
+        self.fare = np.zeros(len(demand))
+        self.pending = []
+        self.waiting = 0
+        self.policy_calls = 0
+        self.policy_seconds = 0.0
+        self.events = 0
+        self._queue = []
+        self._sequence = 0
+
+    def schedule(self, at, kind, index):
+        self._sequence += 1
+        heapq.heappush(self._queue, (at, kind, self._sequence, index))
+
+    def travel_seconds(self, from_latitude, from_longitude, to_latitude, to_longitude):
+        d_lat = math.radians(to_latitude - from_latitude)
+        d_lon = math.radians(to_longitude - from_longitude) * math.cos(math.radians(from_latitude))
+        distance = math.hypot(d_lat, d_lon) * EARTH_RADIUS_M * self.road_factor
+        hour = int(hours_of_week(self.now, self.speed_table.utc_offset_hours))
+        speeds = self.speed_table.lookup([from_latitude, to_latitude], [from_longitude, to_longitude], hour)
+        return distance / 2 / speeds[0] + distance / 2 / speeds[1]
+
+    def run(self):
+        started = time.perf_counter()
+        for index, at in enumerate(self.demand.requested_at):
+            self.schedule(at, REQUEST, index)
+        for driver in range(len(self.fleet)):
+            self.schedule(self.fleet.shift_start[driver], SHIFT_START, driver)
+            self.schedule(self.fleet.shift_end[driver], SHIFT_END, driver)
+
+        handlers = {
+            DROPOFF: self._dropoff, SHIFT_START: self._shift_start, SHIFT_END: self._shift_end,
+            REQUEST: self._request, ABANDON: self._abandon,
+        }
+        while self._queue:
+            self.now, kind, _, index = heapq.heappop(self._queue)
+            self.events += 1
+            handlers[kind](index)
+        return self.report(time.perf_counter() - started)
+
+    def _offer(self, index):
+        request = RideRequest(self.demand, index)
+        started = time.process_time()
+        driver, fare = self.policy(request, self)
+        self.policy_seconds += time.process_time() - started
+        self.policy_calls += 1
+        if driver is None:
+            return False
+        if not self.fleet.available[driver]:
+            raise ValueError(f"Policy assigned driver {driver}, who is not available")
+
+        if self.price_elasticity and fare > request.standard_fare:
+            accept = math.exp(-self.price_elasticity * (fare / request.standard_fare - 1))
+            if self.rng.random() >= accept:
+                self.status[index] = DECLINED
+                return True
+
+        fleet = self.fleet
+        pickup_s = self.travel_seconds(fleet.latitude[driver], fleet.longitude[driver], request.latitude, request.longitude)
+        busy_s = pickup_s + request.duration_s
+        fleet.available[driver] = False
+        fleet.busy[driver] = True
+        fleet.busy_seconds[driver] += busy_s
+        fleet.trips[driver] += 1
+        fleet.latitude[driver], fleet.longitude[driver] = self.demand.destination[index]
+        self.status[index] = COMPLETED
+        self.wait_s[index] = self.now - request.requested_at + pickup_s
+        self.fare[index] = fare
+        self.schedule(self.now + busy_s, DROPOFF, driver)
+        return True
+
+    def _serve_waiting(self, driver):
+        """
+        Offer waiting riders to a driver who just became free, nearest first.
+        """
+        if not self.pending or not self.fleet.available[driver]:
+            return
+        waiting = np.fromiter(self.pending, dtype=np.int64, count=len(self.pending))
+        waiting = waiting[self.status[waiting] == PENDING]
+        latitude, longitude = self.fleet.latitude[driver], self.fleet.longitude[driver]
+        d_lat = self.demand.pickup[waiting, 0] - latitude
+        d_lon = (self.demand.pickup[waiting, 1] - longitude) * math.cos(math.radians(latitude))
+        order = np.argsort(d_lat * d_lat + d_lon * d_lon)[:MAX_RETRIES]
+        for index in waiting[order].tolist():
+            if not self.fleet.available[driver]:
+                break
+            if self._offer(index):
+                self.waiting -= 1
+        self.pending = [index for index in waiting.tolist() if self.status[index] == PENDING]
+
+    def _request(self, index):
+        if not self._offer(index):
+            self.pending.append(index)
+            self.waiting += 1
+            self.schedule(self.now + self.patience, ABANDON, index)
+
+    def _abandon(self, index):
+        if self.status[index] == PENDING:
+            self.status[index] = ABANDONED
+            self.waiting -= 1
+
+    def _dropoff(self, driver):
+        self.fleet.busy[driver] = False
+        self.fleet.available[driver] = self.fleet.online[driver]
+        self._serve_waiting(driver)
+
+    def _shift_start(self, driver):
+        self.fleet.online[driver] = True
+        self.fleet.available[driver] = not self.fleet.busy[driver]
+        self._serve_waiting(driver)
+
+    def _shift_end(self, driver):
+        # A driver on a trip finishes it and then stays offline
+        self.fleet.online[driver] = False
+        self.fleet.available[driver] = False
+
+    def report(self, elapsed):
+        demand, fleet = self.demand, self.fleet
+        waits = self.wait_s[self.status == COMPLETED]
+        start, end = (demand.requested_at[0], self.now) if len(demand) else (0.0, 0.0)
+        online_s = np.clip(np.minimum(fleet.shift_end, end) - np.maximum(fleet.shift_start, start), 0, None).sum()
+        percentiles = np.percentile(waits, [50, 90, 99]) if len(waits) else (math.nan,) * 3
+        return {
+            'requests': len(demand),
+            'completed': int((self.status == COMPLETED).sum()),
+            'abandoned': int((self.status == ABANDONED).sum()),
+            'declined': int((self.status == DECLINED).sum()),
+            'completion_rate': float((self.status == COMPLETED).mean()) if len(demand) else 0.0,
+            'wait_mean_s': float(waits.mean()) if len(waits) else math.nan,
+            'wait_p50_s': float(percentiles[0]),
+            'wait_p90_s': float(percentiles[1]),
+            'wait_p99_s': float(percentiles[2]),
+            'drivers': len(fleet),
+            # Share of drivers' online time spent driving to pickups or on trips
+            'utilization': float(min(fleet.busy_seconds.sum() / online_s, 1.0)) if online_s else 0.0,
+            'revenue': float(self.fare.sum()),
+            'policy_calls': self.policy_calls,
+            'policy_cpu_s': self.policy_seconds,
+            'policy_cpu_us_per_call': self.policy_seconds / self.policy_calls * 1e6 if self.policy_calls else 0.0,
+            'events': self.events,
+            'simulated_hours': float(end - start) / 3600,
+            'elapsed_s': elapsed,
+        }
@@ -0,0 +1,60 @@
+from decimal import Decimal
+from django.db.models import Avg
+from jobs.registry import task
+from .models import Driver, Ride
+from .payments import get_payments_setting, refund_rides, retry_delay, settle_rides
+
+
+@task(queue='ratings', batch_size=100)
+def update_driver_ratings(payloads):
+    """
+    Recompute the average rating of every driver in the batch with one query.
+    """
+    driver_ids = {payload['driver_id'] for payload in payloads}
+    averages = (
+        Ride.objects.filter(driver_id__in=driver_ids, user_rating__isnull=False)
+        .values('driver_id')
+        .annotate(avg=Avg('user_rating'))
+    )
+    Driver.objects.bulk_update(
+        [Driver(id=row['driver_id'], rating=Decimal(f"{row['avg']:.2f}")) for row in averages],
+        ['rating'],
+    )
+
+
+def _by_attempt(payloads):
+    batches = {}
+    for payload in payloads:
+        batches.setdefault(payload.get('attempt', 1), []).append(payload['ride_id'])
+    return batches.items()
+
+
+@task(queue='payments', batch_size=get_payments_setting('BATCH_SIZE'))
+def settle_ride_payments(payloads):
+    """
+    Charge a batch of completed rides, queueing the ones that hit gateway errors again later.
+    """
+    for attempt, ride_ids in _by_attempt(payloads):
+        for ride_id in settle_rides(ride_ids, attempt)['retry']:
+            settle_ride_payments.enqueue({'ride_id': ride_id, 'attempt': attempt + 1}, delay=retry_delay(attempt))
+
+
+@task(queue='payments', batch_size=get_payments_setting('BATCH_SIZE'))
+def refund_ride_payments(payloads):
+    """
+    Refund a batch of paid rides, queueing the ones that hit gateway errors again later.
+    """
+    for attempt, ride_ids in _by_attempt(payloads):
+        for ride_id in refund_rides(ride_ids, attempt)['retry']:
+            refund_ride_payments.enqueue({'ride_id': ride_id, 'attempt': attempt + 1}, delay=retry_delay(attempt))
+
+
+@task(queue='map_matching', batch_size=20)
+def match_ride_routes(payloads):
+    """
+    Snap the GPS traces of a batch of completed rides onto the road graph.
+    """
+    # Imported here so only workers that match routes load NumPy and the road graph
+    from .map_matching import match_rides
+
+    match_rides([payload['ride_id'] for payload in payloads])
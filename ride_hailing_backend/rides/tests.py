@@ -1,3 +1,1478 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import logging
+from decimal import Decimal
+from io import StringIO
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Avg, Q
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import NoReverseMatch, reverse
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from ride_hailing_backend import api_schema, geocoder, metrics
+from ride_hailing_backend.db_routing import ReplicaRouter, read_from
+from ride_hailing_backend.fields import bounding_box
+from ride_hailing_backend.paginators import EstimatedCountPaginator
+from jobs.models import Job
+from users.models import User, PaymentMethod, UserLocation
+from users.serializers import UserLocationSerializer
+from rides.eta import (
+    SpeedTable, build_speed_table, cell_keys, estimate_pickup, eta_minutes, hours_of_week, reset_speed_table,
+)
+from rides.pooling import Planner, fare_shares
+from rides.payments import StubGateway, refund_rides, reset_gateway, settle_rides
+from rides.simulator import Demand, Fleet, Simulation, nearest_driver_policy
+from rides.heartbeats import TimingWheel, monitor
+from rides.map_matching import MapMatcher, RoadGraph, build_road_graph, match_rides, matcher_options, reset_map_matcher
+from rides.gps import get_policy, take_token, should_persist, remember_persisted, distance_m
+from rides.idempotency import response_cache
+from rides.traces import encode_polyline, simplify
+from rides.tasks import settle_ride_payments
+from rides.models import Driver, RideCategory, Ride, RideLocation, IdempotencyKey, PoolTrip, MatchedRoute
+
+
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class SeedDataCommandTests(TestCase):
+    def test_seeds_related_rows(self):
+        call_command('seed_data', users=20, drivers=5, rides=40, locations_per_ride=3, batch_size=7, stdout=StringIO())
+
+        self.assertEqual(User.objects.count(), 20)
+        self.assertEqual(PaymentMethod.objects.filter(type='cash', is_default=True).count(), 20)
+        self.assertEqual(Driver.objects.count(), 5)
+        self.assertEqual(Ride.objects.count(), 40)
+        driven = Ride.objects.filter(started_at__isnull=False).count()
+        self.assertEqual(RideLocation.objects.count(), driven * 3)
+        # Request times are spread over the past instead of all being "now"
+        self.assertGreater(Ride.objects.dates('requested_at', 'day').count(), 1)
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class BenchmarkApiCommandTests(TestCase):
+    def test_writes_results(self):
+        call_command('seed_data', users=10, drivers=2, rides=20, locations_per_ride=2, stdout=StringIO())
+        rides_before = Ride.objects.count()
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            call_command('benchmark_api', requests=3, login_requests=1, users=3, output_dir=output_dir, stdout=StringIO())
+            [name] = os.listdir(output_dir)
+            with open(os.path.join(output_dir, name)) as fh:
+                results = json.load(fh)['results']
+
+        self.assertEqual(set(results), {'login', 'home', 'ride-history', 'ride-active', 'ride-create', 'location-update'})
+        for summary in results.values():
+            self.assertLessEqual(summary['p50_ms'], summary['p99_ms'])
+            self.assertNotIn('500', summary['status_codes'])
+        # Writes made by the benchmark are rolled back
+        self.assertEqual(Ride.objects.count(), rides_before)
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class CoordinateFieldTests(TestCase):
+    def test_stored_as_micro_degrees_and_read_as_floats(self):
+        user = User.objects.create_user(email='c@example.com', password='pass', phone_number='+2348000000301', full_name='C')
+        location = UserLocation.objects.create(
+            user=user, name='Home', address='Plot 1', latitude=Decimal('6.524400'), longitude='-3.379201'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT latitude, longitude FROM users_userlocation WHERE id = %s', [location.pk.hex])
+            self.assertEqual(cursor.fetchone(), (6524400, -3379201))
+
+        location.refresh_from_db()
+        self.assertEqual((location.latitude, location.longitude), (6.5244, -3.379201))
+        self.assertEqual(UserLocation.objects.filter(latitude=6.5244).count(), 1)
+
+    def test_bounding_box_contains_radius(self):
+        box = bounding_box(6.5, 3.35, 5)
+        low, high = box['latitude__range']
+        self.assertAlmostEqual(distance_m(low, 3.35, high, 3.35), 10000, delta=1)
+        low, high = box['longitude__range']
+        self.assertAlmostEqual(distance_m(6.5, low, 6.5, high), 10000, delta=10)
+
+    def test_range_is_validated(self):
+        serializer = UserLocationSerializer(data={
+            'name': 'Nowhere', 'address': 'x', 'latitude': '91', 'longitude': '3.35', 'type': 'other'
+        })
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(set(serializer.errors), {'latitude'})
+
+
+class BenchmarkCoordinatesCommandTests(TransactionTestCase):
+    def test_compares_both_representations(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            call_command('benchmark_coordinates', rows=500, queries=5, output_dir=output_dir, stdout=StringIO())
+            [name] = os.listdir(output_dir)
+            with open(os.path.join(output_dir, name)) as fh:
+                results = json.load(fh)['results']
+
+        self.assertEqual(results['rows'], 500)
+        self.assertEqual(set(results['decimal']), set(results['micro_degrees']))
+        self.assertNotIn('benchmark_decimal_point', connection.introspection.table_names())
+
+
+class ApiProfileTests(TestCase):
+    def test_api_urlconf_has_no_admin_or_docs(self):
+        urlconf = 'ride_hailing_backend.urls_api'
+        self.assertEqual(reverse('home-data', urlconf=urlconf), reverse('home-data'))
+        for name in ('admin:index', 'schema-swagger-ui'):
+            with self.assertRaises(NoReverseMatch):
+                reverse(name, urlconf=urlconf)
+
+    def test_startup_benchmark_loads_both_profiles(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            call_command('benchmark_startup', runs=1, output_dir=output_dir, stdout=StringIO())
+            [name] = os.listdir(output_dir)
+            with open(os.path.join(output_dir, name)) as fh:
+                results = json.load(fh)['results']
+
+        full, api = results['ride_hailing_backend.settings'], results['ride_hailing_backend.settings_api']
+        self.assertLess(api['modules'], full['modules'])
+        self.assertGreater(api['max_rss_mb'], 0)
+
+
+class ApiSchemaTests(SimpleTestCase):
+    def setUp(self):
+        self.schema_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.schema_dir, True)
+        settings_override = override_settings(API_SCHEMA={'DIR': self.schema_dir, 'AUTO_REGENERATE': False})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        api_schema.reset_schema()
+        self.addCleanup(api_schema.reset_schema)
+        # drf_yasg logs the views that cannot be introspected without a user
+        logging.disable(logging.WARNING)
+        self.addCleanup(logging.disable, logging.NOTSET)
+
+    def test_command_writes_schema_that_is_served_with_etag(self):
+        call_command('generate_api_schema', stdout=StringIO())
+        self.assertEqual(sorted(os.listdir(self.schema_dir)), ['openapi.json', 'openapi.yaml'])
+
+        with mock.patch.object(api_schema, 'generate_schema') as generate:
+            response = self.client.get(reverse('schema-json'))
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('/rides/', json.loads(response.content)['paths'])
+            etag = response['ETag']
+
+            not_modified = self.client.get(reverse('schema-json'), HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(not_modified.status_code, 304)
+            self.assertEqual(self.client.get(reverse('schema-yaml'))['Content-Type'], 'application/yaml')
+        generate.assert_not_called()
+
+    def test_missing_schema_is_built_once_and_stored(self):
+        with mock.patch.object(api_schema, 'generate_schema', wraps=api_schema.generate_schema) as generate:
+            self.client.get(reverse('schema-json'))
+            self.client.get(reverse('schema-json'))
+        self.assertEqual(generate.call_count, 1)
+        self.assertTrue(os.path.exists(os.path.join(self.schema_dir, 'openapi.json')))
+
+    def test_auto_regenerate_rebuilds_when_sources_change(self):
+        call_command('generate_api_schema', stdout=StringIO())
+        stored_mtime = os.path.getmtime(os.path.join(self.schema_dir, 'openapi.json'))
+        with override_settings(API_SCHEMA={'DIR': self.schema_dir, 'AUTO_REGENERATE': True}), \
+                mock.patch.object(api_schema, 'generate_schema', wraps=api_schema.generate_schema) as generate:
+            with mock.patch.object(api_schema, 'newest_source_mtime', return_value=stored_mtime - 1):
+                self.client.get(reverse('schema-json'))
+            self.assertEqual(generate.call_count, 0)
+            with mock.patch.object(api_schema, 'newest_source_mtime', return_value=stored_mtime + 1):
+                self.client.get(reverse('schema-json'))
+            self.assertEqual(generate.call_count, 1)
+
+    def test_swagger_ui_loads_stored_schema(self):
+        response = self.client.get(reverse('schema-swagger-ui'))
+        self.assertContains(response, reverse('schema-json'))
+
+
+class ProfilingMiddlewareTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='rider@example.com', password='pass', phone_number='+2348000000001', full_name='Rider'
+        )
+        self.auth = {'HTTP_AUTHORIZATION': f"Bearer {RefreshToken.for_user(self.user).access_token}"}
+
+    def profiling(self, **overrides):
+        return override_settings(PROFILING={'ENABLED': True, 'SAMPLE_RATE': 0.0, **overrides})
+
+    def test_sampled_request_has_server_timing(self):
+        with self.profiling(SAMPLE_RATE=1.0):
+            response = self.client.get(reverse('home-data'), **self.auth)
+
+        timing = response['Server-Timing']
+        for metric in ('sql;', 'serializer;', 'render;', 'total;'):
+            self.assertIn(metric, timing)
+        self.assertNotIn('desc="0 queries"', timing)
+
+    def test_unsampled_request_has_no_header(self):
+        with self.profiling():
+            response = self.client.get(reverse('home-data'), **self.auth)
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    def test_cprofile_requires_token(self):
+        with tempfile.TemporaryDirectory() as profile_dir:
+            with self.profiling(CPROFILE_TOKEN='secret', CPROFILE_DIR=profile_dir):
+                response = self.client.get(reverse('home-data'), HTTP_X_PROFILE='wrong', **self.auth)
+                self.assertFalse(response.has_header('X-Profile-Dump'))
+
+                response = self.client.get(reverse('home-data'), HTTP_X_PROFILE='secret', **self.auth)
+                self.assertTrue(os.path.exists(os.path.join(profile_dir, response['X-Profile-Dump'])))
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.metrics_dir)
+        settings_override = override_settings(METRICS={'ENABLED': True, 'DIR': self.metrics_dir})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create_user(
+            email='rider@example.com', password='pass', phone_number='+2348000000001', full_name='Rider'
+        )
+        self.auth = {'HTTP_AUTHORIZATION': f"Bearer {RefreshToken.for_user(self.user).access_token}"}
+
+    def scrape(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_records_requests_per_url_name(self):
+        self.client.get(reverse('home-data'), **self.auth)
+        self.client.get(reverse('ride-history'), **self.auth)
+        body = self.scrape()
+
+        self.assertRegex(body, r'http_requests_total\{view="home-data",method="GET",status="200"\} \d+')
+        self.assertRegex(body, r'http_request_duration_seconds_bucket\{view="ride-history",le="\+Inf"\} \d+')
+        self.assertRegex(body, r'http_request_db_queries_count\{view="home-data"\} \d+')
+
+    def test_aggregates_other_workers(self):
+        before = metrics.collect().get(('location_updates_ingested_total', ()), 0)
+        # The parent process stands in for a live worker
+        with open(os.path.join(self.metrics_dir, f"{os.getppid()}.json"), 'w') as fh:
+            json.dump([['location_updates_ingested_total', [], 5]], fh)
+
+        self.assertIn(f"location_updates_ingested_total {before + 5}", self.scrape())
+
+    def test_exited_workers_are_retired(self):
+        before = metrics.collect().get(('location_updates_ingested_total', ()), 0)
+        exited = subprocess.Popen(['true'])
+        exited.wait()
+        with open(os.path.join(self.metrics_dir, f"{exited.pid}.json"), 'w') as fh:
+            json.dump([['location_updates_ingested_total', [], 5]], fh)
+        # Left under this process's PID by an earlier process
+        with open(os.path.join(self.metrics_dir, f"{os.getpid()}.json"), 'w') as fh:
+            json.dump([['location_updates_ingested_total', [], 2]], fh)
+        metrics._flushed_pid = None
+
+        self.assertIn(f"location_updates_ingested_total {before + 7}", self.scrape())
+        self.assertEqual(
+            sorted(name for name in os.listdir(self.metrics_dir) if name.endswith('.json')),
+            sorted([f"{os.getpid()}.json", metrics.RETIRED_FILE]),
+        )
+        # Counted once, not again on every scrape
+        self.assertIn(f"location_updates_ingested_total {before + 7}", self.scrape())
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram('test_histogram', 'Test.', buckets=(1, 10))
+        self.addCleanup(metrics._metrics.pop, 'test_histogram')
+        for value in (0.5, 5, 50):
+            histogram.observe(value)
+        body = metrics.render_prometheus(metrics.snapshot())
+
+        self.assertIn('test_histogram_bucket{le="1"} 1', body)
+        self.assertIn('test_histogram_bucket{le="10"} 2', body)
+        self.assertIn('test_histogram_bucket{le="+Inf"} 3', body)
+        self.assertIn('test_histogram_count 3', body)
+
+    def test_forbidden_outside_allowed_ips(self):
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class AdminScalingTests(TestCase):
+    def setUp(self):
+        call_command('seed_data', users=30, drivers=5, rides=60, locations_per_ride=30, stdout=StringIO())
+        self.admin = User.objects.create_superuser(
+            email='admin@example.com', password='pass', phone_number='+2348000000009', full_name='Admin'
+        )
+        self.client.force_login(self.admin)
+
+    def changelist_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_ride_changelist_queries_do_not_grow_with_rows(self):
+        url = reverse('admin:rides_ride_changelist')
+        few = self.changelist_queries(f"{url}?status__exact=requested")
+        many = self.changelist_queries(url)
+        self.assertLessEqual(many, few + 1)
+
+    def test_ride_change_page_summarizes_trace(self):
+        ride = Ride.objects.filter(status='completed').first()
+        response = self.client.get(reverse('admin:rides_ride_change', args=[ride.pk]))
+
+        self.assertContains(response, '30 points from')
+        self.assertContains(response, f"?ride__id__exact={ride.pk}")
+        self.assertEqual(response.content.decode().count('<td>'), 3 * 20)
+
+    def test_search_by_id_and_email(self):
+        ride = Ride.objects.select_related('user').first()
+        url = reverse('admin:rides_ride_changelist')
+
+        self.assertContains(self.client.get(url, {'q': str(ride.pk)}), str(ride.pk))
+        response = self.client.get(url, {'q': ride.user.email})
+        self.assertEqual(
+            set(response.context['cl'].result_list),
+            set(Ride.objects.filter(Q(user=ride.user) | Q(driver__user=ride.user))),
+        )
+
+    def test_ride_location_search_requires_ride_id(self):
+        ride = Ride.objects.filter(status='completed').first()
+        url = reverse('admin:rides_ridelocation_changelist')
+
+        self.assertEqual(self.client.get(url, {'q': 'not-a-uuid'}).context['cl'].result_count, 0)
+        self.assertEqual(self.client.get(url, {'q': str(ride.pk)}).context['cl'].result_count, 30)
+
+    def test_paginator_estimates_unfiltered_counts(self):
+        paginator = EstimatedCountPaginator(RideLocation.objects.all(), 100)
+        paginator.exact_count_threshold = 1
+        with CaptureQueriesContext(connection) as ctx:
+            count = paginator.count
+        self.assertNotIn('COUNT', ctx.captured_queries[0]['sql'])
+        self.assertGreaterEqual(count, RideLocation.objects.count())
+
+        filtered = EstimatedCountPaginator(RideLocation.objects.filter(ride__status='completed'), 100)
+        filtered.exact_count_threshold = 1
+        self.assertEqual(filtered.count, RideLocation.objects.filter(ride__status='completed').count())
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class RateRideTests(TestCase):
+    def setUp(self):
+        call_command('seed_data', users=10, drivers=2, rides=30, locations_per_ride=0, stdout=StringIO())
+        self.ride = Ride.objects.filter(status='completed', user_rating__isnull=True).select_related('user').first()
+        self.auth = {'HTTP_AUTHORIZATION': f"Bearer {RefreshToken.for_user(self.ride.user).access_token}"}
+        self.url = reverse('ride-rate-ride', args=[self.ride.pk])
+
+    def test_rating_update_is_queued(self):
+        response = self.client.post(self.url, {'user_rating': 5}, content_type='application/json', **self.auth)
+        self.assertEqual(response.status_code, 200)
+        job = Job.objects.get(task='rides.tasks.update_driver_ratings')
+        self.assertEqual(job.payload, {'driver_id': str(self.ride.driver_id)})
+
+    @override_settings(JOBS={'EAGER': True})
+    def test_driver_rating_is_recomputed(self):
+        self.client.post(self.url, {'user_rating': 1}, content_type='application/json', **self.auth)
+        expected = Ride.objects.filter(driver_id=self.ride.driver_id, user_rating__isnull=False).aggregate(
+            avg=Avg('user_rating')
+        )['avg']
+        self.assertAlmostEqual(float(Driver.objects.get(pk=self.ride.driver_id).rating), expected, places=2)
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class RideCounterTests(TestCase):
+    def setUp(self):
+        call_command('seed_data', users=10, drivers=2, rides=40, locations_per_ride=0, stdout=StringIO())
+        self.user = User.objects.filter(driver_profile__isnull=True).first()
+        self.driver = Driver.objects.first()
+        self.category = RideCategory.objects.filter(is_pooled=False).first()
+
+    def new_ride(self):
+        return Ride.objects.create(
+            user=self.user, category=self.category, pickup_latitude=9, pickup_longitude=8,
+            pickup_address='A', destination_latitude=9.1, destination_longitude=8.1, destination_address='B',
+            estimated_distance_km=5, estimated_duration_minutes=10, base_fare=1, distance_fare=1,
+            time_fare=1, total_fare=3,
+        )
+
+    def counters(self, obj):
+        obj.refresh_from_db()
+        return obj.total_rides, obj.completed_rides
+
+    def test_seeded_counters_match_rides(self):
+        self.assertEqual(self.counters(self.user), (
+            self.user.rides.count(), self.user.rides.filter(status='completed').count()
+        ))
+
+    def test_create_assign_and_complete(self):
+        user_before = self.counters(self.user)
+        driver_before = self.counters(self.driver)
+
+        ride = self.new_ride()
+        self.assertTrue(ride.assign_driver(self.driver))
+        self.assertFalse(ride.assign_driver(self.driver))
+        self.assertTrue(ride.complete())
+        self.assertFalse(ride.complete())
+
+        self.assertEqual(self.counters(self.user), (user_before[0] + 1, user_before[1] + 1))
+        self.assertEqual(self.counters(self.driver), (driver_before[0] + 1, driver_before[1] + 1))
+
+    def test_profile_serialization_does_not_count_rides(self):
+        auth = {'HTTP_AUTHORIZATION': f"Bearer {RefreshToken.for_user(self.user).access_token}"}
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('profile'), **auth)
+        self.assertEqual(response.json()['total_rides'], self.user.rides.count())
+        self.assertFalse([q for q in ctx.captured_queries if 'COUNT(' in q['sql']])
+
+    def test_reconcile_fixes_drift(self):
+        User.objects.filter(pk=self.user.pk).update(total_rides=999, completed_rides=999)
+        out = StringIO()
+        call_command('reconcile_ride_counters', chunk_size=3, stdout=out)
+
+        self.assertIn('users: checked 10, fixed 1', out.getvalue())
+        self.assertEqual(self.counters(self.user)[0], self.user.rides.count())
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class PaymentSettlementTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='pay@example.com', password='pass', phone_number='+2348000000401', full_name='Pay'
+        )
+        self.category = RideCategory.objects.create(
+            name='Standard', description='', base_fare=500, per_km_rate=100, per_minute_rate=10
+        )
+        self.methods = {
+            kind: PaymentMethod.objects.create(user=self.user, type=kind, is_default=kind == 'cash')
+            for kind in ('card', 'cash', 'wallet')
+        }
+        reset_gateway()
+        self.addCleanup(reset_gateway)
+
+    def new_ride(self, kind='card', status='completed'):
+        return Ride.objects.create(
+            user=self.user, category=self.category, payment_method=self.methods[kind], status=status,
+            pickup_latitude=9, pickup_longitude=8, pickup_address='A', destination_latitude=9.1,
+            destination_longitude=8.1, destination_address='B', estimated_distance_km=5,
+            estimated_duration_minutes=10, base_fare=500, distance_fare=500, time_fare=100, total_fare=1100,
+        )
+
+    def payment(self, ride):
+        ride.refresh_from_db()
+        return ride.payment_status
+
+    def test_completion_queues_settlement(self):
+        ride = self.new_ride(status='in_progress')
+        self.assertTrue(ride.complete())
+        job = Job.objects.get(task='rides.tasks.settle_ride_payments')
+        self.assertEqual((job.queue, job.payload), ('payments', {'ride_id': str(ride.id)}))
+
+    def test_batch_is_charged_concurrently_and_recorded_in_bulk(self):
+        cards = [self.new_ride('card') for _ in range(5)]
+        cash, wallet, unfinished = self.new_ride('cash'), self.new_ride('wallet'), self.new_ride(status='in_progress')
+        gateway = StubGateway(decline_types={'wallet'})
+
+        # Selecting the batch, then one UPDATE per outcome
+        with self.assertNumQueries(4), self.assertLogs('rides.payments', 'WARNING'):
+            result = settle_rides([ride.id for ride in cards + [cash, wallet, unfinished]], gateway=gateway)
+
+        self.assertEqual(result, {'paid': 6, 'failed': 1, 'retry': []})
+        self.assertEqual([self.payment(ride) for ride in (cash, wallet, unfinished)], ['paid', 'failed', 'pending'])
+        self.assertEqual(
+            set(Ride.objects.filter(id__in=[ride.id for ride in cards]).values_list('payment_reference', flat=True)),
+            set(gateway.charges.values()),
+        )
+        # Settling again does not charge anyone twice
+        self.assertEqual(settle_rides([ride.id for ride in cards], gateway=gateway)['paid'], 0)
+        self.assertEqual(gateway.calls, 6)
+
+    @override_settings(PAYMENTS={
+        'GATEWAY': 'rides.payments.StubGateway', 'GATEWAY_OPTIONS': {'fail_every': 1}, 'MAX_ATTEMPTS': 2,
+    })
+    def test_gateway_errors_are_retried_then_failed(self):
+        ride = self.new_ride('card')
+        settle_ride_payments([{'ride_id': str(ride.id)}])
+
+        self.assertEqual(self.payment(ride), 'pending')
+        job = Job.objects.get(task='rides.tasks.settle_ride_payments')
+        self.assertEqual(job.payload, {'ride_id': str(ride.id), 'attempt': 2})
+        self.assertGreater(job.run_at, timezone.now())
+
+        with self.assertLogs('rides.payments', 'WARNING'):
+            settle_ride_payments([job.payload])
+        self.assertEqual(self.payment(ride), 'failed')
+        self.assertEqual(Job.objects.filter(task='rides.tasks.settle_ride_payments').count(), 1)
+
+    @override_settings(PAYMENTS={})
+    def test_rides_stay_pending_without_a_gateway(self):
+        card, cash = self.new_ride('card'), self.new_ride('cash')
+        with self.assertLogs('rides.payments', 'WARNING'):
+            settle_ride_payments([{'ride_id': str(card.id)}, {'ride_id': str(cash.id)}])
+        self.assertEqual((self.payment(card), self.payment(cash)), ('pending', 'paid'))
+        self.assertIsNone(Ride.objects.get(pk=card.pk).payment_reference)
+        self.assertFalse(Job.objects.filter(task='rides.tasks.settle_ride_payments').exists())
+
+    def test_refunds_charged_rides(self):
+        card, cash = self.new_ride('card'), self.new_ride('cash')
+        gateway = StubGateway()
+        settle_rides([card.id, cash.id], gateway=gateway)
+
+        result = refund_rides([card.id, cash.id], gateway=gateway)
+        self.assertEqual(result, {'refunded': 1, 'skipped': 1, 'retry': []})
+        self.assertEqual((self.payment(card), self.payment(cash)), ('refunded', 'paid'))
+        self.assertEqual(list(gateway.refunds), [f"refund:{card.id}"])
+
+    def test_settlement_benchmark(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            call_command('benchmark_settlement', rides=20, latency_ms=0, concurrency='1,4', output_dir=output_dir,
+                         stdout=StringIO())
+            [name] = os.listdir(output_dir)
+            with open(os.path.join(output_dir, name)) as fh:
+                results = json.load(fh)['results']
+
+        self.assertEqual({summary['rides'] for summary in results.values()}, {20})
+        self.assertFalse(Ride.objects.filter(user__email='settlement-benchmark@example.com').exists())
+
+
+class PoolingTests(TestCase):
+    def setUp(self):
+        call_command('seed_data', users=5, drivers=1, rides=0, stdout=StringIO())
+        self.category = RideCategory.objects.get(is_pooled=True)
+        self.driver = Driver.objects.get()
+        Driver.objects.filter(pk=self.driver.pk).update(current_latitude=9.080, current_longitude=8.6753)
+        self.riders = list(User.objects.filter(driver_profile__isnull=True)[:2])
+
+    def request_ride(self, rider, pickup, destination, seats=1):
+        return self.client.post(reverse('ride-list'), {
+            'category_id': str(self.category.id), 'seats': seats,
+            'pickup_latitude': pickup, 'pickup_longitude': 8.6753, 'pickup_address': 'Pickup',
+            'destination_latitude': destination, 'destination_longitude': 8.6753, 'destination_address': 'Drop-off',
+            'estimated_distance_km': '3.00', 'estimated_duration_minutes': 10,
+        }, content_type='application/json', HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(rider).access_token}")
+
+    def start_trip(self):
+        # The first rider heads north past everyone else's stops
+        response = self.request_ride(self.riders[0], 9.082, 9.110)
+        ride = Ride.objects.get(pk=response.json()['data']['id'])
+        self.assertEqual(ride.status, 'requested')
+        self.assertTrue(ride.assign_driver(self.driver))
+        return ride
+
+    def test_best_insertion(self):
+        planner = Planner()
+        # Vehicle, then the waiting rider's pickup and drop-off
+        route = [(9.080, 8.6753, 0), (9.082, 8.6753, 1), (9.110, 8.6753, -1)]
+        added, i, j, wait = planner.best_insertion(route, 0, 4, (9.090, 8.6753), (9.100, 8.6753), 1)
+        self.assertEqual((i, j), (1, 1))
+        # On the way: only stopping costs time, which this model does not count
+        self.assertAlmostEqual(added, 0, delta=1)
+        self.assertAlmostEqual(wait, planner.seconds((9.080, 8.6753), (9.090, 8.6753)), delta=1)
+        # No seat left once the first rider is on board, and the detour before them is too long
+        self.assertIsNone(planner.best_insertion(route, 0, 1, (9.090, 8.6753), (9.100, 8.6753), 1))
+
+    def test_fare_shares(self):
+        planner = Planner()
+        stops = [
+            ('a', 'pickup', 9.0, 8.0, 1), ('b', 'pickup', 9.0, 8.0, 1),
+            ('b', 'dropoff', 9.01, 8.0, 1), ('a', 'dropoff', 9.02, 8.0, 1),
+        ]
+        shares = fare_shares(stops, planner.seconds)
+        self.assertAlmostEqual(shares['b'], 0.5)
+        self.assertAlmostEqual(shares['a'], 0.75)
+        # A ride stored with no seats gets no share instead of dividing by zero
+        stops = [('a', 'pickup', 9.0, 8.0, 0), ('a', 'dropoff', 9.01, 8.0, 0)]
+        self.assertEqual(fare_shares(stops, planner.seconds), {})
+
+    def test_request_joins_trip_under_way(self):
+        first = self.start_trip()
+        trip = PoolTrip.objects.get()
+        self.assertEqual(list(trip.stops.values_list('ride_id', 'kind', 'sequence')), [
+            (first.id, 'pickup', 0), (first.id, 'dropoff', 1),
+        ])
+        quoted = first.total_fare
+        self.assertEqual(first.distance_fare, (self.category.per_km_rate * 3 * Decimal('0.75')).quantize(Decimal('0.01')))
+
+        response = self.request_ride(self.riders[1], 9.090, 9.100)
+        self.assertEqual(response.status_code, 201)
+        data = response.json()['data']
+        self.assertEqual((data['status'], data['driver']['id'], data['pool_trip']), ('accepted', str(self.driver.id), str(trip.id)))
+        second = Ride.objects.get(pk=data['id'])
+        self.assertEqual(list(trip.stops.values_list('ride_id', 'kind')), [
+            (first.id, 'pickup'), (second.id, 'pickup'), (second.id, 'dropoff'), (first.id, 'dropoff'),
+        ])
+        # The second rider shares their whole ride; the first shares too little of theirs to go below the cap
+        self.assertEqual(second.distance_fare, (self.category.per_km_rate * 3 * Decimal('0.5')).quantize(Decimal('0.01')))
+        first.refresh_from_db()
+        self.assertEqual(first.total_fare, quoted)
+
+        self.assertTrue(first.complete())
+        self.assertTrue(PoolTrip.objects.get().is_open)
+        self.assertTrue(second.complete())
+        self.assertFalse(PoolTrip.objects.get().is_open)
+
+    def test_request_without_room_waits(self):
+        self.start_trip()
+        response = self.request_ride(self.riders[1], 9.090, 9.100, seats=4)
+        self.assertEqual(response.status_code, 201)
+        ride = Ride.objects.get(pk=response.json()['data']['id'])
+        self.assertEqual((ride.status, ride.pool_trip_id), ('requested', None))
+        self.assertEqual(self.request_ride(self.riders[1], 9.090, 9.100, seats=5).status_code, 400)
+
+    def test_request_needs_a_seat(self):
+        response = self.request_ride(self.riders[0], 9.080, 9.110, seats=0)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('seats', response.json()['errors'])
+        self.assertFalse(Ride.objects.exists())
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        call_command('seed_data', users=10, drivers=2, rides=20, locations_per_ride=0, stdout=StringIO())
+        response_cache.clear()
+        self.user = User.objects.filter(driver_profile__isnull=True).first()
+        self.auth = {'HTTP_AUTHORIZATION': f"Bearer {RefreshToken.for_user(self.user).access_token}"}
+        self.payload = {
+            'category_id': str(RideCategory.objects.filter(is_pooled=False).first().id),
+            'pickup_latitude': '9.082000',
+            'pickup_longitude': '8.675300',
+            'pickup_address': 'Pickup',
+            'destination_latitude': '9.092000',
+            'destination_longitude': '8.685300',
+            'destination_address': 'Destination',
+            'estimated_distance_km': '5.00',
+            'estimated_duration_minutes': 15,
+        }
+
+    def tearDown(self):
+        response_cache.clear()
+
+    def request_ride(self, key, payload=None):
+        return self.client.post(
+            reverse('ride-list'), payload or self.payload, content_type='application/json',
+            HTTP_IDEMPOTENCY_KEY=key, **self.auth
+        )
+
+    def test_retry_replays_stored_response(self):
+        rides_before = Ride.objects.count()
+        first = self.request_ride('key-1')
+        self.assertEqual(first.status_code, 201)
+
+        with CaptureQueriesContext(connection) as ctx:
+            retry = self.request_ride('key-1')
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertFalse(any('rides_ride' in q['sql'] for q in ctx.captured_queries))
+        self.assertEqual(Ride.objects.count(), rides_before + 1)
+
+        # Other processes find the response in the database
+        response_cache.clear()
+        self.assertEqual(self.request_ride('key-1').content, first.content)
+        self.assertEqual(Ride.objects.count(), rides_before + 1)
+
+    def test_key_reuse_with_different_body_is_rejected(self):
+        self.request_ride('key-1')
+        response = self.request_ride('key-1', dict(self.payload, pickup_address='Elsewhere'))
+        self.assertEqual(response.status_code, 422)
+
+    def test_in_progress_and_abandoned_keys(self):
+        now = timezone.now()
+        record = IdempotencyKey.objects.create(
+            user=self.user, path=reverse('ride-list'), key='key-1', request_hash='',
+            expires_at=now + timedelta(days=1),
+        )
+        self.assertEqual(self.request_ride('key-1').status_code, 409)
+
+        # A first request whose process died is taken over after LOCK_TIMEOUT
+        IdempotencyKey.objects.filter(pk=record.pk).update(created_at=now - timedelta(minutes=5))
+        self.assertEqual(self.request_ride('key-1').status_code, 201)
+
+    def test_failed_validation_is_not_stored(self):
+        response = self.request_ride('key-1', dict(self.payload, pickup_latitude='x'))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.request_ride('key-1').status_code, 201)
+
+    def test_location_update_is_deduplicated(self):
+        ride = Ride.objects.create(
+            user=self.user, category=RideCategory.objects.filter(is_pooled=False).first(), driver=Driver.objects.first(),
+            status='in_progress', pickup_latitude=9, pickup_longitude=8, pickup_address='A',
+            destination_latitude=9.1, destination_longitude=8.1, destination_address='B',
+            estimated_distance_km=5, estimated_duration_minutes=10, base_fare=1, distance_fare=1,
+            time_fare=1, total_fare=3,
+        )
+        driver_auth = {'HTTP_AUTHORIZATION': f"Bearer {RefreshToken.for_user(ride.driver.user).access_token}"}
+        payload = {'ride_id': str(ride.id), 'latitude': '9.083000', 'longitude': '8.676300'}
+        for _ in range(3):
+            response = self.client.post(
+                reverse('location-update'), payload, content_type='application/json',
+                HTTP_IDEMPOTENCY_KEY='ping-1', **driver_auth
+            )
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(ride.location_updates.count(), 1)
+
+    def test_purge_expired_keys(self):
+        self.request_ride('key-1')
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        call_command('purge_idempotency_keys', stdout=StringIO())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class GpsThrottleTests(TestCase):
+    def setUp(self):
+        call_command('seed_data', users=5, drivers=1, rides=0, stdout=StringIO())
+        cache.clear()
+        self.driver = Driver.objects.select_related('user').first()
+        self.ride = Ride.objects.create(
+            user=User.objects.filter(driver_profile__isnull=True).first(), category=RideCategory.objects.filter(is_pooled=False).first(),
+            driver=self.driver, status='in_progress', pickup_latitude=9, pickup_longitude=8, pickup_address='A',
+            destination_latitude=9.1, destination_longitude=8.1, destination_address='B',
+            estimated_distance_km=5, estimated_duration_minutes=10, base_fare=1, distance_fare=1,
+            time_fare=1, total_fare=3,
+        )
+        self.auth = {'HTTP_AUTHORIZATION': f"Bearer {RefreshToken.for_user(self.driver.user).access_token}"}
+
+    def tearDown(self):
+        cache.clear()
+
+    def ping(self, latitude, longitude):
+        return self.client.post(reverse('location-update'), {
+            'ride_id': str(self.ride.id), 'latitude': f"{latitude:.6f}", 'longitude': f"{longitude:.6f}",
+        }, content_type='application/json', **self.auth)
+
+    def test_token_bucket(self):
+        policy = {'RATE': 1.0, 'BURST': 3}
+        self.assertEqual([take_token('d', policy, now=100) for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(take_token('d', policy, now=100), 1.0)
+        self.assertEqual(take_token('d', policy, now=101.5), 0)
+
+    def test_downsampled_trip_keeps_its_shape(self):
+        # 10 minutes of 1 Hz pings: 3 minutes parked, then ~10 m/s straight north
+        policy = get_policy('in_progress')
+        fixes = [(9.0, 8.0)] * 180 + [(9.0 + i * 0.00009, 8.0) for i in range(420)]
+        kept = []
+        for second, (latitude, longitude) in enumerate(fixes):
+            if should_persist(self.ride, latitude, longitude, policy, now=second):
+                remember_persisted(self.ride, latitude, longitude, now=second)
+                kept.append((second, latitude, longitude))
+
+        self.assertLess(len(kept), len(fixes) / 4)
+        gaps = [b[0] - a[0] for a, b in zip(kept, kept[1:])]
+        self.assertLessEqual(max(gaps), policy['MAX_INTERVAL_S'])
+        # Every dropped fix is close to a kept one
+        for second, (latitude, longitude) in enumerate(fixes):
+            previous = max(k for k in kept if k[0] <= second)
+            self.assertLess(distance_m(previous[1], previous[2], latitude, longitude), 100)
+
+    def test_parked_pings_update_live_position_only(self):
+        first = self.ping(9.01, 8.01)
+        self.assertEqual(first.status_code, 201)
+        self.assertTrue(first.json()['data']['persisted'])
+
+        second = self.ping(9.01001, 8.01)
+        self.assertEqual(second.status_code, 200)
+        self.assertFalse(second.json()['data']['persisted'])
+        self.assertEqual(self.ride.location_updates.count(), 1)
+        self.driver.refresh_from_db()
+        self.assertEqual(self.driver.current_latitude, 9.01001)
+
+    @override_settings(GPS_THROTTLE={'POLICIES': {'in_progress': {
+        'RATE': 0.01, 'BURST': 2, 'MIN_DISTANCE_M': 0, 'MIN_INTERVAL_S': 0, 'MAX_INTERVAL_S': 0,
+    }}})
+    def test_bursts_are_throttled(self):
+        self.assertEqual([self.ping(9.01, 8.01).status_code for _ in range(3)], [201, 201, 429])
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class HeartbeatTests(TestCase):
+    def setUp(self):
+        call_command('seed_data', users=5, drivers=3, rides=0, stdout=StringIO())
+        self.drivers = list(Driver.objects.select_related('user').order_by('id'))
+        Driver.objects.update(is_available=True, last_location_update=timezone.now())
+        monitor.reset()
+        self.addCleanup(monitor.reset)
+
+    def test_timing_wheel(self):
+        wheel = TimingWheel(horizon=60, tick=1.0, now=1000)
+        wheel.schedule('a', 1030)
+        wheel.schedule('b', 1045)
+        wheel.schedule('c', 900)  # already due: fires on the next turn
+        self.assertEqual(wheel.advance(1001), ['c'])
+        self.assertEqual(wheel.advance(1029), [])
+        wheel.schedule('a', 1050)  # a heartbeat moves the deadline
+        self.assertEqual(wheel.advance(1046), ['b'])
+        wheel.cancel('a')
+        self.assertEqual(wheel.advance(1200), [])
+        self.assertEqual(len(wheel), 0)
+
+    def test_sweep_expires_only_silent_drivers(self):
+        silent, heard_elsewhere, beating = self.drivers
+        now = time.time()
+        Driver.objects.filter(id=silent.id).update(last_location_update=timezone.now() - timedelta(minutes=5))
+        for driver in self.drivers:
+            monitor.beat(driver.id, at=now - 120)
+        monitor.beat(beating.id, at=now)
+
+        # Overdue deadlines fire on the wheel's next turn
+        with self.assertNumQueries(2):
+            self.assertEqual(monitor.sweep(now + 2), 1)
+        self.assertEqual(
+            set(Driver.objects.filter(is_available=True).values_list('id', flat=True)), {heard_elsewhere.id, beating.id}
+        )
+        # The driver another process heard from is back on the wheel at its real deadline
+        self.assertEqual(monitor.sweep(now + 3), 0)
+        self.assertEqual(monitor.sweep(now + 63), 2)
+        self.assertFalse(Driver.objects.filter(is_available=True).exists())
+
+    def test_drivers_heard_by_exited_processes_are_expired(self):
+        orphan = self.drivers[2]
+        Driver.objects.filter(id=orphan.id).update(is_available=False)
+        now = time.time()
+        monitor.sweep(now)
+        self.assertNotIn(orphan.id, monitor.wheel.slot_of)
+
+        # Made available by a process that exited before its heartbeats stopped
+        Driver.objects.filter(id=orphan.id).update(
+            is_available=True, last_location_update=timezone.now() - timedelta(minutes=5)
+        )
+        self.assertEqual(monitor.sweep(now + 2), 0)
+        monitor.sweep(now + 301)
+        self.assertFalse(Driver.objects.get(id=orphan.id).is_available)
+
+    def test_sweeper_starts_with_the_first_heartbeat(self):
+        self.addCleanup(setattr, monitor, 'autostart', False)
+        self.addCleanup(setattr, monitor, 'thread', None)
+        driver_id = self.drivers[0].id
+        with mock.patch('rides.heartbeats.threading.Thread') as thread:
+            monitor.beat(driver_id)
+            monitor.enable_sweeper()
+            thread.assert_not_called()
+            monitor.beat(driver_id)
+            monitor.beat(driver_id)
+            self.assertEqual(thread.call_count, 1)
+            # A worker forked from a process whose sweeper was running starts its own
+            with mock.patch('rides.heartbeats.os.getpid', return_value=-1):
+                monitor.beat(driver_id)
+            self.assertEqual(thread.call_count, 2)
+
+    def test_heartbeat_endpoint(self):
+        driver = self.drivers[0]
+        Driver.objects.filter(id=driver.id).update(is_available=False, last_location_update=None)
+        auth = {'HTTP_AUTHORIZATION': f"Bearer {RefreshToken.for_user(driver.user).access_token}"}
+
+        response = self.client.post(reverse('driver-heartbeat'), {'latitude': 6.5, 'longitude': 3.4},
+                                    content_type='application/json', **auth)
+        self.assertEqual(response.status_code, 200)
+        driver.refresh_from_db()
+        self.assertTrue(driver.is_available)
+        self.assertEqual((driver.current_latitude, driver.current_longitude), (6.5, 3.4))
+        self.assertIn(driver.id, monitor.wheel.slot_of)
+
+        # Form-encoded "nan" parses as a float and is not out of range
+        response = self.client.post(reverse('driver-heartbeat'), {'latitude': 'nan', 'longitude': 3.4}, **auth)
+        self.assertEqual(response.status_code, 400)
+
+        self.client.post(reverse('driver-heartbeat'), {'is_available': False}, content_type='application/json', **auth)
+        driver.refresh_from_db()
+        self.assertFalse(driver.is_available)
+        self.assertNotIn(driver.id, monitor.wheel.slot_of)
+
+        rider = User.objects.filter(driver_profile__isnull=True).first()
+        response = self.client.post(
+            reverse('driver-heartbeat'), {}, content_type='application/json',
+            HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(rider).access_token}",
+        )
+        self.assertEqual(response.status_code, 403)
+
+
+# Road grid around Lagos Island: streets every 0.002 degrees (about 220 m)
+GRID_ORIGIN = (6.450, 3.390)
+GRID_STEP = 0.002
+
+
+def write_road_grid(path, size=8, oneway=()):
+    with open(path, 'w', newline='') as fh:
+        writer = csv.writer(fh)
+        writer.writerow(['from_node', 'to_node', 'from_latitude', 'from_longitude', 'to_latitude', 'to_longitude', 'oneway'])
+        for row in range(size):
+            for col in range(size):
+                start = (GRID_ORIGIN[0] + row * GRID_STEP, GRID_ORIGIN[1] + col * GRID_STEP)
+                for end_row, end_col in ((row, col + 1), (row + 1, col)):
+                    if end_row < size and end_col < size:
+                        end = (GRID_ORIGIN[0] + end_row * GRID_STEP, GRID_ORIGIN[1] + end_col * GRID_STEP)
+                        writer.writerow([
+                            f"{row}-{col}", f"{end_row}-{end_col}", *start, *end,
+                            'yes' if (row, col, end_row, end_col) in oneway else 'no',
+                        ])
+
+
+def noisy_trace(seed=7):
+    """
+    East along street row 1 from column 1 to 5, then north along column 5 to row 4, with about 6 m of GPS error.
+    """
+    rng = random.Random(seed)
+    row, col = GRID_ORIGIN[0] + GRID_STEP, GRID_ORIGIN[1] + 5 * GRID_STEP
+    points = [(row, GRID_ORIGIN[1] + GRID_STEP + index * 0.0001) for index in range(81)]
+    points += [(row + index * 0.0001, col) for index in range(1, 61)]
+    return [(lat + rng.gauss(0, 6) / 111000, lon + rng.gauss(0, 6) / 111000) for lat, lon in points]
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class MapMatchingTests(TestCase):
+    def setUp(self):
+        self.graph_dir = tempfile.mkdtemp()
+        self.roads_file = os.path.join(self.graph_dir, 'roads.csv')
+        write_road_grid(self.roads_file)
+        self.settings_override = override_settings(MAP_MATCHING={
+            'ROADS_FILE': self.roads_file, 'GRAPH_PATH': os.path.join(self.graph_dir, 'graph.npz'), 'WORKERS': 1,
+        })
+        self.settings_override.enable()
+        reset_map_matcher()
+
+    def tearDown(self):
+        reset_map_matcher()
+        self.settings_override.disable()
+        shutil.rmtree(self.graph_dir)
+
+    def completed_ride(self, trace):
+        call_command('seed_data', users=2, drivers=1, rides=0, stdout=StringIO())
+        ride = Ride.objects.create(
+            user=User.objects.filter(driver_profile__isnull=True).first(), driver=Driver.objects.get(),
+            category=RideCategory.objects.filter(is_pooled=False).first(), status='in_progress',
+            pickup_latitude=trace[0][0], pickup_longitude=trace[0][1], pickup_address='A',
+            destination_latitude=trace[-1][0], destination_longitude=trace[-1][1], destination_address='B',
+            estimated_distance_km=2, estimated_duration_minutes=6, base_fare=500, distance_fare=200,
+            time_fare=60, total_fare=760,
+        )
+        locations = RideLocation.objects.bulk_create(
+            RideLocation(ride=ride, latitude=lat, longitude=lon) for lat, lon in trace
+        )
+        # auto_now_add stamps them all at once; space them out like the driver app does
+        started = timezone.now() - timedelta(minutes=10)
+        for index, location in enumerate(locations):
+            location.timestamp = started + timedelta(seconds=3 * index)
+        RideLocation.objects.bulk_update(locations, ['timestamp'])
+        self.assertTrue(ride.complete())
+        return ride
+
+    def test_graph_keeps_one_way_streets_in_one_direction(self):
+        write_road_grid(self.roads_file, size=2, oneway={(0, 0, 0, 1)})
+        graph = RoadGraph.from_csv(self.roads_file, 0.005)
+        self.assertEqual((len(graph.node_coords), len(graph)), (4, 7))
+        one_way = [(graph.segment_from[index], graph.segment_to[index]) for index in range(len(graph))]
+        self.assertEqual(one_way.count((0, 1)) + one_way.count((1, 0)), 1)
+
+    def test_noisy_trace_follows_the_streets(self):
+        graph = build_road_graph()
+        result = MapMatcher(RoadGraph.load(os.path.join(self.graph_dir, 'graph.npz')), **matcher_options()).match(
+            noisy_trace()
+        )
+        # 4 blocks east and 3 north, less the few metres the first and last fixes are off the corners
+        expected = 7 * GRID_STEP * 111000
+        self.assertLess(abs(result.distance_m - expected), 0.03 * expected)
+        self.assertEqual(result.points_total, 141)
+        corner = [round(GRID_ORIGIN[0] + GRID_STEP, 6), round(GRID_ORIGIN[1] + 5 * GRID_STEP, 6)]
+        self.assertIn(corner, result.path)
+        for lat, lon in result.path:
+            self.assertTrue(abs(lat - corner[0]) < 1e-6 or abs(lon - corner[1]) < 1e-6, (lat, lon))
+        self.assertEqual(len(graph), 2 * 2 * 8 * 7)
+
+    def test_completed_rides_are_matched_after_completion(self):
+        ride = self.completed_ride(noisy_trace())
+        job = Job.objects.get(task='rides.tasks.match_ride_routes')
+        self.assertEqual((job.queue, job.payload), ('map_matching', {'ride_id': str(ride.id)}))
+
+        build_road_graph()
+        self.assertEqual(match_rides([ride.id]), 1)
+        route = MatchedRoute.objects.get(ride=ride)
+        self.assertAlmostEqual(float(route.distance_km), 7 * GRID_STEP * 111, delta=0.05)
+        self.assertEqual(route.points_total, 141)
+        ride.refresh_from_db()
+        self.assertEqual(ride.actual_distance_km, route.distance_km.quantize(Decimal('0.01')))
+
+        # Matching again replaces the route and keeps the distance the driver app reported
+        Ride.objects.filter(pk=ride.pk).update(actual_distance_km=Decimal('9.99'))
+        self.assertEqual(match_rides([ride.id], workers=2), 1)
+        self.assertEqual(MatchedRoute.objects.get(ride=ride).path, route.path)
+        ride.refresh_from_db()
+        self.assertEqual(ride.actual_distance_km, Decimal('9.99'))
+
+    def test_trace_off_the_roads_is_not_stored(self):
+        # The same drive 5 km north of the grid, where no fix is near a road
+        ride = self.completed_ride([(lat + 0.045, lon) for lat, lon in noisy_trace()])
+        build_road_graph()
+        self.assertEqual(match_rides([ride.id]), 0)
+        self.assertFalse(MatchedRoute.objects.exists())
+        ride.refresh_from_db()
+        self.assertIsNone(ride.actual_distance_km)
+
+    def test_matching_is_skipped_without_a_graph(self):
+        ride = self.completed_ride(noisy_trace())
+        with self.assertLogs('rides.map_matching', 'WARNING') as logs:
+            self.assertEqual(match_rides([ride.id]), 0)
+            self.assertEqual(match_rides([ride.id]), 0)
+        self.assertEqual(len(logs.records), 1)
+        self.assertFalse(MatchedRoute.objects.exists())
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class TraceSimplificationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='trace@example.com', password='pass', phone_number='+2348000000501', full_name='Trace'
+        )
+        self.auth = {'HTTP_AUTHORIZATION': f"Bearer {RefreshToken.for_user(self.user).access_token}"}
+        category = RideCategory.objects.create(
+            name='Standard', description='', base_fare=500, per_km_rate=100, per_minute_rate=10
+        )
+        self.ride = Ride.objects.create(
+            user=self.user, category=category, status='completed', pickup_latitude=6.45, pickup_longitude=3.39,
+            pickup_address='A', destination_latitude=6.47, destination_longitude=3.41, destination_address='B',
+            estimated_distance_km=5, estimated_duration_minutes=15, base_fare=500, distance_fare=500,
+            time_fare=150, total_fare=1150,
+        )
+        # North for 2 km, then east for 2 km, a point every 20 m with up to 2 m of wobble
+        points = [(6.45 + index * 0.00018, 3.39 + (index % 2) * 0.00002) for index in range(101)]
+        points += [(6.468, 3.39 + index * 0.00018) for index in range(1, 101)]
+        locations = RideLocation.objects.bulk_create(
+            RideLocation(ride=self.ride, latitude=lat, longitude=lon) for lat, lon in points
+        )
+        started = timezone.now() - timedelta(hours=1)
+        for index, location in enumerate(locations):
+            location.timestamp = started + timedelta(seconds=3 * index)
+        RideLocation.objects.bulk_update(locations, ['timestamp'])
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def detail(self, **params):
+        return self.client.get(reverse('ride-detail', args=[self.ride.id]), params, **self.auth)
+
+    def test_polyline_encoding(self):
+        # Google's worked example
+        self.assertEqual(
+            encode_polyline([(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]), '_p~iF~ps|U_ulLnnqC_mqNvxq`@'
+        )
+
+    def test_simplify_keeps_corners_and_turnarounds(self):
+        north = [(6.45 + index * 0.0001, 3.39) for index in range(50)]
+        east = [(6.4549, 3.39 + index * 0.0001) for index in range(1, 50)]
+        self.assertEqual(simplify(north + east, 5).tolist(), [list(north[0]), list(north[-1]), list(east[-1])])
+        # A line through both ends would hide the turnaround
+        self.assertEqual(len(simplify(north + north[-2::-1], 5)), 3)
+
+    def test_detail_returns_simplified_route(self):
+        response = self.detail()
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertNotIn('location_updates', data)
+        route = data['route']
+        self.assertEqual((route['points_total'], route['points_kept']), (201, 3))
+        self.assertEqual(route['points'][1], [6.468, 3.39])
+        self.assertEqual(route['tolerance_m'], 5.0)
+
+        full = self.detail(trace='full').json()
+        self.assertEqual(len(full['location_updates']), 201)
+        self.assertGreater(len(json.dumps(full)), 10 * len(json.dumps(data)))
+
+        polyline = self.detail(zoom=12, encoding='polyline').json()['route']
+        self.assertEqual(polyline['polyline'], encode_polyline(route['points']))
+        self.assertGreater(polyline['tolerance_m'], route['tolerance_m'])
+
+    def test_finished_rides_are_served_from_cache(self):
+        self.detail(zoom=15)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.detail(zoom=15).status_code, 200)
+        self.assertFalse(any('rides_ridelocation' in query['sql'] for query in ctx.captured_queries))
+
+        # Active rides' traces still grow, so they are read every time
+        Ride.objects.filter(pk=self.ride.pk).update(status='in_progress')
+        self.detail(zoom=15)
+        with CaptureQueriesContext(connection) as ctx:
+            self.detail(zoom=15)
+        self.assertTrue(any('rides_ridelocation' in query['sql'] for query in ctx.captured_queries))
+
+    def test_lists_leave_out_routes_unless_asked(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('ride-history'), **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('route', response.json()['results'][0])
+        self.assertFalse(any('rides_ridelocation' in query['sql'] for query in ctx.captured_queries))
+
+        rides = self.client.get(reverse('ride-history'), {'route': 'true'}, **self.auth).json()['results']
+        self.assertEqual(rides[0]['route']['points_kept'], 3)
+
+    def test_invalid_parameters(self):
+        response = self.detail(zoom='far', encoding='geojson', tolerance='-1')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()['errors']), {'zoom', 'encoding', 'tolerance'})
+
+
+class GeocoderTests(TestCase):
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(GEOCODER={'INDEX_DIR': self.index_dir})
+        self.settings_override.enable()
+        geocoder.reset_geocoder()
+
+    def tearDown(self):
+        geocoder.reset_geocoder()
+        self.settings_override.disable()
+        shutil.rmtree(self.index_dir)
+
+    def test_nearest_place(self):
+        lookup = geocoder.get_geocoder()
+        place = lookup.nearest(9.0585, 7.4960)
+        self.assertEqual(place.label, 'Central Business District, Abuja')
+        self.assertLess(place.distance_m, 200)
+        self.assertEqual(lookup.nearest(9.0585, 7.4960), place)
+        # Far from every shipped place
+        self.assertIsNone(lookup.nearest(0.0, 0.0))
+
+    def test_index_is_rebuilt_when_places_change(self):
+        places_file = os.path.join(self.index_dir, 'places.csv')
+        with open(places_file, 'w') as fh:
+            fh.write('name,region,latitude,longitude\nOld Place,,9.0,8.0\n')
+        with override_settings(GEOCODER={'INDEX_DIR': self.index_dir, 'PLACES_FILE': places_file}):
+            self.assertEqual(geocoder.get_geocoder().nearest(9.0, 8.0).label, 'Old Place')
+            with open(places_file, 'w') as fh:
+                fh.write('name,region,latitude,longitude\nNew Place,,9.0,8.0\n')
+            os.utime(places_file, (0, 1))
+            geocoder.reset_geocoder()
+            self.assertEqual(geocoder.get_geocoder().nearest(9.0, 8.0).label, 'New Place')
+
+    def test_fills_missing_and_placeholder_addresses(self):
+        call_command('seed_data', users=2, drivers=0, rides=0, stdout=StringIO())
+        user = User.objects.first()
+        auth = {'HTTP_AUTHORIZATION': f"Bearer {RefreshToken.for_user(user).access_token}"}
+        response = self.client.post(reverse('ride-list'), {
+            'category_id': str(RideCategory.objects.filter(is_pooled=False).first().id),
+            'pickup_latitude': '9.076500', 'pickup_longitude': '7.472900', 'pickup_address': 'Current Location',
+            'destination_latitude': '9.150000', 'destination_longitude': '7.450000',
+            'estimated_distance_km': '5.00', 'estimated_duration_minutes': 15,
+        }, content_type='application/json', **auth)
+        self.assertEqual(response.status_code, 201)
+        data = response.json()['data']
+        self.assertEqual(data['pickup_address'], 'Wuse, Abuja')
+        self.assertEqual(data['destination_address'], 'Near Gwarinpa, Abuja')
+
+        location = UserLocation.objects.create(user=user, name='Home', address='', latitude=6.4282, longitude=3.4220)
+        self.assertEqual(location.address, 'Victoria Island, Lagos')
+        location = UserLocation.objects.create(user=user, name='Office', address='Plot 5', latitude=6.4282, longitude=3.4220)
+        self.assertEqual(location.address, 'Plot 5')
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class DriverEarningsExportTests(TestCase):
+    def setUp(self):
+        call_command('seed_data', users=10, drivers=3, rides=60, locations_per_ride=0, days=10, stdout=StringIO())
+        admin = User.objects.create_superuser(
+            email='admin@example.com', password='pass', phone_number='+2348111111111', full_name='Admin'
+        )
+        self.auth = {'HTTP_AUTHORIZATION': f"Bearer {RefreshToken.for_user(admin).access_token}"}
+        self.url = reverse('driver-earnings-export')
+
+    def read_csv(self, response):
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode()
+        return list(csv.DictReader(io.StringIO(content)))
+
+    def test_summary_matches_completed_rides(self):
+        rows = self.read_csv(self.client.get(self.url, **self.auth))
+        completed = Ride.objects.filter(status='completed')
+        self.assertEqual(len(rows), completed.values('driver_id').distinct().count())
+        for row in rows:
+            rides = completed.filter(driver_id=row['driver_id'])
+            self.assertEqual(int(row['trips']), rides.count())
+            self.assertEqual(Decimal(row['total_fare']), sum(ride.total_fare for ride in rides))
+
+    def test_trips_within_date_range(self):
+        start = (timezone.now() - timedelta(days=3)).date().isoformat()
+        rows = self.read_csv(self.client.get(self.url, {'kind': 'trips', 'start': start}, **self.auth))
+        expected = Ride.objects.filter(status='completed', completed_at__date__gte=start)
+        self.assertEqual({row['ride_id'] for row in rows}, {str(pk) for pk in expected.values_list('id', flat=True)})
+
+        self.assertEqual(self.client.get(self.url, {'start': 'yesterday'}, **self.auth).status_code, 400)
+        response = self.client.get(self.url, {'driver': 'abc'}, **self.auth)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('driver', response.json()['errors'])
+
+    def test_command_writes_same_csv(self):
+        response_content = b''.join(self.client.get(self.url, **self.auth).streaming_content).decode()
+        out = StringIO()
+        call_command('export_driver_earnings', stdout=out)
+        self.assertEqual(out.getvalue(), response_content)
+
+    def test_export_is_admin_only(self):
+        rider = User.objects.filter(is_superuser=False).first()
+        auth = {'HTTP_AUTHORIZATION': f"Bearer {RefreshToken.for_user(rider).access_token}"}
+        self.assertEqual(self.client.get(self.url, **auth).status_code, 403)
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class RideHistoryExportTests(TestCase):
+    def setUp(self):
+        call_command('seed_data', users=3, drivers=1, rides=90, locations_per_ride=0, stdout=StringIO())
+        self.user = User.objects.filter(driver_profile__isnull=True).order_by('-total_rides').first()
+        self.auth = {'HTTP_AUTHORIZATION': f"Bearer {RefreshToken.for_user(self.user).access_token}"}
+        self.url = reverse('ride-export')
+
+    def test_streams_whole_history_in_one_query(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url, **self.auth)
+            content = b''.join(response.streaming_content).decode()
+        rows = [json.loads(line) for line in content.splitlines()]
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(len(rows), self.user.rides.count())
+        self.assertGreater(len(rows), 10)
+        self.assertEqual([r['requested_at'] for r in rows], sorted((r['requested_at'] for r in rows), reverse=True))
+        ride = self.user.rides.select_related('category').get(pk=rows[0]['id'])
+        self.assertEqual(rows[0]['category'], ride.category.name)
+        self.assertEqual(rows[0]['total_fare'], str(ride.total_fare))
+        self.assertEqual(len([q for q in ctx.captured_queries if 'rides_ride' in q['sql']]), 1)
+
+    def test_gzip(self):
+        plain = b''.join(self.client.get(self.url, **self.auth).streaming_content)
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, deflate', **self.auth)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), plain)
+
+    def test_only_own_rides(self):
+        other = User.objects.exclude(pk=self.user.pk).filter(driver_profile__isnull=True).first()
+        auth = {'HTTP_AUTHORIZATION': f"Bearer {RefreshToken.for_user(other).access_token}"}
+        content = b''.join(self.client.get(self.url, HTTP_ACCEPT='application/x-ndjson', **auth).streaming_content)
+        ids = {json.loads(line)['id'] for line in content.decode().splitlines()}
+        self.assertEqual(ids, {str(pk) for pk in other.rides.values_list('id', flat=True)})
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    def test_reads_follow_context(self):
+        router = ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Ride))
+        with read_from('replica1'):
+            self.assertEqual(router.db_for_read(Ride), 'replica1')
+            self.assertEqual(router.db_for_write(Ride), 'default')
+        self.assertIsNone(router.db_for_read(Ride))
+
+    @override_settings(DATABASE_ROUTING={'REPLICAS': ['replica1']})
+    def test_no_migrations_on_replicas(self):
+        router = ReplicaRouter()
+        self.assertFalse(router.allow_migrate('replica1', 'rides'))
+        self.assertIsNone(router.allow_migrate('default', 'rides'))
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS, DATABASE_ROUTING={'REPLICAS': ['default'], 'PIN_SECONDS': 5})
+class ReplicaRoutingMiddlewareTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            email='rider@example.com', password='pass', phone_number='+2348000000001', full_name='Rider'
+        )
+        self.auth = self.auth_for(issued_ago=60)
+
+    def auth_for(self, issued_ago):
+        token = RefreshToken.for_user(self.user).access_token
+        token['iat'] = int(time.time()) - issued_ago
+        return {'HTTP_AUTHORIZATION': f"Bearer {token}"}
+
+    def routes(self, url, **extra):
+        before = metrics.collect()
+        response = self.client.get(url, **extra)
+        self.assertEqual(response.status_code, 200)
+        after = metrics.collect()
+        return {
+            route: after.get(('database_read_routes_total', (route,)), 0)
+            - before.get(('database_read_routes_total', (route,)), 0)
+            for route in ('replica', 'pinned')
+        }
+
+    def test_annotated_views_read_from_replica(self):
+        for name in ('ridecategory-list', 'ride-history', 'home-data', 'profile'):
+            self.assertEqual(self.routes(reverse(name), **self.auth), {'replica': 1, 'pinned': 0}, name)
+
+    def test_other_views_stay_on_primary(self):
+        for name in ('ride-list', 'ride-active'):
+            self.assertEqual(self.routes(reverse(name), **self.auth), {'replica': 0, 'pinned': 0}, name)
+
+    def test_pinned_after_own_write(self):
+        response = self.client.patch(
+            reverse('profile'), {'full_name': 'New Name'}, content_type='application/json', **self.auth
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.routes(reverse('profile'), **self.auth), {'replica': 0, 'pinned': 1})
+
+    def test_pinned_after_token_issued(self):
+        self.assertEqual(self.routes(reverse('home-data'), **self.auth_for(issued_ago=0)), {'replica': 0, 'pinned': 1})
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class EtaTests(TestCase):
+    def setUp(self):
+        call_command('seed_data', users=5, drivers=3, rides=0, stdout=StringIO())
+        self.table_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.table_dir)
+        settings_override = override_settings(ETA={'TABLE_PATH': os.path.join(self.table_dir, 'speeds.npz')})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        reset_speed_table()
+        self.addCleanup(reset_speed_table)
+
+        self.user = User.objects.filter(driver_profile__isnull=True).first()
+        self.auth = {'HTTP_AUTHORIZATION': f"Bearer {RefreshToken.for_user(self.user).access_token}"}
+        self.drivers = list(Driver.objects.order_by('id'))
+        Driver.objects.update(is_available=False)
+
+    def drive(self, started, speed_ms, pings=60):
+        # One ping a minute heading north from Lagos at a constant speed
+        ride = Ride.objects.create(
+            user=self.user, category=RideCategory.objects.filter(is_pooled=False).first(), driver=self.drivers[0], status='completed',
+            pickup_latitude=6.5, pickup_longitude=3.35, pickup_address='A', destination_latitude=6.6,
+            destination_longitude=3.35, destination_address='B', estimated_distance_km=5,
+            estimated_duration_minutes=10, base_fare=1, distance_fare=1, time_fare=1, total_fare=3,
+        )
+        step = speed_ms * 60 / 111195
+        for i in range(pings):
+            update = RideLocation.objects.create(ride=ride, latitude=round(6.5 + i * step, 6), longitude=3.35)
+            RideLocation.objects.filter(pk=update.pk).update(timestamp=started + timedelta(minutes=i))
+
+    def place_driver(self, driver, latitude, longitude):
+        Driver.objects.filter(pk=driver.pk).update(
+            is_available=True, current_latitude=latitude, current_longitude=longitude,
+            last_location_update=timezone.now(),
+        )
+
+    def test_hour_of_week_is_local(self):
+        monday_utc = datetime(2026, 10, 19, 7, tzinfo=dt_timezone.utc)
+        self.assertEqual(int(hours_of_week(monday_utc.timestamp(), 1)), 8)
+        self.assertEqual(int(hours_of_week((monday_utc - timedelta(hours=9)).timestamp(), 1)), 167)
+
+    def test_learns_speeds_by_hour(self):
+        monday = datetime(2026, 10, 19, 7, tzinfo=dt_timezone.utc)
+        self.drive(monday, speed_ms=4)
+        self.drive(monday + timedelta(hours=6), speed_ms=12, pings=20)
+        table = build_speed_table(cell_size=0.1, min_sample_seconds=600)
+
+        self.assertGreater(len(table.keys), 0)
+        self.assertAlmostEqual(table.lookup([6.55], [3.35], 8)[0], 4, delta=0.2)
+        self.assertAlmostEqual(table.lookup([6.55], [3.35], 14)[0], 12, delta=0.5)
+        # Unknown hours fall back to the cell average, unknown cells to the default
+        self.assertTrue(4 < table.lookup([6.55], [3.35], 3)[0] < 12)
+        self.assertAlmostEqual(table.lookup([9.0], [7.5], 8)[0], 4, delta=0.2)
+        self.assertAlmostEqual(table.lookup([9.0], [7.5], 3)[0], 25 / 3.6, places=3)
+
+    def test_waiting_drivers_do_not_stop_the_clock(self):
+        # A driver queueing in one spot for an hour teaches the table nothing
+        self.drive(datetime(2026, 10, 19, 7, tzinfo=dt_timezone.utc), speed_ms=0)
+        table = build_speed_table(cell_size=0.1, min_sample_seconds=600)
+        self.assertEqual(len(table.keys), 0)
+
+        # A table that still holds a speed of 0 is read as walking pace
+        cell = cell_keys([6.5], [3.35], 0.01)
+        SpeedTable(cell, [[0.0] * 168], [float('nan')] * 168, 0.01, 1, 25 / 3.6).save(os.path.join(self.table_dir, 'speeds.npz'))
+        self.place_driver(self.drivers[0], 6.501, 3.35)
+        estimate = estimate_pickup(6.5, 3.35)
+        self.assertAlmostEqual(estimate['eta_seconds'], 111 * 1.3 / 1.0, delta=2)
+        response = self.client.get(reverse('home-data'), {'latitude': 6.5, 'longitude': 3.35}, **self.auth)
+        self.assertEqual(response.data['data']['pickup_eta_minutes'], 3)
+        self.assertIsNone(eta_minutes(float('inf')))
+
+    def test_command_writes_table(self):
+        self.drive(timezone.now() - timedelta(hours=2), speed_ms=8)
+        out = StringIO()
+        call_command('build_speed_table', lookups=10, stdout=out)
+        self.assertIn('ETA computations', out.getvalue())
+        self.assertTrue(os.path.exists(os.path.join(self.table_dir, 'speeds.npz')))
+
+    def test_estimate_uses_nearest_drivers(self):
+        self.place_driver(self.drivers[0], 6.52, 3.35)
+        self.place_driver(self.drivers[1], 6.54, 3.35)
+        self.place_driver(self.drivers[2], 7.5, 3.35)
+
+        estimate = estimate_pickup(6.5, 3.35)
+        self.assertEqual(estimate['nearby_drivers'], 2)
+        self.assertEqual(estimate['driver_id'], self.drivers[0].pk)
+        # 2.2 km straight, 1.3 road factor, 25 km/h default speed
+        self.assertAlmostEqual(estimate['eta_seconds'], 2224 * 1.3 / (25 / 3.6), delta=5)
+
+    def test_home_and_ride_request_show_eta(self):
+        self.place_driver(self.drivers[0], 6.52, 3.35)
+        response = self.client.get(reverse('home-data'), {'latitude': 6.5, 'longitude': 3.35}, **self.auth)
+        self.assertEqual(response.data['data']['nearby_drivers_count'], 1)
+        self.assertEqual(response.data['data']['pickup_eta_minutes'], 7)
+        for params in ({'latitude': 'x'}, {'latitude': 'nan', 'longitude': 3.35},
+                       {'latitude': 'inf', 'longitude': 3.35}, {'latitude': 95, 'longitude': 3.35}):
+            response = self.client.get(reverse('home-data'), params, **self.auth)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn('latitude', response.json()['errors'])
+
+        response = self.client.post(reverse('ride-list'), {
+            'category_id': str(RideCategory.objects.filter(is_pooled=False).first().id),
+            'pickup_latitude': '6.500000', 'pickup_longitude': '3.350000', 'pickup_address': 'Pickup',
+            'destination_latitude': '6.600000', 'destination_longitude': '3.350000', 'destination_address': 'Dest',
+            'estimated_distance_km': '11.00', 'estimated_duration_minutes': 20,
+        }, content_type='application/json', **self.auth)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['data']['pickup_eta_minutes'], 7)
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS, ETA={'TABLE_PATH': None})
+class DispatchSimulatorTests(TestCase):
+    def setUp(self):
+        reset_speed_table()
+        self.addCleanup(reset_speed_table)
+
+    def demand(self, times):
+        count = len(times)
+        return Demand(times, [(6.5, 3.35)] * count, [(6.53, 3.35)] * count, ['Standard'] * count, [600] * count, [2000] * count)
+
+    def test_second_rider_waits_for_the_only_driver(self):
+        demand = self.demand([1000, 1010])
+        fleet = Fleet([(6.51, 3.35)], [0], [10000])
+        report = Simulation(demand, fleet, nearest_driver_policy, patience=3600).run()
+
+        self.assertEqual(report['completed'], 2)
+        self.assertEqual(report['completion_rate'], 1.0)
+        self.assertEqual(fleet.trips[0], 2)
+        # The second rider waits for the first trip and the 3.3 km back to the pickup
+        self.assertGreater(report['wait_p99_s'], 600)
+        self.assertLess(report['wait_p50_s'], report['wait_p99_s'])
+        self.assertEqual(report['revenue'], 4000)
+        self.assertGreater(report['utilization'], 0)
+
+    def test_riders_give_up_without_drivers(self):
+        def never_assign(request, simulation):
+            return None, request.standard_fare
+
+        demand = self.demand([0, 60, 120])
+        report = Simulation(demand, Fleet.synthetic(demand, 3, seed=1), never_assign, patience=300).run()
+        self.assertEqual(report['abandoned'], 3)
+        self.assertEqual(report['completion_rate'], 0.0)
+        self.assertGreaterEqual(report['policy_calls'], 3)
+
+    def test_surge_declines(self):
+        def double_fare(request, simulation):
+            driver, _ = simulation.fleet.nearest_available(request.latitude, request.longitude)
+            return driver, request.standard_fare * 2
+
+        demand = self.demand([0])
+        report = Simulation(demand, Fleet([(6.5, 3.35)], [-1], [10000]), double_fare, price_elasticity=50).run()
+        self.assertEqual(report['declined'], 1)
+
+    def test_command_replays_rides(self):
+        call_command('seed_data', users=10, drivers=2, rides=40, locations_per_ride=0, stdout=StringIO())
+        out = StringIO()
+        call_command('simulate_dispatch', drivers=5, seed=1, json=True, stdout=out)
+        report = json.loads(out.getvalue())
+
+        latest = Ride.objects.latest('requested_at').requested_at
+        self.assertEqual(report['requests'], Ride.objects.filter(requested_at__gt=latest - timedelta(days=1)).count())
+        self.assertEqual(report['completed'] + report['abandoned'] + report['declined'], report['requests'])
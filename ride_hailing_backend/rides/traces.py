@@ -0,0 +1,179 @@
+"""
+Simplified ride traces for API responses.
+
+A long ride stores thousands of RideLocation points, far more than a phone
+can draw at any zoom level. Responses carry the trace simplified with
+Douglas-Peucker instead: points closer than the tolerance to the line kept
+through their neighbours are dropped. The tolerance is given in metres
+(?tolerance=) or derived from a map zoom level (?zoom=) as PIXEL_TOLERANCE
+pixels at that zoom, and the points come as [latitude, longitude] pairs or,
+with ?encoding=polyline, as one encoded polyline string.
+
+Traces of finished rides never change, so their simplified versions are
+cached per tolerance and encoding.
+"""
+import math
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import serializers
+
+from .models import RideLocation
+
+
+DEFAULTS = {
+    # Django cache alias holding the simplified traces of finished rides
+    'CACHE': 'default',
+    'CACHE_TIMEOUT': 86400,
+    # Allowed error in screen pixels when the tolerance comes from ?zoom=
+    'PIXEL_TOLERANCE': 1.0,
+    # Zoom of a street-level map, used when the request gives neither parameter
+    'DEFAULT_ZOOM': 16,
+    # GPS fixes are no more accurate than this; finer tolerances only keep noise
+    'MIN_TOLERANCE_M': 5.0,
+    'MAX_TOLERANCE_M': 1000.0,
+    # Decimal places kept by encoded polylines; 5 is what most map SDKs decode
+    'POLYLINE_PRECISION': 5,
+}
+
+ENCODINGS = ('points', 'polyline')
+FINISHED_STATUSES = ('completed', 'cancelled')
+# Web Mercator metres per pixel of a 256-pixel tile at zoom 0 on the equator
+METRES_PER_PIXEL = 156543.03392
+METRES_PER_DEGREE = 6371000.0 * math.pi / 180
+
+
+def get_trace_setting(name):
+    return getattr(settings, 'TRACES', {}).get(name, DEFAULTS[name])
+
+
+def _cache():
+    return caches[get_trace_setting('CACHE')]
+
+
+def tolerance_for_zoom(zoom, latitude):
+    """
+    Metres covered by PIXEL_TOLERANCE pixels at a map zoom level and latitude.
+    """
+    return METRES_PER_PIXEL * math.cos(math.radians(latitude)) / 2 ** zoom * get_trace_setting('PIXEL_TOLERANCE')
+
+
+def route_options(query_params):
+    """
+    Read ?tolerance=, ?zoom= and ?encoding= from a request, raising ValidationError for bad values.
+    """
+    options = {}
+    errors = {}
+    checks = (
+        ('tolerance', float, lambda value: 0 < value < math.inf, 'Must be a positive number of metres'),
+        ('zoom', int, lambda value: 0 <= value <= 24, 'Must be a whole number from 0 to 24'),
+    )
+    for name, cast, valid, message in checks:
+        value = query_params.get(name)
+        if value in (None, ''):
+            continue
+        try:
+            options[name] = cast(value)
+        except ValueError:
+            errors[name] = message
+            continue
+        if not valid(options[name]):
+            errors[name] = message
+    encoding = query_params.get('encoding') or 'points'
+    if encoding not in ENCODINGS:
+        errors['encoding'] = f"Must be one of: {', '.join(ENCODINGS)}"
+    options['encoding'] = encoding
+    if errors:
+        raise serializers.ValidationError(errors)
+    return options
+
+
+def simplify(points, tolerance_m):
+    """
+    Douglas-Peucker simplification of an (n, 2) array of coordinates.
+
+    Distances are measured to the kept segment rather than its whole line,
+    so traces that double back on themselves keep their turning points.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(points) < 3:
+        return points
+    # Flat projection around the trace; exact enough for a city-sized ride
+    x = points[:, 1] * METRES_PER_DEGREE * math.cos(math.radians(float(points[:, 0].mean())))
+    y = points[:, 0] * METRES_PER_DEGREE
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        ax, ay = x[first], y[first]
+        dx, dy = x[last] - ax, y[last] - ay
+        squared = dx * dx + dy * dy
+        px, py = x[first + 1:last] - ax, y[first + 1:last] - ay
+        t = np.clip((px * dx + py * dy) / squared, 0, 1) if squared else 0.0
+        distances = np.hypot(px - t * dx, py - t * dy)
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance_m:
+            split = first + 1 + farthest
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return points[keep]
+
+
+def encode_polyline(points, precision=5):
+    """
+    Encode coordinates in Google's encoded polyline format.
+    """
+    factor = 10 ** precision
+    chunks = []
+    previous_lat = previous_lon = 0
+    for latitude, longitude in points:
+        lat, lon = round(latitude * factor), round(longitude * factor)
+        for delta in (lat - previous_lat, lon - previous_lon):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            chunks.append(chr(value + 63))
+        previous_lat, previous_lon = lat, lon
+    return ''.join(chunks)
+
+
+def resolve_tolerance(ride, tolerance=None, zoom=None):
+    if tolerance is None:
+        zoom = get_trace_setting('DEFAULT_ZOOM') if zoom is None else zoom
+        tolerance = tolerance_for_zoom(zoom, ride.pickup_latitude)
+    tolerance = min(max(tolerance, get_trace_setting('MIN_TOLERANCE_M')), get_trace_setting('MAX_TOLERANCE_M'))
+    # Rounded so nearby tolerances share a cache entry
+    return round(tolerance, 1)
+
+
+def ride_route(ride, tolerance=None, zoom=None, encoding='points'):
+    """
+    The ride's GPS trace simplified for display, cached once the ride is finished.
+    """
+    tolerance = resolve_tolerance(ride, tolerance, zoom)
+    cacheable = ride.status in FINISHED_STATUSES
+    key = f"trace:{ride.id}:{tolerance}:{encoding}"
+    if cacheable:
+        route = _cache().get(key)
+        if route is not None:
+            return route
+
+    rows = RideLocation.objects.filter(ride_id=ride.id).order_by('timestamp').values_list('latitude', 'longitude')
+    trace = list(rows)
+    kept = [[round(float(lat), 6), round(float(lon), 6)] for lat, lon in simplify(trace, tolerance)]
+    route = {'tolerance_m': tolerance, 'points_total': len(trace), 'points_kept': len(kept)}
+    if encoding == 'polyline':
+        precision = get_trace_setting('POLYLINE_PRECISION')
+        route.update(polyline=encode_polyline(kept, precision), precision=precision)
+    else:
+        route['points'] = kept
+
+    if cacheable:
+        _cache().set(key, route, get_trace_setting('CACHE_TIMEOUT'))
+    return route
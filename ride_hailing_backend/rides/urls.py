@@ -4,7 +4,9 @@ from .views import (
     RideCategoryViewSet,
     RideViewSet,
     RideLocationUpdateView,
-    HomePageDataView
+    DriverHeartbeatView,
+    HomePageDataView,
+    DriverEarningsExportView
 )
 
 router = DefaultRouter()
@@ -14,5 +16,7 @@ router.register(r'rides', RideViewSet, basename='ride')
 urlpatterns = [
     path('', include(router.urls)),
     path('location-update/', RideLocationUpdateView.as_view(), name='location-update'),
+    path('drivers/heartbeat/', DriverHeartbeatView.as_view(), name='driver-heartbeat'),
     path('home/', HomePageDataView.as_view(), name='home-data'),
+    path('exports/driver-earnings/', DriverEarningsExportView.as_view(), name='driver-earnings-export'),
 ]
@@ -1,10 +1,24 @@
+import uuid
 from rest_framework import viewsets, status, generics, permissions
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.exceptions import Throttled
+from rest_framework.renderers import JSONRenderer
 from django.db.models import Q
+from django.http import StreamingHttpResponse
 from django.utils import timezone
 from datetime import timedelta
+from ride_hailing_backend.db_routing import replica_reads
+from .exports import (
+    KINDS, NDJSONRenderer, buffered, export_rows, gzip_stream, iter_csv, parse_bound, ride_history_lines
+)
+from .heartbeats import get_heartbeat_setting, monitor
+from .gps import get_policy, take_token, should_persist, remember_persisted
+from .idempotency import idempotent
 from .models import Driver, RideCategory, Ride, RideLocation
+from .pooling import insert_ride
+from .metrics import LOCATION_UPDATES, LOCATION_UPDATES_SKIPPED, RIDES_CREATED, RIDES_CANCELLED
+from .tasks import update_driver_ratings
 from .serializers import (
     DriverSerializer,
     RideCategorySerializer,
@@ -12,10 +26,13 @@ from .serializers import (
     RideRequestSerializer,
     RideFeedbackSerializer,
     RideLocationSerializer,
+    DriverHeartbeatSerializer,
+    PickupPointSerializer,
     HomePageDataSerializer
 )
 
 
+@replica_reads
 class RideCategoryViewSet(viewsets.ReadOnlyModelViewSet):
     """
     API endpoint for retrieving ride categories.
@@ -35,6 +52,18 @@ class RideViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return Ride.objects.filter(user=self.request.user).order_by('-requested_at')
     
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.request is not None and self.request.method == 'GET':
+            context['full_trace'] = self.request.query_params.get('trace') == 'full'
+            # Each route reads a whole GPS trace, so lists only carry them when asked for with ?route=true
+            if self.action in ('retrieve', 'active') or self.request.query_params.get('route') == 'true':
+                # Imported here so NumPy is only loaded once a route is served
+                from .traces import route_options
+                
+                context['route_options'] = route_options(self.request.query_params)
+        return context
+    
     def get_serializer_class(self):
         if self.action == 'create':
             return RideRequestSerializer
@@ -42,6 +71,7 @@ class RideViewSet(viewsets.ModelViewSet):
             return RideFeedbackSerializer
         return self.serializer_class
     
+    @idempotent
     def create(self, request, *args, **kwargs):
         """
         Request a new ride.
@@ -49,11 +79,26 @@ class RideViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         ride = serializer.save()
+        RIDES_CREATED.inc(ride.category.name)
+        
+        # Imported on first use, so NumPy is not loaded at worker startup
+        from .eta import estimate_pickup, eta_minutes
+        
+        # Pooled rides join a trip under way when one has room on the way
+        insertion = insert_ride(ride) if ride.category.is_pooled else None
+        if insertion:
+            ride.refresh_from_db()
+            data = RideSerializer(ride).data
+            data['pickup_eta_minutes'] = eta_minutes(insertion.pickup_seconds)
+        else:
+            data = RideSerializer(ride).data
+            estimate = estimate_pickup(ride.pickup_latitude, ride.pickup_longitude)
+            data['pickup_eta_minutes'] = eta_minutes(estimate['eta_seconds'])
         
         return Response({
             'status': 'success',
             'message': 'Ride requested successfully',
-            'data': RideSerializer(ride).data
+            'data': data
         }, status=status.HTTP_201_CREATED)
     
     @action(detail=True, methods=['post'])
@@ -71,12 +116,15 @@ class RideViewSet(viewsets.ModelViewSet):
                 'errors': {'status': f'Ride is already {ride.status}'}
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Update ride status
-        ride.status = 'cancelled'
-        ride.cancelled_at = timezone.now()
-        ride.cancelled_by = 'user'
-        ride.cancellation_reason = request.data.get('reason', 'Cancelled by user')
-        ride.save()
+        # Update ride status; the conditional update loses to a concurrent start or cancel
+        if not ride.cancel('user', request.data.get('reason', 'Cancelled by user')):
+            ride.refresh_from_db(fields=['status'])
+            return Response({
+                'status': 'error',
+                'message': 'This ride cannot be cancelled',
+                'errors': {'status': f'Ride is already {ride.status}'}
+            }, status=status.HTTP_400_BAD_REQUEST)
+        RIDES_CANCELLED.inc(ride.cancelled_by)
         
         return Response({
             'status': 'success',
@@ -111,17 +159,9 @@ class RideViewSet(viewsets.ModelViewSet):
         serializer.is_valid(raise_exception=True)
         updated_ride = serializer.save()
         
-        # Update driver rating
-        if updated_ride.driver and updated_ride.user_rating:
-            driver = updated_ride.driver
-            # Calculate average rating
-            avg_rating = Ride.objects.filter(
-                driver=driver,
-                user_rating__isnull=False
-            ).aggregate(avg=Avg('user_rating'))['avg'] or 0
-            
-            driver.rating = avg_rating
-            driver.save(update_fields=['rating'])
+        # Driver rating is recomputed by a background job
+        if updated_ride.driver_id and updated_ride.user_rating:
+            update_driver_ratings.enqueue({'driver_id': str(updated_ride.driver_id)})
         
         return Response({
             'status': 'success',
@@ -149,9 +189,10 @@ class RideViewSet(viewsets.ModelViewSet):
         return Response({
             'status': 'success',
             'message': 'Active ride retrieved successfully',
-            'data': RideSerializer(active_ride).data
+            'data': RideSerializer(active_ride, context=self.get_serializer_context()).data
         })
     
+    @replica_reads
     @action(detail=False, methods=['get'])
     def history(self, request):
         """
@@ -184,6 +225,23 @@ class RideViewSet(viewsets.ModelViewSet):
             'message': 'Ride history retrieved successfully',
             'data': serializer.data
         })
+    
+    @action(detail=False, methods=['get'], renderer_classes=[JSONRenderer, NDJSONRenderer])
+    def export(self, request):
+        """
+        Stream the user's whole ride history as NDJSON, gzipped if the client accepts it.
+        """
+        body = buffered(ride_history_lines(request.user))
+        compress = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if compress:
+            body = gzip_stream(body)
+        
+        response = StreamingHttpResponse(body, content_type='application/x-ndjson')
+        response['Content-Disposition'] = 'attachment; filename="ride-history.ndjson"'
+        response['Vary'] = 'Accept-Encoding'
+        if compress:
+            response['Content-Encoding'] = 'gzip'
+        return response
 
 
 class RideLocationUpdateView(generics.CreateAPIView):
@@ -194,6 +252,7 @@ class RideLocationUpdateView(generics.CreateAPIView):
     serializer_class = RideLocationSerializer
     permission_classes = [permissions.IsAuthenticated]
     
+    @idempotent
     def create(self, request, *args, **kwargs):
         # Ensure ride_id is provided
         ride_id = request.data.get('ride_id')
@@ -206,7 +265,7 @@ class RideLocationUpdateView(generics.CreateAPIView):
         
         try:
             # Check if this is a valid active ride
-            ride = Ride.objects.get(
+            ride = Ride.objects.select_related('driver').get(
                 Q(id=ride_id),
                 Q(status__in=['accepted', 'arrived', 'in_progress']),
                 Q(driver__user=request.user)  # Ensure driver is the one updating
@@ -218,29 +277,89 @@ class RideLocationUpdateView(generics.CreateAPIView):
                 'errors': {'ride_id': 'No active ride found with this ID'}
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Create location update
+        policy = get_policy(ride.status)
+        if policy:
+            wait = take_token(ride.driver_id, policy)
+            if wait:
+                LOCATION_UPDATES_SKIPPED.inc('throttled')
+                raise Throttled(wait=wait)
+        
         serializer = self.get_serializer(data={
             'ride': ride.id,
             'latitude': request.data.get('latitude'),
             'longitude': request.data.get('longitude')
         })
         serializer.is_valid(raise_exception=True)
-        location_update = serializer.save(ride=ride)
+        latitude = serializer.validated_data['latitude']
+        longitude = serializer.validated_data['longitude']
         
-        # Update driver's current location
+        # The live position is always updated, even for pings not kept in the trace
         driver = ride.driver
-        driver.current_latitude = request.data.get('latitude')
-        driver.current_longitude = request.data.get('longitude')
+        driver.current_latitude = latitude
+        driver.current_longitude = longitude
         driver.last_location_update = timezone.now()
         driver.save(update_fields=['current_latitude', 'current_longitude', 'last_location_update'])
+        monitor.beat(driver.id)
+        
+        if policy and not should_persist(ride, latitude, longitude, policy):
+            LOCATION_UPDATES_SKIPPED.inc('downsampled')
+            return Response({
+                'status': 'success',
+                'message': 'Location updated successfully',
+                'data': {'latitude': latitude, 'longitude': longitude, 'persisted': False}
+            }, status=status.HTTP_200_OK)
+        
+        serializer.save(ride=ride)
+        remember_persisted(ride, latitude, longitude)
+        LOCATION_UPDATES.inc()
         
         return Response({
             'status': 'success',
             'message': 'Location updated successfully',
-            'data': serializer.data
+            'data': dict(serializer.data, persisted=True)
         }, status=status.HTTP_201_CREATED)
 
 
+class DriverHeartbeatView(generics.GenericAPIView):
+    """
+    API endpoint for the driver app to report that it is online.
+    Drivers that stop sending heartbeats are made unavailable (see heartbeats.py).
+    """
+    serializer_class = DriverHeartbeatSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        
+        now = timezone.now()
+        fields = {'is_available': data['is_available'], 'last_location_update': now, 'updated_at': now}
+        if 'latitude' in data:
+            fields.update(current_latitude=data['latitude'], current_longitude=data['longitude'])
+        # Heartbeats are frequent: only the id is read and the row is written with one UPDATE
+        driver_id = Driver.objects.filter(user=request.user).values_list('id', flat=True).first()
+        if driver_id is None:
+            return Response({
+                'status': 'error',
+                'message': 'Only drivers can send heartbeats',
+                'errors': {'user': 'No driver profile found for this user'}
+            }, status=status.HTTP_403_FORBIDDEN)
+        Driver.objects.filter(id=driver_id).update(**fields)
+        
+        if data['is_available']:
+            monitor.beat(driver_id, now.timestamp())
+        else:
+            monitor.forget(driver_id)
+        
+        return Response({
+            'status': 'success',
+            'message': 'Heartbeat received',
+            'data': {'is_available': data['is_available'], 'timeout': get_heartbeat_setting('TIMEOUT')}
+        }, status=status.HTTP_200_OK)
+
+
+@replica_reads
 class HomePageDataView(generics.GenericAPIView):
     """
     API endpoint to get all data needed for the home page.
@@ -249,23 +368,29 @@ class HomePageDataView(generics.GenericAPIView):
     serializer_class = HomePageDataSerializer
     
     def get(self, request, *args, **kwargs):
+        from .eta import estimate_pickup, eta_minutes
+        
         user = request.user
         
         # Get user's saved locations
         saved_locations = user.saved_locations.all()
         
-        # Count nearby drivers (within 5km of user's last known location)
-        # This is a simplified implementation - in a real app you'd use geospatial queries
-        nearby_drivers_count = 0
-        if saved_locations.filter(is_favorite=True, type='home').exists():
-            home = saved_locations.get(is_favorite=True, type='home')
-            # Count drivers who have updated their location in the last 15 minutes
-            # This is a simplified implementation
-            nearby_drivers_count = Driver.objects.filter(
-                is_active=True,
-                is_available=True,
-                last_location_update__gte=timezone.now() - timedelta(minutes=15)
-            ).count()
+        # Pickup point: the position sent by the client, else the favourite home location
+        point = None
+        if 'latitude' in request.query_params or 'longitude' in request.query_params:
+            location = PickupPointSerializer(data=request.query_params)
+            if not location.is_valid():
+                return Response({
+                    'status': 'error',
+                    'message': 'Invalid location',
+                    'errors': location.errors
+                }, status=status.HTTP_400_BAD_REQUEST)
+            point = (location.validated_data['latitude'], location.validated_data['longitude'])
+        else:
+            point = saved_locations.filter(is_favorite=True, type='home').values_list('latitude', 'longitude').first()
+        
+        # Available drivers near the pickup point and how soon the quickest can be there
+        estimate = estimate_pickup(*point) if point else {'nearby_drivers': 0, 'eta_seconds': None}
         
         # Get ride categories
         categories = RideCategory.objects.filter(is_active=True)
@@ -297,7 +422,8 @@ class HomePageDataView(generics.GenericAPIView):
         data = {
             'user': user,
             'saved_locations': saved_locations,
-            'nearby_drivers_count': nearby_drivers_count,
+            'nearby_drivers_count': estimate['nearby_drivers'],
+            'pickup_eta_minutes': eta_minutes(estimate['eta_seconds']),
             'categories': categories,
             'recent_rides': recent_rides,
             'promotions': promotions
@@ -310,3 +436,42 @@ class HomePageDataView(generics.GenericAPIView):
             'message': 'Home page data retrieved successfully',
             'data': serializer.data
         })
+
+
+class DriverEarningsExportView(generics.GenericAPIView):
+    """
+    Admin endpoint streaming completed-ride earnings per driver as CSV.
+    Rows are written as they are read, so any date range uses constant memory.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    
+    def get(self, request, *args, **kwargs):
+        kind = request.query_params.get('kind', 'summary')
+        errors = {}
+        if kind not in KINDS:
+            errors['kind'] = f"Must be one of: {', '.join(KINDS)}"
+        bounds = {}
+        for name in ('start', 'end'):
+            value = request.query_params.get(name)
+            if value:
+                try:
+                    bounds[name] = parse_bound(value, is_end=name == 'end')
+                except ValueError:
+                    errors[name] = 'Enter a valid ISO 8601 date or date/time'
+        driver_id = request.query_params.get('driver') or None
+        if driver_id:
+            try:
+                driver_id = uuid.UUID(driver_id)
+            except ValueError:
+                errors['driver'] = 'Enter a valid driver ID'
+        if errors:
+            return Response({
+                'status': 'error',
+                'message': 'Invalid export parameters',
+                'errors': errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        header, rows = export_rows(kind, bounds.get('start'), bounds.get('end'), driver_id)
+        response = StreamingHttpResponse(iter_csv(header, rows), content_type='text/csv')
+        response['Content-Disposition'] = f'attachment; filename="driver-earnings-{kind}.csv"'
+        return response
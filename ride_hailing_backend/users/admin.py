@@ -27,6 +27,8 @@ class UserAdmin(BaseUserAdmin):
 @admin.register(UserLocation)
 class UserLocationAdmin(admin.ModelAdmin):
     list_display = ('name', 'user', 'type', 'is_favorite')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
     list_filter = ('type', 'is_favorite')
     search_fields = ('name', 'address', 'user__email', 'user__full_name')
 
@@ -34,6 +36,8 @@ class UserLocationAdmin(admin.ModelAdmin):
 @admin.register(PaymentMethod)
 class PaymentMethodAdmin(admin.ModelAdmin):
     list_display = ('user', 'type', 'is_default', 'get_payment_details')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
     list_filter = ('type', 'is_default')
     search_fields = ('user__email', 'card_last_four', 'wallet_number')
     
@@ -0,0 +1,265 @@
+import csv
+import json
+import os
+import re
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.password_validation import validate_password
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from rides.models import Driver
+from .models import User, PaymentMethod
+
+
+DEFAULTS = {
+    # Hashing processes of imports uploaded through the admin API, which run
+    # inside a web worker; import_users takes --workers instead
+    'API_WORKERS': 2,
+}
+
+PHONE_RE = re.compile(r'^\+?[0-9]{10,15}$')
+USER_FIELDS = ('email', 'phone_number', 'full_name', 'password')
+DRIVER_FIELDS = (
+    'vehicle_make', 'vehicle_model', 'vehicle_year', 'vehicle_color',
+    'vehicle_license_plate', 'driving_license_number',
+)
+
+
+class ImportResult:
+    """Counts and per-line errors of a bulk import"""
+
+    def __init__(self):
+        self.users_created = 0
+        self.drivers_created = 0
+        self.errors = []
+
+    def as_dict(self):
+        return {
+            'users_created': self.users_created,
+            'drivers_created': self.drivers_created,
+            'errors': [{'line': line, 'errors': errors} for line, errors in self.errors],
+        }
+
+
+def get_import_setting(name):
+    return getattr(settings, 'USER_IMPORT', {}).get(name, DEFAULTS[name])
+
+
+def iter_records(fileobj, fmt):
+    """
+    Yield (line_number, record) pairs from a CSV or NDJSON text stream.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(fileobj)
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == 'ndjson':
+        for line_number, line in enumerate(fileobj, start=1):
+            if line.strip():
+                try:
+                    yield line_number, json.loads(line)
+                except ValueError:
+                    yield line_number, None
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+
+def guess_format(filename):
+    extension = os.path.splitext(filename)[1].lower()
+    return 'ndjson' if extension in ('.ndjson', '.jsonl') else 'csv'
+
+
+def _init_worker():
+    # Spawned hashing processes need Django configured to read PASSWORD_HASHERS
+    if not apps.ready:
+        django.setup()
+
+
+class UserImporter:
+    """
+    Create users (and optionally their driver profiles) from a stream of records.
+
+    Records are handled in chunks: uniqueness is checked with one query per
+    field per chunk, passwords are hashed in a process pool and rows are
+    written with bulk_create, including the default cash payment method that
+    the post_save signal would otherwise insert per user.
+    """
+
+    def __init__(self, chunk_size=1000, workers=None):
+        self.chunk_size = chunk_size
+        self.workers = workers or os.cpu_count() or 1
+        self.seen_emails = set()
+        self.seen_phones = set()
+        self.seen_plates = set()
+
+    def run(self, records):
+        result = ImportResult()
+        records = iter(records)
+        pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker) if self.workers > 1 else None
+        try:
+            while True:
+                chunk = list(islice(records, self.chunk_size))
+                if not chunk:
+                    break
+                self._import_chunk(chunk, result, pool)
+        finally:
+            if pool:
+                pool.shutdown()
+        return result
+
+    def _import_chunk(self, chunk, result, pool):
+        valid = []
+        for line, record in chunk:
+            errors = self._validate(record)
+            if errors:
+                result.errors.append((line, errors))
+            else:
+                valid.append((line, record))
+
+        valid = self._exclude_existing(valid, result)
+        if not valid:
+            return
+
+        passwords = [record['password'] for _, record in valid]
+        if pool:
+            hashes = list(pool.map(make_password, passwords, chunksize=max(1, len(passwords) // (self.workers * 4))))
+        else:
+            hashes = [make_password(password) for password in passwords]
+
+        now = timezone.now()
+        users, drivers, payment_methods = [], [], []
+        for (line, record), password_hash in zip(valid, hashes):
+            user = User(
+                id=uuid.uuid4(),
+                email=record['email'],
+                phone_number=record['phone_number'],
+                full_name=record['full_name'],
+                password=password_hash,
+                date_joined=now,
+            )
+            users.append(user)
+            payment_methods.append(PaymentMethod(user_id=user.id, type='cash', is_default=True))
+            if record.get('driving_license_number'):
+                drivers.append(self._build_driver(user, record))
+
+        try:
+            with transaction.atomic():
+                User.objects.bulk_create(users)
+                PaymentMethod.objects.bulk_create(payment_methods)
+                Driver.objects.bulk_create(drivers)
+        except IntegrityError as exc:
+            # Most likely a concurrent write of the same email or phone number
+            result.errors.extend((line, {'non_field_errors': [str(exc)]}) for line, _ in valid)
+            return
+        result.users_created += len(users)
+        result.drivers_created += len(drivers)
+
+    def _validate(self, record):
+        if not isinstance(record, dict):
+            return {'non_field_errors': ['Invalid record']}
+
+        errors = {}
+        for field in USER_FIELDS:
+            value = record.get(field)
+            if value is not None and not isinstance(value, str):
+                errors[field] = ['Not a valid string.']
+                continue
+            record[field] = value.strip() if value else value
+            if not record[field]:
+                errors[field] = ['This field is required.']
+            elif field != 'password':
+                self._check_length(User, field, record[field], errors)
+        if errors:
+            return errors
+
+        record['email'] = User.objects.normalize_email(record['email'])
+        try:
+            validate_email(record['email'])
+        except ValidationError:
+            errors['email'] = ['Enter a valid email address.']
+        if not PHONE_RE.match(record['phone_number']):
+            errors['phone_number'] = ['Enter a valid phone number (10-15 digits with optional + prefix).']
+        # The same checks as registration, against the row's own details
+        try:
+            validate_password(record['password'], User(
+                email=record['email'], phone_number=record['phone_number'], full_name=record['full_name']
+            ))
+        except ValidationError as exc:
+            errors['password'] = list(exc.messages)
+
+        # Duplicates within the file itself
+        if record['email'].lower() in self.seen_emails:
+            errors['email'] = ['Duplicate email in import.']
+        if record['phone_number'] in self.seen_phones:
+            errors['phone_number'] = ['Duplicate phone number in import.']
+
+        if any(record.get(field) for field in DRIVER_FIELDS):
+            missing = [field for field in DRIVER_FIELDS if not record.get(field)]
+            for field in missing:
+                errors[field] = ['This field is required for drivers.']
+            for field in DRIVER_FIELDS:
+                if field == 'vehicle_year' or field in missing:
+                    continue
+                if not isinstance(record[field], str):
+                    errors[field] = ['Not a valid string.']
+                else:
+                    self._check_length(Driver, field, record[field], errors)
+            if not missing:
+                try:
+                    record['vehicle_year'] = int(record['vehicle_year'])
+                except (TypeError, ValueError):
+                    errors['vehicle_year'] = ['A valid integer is required.']
+                if record['vehicle_license_plate'] in self.seen_plates:
+                    errors['vehicle_license_plate'] = ['Duplicate license plate in import.']
+
+        if not errors:
+            self.seen_emails.add(record['email'].lower())
+            self.seen_phones.add(record['phone_number'])
+            if record.get('vehicle_license_plate'):
+                self.seen_plates.add(record['vehicle_license_plate'])
+        return errors
+
+    def _check_length(self, model, field, value, errors):
+        # Caught here, as DataError on PostgreSQL would abort the whole chunk
+        max_length = model._meta.get_field(field).max_length
+        if len(value) > max_length:
+            errors[field] = [f'Ensure this field has no more than {max_length} characters.']
+
+    def _exclude_existing(self, valid, result):
+        emails = {record['email'] for _, record in valid}
+        phones = {record['phone_number'] for _, record in valid}
+        taken_emails = set(User.objects.filter(email__in=emails).values_list('email', flat=True))
+        taken_phones = set(User.objects.filter(phone_number__in=phones).values_list('phone_number', flat=True))
+
+        remaining = []
+        for line, record in valid:
+            errors = {}
+            if record['email'] in taken_emails:
+                errors['email'] = ['User with this email already exists.']
+            if record['phone_number'] in taken_phones:
+                errors['phone_number'] = ['User with this phone number already exists.']
+            if errors:
+                result.errors.append((line, errors))
+            else:
+                remaining.append((line, record))
+        return remaining
+
+    def _build_driver(self, user, record):
+        return Driver(
+            user_id=user.id,
+            vehicle_make=record['vehicle_make'],
+            vehicle_model=record['vehicle_model'],
+            vehicle_year=record['vehicle_year'],
+            vehicle_color=record['vehicle_color'],
+            vehicle_license_plate=record['vehicle_license_plate'],
+            driving_license_number=record['driving_license_number'],
+        )
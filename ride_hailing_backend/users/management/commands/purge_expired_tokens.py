@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+
+class Command(BaseCommand):
+    help = 'Delete expired outstanding and blacklisted refresh tokens in small chunks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--sleep', type=float, default=0.0,
+                            help='Seconds to pause between chunks to limit load on the database.')
+
+    def handle(self, *args, **options):
+        # Unlike flushexpiredtokens, each chunk is its own short transaction so
+        # table locks are never held for the whole purge
+        now = timezone.now()
+        deleted = 0
+        last_pk = 0
+        while True:
+            pks = list(
+                OutstandingToken.objects.filter(expires_at__lte=now, pk__gt=last_pk)
+                .order_by('pk').values_list('pk', flat=True)[:options['chunk_size']]
+            )
+            if not pks:
+                break
+            last_pk = pks[-1]
+            with transaction.atomic():
+                BlacklistedToken.objects.filter(token_id__in=pks).delete()
+                OutstandingToken.objects.filter(pk__in=pks).delete()
+            deleted += len(pks)
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired tokens"))
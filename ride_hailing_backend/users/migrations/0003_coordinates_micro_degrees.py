@@ -0,0 +1,88 @@
+# Store coordinates as integer micro-degrees (see ride_hailing_backend/fields.py).
+#
+# Each column is copied into a new integer column with a single UPDATE per
+# table, then the decimal column is dropped and the new one takes its name.
+# The old columns are made nullable first so the migration can be reversed.
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import F, Value
+from django.db.models.functions import Cast, Round
+
+import ride_hailing_backend.fields
+
+FIELDS = ('latitude', 'longitude')
+
+
+def to_micro_degrees(apps, schema_editor):
+    UserLocation = apps.get_model('users', 'UserLocation')
+    UserLocation.objects.using(schema_editor.connection.alias).update(**{
+        f"{name}_e6": Cast(Round(F(name) * Value(Decimal(1000000))), models.IntegerField()) for name in FIELDS
+    })
+
+
+def to_degrees(apps, schema_editor):
+    UserLocation = apps.get_model('users', 'UserLocation')
+    UserLocation.objects.using(schema_editor.connection.alias).update(**{
+        name: F(f"{name}_e6") / Value(1000000.0) for name in FIELDS
+    })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_user_ride_counters'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userlocation',
+            name='latitude',
+            field=models.DecimalField(decimal_places=6, max_digits=9, null=True),
+        ),
+        migrations.AlterField(
+            model_name='userlocation',
+            name='longitude',
+            field=models.DecimalField(decimal_places=6, max_digits=9, null=True),
+        ),
+        migrations.AddField(
+            model_name='userlocation',
+            name='latitude_e6',
+            field=ride_hailing_backend.fields.CoordinateField(max_degrees=90, null=True),
+        ),
+        migrations.AddField(
+            model_name='userlocation',
+            name='longitude_e6',
+            field=ride_hailing_backend.fields.CoordinateField(null=True),
+        ),
+        migrations.RunPython(to_micro_degrees, to_degrees),
+        migrations.RemoveField(
+            model_name='userlocation',
+            name='latitude',
+        ),
+        migrations.RemoveField(
+            model_name='userlocation',
+            name='longitude',
+        ),
+        migrations.RenameField(
+            model_name='userlocation',
+            old_name='latitude_e6',
+            new_name='latitude',
+        ),
+        migrations.RenameField(
+            model_name='userlocation',
+            old_name='longitude_e6',
+            new_name='longitude',
+        ),
+        migrations.AlterField(
+            model_name='userlocation',
+            name='latitude',
+            field=ride_hailing_backend.fields.CoordinateField(max_degrees=90),
+        ),
+        migrations.AlterField(
+            model_name='userlocation',
+            name='longitude',
+            field=ride_hailing_backend.fields.CoordinateField(),
+        ),
+    ]
@@ -4,6 +4,8 @@ from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 import uuid
 
+from ride_hailing_backend.fields import CoordinateField
+
 
 class UserManager(BaseUserManager):
     def create_user(self, email, password=None, **extra_fields):
@@ -40,6 +42,10 @@ class User(AbstractBaseUser, PermissionsMixin):
     is_active = models.BooleanField(default=True)
     is_verified = models.BooleanField(default=False)
     
+    # Denormalized ride counters, maintained by rides.models.Ride
+    total_rides = models.PositiveIntegerField(default=0)
+    completed_rides = models.PositiveIntegerField(default=0)
+    
     date_joined = models.DateTimeField(default=timezone.now)
     last_login = models.DateTimeField(null=True, blank=True)
     
@@ -70,8 +76,8 @@ class UserLocation(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='saved_locations')
     name = models.CharField(max_length=100)
     address = models.CharField(max_length=255)
-    latitude = models.DecimalField(max_digits=9, decimal_places=6)
-    longitude = models.DecimalField(max_digits=9, decimal_places=6)
+    latitude = CoordinateField(max_degrees=90)
+    longitude = CoordinateField()
     type = models.CharField(max_length=20, choices=LOCATION_TYPES, default='other')
     is_favorite = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -3,7 +3,9 @@ from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
 from django.contrib.auth import authenticate
 from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer as BaseTokenRefreshSerializer
 from .models import User, UserLocation, PaymentMethod
+from .tokens import RefreshToken
 import re
 
 
@@ -12,6 +14,8 @@ class UserLocationSerializer(serializers.ModelSerializer):
         model = UserLocation
         fields = ['id', 'name', 'address', 'latitude', 'longitude', 'type', 'is_favorite']
         read_only_fields = ['id']
+        # Filled in from the coordinates when left out (see users/signals.py)
+        extra_kwargs = {'address': {'required': False, 'allow_blank': True}}
         
 
 class PaymentMethodSerializer(serializers.ModelSerializer):
@@ -130,20 +134,15 @@ class UserLoginSerializer(serializers.Serializer):
 class UserProfileSerializer(serializers.ModelSerializer):
     saved_locations = UserLocationSerializer(many=True, read_only=True)
     payment_methods = PaymentMethodSerializer(many=True, read_only=True)
-    total_rides = serializers.SerializerMethodField()
     
     class Meta:
         model = User
         fields = [
             'id', 'email', 'phone_number', 'full_name', 'profile_image',
             'is_verified', 'date_joined', 'saved_locations', 'payment_methods',
-            'total_rides'
+            'total_rides', 'completed_rides'
         ]
-        read_only_fields = ['id', 'is_verified', 'date_joined', 'total_rides']
-        
-    def get_total_rides(self, obj):
-        # Count user's rides (assuming there's a Ride model with user foreign key)
-        return obj.rides.count() if hasattr(obj, 'rides') else 0
+        read_only_fields = ['id', 'is_verified', 'date_joined', 'total_rides', 'completed_rides']
 
 
 class ChangePasswordSerializer(serializers.Serializer):
@@ -170,3 +169,8 @@ class ChangePasswordSerializer(serializers.Serializer):
         if data.get('old_password') == data.get('new_password'):
             raise serializers.ValidationError({"new_password": "New password must be different from the current password."})
         return data
+
+
+class TokenRefreshSerializer(BaseTokenRefreshSerializer):
+    """Token refresh using the filtered blacklist check"""
+    token_class = RefreshToken
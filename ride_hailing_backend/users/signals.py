@@ -1,6 +1,6 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, pre_save
 from django.dispatch import receiver
-from .models import User, PaymentMethod
+from .models import User, UserLocation, PaymentMethod
 
 
 @receiver(post_save, sender=User)
@@ -14,3 +14,13 @@ def create_default_payment_method(sender, instance, created, **kwargs):
             type='cash',
             is_default=True
         )
+
+
+@receiver(pre_save, sender=UserLocation)
+def fill_saved_location_address(sender, instance, **kwargs):
+    """
+    Describe saved locations from their coordinates when no address was given.
+    """
+    from ride_hailing_backend.geocoder import fill_address
+
+    instance.address = fill_address(instance.address, instance.latitude, instance.longitude)
@@ -1,3 +1,207 @@
-from django.test import TestCase
+import io
+import json
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.hashers import check_password
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from rides.models import Driver
+from .importers import UserImporter, iter_records
+from .models import User, PaymentMethod
+from .tokens import BloomFilter, blacklist_filter
+
+
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+CSV_HEADER = (
+    'email,phone_number,full_name,password,vehicle_make,vehicle_model,vehicle_year,'
+    'vehicle_color,vehicle_license_plate,driving_license_number\n'
+)
+
+
+def csv_rows(count, start=0, driver_every=3):
+    rows = []
+    for i in range(start, start + count):
+        driver = f"Toyota,Corolla,2020,Black,PL-{i},DL-{i}" if i % driver_every == 0 else ',,,,,'
+        rows.append(f"user{i}@example.com,+23480{i:08d},User {i},Secret{i}!,{driver}\n")
+    return CSV_HEADER + ''.join(rows)
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class RegistrationTests(TestCase):
+    def test_new_user_has_default_payment_method(self):
+        response = self.client.post(reverse('register'), {
+            'email': 'rider@example.com', 'phone_number': '+2348000000001', 'full_name': 'Rider',
+            'password': 'Secret1!x', 'confirm_password': 'Secret1!x',
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        [method] = response.json()['data']['user']['payment_methods']
+        self.assertEqual((method['type'], method['is_default']), ('cash', True))
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class UserImporterTests(TestCase):
+    def run_import(self, text, **kwargs):
+        kwargs.setdefault('workers', 1)
+        return UserImporter(**kwargs).run(iter_records(io.StringIO(text), 'csv'))
+
+    def test_imports_users_drivers_and_payment_methods(self):
+        result = self.run_import(csv_rows(10), chunk_size=4)
+
+        self.assertEqual((result.users_created, result.drivers_created, result.errors), (10, 4, []))
+        self.assertEqual(PaymentMethod.objects.filter(type='cash', is_default=True).count(), 10)
+        user = User.objects.get(email='user3@example.com')
+        self.assertTrue(check_password('Secret3!', user.password))
+        self.assertEqual(Driver.objects.get(user=user).vehicle_license_plate, 'PL-3')
+
+    def test_hashes_in_process_pool(self):
+        result = self.run_import(csv_rows(6), workers=2)
+        self.assertEqual(result.users_created, 6)
+        self.assertTrue(User.objects.get(email='user5@example.com').check_password('Secret5!'))
+
+    def test_rejects_duplicates_and_invalid_rows(self):
+        self.run_import(csv_rows(2))
+        text = csv_rows(3) + (
+            'user9@example.com,+2348000000001,Dup Phone,Secret9!,,,,,,\n'
+            'bad-email,123,Bad,Secret10!,,,,,,\n'
+            'user8@example.com,+2348099999999,Half Driver,Secret8!,Toyota,,,,,\n'
+            'user7@example.com,+2348099999997,Weak Password,pass,,,,,,\n'
+        )
+        result = self.run_import(text)
+
+        self.assertEqual(result.users_created, 1)
+        errors = dict(result.errors)
+        self.assertIn('email', errors[2])
+        self.assertIn('email', errors[3])
+        self.assertIn('phone_number', errors[5])
+        self.assertEqual(set(errors[6]), {'email', 'phone_number'})
+        self.assertIn('vehicle_model', errors[7])
+        self.assertEqual(set(errors[8]), {'password'})
+
+    def test_ndjson(self):
+        ndjson = '{"email": "a@example.com", "phone_number": "+2348000000001", "full_name": "A", "password": "Secret1!"}\nnot json\n'
+        result = UserImporter(workers=1).run(iter_records(io.StringIO(ndjson), 'ndjson'))
+        self.assertEqual(result.users_created, 1)
+        self.assertEqual(result.errors, [(2, {'non_field_errors': ['Invalid record']})])
+
+    def test_rejects_non_string_and_over_long_values(self):
+        rows = [
+            {'email': 5, 'phone_number': 2348000000011, 'full_name': 'Numbers', 'password': 'Secret1!'},
+            {'email': 'long@example.com', 'phone_number': '+2348000000012', 'full_name': 'L' * 256,
+             'password': 'Secret2!'},
+            {'email': 'driver@example.com', 'phone_number': '+2348000000013', 'full_name': 'Driver',
+             'password': 'Secret3!', 'vehicle_make': 'Toyota', 'vehicle_model': 'Corolla', 'vehicle_year': 2020,
+             'vehicle_color': 'Blue', 'vehicle_license_plate': 'P' * 21, 'driving_license_number': 42},
+        ]
+        ndjson = ''.join(json.dumps(row) + '\n' for row in rows)
+        result = UserImporter(workers=1).run(iter_records(io.StringIO(ndjson), 'ndjson'))
+
+        self.assertEqual(result.users_created, 0)
+        errors = dict(result.errors)
+        self.assertEqual(set(errors[1]), {'email', 'phone_number'})
+        self.assertEqual(set(errors[2]), {'full_name'})
+        self.assertEqual(set(errors[3]), {'vehicle_license_plate', 'driving_license_number'})
+
+    def test_import_endpoint_is_admin_only(self):
+        admin = User.objects.create_superuser(
+            email='admin@example.com', password='pass', phone_number='+2348111111111', full_name='Admin'
+        )
+        rider = User.objects.create_user(
+            email='rider@example.com', password='pass', phone_number='+2348111111112', full_name='Rider'
+        )
+        url = reverse('user-import')
+
+        def upload(user):
+            token = RefreshToken.for_user(user).access_token
+            return self.client.post(
+                url, {'file': SimpleUploadedFile('users.csv', csv_rows(3).encode())},
+                HTTP_AUTHORIZATION=f"Bearer {token}",
+            )
+
+        self.assertEqual(upload(rider).status_code, 403)
+        # Hashed inline in the web worker rather than in a process pool per upload
+        with override_settings(USER_IMPORT={'API_WORKERS': 1}), \
+                mock.patch('users.importers.ProcessPoolExecutor') as pool:
+            response = upload(admin)
+        pool.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['users_created'], 3)
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class TokenBlacklistTests(TestCase):
+    def setUp(self):
+        blacklist_filter.reset()
+        self.user = User.objects.create_user(
+            email='rider@example.com', password='pass', phone_number='+2348111111112', full_name='Rider'
+        )
+        self.refresh_url = reverse('token_refresh')
+
+    def tearDown(self):
+        blacklist_filter.reset()
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = BloomFilter(1000, 0.01)
+        keys = [f"jti-{i}" for i in range(1000)]
+        for key in keys:
+            bloom.add(key)
+        self.assertTrue(all(key in bloom for key in keys))
+        false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    # A sync falling inside the request would also select from the blacklist
+    @override_settings(TOKEN_BLACKLIST_FILTER={'SYNC_INTERVAL': 3600})
+    def test_refresh_skips_blacklist_query_for_unknown_token(self):
+        refresh = str(RefreshToken.for_user(self.user))
+        blacklist_filter.might_contain('warm-up')
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(self.refresh_url, {'refresh': refresh})
+        self.assertEqual(response.status_code, 200)
+        # Rotation still blacklists the old token; only the lookup by jti is skipped
+        lookups = [q['sql'] for q in ctx.captured_queries if 'blacklistedtoken' in q['sql'] and '"jti"' in q['sql']]
+        self.assertEqual(lookups, [])
+
+    def test_rotated_and_logged_out_tokens_are_rejected(self):
+        refresh = str(RefreshToken.for_user(self.user))
+        response = self.client.post(self.refresh_url, {'refresh': refresh})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.post(self.refresh_url, {'refresh': refresh}).status_code, 401)
+
+        rotated = response.json()['refresh']
+        access = response.json()['access']
+        response = self.client.post(
+            reverse('logout'), {'refresh_token': rotated}, HTTP_AUTHORIZATION=f"Bearer {access}"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.post(self.refresh_url, {'refresh': rotated}).status_code, 401)
+
+    @override_settings(TOKEN_BLACKLIST_FILTER={'SYNC_INTERVAL': 0.05})
+    def test_picks_up_tokens_blacklisted_by_other_processes(self):
+        token = RefreshToken.for_user(self.user)
+        blacklist_filter.might_contain('warm-up')
+        # Blacklisted straight through the database, as another worker would
+        BlacklistedToken.objects.create(token=OutstandingToken.objects.get(jti=token['jti']))
+        time.sleep(0.1)
+        self.assertEqual(self.client.post(self.refresh_url, {'refresh': str(token)}).status_code, 401)
+
+    def test_purge_expired_tokens(self):
+        expired = RefreshToken.for_user(self.user)
+        expired.blacklist()
+        RefreshToken.for_user(self.user)
+        OutstandingToken.objects.filter(jti=expired['jti']).update(expires_at=timezone.now() - timedelta(days=1))
+
+        out = io.StringIO()
+        call_command('purge_expired_tokens', chunk_size=1, stdout=out)
+        self.assertIn('Deleted 1 expired tokens', out.getvalue())
+        self.assertEqual(OutstandingToken.objects.count(), 1)
+        self.assertFalse(BlacklistedToken.objects.exists())
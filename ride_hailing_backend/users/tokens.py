@@ -0,0 +1,131 @@
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from rest_framework_simplejwt.tokens import RefreshToken as BaseRefreshToken
+
+
+DEFAULTS = {
+    # Expected number of unexpired blacklisted tokens; the filter grows past it
+    'CAPACITY': 100000,
+    'ERROR_RATE': 0.001,
+    # Seconds between pulls of tokens blacklisted by other processes. A token
+    # blacklisted elsewhere can be accepted here for at most this long.
+    'SYNC_INTERVAL': 2.0,
+    # Seconds between full rebuilds, which drop expired tokens from the filter
+    'REBUILD_INTERVAL': 3600.0,
+}
+
+
+def get_filter_setting(name):
+    return getattr(settings, 'TOKEN_BLACKLIST_FILTER', {}).get(name, DEFAULTS[name])
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over strings.
+
+    No false negatives: if a key was added, it is always reported present.
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = max(int(capacity), 1)
+        self.size = max(int(-self.capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hash_count = max(int(round(self.size / self.capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # Double hashing: k positions from two 64-bit halves of one digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class BlacklistFilter:
+    """
+    Per-process Bloom filter of blacklisted refresh token JTIs.
+
+    Built from the database on first use, then kept current by pulling rows
+    with a higher id than the last one seen every SYNC_INTERVAL seconds.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bloom = None
+        self.last_id = 0
+        self.next_sync = 0.0
+        self.next_rebuild = 0.0
+
+    def reset(self):
+        with self.lock:
+            self.bloom = None
+
+    def might_contain(self, jti):
+        now = time.monotonic()
+        if self.bloom is None or now >= self.next_sync:
+            with self.lock:
+                if self.bloom is None or now >= self.next_rebuild or self.bloom.count > self.bloom.capacity:
+                    self._rebuild(now)
+                elif now >= self.next_sync:
+                    self._load(BlacklistedToken.objects.filter(id__gt=self.last_id))
+                self.next_sync = now + get_filter_setting('SYNC_INTERVAL')
+        return jti in self.bloom
+
+    def add(self, jti):
+        # Writers take the lock: two unsynchronized |= on one byte can lose a bit
+        with self.lock:
+            if self.bloom is not None:
+                self.bloom.add(jti)
+
+    def _rebuild(self, now):
+        # Read the high-water mark first so rows added during the load are
+        # picked up again by the next sync rather than skipped
+        latest = BlacklistedToken.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        live = BlacklistedToken.objects.filter(token__expires_at__gt=timezone.now())
+        capacity = max(get_filter_setting('CAPACITY'), live.count() * 2)
+        self.bloom = BloomFilter(capacity, get_filter_setting('ERROR_RATE'))
+        self._load(live)
+        self.last_id = latest
+        self.next_rebuild = now + get_filter_setting('REBUILD_INTERVAL')
+
+    def _load(self, queryset):
+        rows = queryset.order_by('id').values_list('id', 'token__jti').iterator(chunk_size=5000)
+        for row_id, jti in rows:
+            self.bloom.add(jti)
+            self.last_id = max(self.last_id, row_id)
+
+
+blacklist_filter = BlacklistFilter()
+
+
+class RefreshToken(BaseRefreshToken):
+    """
+    Refresh token whose blacklist check skips the database on definite misses.
+    """
+
+    def check_blacklist(self):
+        jti = self.payload[api_settings.JTI_CLAIM]
+        if not blacklist_filter.might_contain(jti):
+            return
+        super().check_blacklist()
+
+    def blacklist(self):
+        result = super().blacklist()
+        blacklist_filter.add(self.payload[api_settings.JTI_CLAIM])
+        return result
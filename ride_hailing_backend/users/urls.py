@@ -8,7 +8,8 @@ from .views import (
     UserProfileView,
     ChangePasswordView,
     UserLocationViewSet,
-    PaymentMethodViewSet
+    PaymentMethodViewSet,
+    UserImportView
 )
 
 # ViewSet router
@@ -27,6 +28,9 @@ urlpatterns = [
     path('auth/profile/', UserProfileView.as_view(), name='profile'),
     path('auth/change-password/', ChangePasswordView.as_view(), name='change_password'),
     
+    # Bulk onboarding (admin only)
+    path('admin/users/import/', UserImportView.as_view(), name='user-import'),
+    
     # User locations and payment methods (ViewSets)
     path('user/', include(router.urls)),
 ]
@@ -1,10 +1,13 @@
 from rest_framework import status, viewsets, generics, permissions
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework.parsers import MultiPartParser
 from django.contrib.auth import logout
 from django.utils import timezone
+import io
+from ride_hailing_backend.db_routing import replica_reads
 from .models import User, UserLocation, PaymentMethod
+from .tokens import RefreshToken
 from .serializers import (
     UserRegistrationSerializer,
     UserLoginSerializer,
@@ -114,6 +117,7 @@ class UserLogoutView(generics.GenericAPIView):
             }, status=status.HTTP_400_BAD_REQUEST)
 
 
+@replica_reads
 class UserProfileView(generics.RetrieveUpdateAPIView):
     """
     API endpoint for retrieving and updating user profile.
@@ -198,3 +202,41 @@ class PaymentMethodViewSet(viewsets.ModelViewSet):
             # Set all other payment methods as non-default
             self.get_queryset().exclude(id=self.get_object().id).update(is_default=False)
         serializer.save()
+
+
+class UserImportView(generics.GenericAPIView):
+    """
+    Admin endpoint to bulk-import users and drivers from an uploaded CSV or NDJSON file.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    parser_classes = [MultiPartParser]
+    
+    def post(self, request, *args, **kwargs):
+        # The importer pulls in multiprocessing; only load it for imports
+        from .importers import UserImporter, get_import_setting, iter_records, guess_format
+        
+        upload = request.FILES.get('file')
+        if not upload:
+            return Response({
+                'status': 'error',
+                'message': 'Import failed',
+                'errors': {'file': 'This field is required'}
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        fmt = request.data.get('format') or guess_format(upload.name)
+        if fmt not in ('csv', 'ndjson'):
+            return Response({
+                'status': 'error',
+                'message': 'Import failed',
+                'errors': {'format': 'Must be csv or ndjson'}
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Stream the upload instead of reading it into memory
+        stream = io.TextIOWrapper(upload.file, encoding='utf-8', newline='')
+        result = UserImporter(workers=get_import_setting('API_WORKERS')).run(iter_records(stream, fmt))
+        
+        return Response({
+            'status': 'success',
+            'message': 'Import finished',
+            'data': result.as_dict()
+        }, status=status.HTTP_200_OK)